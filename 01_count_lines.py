@@ -1,7 +1,9 @@
+from concurrent.futures import ProcessPoolExecutor
 from time import time
 from pathlib import Path
 import json
 from lib.util import log
+from lib.file_partition import index_file, write_partition_file, get_partition_file, PARTITION_LENGTH
 from os import getenv, environ
 from dotenv import load_dotenv
 
@@ -28,30 +30,38 @@ def main():
     target_directory = Path('domain_lists')
     cache = load_cache()
 
-    for filename in target_directory.iterdir():
-        if filename.name.endswith('.txt'):
-            file_path = str(filename)
-            mtime = filename.stat().st_mtime
-
-            # Check if we have a valid cached result
-            if (file_path in cache and
-                'mtime' in cache[file_path] and
-                'line_count' in cache[file_path] and
-                cache[file_path]['mtime'] == mtime):
-                # Use cached result
-                num_lines = cache[file_path]['line_count']
-                log(f"{filename.name}: {num_lines:,} (cached)")
-            else:
-                # Count lines and update cache
-                with open(filename, 'rt', encoding='utf-8') as f:
-                    num_lines = len(f.readlines())
-
-                # Update cache
-                cache[file_path] = {
-                    'mtime': mtime,
-                    'line_count': num_lines
-                }
-                log(f"{filename.name}: {num_lines:,}")
+    with ProcessPoolExecutor() as executor:
+        for filename in sorted(target_directory.iterdir()):
+            if filename.name.endswith('.txt'):
+                file_path = str(filename)
+                mtime = filename.stat().st_mtime
+                partition_file = get_partition_file(filename)
+
+                # Check if we have a valid cached result, including the partition index
+                if (file_path in cache and
+                    'mtime' in cache[file_path] and
+                    'line_count' in cache[file_path] and
+                    cache[file_path]['mtime'] == mtime and
+                    cache[file_path].get('partition_length') == PARTITION_LENGTH and
+                    partition_file.exists() and
+                    partition_file.stat().st_mtime >= mtime):
+                    # Use cached result
+                    num_lines = cache[file_path]['line_count']
+                    log(f"{filename.name}: {num_lines:,} (cached)")
+                else:
+                    # Count lines and build the partition index in the same pass
+                    num_lines, chunk_lengths = index_file(filename, executor)
+                    write_partition_file(filename, chunk_lengths)
+
+                    # Update cache
+                    cache[file_path] = {
+                        'mtime': mtime,
+                        'line_count': num_lines,
+                        'partition_file': str(partition_file),
+                        'partition_length': PARTITION_LENGTH,
+                        'partition_count': len(chunk_lengths),
+                    }
+                    log(f"{filename.name}: {num_lines:,}")
 
     # Save the updated cache
     save_cache(cache)
@@ -1,21 +1,107 @@
-import re
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from tempfile import TemporaryDirectory
 from time import time
 from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from lib.counters import merge_dicts
+from lib.external_sort import merge_runs, write_sorted_runs
+from lib.file_partition import FilePartition, coalesce_partitions, to_partition_descriptions
+from lib.hostname import a_label_line_regex, invalid_domain_reason, invalid_line_regex, is_punycode, to_a_label_domain
+from lib.sketches import HyperLogLog, hash64
 from lib.util import log
 
+HLL_PRECISION = 14  # About 0.8 % standard error with 16 KiB of registers
+
+
+def do_work(file_partition: FilePartition, tld: str, run_dir: Optional[Path]) -> Tuple[Dict[str, int], Optional[bytes], List[Path], List[str]]:
+    """
+    Validates a whole buffer at once. Only invalid lines and A-labels come back to Python,
+    valid LDH names are skipped by the regex engine.
+    """
+    raw = file_partition.read_bytes()
+    buffer = raw.lower()  # ASCII only, so offsets stay the same
+    counter = defaultdict(int)
+    invalid_lines: List[str] = []
+
+    for match in invalid_line_regex(tld).finditer(buffer):
+        start, end = match.span()
+        name = buffer[start:end].rstrip(b'\r').decode('utf-8', errors='replace')
+        if not name.isascii():
+            a_label_name = to_a_label_domain(name)
+            if a_label_name and invalid_domain_reason(a_label_name, tld) is None:
+                counter['IDN (U-label)'] += 1
+                continue
+        reason = invalid_domain_reason(name, tld) or 'invalid syntax'
+        counter[reason] += 1
+        line = raw[start:end].rstrip(b'\r').decode('utf-8', errors='replace')
+        invalid_lines.append(f"{reason}\t{line}")
+
+    for match in a_label_line_regex(tld).finditer(buffer):
+        if is_punycode(match.group(1).decode('ascii')):
+            counter['IDN (A-label)'] += 1
+        else:
+            counter['invalid punycode'] += 1
+            line = match.group().rstrip(b'\r').decode('ascii')
+            invalid_lines.append(f"invalid punycode\t{line}")
+
+    # One name per line as for the line regexes, names with embedded whitespace stay one name
+    names = [line.rstrip(b'\r') for line in buffer.split(b'\n')]
+    names = [name for name in names if name]
+    counter['names'] = len(names)
+    counter['invalid'] = len(invalid_lines)
+
+    if run_dir is not None:
+        start, _ = file_partition.descriptor
+        run_paths = write_sorted_runs((name.decode('utf-8', errors='replace') for name in names), run_dir, f"names-{start:012}")
+        return counter, None, run_paths, invalid_lines
+
+    hll = HyperLogLog(HLL_PRECISION)
+    add_hash = hll.add_hash
+    for value in map(hash64, names):
+        add_hash(value)
+    return counter, hll.to_bytes(), [], invalid_lines
+
+
 def main():
-    p = re.compile('^[a-zA-Z0-9-]+\\.de$')
+    file_path = Path('domain_lists/de_combined2.txt')
+    tld = 'de'
+    exact = False  # Exact distinct count through sorted runs on disk instead of a HyperLogLog estimate
+    report_path = file_path.with_name(f"{file_path.stem}_invalid.txt")
+
+    partitions = coalesce_partitions(to_partition_descriptions(file_path))
+    counter = defaultdict(int)
+    hll = HyperLogLog(HLL_PRECISION)
+    run_paths: List[Path] = []
+
+    with TemporaryDirectory(dir=file_path.parent) as tmp_dir, ProcessPoolExecutor() as executor:
+        run_dir = Path(tmp_dir) if exact else None
+        futures_list = [executor.submit(do_work, partition, tld, run_dir) for partition in partitions]
+        log(f"Submitted {len(futures_list)} tasks. Waiting for results...")
+
+        with open(report_path, mode='wt', encoding='utf-8') as fp:
+            for future in as_completed(futures_list):
+                partition_counter, registers, partition_runs, invalid_lines = future.result()
+                merge_dicts(counter, partition_counter)
+                if registers is not None:
+                    hll.merge(HyperLogLog.from_bytes(registers))
+                run_paths.extend(partition_runs)
+                if invalid_lines:
+                    fp.write('\n'.join(invalid_lines))
+                    fp.write('\n')
 
-    domains = set()
+        if exact:
+            distinct = sum(1 for _ in merge_runs(run_paths))
+        else:
+            distinct = hll.count()
 
-    with open(Path('domain_lists/de_combined2.txt'), mode='rt', encoding='utf-8') as fp:
-        for line in fp:
-            line = line.strip()
-            domains.add(line)
-            if not p.match(line):
-                log(f"Invalid domain: {line}")
+    for reason, count in sorted(counter.items()):
+        if reason not in ('names', 'invalid'):
+            log(f"{reason}: {count:,}")
+    log(f"Invalid domains: {counter['invalid']:,}, written to {report_path}")
+    log(f"Total domains: {distinct:,} distinct ({'exact' if exact else 'estimated'}) of {counter['names']:,} names")
 
-    log(f"Total domains: {len(domains)}")
 
 if __name__ == '__main__':
     start = time()
@@ -1,17 +1,63 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import chain
+from pathlib import Path
 from time import time
-from string import ascii_lowercase
-from itertools import product
+from typing import List
 
-def brute(num: int):
+from lib.batches import BATCH_SIZE, BatchInfo, write_batches, write_batch_manifest
+from lib.hostname import LDH_ALPHABET, LETTERS, label_blocks, label_shards
+from lib.util import log
+
+
+def brute(num: int, alphabet: str = LETTERS, tld: str = 'de') -> None:
+    """Writes all labels of length num as a plain domain list, e.g. as input for 03_generate_batches.py."""
     counter = 0
-    with open(f"domain_lists/de_len_{num}.txt", mode='wt', encoding='utf-8') as fp:
-        for p in product(ascii_lowercase, repeat=num):
-            counter += 1
-            fp.write(f"{''.join(p)}.de\n")
+    with open(f"domain_lists/{tld}_len_{num}.txt", mode='wt', encoding='utf-8') as fp:
+        for block in label_blocks(num, alphabet, suffix=f".{tld}\n"):
+            counter += len(block)
+            fp.write(''.join(block))
 
     print(f"Number of domains: {counter}")
 
+
+def do_work(length: int, alphabet: str, shard: str, tld: str, output_dir: Path, prefix: str, chunk_size: int) -> List[BatchInfo]:
+    names = chain.from_iterable(label_blocks(length, alphabet, shard, f".{tld}"))
+    # No '-' within the prefix, result names are split into prefix, chunk number and runner tag at it
+    return write_batches(names, f"{prefix}_{shard}", output_dir, chunk_size)
+
+
+def generate(length: int, alphabet: str = LDH_ALPHABET, tld: str = 'de', output_dir: Path = Path('queue'),
+             chunk_size: int = BATCH_SIZE) -> None:
+    """
+    Enumerates all LDH labels of the given length below tld straight into bz2 batch chunks.
+
+    The keyspace is sharded by the first character, every process writes the chunks of its shard
+    ({prefix}_{shard}-00001.txt.bz2, ...). Output is lexicographic and therefore reproducible, a
+    single manifest covers all shards.
+    """
+    prefix = f"{tld}_len_{length}"
+    output_dir.mkdir(parents=True, exist_ok=True)
+    batches: List[BatchInfo] = []
+    with ProcessPoolExecutor() as executor:
+        futures_list = [
+            executor.submit(do_work, length, alphabet, shard, tld, output_dir, prefix, chunk_size)
+            for shard in label_shards(alphabet)
+        ]
+        log(f"Submitted {len(futures_list)} shards. Waiting for results...")
+        for future in as_completed(futures_list):
+            batches.extend(future.result())
+
+    batches.sort(key=lambda batch: batch.path.name)
+    write_batch_manifest(output_dir, prefix, batches, length=length, alphabet=alphabet, tld=tld)
+    log(f"Number of domains: {sum(batch.lines for batch in batches):,} in {len(batches):,} chunks.")
+
+
+def main() -> None:
+    generate(5)
+
+
 if __name__ == '__main__':
     start = time()
-    brute(2)
+    log('Started execution.')
+    main()
     print(f"\nProcessing time: {time() - start:.3f} s")
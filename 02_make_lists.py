@@ -1,10 +1,25 @@
+from concurrent.futures import ProcessPoolExecutor
+from tempfile import TemporaryDirectory
 from time import time
 from pathlib import Path
+from typing import List
 from lib.util import log, get_org_domain
+from lib.external_sort import write_sorted_runs, merge_runs
+
+
+def read_org_domains(file: Path):
+    with open(file, mode='rt', encoding='utf-8') as fp:
+        for line in fp:
+            line = line.strip()
+            if line:
+                yield get_org_domain(line)
 
-def main():
-    domains = set()
 
+def do_work(file: Path, run_dir: Path) -> List[Path]:
+    return write_sorted_runs(read_org_domains(file), run_dir, file.stem)
+
+
+def main():
     files = [
         Path('domain_lists/de_combined.txt'),
         Path('domain_lists/de_combined2.txt'),
@@ -13,17 +28,19 @@ def main():
         Path('domain_lists/de_source1.txt'),
     ]
 
-    for file in files:
-        with open(file, mode='rt', encoding='utf-8') as fp:
-            for line in fp:
-                line = line.strip()
-                domains.add(get_org_domain(line))
+    # Memory is bounded by the run size per worker, the k-way merge only holds one line per run
+    with TemporaryDirectory(dir='domain_lists', prefix='runs-') as run_dir:
+        with ProcessPoolExecutor() as executor:
+            run_paths = [run_path for runs in executor.map(do_work, files, [Path(run_dir)] * len(files)) for run_path in runs]
+        log(f"Merging {len(run_paths)} sorted runs...")
 
-    log(f"Total domains: {len(domains)}")
+        domain_count = 0
+        with open(Path('domain_lists/de_combined3.txt'), mode='wt', encoding='utf-8') as fp:
+            for domain in merge_runs(run_paths):
+                domain_count += 1
+                fp.write(f"{domain}\n")
 
-    with open(Path('domain_lists/de_combined3.txt'), mode='wt', encoding='utf-8') as fp:
-        for domain in domains:
-            fp.write(f"{domain}\n")
+    log(f"Total domains: {domain_count}")
 
 if __name__ == '__main__':
     start = time()
@@ -1,18 +1,83 @@
+from json import loads
+from pathlib import Path
+from random import Random
 from time import time
-from random import sample
+from typing import Callable, Dict, Hashable, Iterator, Optional, Set
 
+from lib.sampling import reservoir_sample, stratified_sample, ALLOCATION_PROPORTIONAL
+from lib.sketches import hash64
+from lib.util import get_org_domain, log, open_text
 
-def main():
-    domains = set()
-    with open('domain_lists/de_combined.txt', mode='rt', encoding='utf-8') as fp:
+SEED = 20250301  # Fixed, so the sample can be recreated from the same list
+
+
+def read_domains(file_path: Path) -> Iterator[str]:
+    """Streams a (optionally compressed) domain list, dropping empty lines and consecutive duplicates."""
+    previous = None
+    with open_text(file_path) as fp:
         for line in fp:
-            domains.add(line.strip())
+            domain = line.strip()
+            if domain and domain != previous:
+                yield domain
+                previous = domain
+
+
+def load_mx_domains(file_path: Path) -> Set[int]:
+    """Hashes of the org domains with at least one MX answer in a massdns result file."""
+    mx_domains = set()
+    with open_text(file_path) as fp:
+        for line in fp:
+            doc = loads(line)
+            if doc.get('type') == 'MX' and any(answer.get('type') == 'MX' for answer in doc.get('data', {}).get('answers', [])):
+                mx_domains.add(hash64(get_org_domain(doc['name'])))
+    return mx_domains
+
+
+def by_label_length(domain: str) -> int:
+    return len(domain.split('.', 1)[0])
+
 
-    domains = sample(list(domains), 50000)
+def by_first_char(domain: str) -> str:
+    return domain[:1]
 
-    with open('server_tests/sample_domains_small.txt', mode='wt', encoding='utf-8') as fp:
+
+def by_mx(mx_domains: Set[int]) -> Callable[[str], str]:
+    """Stratifies by MX presence, e.g. by_mx(load_mx_domains(datasets['de_combined2_org']))."""
+    def stratum(domain: str) -> str:
+        return 'MX' if hash64(get_org_domain(domain)) in mx_domains else 'No MX'
+    return stratum
+
+
+def sample_domains(input_path: Path, output_path: Path, k: int, seed: int = SEED,
+                   stratum_fn: Optional[Callable[[str], Hashable]] = None,
+                   allocation: str = ALLOCATION_PROPORTIONAL) -> None:
+    """
+    Streams the list once, holding only the sample (or one reservoir per stratum) in memory.
+
+    The input is expected to be deduplicated, as produced by 02_make_lists.py, only consecutive
+    duplicates are dropped here.
+    """
+    rng = Random(seed)
+    log(f"Sampling {k:,} domains from {input_path} with seed {seed}...")
+    if stratum_fn is None:
+        domains = reservoir_sample(read_domains(input_path), k, rng)
+    else:
+        strata: Dict[Hashable, list] = stratified_sample(read_domains(input_path), k, stratum_fn, rng, allocation)
+        for stratum, values in strata.items():
+            log(f"Stratum {stratum}: {len(values):,} domains")
+        domains = [domain for values in strata.values() for domain in values]
+
+    # Reservoir positions are not random, the written order should be
+    rng.shuffle(domains)
+    with open(output_path, mode='wt', encoding='utf-8') as fp:
         for domain in domains:
             fp.write(f"{domain}\n")
+    log(f"Wrote {len(domains):,} domains to {output_path}.")
+
+
+def main():
+    # The sorted and deduplicated union of all lists written by 02_make_lists.py
+    sample_domains(Path('domain_lists/de_combined3.txt'), Path('server_tests/sample_domains_small.txt'), 50000)
 
 
 if __name__ == '__main__':
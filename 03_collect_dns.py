@@ -0,0 +1,63 @@
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from os import cpu_count
+from pathlib import Path
+from time import time
+from typing import Dict, List, Tuple
+
+from lib.batches import get_manifest_path, load_batch_manifest
+from lib.dns_collector import RATE, collect_file, read_resolvers, resolver_name
+from lib.resolver_pool import ResolverPool
+from lib.util import log, random_tag
+
+
+def do_work(chunk_path: Path, result_dir: Path, rr_type: str, resolvers: List[str], tag: str, rate: float) -> Tuple[Path, int, List[Dict]]:
+    """
+    Resolves one chunk into a result file named like the uploads of clouddns/job.sh. Resolvers
+    are drawn by their health within the chunk, see lib/resolver_pool.py.
+    """
+    result_path = result_dir / f"{chunk_path.name.removesuffix('.txt.bz2')}-{tag}.ndjson.bz2"
+    pool = ResolverPool([resolver_name(address) for address in resolvers])
+    written, stats = collect_file(chunk_path, result_path, rr_type, resolvers, rate=rate, pool=pool)
+    return result_path, written, stats
+
+
+def main():
+    queue_dir = Path('queue')
+    prefix = 'de_combined2_dmarc'
+    result_dir = Path('results')
+    rr_type = 'TXT'
+    resolvers = read_resolvers(Path('resolvers.txt'))
+    tag = random_tag(8)  # Stands in for the runner tag, so results can be told apart from runner uploads
+
+    manifest = load_batch_manifest(get_manifest_path(queue_dir, prefix))
+    result_dir.mkdir(parents=True, exist_ok=True)
+    done = {path.name.rsplit('-', 1)[0] for path in result_dir.glob(f"{prefix}-*.ndjson.bz2")}
+    chunk_paths = [queue_dir / chunk['file'] for chunk in manifest['chunks'] if chunk['file'].removesuffix('.txt.bz2') not in done]
+    log(f"{len(chunk_paths):,} of {len(manifest['chunks']):,} chunks left, {len(resolvers)} resolvers, tag {tag}.")
+
+    # One event loop per core, the per-resolver rate limit is shared between them
+    workers = cpu_count() or 1
+    rate = RATE / workers
+    documents = 0
+    resolver_stats: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+    with ProcessPoolExecutor(workers) as executor:
+        futures_list = [executor.submit(do_work, chunk_path, result_dir, rr_type, resolvers, tag, rate) for chunk_path in chunk_paths]
+        log(f"Submitted {len(futures_list)} tasks. Waiting for results...")
+        for future in as_completed(futures_list):
+            result_path, written, stats = future.result()
+            documents += written
+            for stat in stats:
+                for key in ('sent', 'answered', 'timeouts'):
+                    resolver_stats[stat['resolver']][key] += stat[key]
+
+    log(f"Wrote {documents:,} documents to {result_dir}.")
+    for resolver, stats in sorted(resolver_stats.items()):
+        log(f"{resolver}: {stats['sent']:,} sent, {stats['answered']:,} answered, {stats['timeouts']:,} timeouts")
+
+
+if __name__ == '__main__':
+    start = time()
+    log("Script started.")
+    main()
+    log(f"Processing time: {time() - start:.3f} s")
@@ -1,22 +1,21 @@
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from tempfile import TemporaryDirectory
 from time import time
 from pathlib import Path
 import random
-import bz2
-from typing import Optional, List
+from typing import Iterator, Optional
 from lib.util import log
+from lib.batches import even_chunk_sizes, write_batches, write_batch_manifest
+from lib.external_sort import write_shuffled_runs, merge_shuffled_runs
 
-def split_list(alist: List[str], wanted_parts: Optional[int] = None, wanted_size: Optional[int] = None) -> List[List[str]]:
-    if (wanted_parts is None and wanted_size is None) or (wanted_parts is not None and wanted_size is not None):
-        raise ValueError("Exactly one of wanted_parts or wanted_size must be provided")
 
-    length = len(alist)
-
-    if wanted_parts is not None:
-        log(f"Splitting list into {wanted_parts} parts.")
-        return [alist[i * length // wanted_parts: (i + 1) * length // wanted_parts] for i in range(wanted_parts)]
-    else:
-        log(f"Splitting list into parts of size {wanted_size}.")
-        return [alist[i:i + wanted_size] for i in range(0, length, wanted_size)]
+def read_domains(domain_list_path: Path) -> Iterator[str]:
+    with open(domain_list_path, mode='rt', encoding='utf-8') as fp:
+        for line in fp:
+            domain = line.strip()
+            if domain:
+                yield domain
 
 
 def chunk_simple(domain_list_path: Path,
@@ -24,47 +23,40 @@ def chunk_simple(domain_list_path: Path,
                  subname: str = '',
                  output_dir: Path = Path('.'),
                  chunk_size: Optional[int] = None,
-                 chunk_count: Optional[int] = None) -> None:
+                 chunk_count: Optional[int] = None,
+                 seed: Optional[int] = None) -> None:
     if chunk_size is None and chunk_count is None:
         raise ValueError("At least one of chunk_size or chunk_count must be provided")
 
-    log(f"Starting to process domain list: {domain_list_path}")
-    domains = set()
+    # The seed is logged and stored in the manifest, so the batches can be reproduced
+    if seed is None:
+        seed = random.getrandbits(64)
     max_domains = None
-
     if chunk_size is not None and chunk_count is not None:
         max_domains = chunk_size * chunk_count
         log(f"Limiting the number of domains to a maximum of {max_domains}.")
 
-    with open(domain_list_path, mode='rt', encoding='utf-8') as fp:
-        log("Reading domains from the file...")
-        for line in fp:
-            domain = line.strip()
-            if domain:
-                domains.add(domain)
-                if max_domains and len(domains) >= max_domains:
-                    log(f"Reached the maximum number of domains ({max_domains}). Stopping read.")
-                    break
-    log(f"Finished reading. Found {len(domains)} unique domains.")
+    log(f"Starting to process domain list: {domain_list_path}")
+    output_dir.mkdir(parents=True, exist_ok=True)
+    with TemporaryDirectory(dir=output_dir) as run_dir, ProcessPoolExecutor() as executor:
+        log(f"Shuffling and deduplicating domains with seed {seed}...")
+        run_paths = write_shuffled_runs(read_domains(domain_list_path), Path(run_dir), seed)
+
+        chunk_sizes = None
+        if chunk_size is None:
+            domain_count = sum(1 for _ in merge_shuffled_runs(run_paths))
+            log(f"Found {domain_count} unique domains, splitting into {chunk_count} parts.")
+            chunk_sizes = even_chunk_sizes(domain_count, chunk_count)
 
-    domains = list(domains)
-    log("Shuffling the list of domains...")
-    random.shuffle(domains)
-    log("Finished shuffling.")
+        domains = merge_shuffled_runs(run_paths)
+        if max_domains:
+            domains = islice(domains, max_domains)
 
-    if chunk_size is not None:
-        chunks = split_list(domains, wanted_size=chunk_size)
-    else:
-        chunks = split_list(domains, wanted_parts=chunk_count)
+        log(f"Writing chunks to {output_dir}.")
+        batches = write_batches(domains, prefix, output_dir, chunk_size or 0, subname, executor, chunk_sizes)
 
-    log(f"Writing {len(chunks)} chunks to {output_dir}.")
-    for nr, chunk in enumerate(chunks):
-        output_filename = f"{prefix}-{nr + 1:05}.txt.bz2"
-        output_path = output_dir / Path(output_filename)
-        with bz2.open(output_path, 'wb') as dest:
-            for domain in chunk:
-                dest.write(f"{subname}{domain}\n".encode('utf-8'))
-    log("Successfully created all domain chunks.")
+    manifest_path = write_batch_manifest(output_dir, prefix, batches, source=domain_list_path.as_posix(), seed=seed)
+    log(f"Successfully created {len(batches)} domain chunks with {sum(batch.lines for batch in batches)} domains, manifest: {manifest_path}")
 
 
 def main() -> None:
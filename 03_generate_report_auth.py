@@ -0,0 +1,65 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from json import loads
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import time
+from typing import Iterator, List, Set, Tuple
+
+from datasets import datasets
+from lib.batches import write_batches, write_batch_manifest
+from lib.external_sort import write_sorted_runs, merge_runs
+from lib.file_partition import to_partition_descriptions, FilePartition
+from lib.report_auth import single_dmarc_record, record_receiver_domains, is_external, report_auth_name, policy_domain
+from lib.util import log
+
+
+def do_work(file_partition: FilePartition) -> Tuple[List[str], Set[str]]:
+    auth_names = []
+    receivers = set()
+    for line in file_partition.get_io():
+        if line:
+            doc = loads(line)
+            record = single_dmarc_record(doc['answers'])
+            if record is None:
+                continue
+            domain = policy_domain(doc['request'].split()[1])
+            for receiver in record_receiver_domains(record):
+                receivers.add(receiver)
+                if is_external(domain, receiver):
+                    auth_names.append(report_auth_name(domain, receiver))
+    return auth_names, receivers
+
+
+def main():
+    file_path = datasets['de_combined2_dmarc_dedupe']
+    output_dir = Path('queue')
+    receivers = set()
+
+    with TemporaryDirectory(dir='.', prefix='runs-') as run_dir:
+        with ProcessPoolExecutor() as executor:
+            futures_list = [executor.submit(do_work, file_partition) for file_partition in to_partition_descriptions(file_path)]
+            log(f"Submitted {len(futures_list)} tasks. Waiting for results...")
+
+            def collect() -> Iterator[str]:
+                for future in as_completed(futures_list):
+                    auth_names, partition_receivers = future.result()
+                    receivers.update(partition_receivers)
+                    yield from auth_names
+
+            # Pairs are deduplicated through sorted runs on disk, the cross product does not fit in memory
+            run_paths = write_sorted_runs(collect(), Path(run_dir), 'report_auth')
+
+        log(f"Merging {len(run_paths)} sorted runs...")
+        txt_batches = write_batches(merge_runs(run_paths), 'report_auth_txt', output_dir)
+
+    mx_batches = write_batches(sorted(receivers), 'report_auth_mx', output_dir)
+    write_batch_manifest(output_dir, 'report_auth_txt', txt_batches, source=file_path.as_posix())
+    write_batch_manifest(output_dir, 'report_auth_mx', mx_batches, source=file_path.as_posix())
+    log(f"Wrote {len(txt_batches)} TXT chunks (_report._dmarc names) and {len(mx_batches)} MX chunks ({len(receivers):,} receiver domains).")
+
+
+if __name__ == '__main__':
+    start = time()
+    log('Started execution.')
+    main()
+    log(f"Processing time: {time() - start:.3f} s")
@@ -0,0 +1,189 @@
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from threading import Event, Thread
+from time import time
+from typing import Optional
+from urllib.parse import unquote
+import json
+
+from lib.job_queue import DUPLICATES_DIR, RESULT_EXTENSION, JobQueue
+from lib.util import env_ensure, log
+
+RETRY_AFTER = 30  # Seconds a runner waits when all chunks are leased
+REPORT_INTERVAL = 60
+
+
+def read_upload(content_type: str, body: bytes) -> bytes:
+    """The uploaded file of a multipart form (curl -F file=@...), or the body as is."""
+    if not content_type.startswith('multipart/form-data'):
+        return body
+    message = BytesParser(policy=HTTP).parsebytes(f"Content-Type: {content_type}\r\n\r\n".encode('latin-1') + body)
+    for part in message.iter_parts():
+        if part.get_param('name', header='content-disposition') == 'file':
+            return part.get_payload(decode=True)
+    raise ValueError('No file field in upload')
+
+
+def make_handler(queue: JobQueue, result_dir: Path, api_key: str, resolvers_path: Optional[Path] = None):
+    class JobHandler(BaseHTTPRequestHandler):
+        def runner_tag(self) -> str:
+            return self.headers.get('X-Runner-Tag') or self.client_address[0]
+
+        def authorized(self) -> bool:
+            if self.headers.get('Authorization') == f"Bearer {api_key}":
+                return True
+            self.send_error(401)
+            return False
+
+        def file_name(self) -> str:
+            name = unquote(self.path.removeprefix('/job/'))
+            if '/' in name or '\\' in name or name.startswith('.'):
+                raise ValueError(f"Invalid file name: {name}")
+            return name
+
+        def do_GET(self):
+            if not self.authorized():
+                return
+            if self.path == '/resolvers':
+                # Weighted list of 05_score_resolvers.py, re-read on every request as it is rewritten
+                if resolvers_path is None or not resolvers_path.exists():
+                    self.send_error(404)
+                    return
+                body = resolvers_path.read_bytes()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                return
+            if self.path == '/status':
+                body = json.dumps(queue.reconcile()).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                return
+            if self.path != '/job':
+                self.send_error(404)
+                return
+            lease = queue.lease(self.runner_tag())
+            if lease is None:
+                # 404 ends the runner loop once everything is done, 503 asks it to come back
+                self.send_response(404 if queue.is_done() else 503)
+                self.send_header('Retry-After', str(RETRY_AFTER))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            body = queue.chunk_path(lease.chunk_file).read_bytes()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-bzip2')
+            self.send_header('Content-Disposition', f'attachment; filename="{lease.chunk_file}"')
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('X-Advised-Chunk-Size', str(queue.advised_chunk_size(lease.runner_tag)))
+            record_type = queue.record_type(lease.chunk_file)
+            if record_type is not None:
+                # Retry chunks of 05_extract_retries.py, the runner passes it to massdns --type
+                self.send_header('X-Record-Type', record_type)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            if not self.authorized():
+                return
+            try:
+                result_name = self.file_name()
+                if not result_name.endswith(RESULT_EXTENSION):
+                    raise ValueError(f"Not a result file: {result_name}")
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                data = read_upload(self.headers.get('Content-Type', ''), body)
+            except ValueError as e:
+                self.send_error(400, str(e))
+                return
+            first = queue.complete(result_name)
+            # Only the first result of a chunk goes to the result directory, 06_cache_clouddns.py reads all of them
+            (result_dir if first else result_dir / DUPLICATES_DIR).joinpath(result_name).write_bytes(data)
+            self.send_response(201 if first else 200)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def do_PATCH(self):
+            if not self.authorized():
+                return
+            try:
+                chunk_file = self.file_name()
+            except ValueError as e:
+                self.send_error(400, str(e))
+                return
+            # Sent by clouddns/runner_agent.py when massdns starts on a prefetched chunk
+            self.send_response(204 if queue.start(chunk_file, self.runner_tag()) else 404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def do_DELETE(self):
+            if not self.authorized():
+                return
+            try:
+                chunk_file = self.file_name()
+            except ValueError as e:
+                self.send_error(400, str(e))
+                return
+            queue.release(chunk_file, self.headers.get('X-Runner-Tag'))
+            self.send_response(204)
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass
+
+    return JobHandler
+
+
+def write_report(queue: JobQueue, report_path: Path) -> None:
+    with open(report_path, mode='wt', encoding='utf-8') as fp:
+        fp.write('# Job Server Reconciliation\n\n')
+        queue.dumps(fp)
+
+
+def main():
+    queue_dir = Path('queue')
+    result_dir = Path('results')
+    report_path = Path('job_server_report.md')
+    resolvers_path = Path('resolvers_weighted.txt')
+    address = ('0.0.0.0', 8080)
+    api_key = env_ensure('JOB_SERVER_API_KEY')
+
+    (result_dir / DUPLICATES_DIR).mkdir(parents=True, exist_ok=True)
+    queue = JobQueue()
+    for manifest_path in sorted(queue_dir.glob('*.manifest.json')):
+        log(f"Loaded {queue.add_manifest(manifest_path):,} chunks from {manifest_path}")
+    log(f"Found {queue.add_results(result_dir):,} results from earlier runs.")
+
+    server = ThreadingHTTPServer(address, make_handler(queue, result_dir, api_key, resolvers_path))
+    stopped = Event()
+
+    def report_loop():
+        while not stopped.wait(REPORT_INTERVAL):
+            write_report(queue, report_path)
+            state = queue.reconcile()
+            log(f"{state['done']:,} of {state['chunks']:,} chunks done, {state['leased']:,} leased, {state['pending']:,} pending, {state['delayed']:,} delayed.")
+
+    Thread(target=report_loop, daemon=True).start()
+    log(f"Serving jobs on {address[0]}:{address[1]}...")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stopped.set()
+        server.server_close()
+        write_report(queue, report_path)
+        log(f"Reconciliation report written to {report_path}")
+
+
+if __name__ == '__main__':
+    start = time()
+    log("Script started.")
+    main()
+    log(f"Processing time: {time() - start:.3f} s")
@@ -1,13 +1,33 @@
 from datetime import datetime
 from json import loads
+from pathlib import Path
 from time import time
 
 from lib.counters import DataCounter, DataDistribution, DataPermutation
-from lib.dmarc import parse_dmarc
+from lib.dmarc import parse_dmarc_diagnostic, decode_warnings
+from lib.dmarc_domains import OUTCOME_VALID
+from lib.domain_summary import SPF_MULTIPLE, SPF_NONE
+from lib.summary_table import SummaryTable, mask_combinations, mask_not
 from datasets import datasets
 from lib.util import get_org_domain, log
 
 
+def add_mail_config(table: SummaryTable, mail_auth_valid: DataPermutation, dns_mail_config_perm: DataPermutation) -> None:
+    """
+    Counts the MX, SPF and DMARC combinations of the domain summary table, so the permutations never
+    hold the domains. MX, SPF and DMARC are judged on the majority RRsets of 05_join_domains.py.
+    """
+    has_mx = mask_not(table.isin('mx', 0))
+    has_spf = mask_not(table.isin('spf_all', SPF_NONE))
+    valid_spf = mask_not(table.isin('spf_all', SPF_NONE, SPF_MULTIPLE))
+    valid_dmarc = table.isin('dmarc', OUTCOME_VALID)
+    enforcing_dmarc = table.isin('policy', 'quarantine', 'reject')
+    for values, count in mask_combinations(has_mx, valid_spf, enforcing_dmarc).items():
+        mail_auth_valid.add_combination(values, count)
+    for values, count in mask_combinations(has_mx, has_spf, valid_dmarc).items():
+        dns_mail_config_perm.add_combination(values, count)
+
+
 def main():
     dns_protocol_counter = DataCounter(
         'DNS resolver protocol usage',
@@ -76,7 +96,7 @@ def main():
     )
     mail_auth_valid = DataPermutation(
         'Valid Mail authentication records found',
-        'Shows how many valid mail configurations were found. ✓ means applicable. ✗ means not applicable. - means not set (don\'t care)',
+        'Shows how many valid mail configurations were found, from the domain summary table of 05_join_domains.py. MX means that the domain has at least one MX record, SPF means a single SPF record, DMARC means a valid DMARC record at _dmarc with policy quarantine or reject. ✓ means applicable. ✗ means not applicable. - means not set (don\'t care)',
         ['MX', 'SPF', 'DMARC']
     )
     dmarc_requests = DataCounter(
@@ -172,6 +192,11 @@ def main():
         'Shows if values set sp aspf key are explicit. Requested policy for subdomains. If absent, subdomains follow the p policy. As no DMARC policy of a subdomain was requested in the query, no value should be set for this key. A default value does not exist, so any value given is explicit. If default is given, this refers to the case where no policy is set for the domain (as expected).',
         'DMARC sp explicit'
     )
+    dmarc_warnings = DataCounter(
+        'DMARC record warnings',
+        'Shows how many TXT records at _dmarc subdomains trigger each DMARC warning (see lib/dmarc.py for the IDs). A record may trigger several warnings. Warnings depending on lookups beyond the record itself (G013, L003, T005, L004, L005) are not checked here.',
+        'Warning'
+    )
     cname_redirect_dist = DataDistribution(
         'DNS CNAME redirect distribution',
         'Shows various statistical information about the number of DNS CNAME responses, including redirects. Each CNAME response is counted separately.'
@@ -207,7 +232,7 @@ def main():
     )
     dns_mail_config_perm = DataPermutation(
         'Mail DNS configuration statistics',
-        'Shows the distribution of different DNS mail configuration combinations. MX means that the domain has at least one MX record, SPF means that a SPF record is present and DMARC means that a DMARC record is present. ✓ means applicable. ✗ means not applicable. - means not set (don\'t care)',
+        'Shows the distribution of different DNS mail configuration combinations. MX means that the domain has at least one MX record, SPF means that a SPF record is present and DMARC means that a valid DMARC record is present at _dmarc, from the domain summary table of 05_join_domains.py. ✓ means applicable. ✗ means not applicable. - means not set (don\'t care)',
         ['MX', 'SPF', 'DMARC']
     )
     dns_request_perm = DataPermutation(
@@ -283,10 +308,12 @@ def main():
         dmarc_sp,
         dmarc_sp_valid,
         dmarc_sp_explicit,
+        dmarc_warnings,
         mail_auth_valid,
     ]
 
     files = [datasets['de_combined2_org'], datasets['de_combined2_dmarc']]
+    table_path = Path('datasets/de_combined2_domain_summary.dst')  # Written by 05_join_domains.py
     line_count = 0
     document_counter: int = 0
     domain_pass = set()
@@ -313,13 +340,11 @@ def main():
                 dmarc_org_src_record.announce(org_name)
                 dmarc_org_src_record_valid.announce(org_name)
                 dns_config_perm.announce(org_name)
-                dns_mail_config_perm.announce(org_name)
                 dns_request_perm.announce(org_name)
                 dns_request_detailed_perm.announce(org_name)
                 mx_dmarc_perm.announce(org_name)
                 dmarc_adkim_aspf_explicit_perm.announce(org_name)
                 dmarc_adkim_aspf_valid_perm.announce(org_name)
-                mail_auth_valid.announce(org_name)
 
                 if 'proto' in doc:
                     dns_protocol_counter[doc['proto']] += 1
@@ -378,25 +403,29 @@ def main():
                             for answer in answers:
                                 if 'data' in answer:
                                     dns_ttl_histogram[answer['ttl']] += 1
-                                    if 'dmarc' in answer['data'].lower():
+                                    is_dmarc_data = 'dmarc' in answer['data'].lower()
+                                    if is_dmarc_data or is_dmarc_name:
+                                        dmarc_request, warning_flags = parse_dmarc_diagnostic(answer['data'])
+                                    if is_dmarc_name:
+                                        for warning in decode_warnings(warning_flags):
+                                            dmarc_warnings[warning.id] += 1
+                                        if not warning_flags:
+                                            dmarc_warnings['No warning'] += 1
+                                    if is_dmarc_data:
                                         if is_dmarc_name:
                                             dns_config_perm[org_name]['DMARC'] = True
                                             dmarc_org_src_record[org_name]['Sub'] = True
                                             dmarc_org_src_record_valid[org_name]['Sub'] = True
                                         else:
                                             dmarc_org_src_record[org_name]['Org'] = True
-                                        dmarc_request = parse_dmarc(answer['data'])
                                         if dmarc_request:
                                             if is_dmarc_name:
                                                 dns_config_perm[org_name]['Valid'] = dmarc_request.is_valid()
                                                 mx_dmarc_perm[org_name]['DMARC'] = dmarc_request.is_valid()
-                                                dns_mail_config_perm[org_name]['DMARC'] = dmarc_request.is_valid()
                                                 dmarc_org_src_record_valid[org_name]['Sub'] = dmarc_request.is_valid()
                                             else:
                                                 dmarc_org_src_record_valid[org_name]['Org'] = dmarc_request.is_valid()
                                             dmarc_requests[dmarc_request.p.value.value] += 1
-                                            if dmarc_request.p.value.value != 'none':
-                                                mail_auth_valid[org_name]['DMARC'] = True
                                             if dmarc_request.adkim.explicit:
                                                 dmarc_adkim_explicit['Explicit'] += 1
                                                 dmarc_adkim_aspf_explicit_perm[org_name]['adkim explicit'] = True
@@ -458,9 +487,6 @@ def main():
                                                     dmarc_sp_valid['Fail'] += 1
                                             else:
                                                 dmarc_sp_explicit['Default'] += 1
-                                    if 'spf1' in answer['data'].lower() and not is_dmarc_name:
-                                        dns_mail_config_perm[org_name]['SPF'] = True
-                                        mail_auth_valid[org_name]['SPF'] = True
                         if 'type' in doc and doc['type'] == 'MX':
                             answer_count = len(answers)
                             if answer_count > 0 and is_org_domain:
@@ -468,11 +494,16 @@ def main():
                                     if 'type' in answer:
                                         if answer['type'] == 'MX':
                                             mx_dmarc_perm[org_name]['MX'] = True
-                                            dns_mail_config_perm[org_name]['MX'] = True
-                                            mail_auth_valid[org_name]['MX'] = True
                                             break
 
     valid_domain_count = len(domain_pass)
+    if table_path.exists():
+        with SummaryTable(table_path) as table:
+            add_mail_config(table, mail_auth_valid, dns_mail_config_perm)
+    else:
+        log(f"{table_path} not found, skipping the mail configuration permutations.")
+        data_collections.remove(dns_mail_config_perm)
+        data_collections.remove(mail_auth_valid)
 
     with open('dmarc_report.md', mode='wt', encoding='utf-8') as fp:
         fp.write('# DMARC Report \n\n')
@@ -0,0 +1,50 @@
+from pathlib import Path
+from time import perf_counter, time
+
+from lib.dmarc_domains import OUTCOME_VALID
+from lib.domain_summary import SPF_MULTIPLE, SPF_NONE, dmarc_tag_bits
+from lib.summary_table import SummaryTable, mask_and, mask_not, mask_rows
+from lib.util import log
+
+SAMPLE_SIZE = 10  # Example domains listed per query
+
+
+def main():
+    table_path = Path('datasets/de_combined2_domain_summary.dst')
+
+    with SummaryTable(table_path) as table:
+        log(f"Mapped {len(table):,} domains from {table_path}.")
+        has_mx = mask_not(table.isin('mx', 0))
+        valid_dmarc = table.isin('dmarc', OUTCOME_VALID)
+        enforcing = table.isin('policy', 'quarantine', 'reject')
+        queries = {
+            'MX but no valid DMARC record': lambda: mask_and(has_mx, mask_not(valid_dmarc)),
+            'MX but no SPF record': lambda: mask_and(has_mx, table.isin('spf_all', SPF_NONE, SPF_MULTIPLE)),
+            'p=reject without rua': lambda: mask_and(table.isin('policy', 'reject'), mask_not(table.has_bits('explicit', dmarc_tag_bits('rua')))),
+            'Enforcing DMARC with pct below 100': lambda: mask_and(enforcing, table.between('pct', 0, 99)),
+            'Enforcing DMARC with SPF +all or ?all': lambda: mask_and(enforcing, table.isin('spf_all', '+all', '?all')),
+            'Report interval below a day': lambda: table.between('ri', 0, 86399),
+            'SPF -all without MX (null mail domains)': lambda: mask_and(mask_not(has_mx), table.isin('spf_all', '-all')),
+            'Unanswered requests': lambda: mask_not(table.isin('dns_error', '', 'NXDOMAIN')),
+        }
+
+        with open('domain_queries_report.md', mode='wt', encoding='utf-8') as fp:
+            fp.write('# Domain Queries \n\n')
+            fp.write(f"Domains: {len(table):,}\n\n")
+            fp.write('| Query | Domains | Share | Time ms | Examples |\n')
+            fp.write('| --- | ---: | ---: | ---: | --- |\n')
+            for title, query in queries.items():
+                start = perf_counter()
+                mask = query()
+                count = mask.count(1)
+                elapsed = perf_counter() - start
+                examples = [table.domain(row) for row, _ in zip(mask_rows(mask), range(SAMPLE_SIZE))]
+                fp.write(f"| {title} | {count:,} | {count / (len(table) or 1):.2%} | {elapsed * 1000:.1f} | {', '.join(examples)} |\n")
+                log(f"{title}: {count:,} domains in {elapsed * 1000:.1f} ms")
+
+
+if __name__ == '__main__':
+    start = time()
+    log('Started execution.')
+    main()
+    log(f"Processing time: {time() - start:.3f} s")
@@ -1,46 +1,206 @@
+import os
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
 from json import loads
+from pathlib import Path
+from tempfile import TemporaryDirectory
 from time import time
+from typing import Dict, Iterator, List, TextIO, Tuple
 
+from lib.counters import DataCounter, merge_counter_dicts, merge_dicts
+from lib.file_partition import PARTITION_LENGTH, FilePartition, to_partition_descriptions
+from lib.retries import request_key
+from lib.sketches import CountMinSketch, hash64
+from lib.spill import SPILL_BUCKETS, SpillWriter, bucket_paths, read_bucket
 from lib.util import log
 from datasets import datasets
 
+SKETCH_DEPTH = 4
+MAX_SKETCH_WIDTH = 1 << 24  # 256 MiB of counters at depth 4
+TOP_SOURCES = 30
+
+# How the attempts of a duplicated request relate
+KIND_IDENTICAL = 'identical lines'  # The same rx_ts more than once, a result uploaded twice
+KIND_SAME_CHUNK = 'same chunk'
+KIND_SAME_RUNNER = 'same runner'
+KIND_SEVERAL_RUNNERS = 'several runners'
+
+
+def source_key(doc: Dict) -> str:
+    """Runner and chunk that produced a result, '-' for results collected without job server."""
+    return f"{doc.get('runner_tag', '-')}/{doc.get('chunk_id', '-')}"
+
+
+def read_docs(file_partitions: List[FilePartition]) -> Iterator[Dict]:
+    for file_partition in file_partitions:
+        for line in file_partition.get_io():
+            if line.strip():
+                yield loads(line)
+
+
+def do_spill(file_partitions: List[FilePartition], spill_dir: Path, prefix: str) -> Dict[str, Dict[str, int]]:
+    """Routes every attempt to the hash bucket of its request, counting the lines per source on the way."""
+    counters = {'meta': defaultdict(int), 'sources': defaultdict(int)}
+    with SpillWriter(spill_dir, prefix) as writer:
+        for doc in read_docs(file_partitions):
+            request = request_key(doc)
+            source = source_key(doc)
+            counters['meta']['lines'] += 1
+            counters['sources'][source] += 1
+            writer.write(request, f"{request}\t{source}\t{doc.get('rx_ts', '')}")
+    return counters
+
+
+def duplicate_kind(attempts: List[Tuple[str, str]]) -> str:
+    """
+    Kind of a duplicated request given the (source, rx_ts) of its attempts. Identical lines are
+    only told apart when every attempt has a receive timestamp.
+    """
+    if all(rx_ts for _, rx_ts in attempts) and len({rx_ts for _, rx_ts in attempts}) < len(attempts):
+        return KIND_IDENTICAL
+    sources = {source for source, _ in attempts}
+    if len(sources) == 1:
+        return KIND_SAME_CHUNK
+    if len({source.split('/', 1)[0] for source in sources}) == 1:
+        return KIND_SAME_RUNNER
+    return KIND_SEVERAL_RUNNERS
+
+
+def do_count(bucket: int, spill_dir: Path) -> Dict[str, Dict]:
+    """Counts the attempts of the requests of one bucket exactly."""
+    attempts = defaultdict(list)
+    for line in read_bucket(bucket_paths(spill_dir, bucket)):
+        request, source, rx_ts = line.split('\t')
+        attempts[request].append((source, rx_ts))
+
+    counters = {'attempts': defaultdict(int), 'kinds': defaultdict(int), 'duplicates': defaultdict(int)}
+    for request_attempts in attempts.values():
+        counters['attempts'][len(request_attempts)] += 1
+        if len(request_attempts) > 1:
+            counters['kinds'][duplicate_kind(request_attempts)] += 1
+            for source, _ in request_attempts:
+                counters['duplicates'][source] += 1
+    return counters
+
+
+def do_sketch(file_partitions: List[FilePartition], width: int) -> Tuple[bytes, Dict[str, Dict[str, int]]]:
+    """First pass of the approximate mode, counts the requests of the partitions in a sketch."""
+    sketch = CountMinSketch(width, SKETCH_DEPTH)
+    add_hash = sketch.add_hash
+    counters = {'meta': defaultdict(int), 'sources': defaultdict(int)}
+    for doc in read_docs(file_partitions):
+        add_hash(hash64(request_key(doc)))
+        counters['meta']['lines'] += 1
+        counters['sources'][source_key(doc)] += 1
+    return sketch.to_bytes(), counters
+
+
+def do_estimate(file_partitions: List[FilePartition], sketch_path: Path) -> Dict[str, Dict[int, int]]:
+    """
+    Second pass of the approximate mode. A request with n attempts has n lines with an estimate
+    of (at least) n, so lines per estimate divided by the estimate approximates requests per count.
+    """
+    sketch = CountMinSketch.from_bytes(sketch_path.read_bytes())
+    estimate_hash = sketch.estimate_hash
+    counters = {'lines': defaultdict(int), 'duplicates': defaultdict(int)}
+    for doc in read_docs(file_partitions):
+        estimate = estimate_hash(hash64(request_key(doc)))
+        counters['lines'][estimate] += 1
+        if estimate > 1:
+            counters['duplicates'][source_key(doc)] += 1
+    return counters
+
+
+def sketch_width(line_count: int) -> int:
+    """Twice the lines rounded up to a power of two, few singles collide in every row then."""
+    return min(MAX_SKETCH_WIDTH, 1 << max(10, (2 * line_count - 1).bit_length()))
+
+
+def dump_sources(fp: TextIO, sources: Dict[str, int], duplicates: Dict[str, int]) -> None:
+    fp.write('## Duplicates by source\n\n')
+    fp.write(f"Shows the {TOP_SOURCES} runner_tag/chunk_id sources with the most lines of duplicated requests. A share close to 100 % points to a chunk that was uploaded more than once.\n\n")
+    fp.write('-------\n\n')
+    fp.write('| Source | Lines | Duplicated lines | Share |\n')
+    fp.write('|---|---:|---:|---:|\n')
+    for source, count in sorted(duplicates.items(), key=lambda item: (-item[1], item[0]))[:TOP_SOURCES]:
+        lines = sources.get(source, 0)
+        fp.write(f"| {source} | {lines:,} | {count:,} | {count / (lines or 1):.2%} |\n")
+
 
 def main():
     files = [datasets['de_combined2_org'], datasets['de_combined2_dmarc']]
-    line_count = 0
-    exit_early = False
+    exact = True  # Exact counts through spill files instead of a Count-Min sketch estimate
 
-    requests = defaultdict(lambda: 0)
+    partitions = [partition for file_path in files for partition in to_partition_descriptions(file_path)]
+    task_count = min(os.cpu_count() or 1, len(partitions)) or 1
+    counters = {}
+    attempts = DataCounter(
+        'Attempts per request',
+        'Shows how many requests (type and name) have a given number of result lines across both datasets.' + (
+            '' if exact else ' Approximated with a Count-Min sketch, counts of collisions inflate the larger attempt counts.'
+        ),
+        'Attempts'
+    )
+    kinds = DataCounter(
+        'Duplicate kinds',
+        'Shows how the attempts of duplicated requests relate: identical lines share an rx_ts (uploaded twice), otherwise the attempts came from one chunk, several chunks of one runner, or several runners.',
+        'Kind'
+    )
 
-    for file in files:
-        with open(file, mode='rt', encoding='utf-8') as fp:
-            for line in fp:
-                line_count += 1
-                if exit_early and line_count > 100000:
-                    line_count = 0
-                    break
+    with TemporaryDirectory(dir=files[0].parent) as tmp_dir, ProcessPoolExecutor() as executor:
+        tmp_path = Path(tmp_dir)
+        if exact:
+            futures_list = [
+                executor.submit(do_spill, partitions[task::task_count], tmp_path, f"task{task:03}")
+                for task in range(task_count)
+            ]
+            log(f"Spilling {len(partitions):,} partitions with {task_count} tasks...")
+            for future in as_completed(futures_list):
+                merge_counter_dicts(counters, future.result())
 
-                doc = loads(line.strip())
-                name = doc['name']
-                request = doc['type']
-                item = f"{request} {name}"
-                requests[item] += 1
+            futures_list = [executor.submit(do_count, bucket, tmp_path) for bucket in range(SPILL_BUCKETS)]
+            for future in as_completed(futures_list):
+                merge_counter_dicts(counters, future.result())
+            merge_dicts(attempts, counters['attempts'])
+            merge_dicts(kinds, counters.get('kinds', {}))
+        else:
+            width = sketch_width(len(partitions) * PARTITION_LENGTH)
+            futures_list = [executor.submit(do_sketch, partitions[task::task_count], width) for task in range(task_count)]
+            log(f"Sketching {len(partitions):,} partitions with {task_count} tasks, width {width:,}...")
+            sketch = None
+            for future in as_completed(futures_list):
+                sketch_bytes, task_counters = future.result()
+                merge_counter_dicts(counters, task_counters)
+                if sketch is None:
+                    sketch = CountMinSketch.from_bytes(sketch_bytes)
+                else:
+                    sketch.merge(CountMinSketch.from_bytes(sketch_bytes))
+            sketch_path = tmp_path / 'requests.cms'
+            sketch_path.write_bytes(sketch.to_bytes())
+            del sketch
 
-    distribution = defaultdict(lambda: 0)
-    for value in requests.values():
-        distribution[value] += 1
-
-    distribution = dict(sorted(distribution.items(), key=lambda item: item[1], reverse=True))
+            futures_list = [executor.submit(do_estimate, partitions[task::task_count], sketch_path) for task in range(task_count)]
+            for future in as_completed(futures_list):
+                merge_counter_dicts(counters, future.result())
+            for estimate, lines in counters['lines'].items():
+                attempts[estimate] = max(1, round(lines / estimate))
 
+    meta = counters['meta']
+    attempts.reference_sum = sum(attempts.values())
+    kinds.reference_sum = attempts.reference_sum - attempts.get(1, 0)
+    log(f"{kinds.reference_sum:,} of {attempts.reference_sum:,} requests have more than one result line.")
     with open('duplicates_report.md', mode='wt', encoding='utf-8') as fp:
         fp.write('# Duplicates Report \n\n')
-        fp.write(f"\nLine count: {line_count:,}")
-        fp.write(f"\nReport time: {datetime.now():%Y-%m-%d %H:%M:%S%z}\n")
-
-        for k, v in distribution.items():
-            fp.write(f"\n{k}: {v:,}")
+        fp.write(f"\nLine count: {meta['lines']:,}")
+        fp.write(f"\nReport time: {datetime.now():%Y-%m-%d %H:%M:%S%z}\n\n")
+        attempts.dumps(fp)
+        if kinds:
+            fp.write('\n\n')
+            kinds.dumps(fp)
+        if counters.get('duplicates'):
+            fp.write('\n\n')
+            dump_sources(fp, counters['sources'], counters['duplicates'])
 
 
 if __name__ == '__main__':
@@ -1,72 +1,148 @@
-from concurrent.futures import ProcessPoolExecutor, as_completed
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from json import loads
+from pathlib import Path
 from time import time
-from typing import Set
+from typing import Dict, Optional, TextIO
 
-from lib.util import log
-from lib.file_partition import to_partition_descriptions, FilePartition
+from lib.counters import DataCounter, merge_counter_dicts, top_counts, tree_merge
+from lib.file_partition import FilePartition, coalesce_partitions, to_partition_descriptions
+from lib.mail_providers import parse_mx, preference_pattern, primary_provider
+from lib.summary_table import SummaryTable
+from lib.util import get_org_domain, log
 from datasets import datasets
 
+TOP_PROVIDERS = 30
+TOP_MX_DOMAINS = 50
+TOP_PATTERNS = 20
+NOT_JOINED = 'not_joined'  # Domain missing from the summary table
+POLICIES = ['reject', 'quarantine', 'none']
 
-class WorkResult:
-    def __init__(self, mx_domains: Set[str], mx_domain_records: Set[str]):
-        self.mx_domains = mx_domains
-        self.mx_domain_records = mx_domain_records
+# massdns writes compact JSON, the '"key": value' spacing of the markers comes from the json.dumps() of
+# 06_cache_clouddns.py, which rewrites every line
+MX_MARKER = b'"type": "MX"'
+NOERROR_MARKER = b'"status": "NOERROR"'
 
 
-def do_work(file_partition: FilePartition) -> WorkResult:
-    mx_domains = set()
-    mx_domain_records = set()
-    for line in file_partition.get_io():
-        if line:
-            doc = loads(line)
-            name = doc['name'].rstrip('.')
-            request = doc['type']
-            if request != 'MX':
-                continue
-            if not 'status' in doc:
+def dmarc_class(table: SummaryTable, domain: str) -> str:
+    """Policy of a valid DMARC record, otherwise the DMARC outcome of the domain in the summary table."""
+    row = table.find(domain)
+    if row is None:
+        return NOT_JOINED
+    policy = table.dictionaries['policy'][table['policy'][row]]
+    return policy or table.dictionaries['dmarc'][table['dmarc'][row]]
+
+
+def do_work(file_partition: FilePartition, table_path: Optional[Path]) -> Dict[str, Dict[str, int]]:
+    """
+    Counts the MX setups of the org domains of one partition. Only the counters leave the worker,
+    never the host names, so memory is bounded by the number of distinct providers.
+    """
+    counters = {'meta': defaultdict(int), 'providers': defaultdict(int), 'mx_domains': defaultdict(int),
+                'patterns': defaultdict(int), 'dmarc': defaultdict(int)}
+    meta = counters['meta']
+    table = SummaryTable(table_path) if table_path is not None else None
+    try:
+        for line in file_partition.read_bytes().split(b'\n'):
+            if MX_MARKER not in line or NOERROR_MARKER not in line:
                 continue
-            status = doc['status']
-            if status != 'NOERROR':
+            doc = loads(line)
+            name = doc['name'].lower().removesuffix('.')
+            if doc['type'] != 'MX' or doc.get('status') != 'NOERROR' or get_org_domain(name) != name:
                 continue
-            if not 'answers' in doc['data']:
+            meta['responses'] += 1
+            answers = doc.get('data', {}).get('answers', [])
+            records = [parse_mx(answer['data']) for answer in answers if answer.get('type') == 'MX' and 'data' in answer]
+            records = [record for record in records if record is not None]
+            if not records:
                 continue
-            answers = doc['data']['answers']
-            for answer in answers:
-                if answer['type'] == 'MX':
-                    mx_domains.add(name)
-                    mx_domain_records.add(answer['data'])
-    result = WorkResult(mx_domains, mx_domain_records)
-    return result
+
+            meta['mx'] += 1
+            provider = primary_provider(records)
+            counters['providers'][provider] += 1
+            for mx_domain in {get_org_domain(host) for _, host in records if host}:
+                counters['mx_domains'][mx_domain] += 1
+            counters['patterns'][preference_pattern(preference for preference, _ in records)] += 1
+            if table is not None:
+                counters['dmarc'][f"{provider}\t{dmarc_class(table, name)}"] += 1
+    finally:
+        if table is not None:
+            table.close()
+    return counters
+
+
+def dump_dmarc_by_provider(fp: TextIO, providers: DataCounter, dmarc: Dict[str, int]) -> None:
+    by_provider = defaultdict(lambda: defaultdict(int))
+    for key, count in dmarc.items():
+        provider, value = key.rsplit('\t', 1)
+        by_provider[provider][value] += count
+
+    fp.write('## DMARC adoption by mail provider\n\n')
+    fp.write('Shows the DMARC policy of the domains per provider of their primary MX hosts, joined with the domain summary table. Valid counts all valid DMARC records, the policies are shares of all domains of the provider.\n\n')
+    fp.write('-------\n\n')
+    fp.write(f"| Provider | Domains | Valid DMARC | {' | '.join(f'p={policy}' for policy in POLICIES)} | Not joined |\n")
+    fp.write(f"|---|---:|---:|{'---:|' * len(POLICIES)}---:|\n")
+    for provider, domains in sorted(providers.items(), key=lambda item: (-item[1], item[0])):
+        if provider == 'other':
+            continue
+        values = by_provider[provider]
+        valid = sum(values[policy] for policy in POLICIES)
+        shares = ' | '.join(f"{values[policy] / domains:.2%}" for policy in POLICIES)
+        fp.write(f"| {provider} | {domains:,} | {valid / domains:.2%} | {shares} | {values[NOT_JOINED]:,} |\n")
 
 
 def main():
     file_path = datasets['de_combined2_org']
-    futures_list = []
-    mx_domains = set()
-    mx_domain_records = set()
+    table_path = Path('datasets/de_combined2_domain_summary.dst')  # Written by 05_join_domains.py, optional
 
-    with ProcessPoolExecutor() as executor:
-        for file_partition in to_partition_descriptions(file_path):
-            futures_list.append(executor.submit(do_work, file_partition))
+    join_path = table_path if table_path.exists() else None
+    if join_path is None:
+        log(f"{table_path} not found, skipping the DMARC join.")
 
+    with ProcessPoolExecutor() as executor:
+        futures_list = [
+            executor.submit(do_work, partition, join_path)
+            for partition in coalesce_partitions(to_partition_descriptions(file_path))
+        ]
         log(f"Submitted {len(futures_list)} tasks. Waiting for results...")
-        for future in as_completed(futures_list):
-            result = future.result()
-            mx_domains.update(result.mx_domains)
-            mx_domain_records.update(result.mx_domain_records)
-
-    log(f"{len(mx_domains)=}")
-    log(f"{len(mx_domain_records)=}")
-    mx_domain_records = sorted(mx_domain_records)
-    log(f"Writing MX domains to disk...")
-    with open('results/domains_mx.txt', mode='wt', encoding='utf-8') as fp:
-        for domain in mx_domains:
-            fp.write(f"{domain}\n")
-    log(f"Writing MX domain records to disk...")
-    with open('results/domain_records_mx.txt', mode='wt', encoding='utf-8') as fp:
-        for record in mx_domain_records:
-            fp.write(f"{record}\n")
+        counters = tree_merge(futures_list, executor, merge_counter_dicts)
+
+    meta = counters.get('meta', {})
+    reports = {
+        'providers': (DataCounter(
+            'Mail providers',
+            f"Shows the {TOP_PROVIDERS} most frequent providers of the primary (lowest preference) MX hosts. Known providers are clustered by host suffix, e.g. all *.mail.protection.outlook.com hosts as Microsoft 365, other hosts by their org domain. The sum percentage is relative to all successful MX queries.",
+            'Provider'
+        ), TOP_PROVIDERS),
+        'mx_domains': (DataCounter(
+            'MX host org domains',
+            f"Shows the {TOP_MX_DOMAINS} org domains most MX hosts belong to, counting every domain once per MX host org domain. The sum percentage is relative to the domains with MX records.",
+            'Org domain'
+        ), TOP_MX_DOMAINS),
+        'patterns': (DataCounter(
+            'MX preference patterns',
+            f"Shows the {TOP_PATTERNS} most frequent numbers of hosts per distinct preference, lowest first, e.g. 2+1 for two primary hosts and one backup. The sum percentage is relative to the domains with MX records.",
+            'Pattern'
+        ), TOP_PATTERNS),
+    }
+    for key, (report, limit) in reports.items():
+        top_counts(counters.get(key, {}), report, limit)
+
+    log(f"{meta.get('mx', 0):,} of {meta.get('responses', 0):,} successful MX queries have MX records.")
+    with open('mx_report.md', mode='wt', encoding='utf-8') as fp:
+        fp.write('# MX Report \n\n')
+        fp.write(f"Applicable domains: {meta.get('responses', 0):,}\n")
+        fp.write(f"Domains with MX records: {meta.get('mx', 0):,}")
+        for key, (report, _) in reports.items():
+            if not report:
+                continue
+            fp.write('\n\n')
+            report.reference_sum = meta['responses'] if key == 'providers' else meta['mx']
+            report.dumps(fp)
+        providers, _ = reports['providers']
+        if join_path is not None and providers:
+            fp.write('\n\n')
+            dump_dmarc_by_provider(fp, providers, counters.get('dmarc', {}))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,141 @@
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from json import loads
+from time import time
+from typing import Dict
+
+from lib.counters import DataCounter, merge_dicts
+from lib.file_partition import to_partition_descriptions, FilePartition
+from lib.dmarc import is_dmarc_version_record
+from lib.report_auth import single_dmarc_record, record_receiver_domains, report_auth_name, \
+    is_external, policy_domain, normalize_domain
+from lib.sketches import hash64
+from lib.util import log
+from datasets import datasets
+
+# Lookup results, a definitive answer always wins over an error of another attempt
+STATE_UNKNOWN = 0
+STATE_NEGATIVE = 1
+STATE_POSITIVE = 2
+
+# Filled in every worker by init_worker, keyed by hash64 of the queried name
+auth_states: Dict[int, int] = {}
+mx_states: Dict[int, int] = {}
+
+
+def response_state(doc: dict, answer_type: str, check=None) -> int:
+    if 'error' in doc or doc.get('status') not in ('NOERROR', 'NXDOMAIN'):
+        return STATE_UNKNOWN
+    for answer in doc.get('data', {}).get('answers', []):
+        if answer['type'] == answer_type and (check is None or check(answer['data'])):
+            return STATE_POSITIVE
+    return STATE_NEGATIVE
+
+
+def load_states(file_path, answer_type: str, check=None) -> Dict[int, int]:
+    states: Dict[int, int] = {}
+    with open(file_path, mode='rt', encoding='utf-8') as fp:
+        for line in fp:
+            doc = loads(line)
+            key = hash64(normalize_domain(doc['name']))
+            states[key] = max(states.get(key, STATE_UNKNOWN), response_state(doc, answer_type, check))
+    return states
+
+
+def init_worker(auth: Dict[int, int], mx: Dict[int, int]) -> None:
+    global auth_states, mx_states
+    auth_states = auth
+    mx_states = mx
+
+
+def make_counters() -> dict:
+    return {
+        'meta': defaultdict(int),
+        'receivers': defaultdict(int),
+        'mx': defaultdict(int),
+        'auth': defaultdict(int),
+        'domains': defaultdict(int),
+    }
+
+
+def do_work(file_partition: FilePartition) -> Dict[str, Dict]:
+    counters = make_counters()
+
+    for line in file_partition.get_io():
+        if line:
+            doc = loads(line)
+            record = single_dmarc_record(doc['answers'])
+            if record is None:
+                continue
+            receivers = record_receiver_domains(record)
+            if not receivers:
+                continue
+            domain = policy_domain(doc['request'].split()[1])
+            counters['meta']['domains'] += 1
+            l004 = False
+            l005 = False
+            for receiver in receivers:
+                mx_state = mx_states.get(hash64(receiver), STATE_UNKNOWN)
+                counters['mx'][('Unknown', 'Missing (L004)', 'Present')[mx_state]] += 1
+                l004 |= mx_state == STATE_NEGATIVE
+                if is_external(domain, receiver):
+                    counters['receivers']['External'] += 1
+                    auth_state = auth_states.get(hash64(report_auth_name(domain, receiver)), STATE_UNKNOWN)
+                    counters['auth'][('Unknown', 'Not authorized (L005)', 'Authorized')[auth_state]] += 1
+                    l005 |= auth_state == STATE_NEGATIVE
+                else:
+                    counters['receivers']['Internal'] += 1
+            if l004:
+                counters['domains']['L004'] += 1
+            if l005:
+                counters['domains']['L005'] += 1
+            if not l004 and not l005:
+                counters['domains']['None'] += 1
+    return counters
+
+
+def main():
+    log('Loading report authorization results...')
+    auth = load_states(datasets['de_combined2_report_auth'], 'TXT', is_dmarc_version_record)
+    log(f"Loaded {len(auth):,} _report._dmarc results.")
+    mx = load_states(datasets['de_combined2_report_auth_mx'], 'MX')
+    log(f"Loaded {len(mx):,} receiver MX results.")
+
+    futures_list = []
+    counters = make_counters()
+    counters_all = {
+        'meta': DataCounter('Domains with reporting URIs', 'Domains with a single valid DMARC record and at least one valid rua or ruf URI.', '#'),
+        'receivers': DataCounter('Report receivers', 'Reporting URIs per distinct receiver domain and record. External receivers are in another organizational domain and have to authorize the reports (RFC 7489, section 7.1).', 'Receiver'),
+        'mx': DataCounter('Report receiver MX (L004)', 'Shows if the domain of a reporting URI has MX records. Unknown means the lookup failed or was not part of the scan.', 'MX'),
+        'auth': DataCounter('External report authorization (L005)', 'Shows if external receivers publish a <domain>._report._dmarc.<receiver> record starting with v=DMARC1.', 'Authorization'),
+        'domains': DataCounter('Domains with report URI warnings', 'Shows how many domains have at least one reporting URI triggering L004 or L005. A domain may be counted for both.', 'Warning'),
+    }
+
+    with ProcessPoolExecutor(initializer=init_worker, initargs=(auth, mx)) as executor:
+        for file_partition in to_partition_descriptions(datasets['de_combined2_dmarc_dedupe']):
+            futures_list.append(executor.submit(do_work, file_partition))
+
+        log(f"Submitted {len(futures_list)} tasks. Waiting for results...")
+        for future in as_completed(futures_list):
+            result = future.result()
+            for counter_name, counter in counters.items():
+                counters[counter_name] = merge_dicts(result[counter_name], counter)
+
+    reference_sum = counters['meta']['domains']
+    for counter_name, counter in counters_all.items():
+        counters_all[counter_name].update(counters[counter_name])
+
+    log(f"Writing report to disk...")
+    with open('report_auth_report.md', mode='wt', encoding='utf-8') as fp:
+        fp.write('# DMARC Report Destination Report \n\n')
+        for counter_name, counter in counters_all.items():
+            counter.reference_sum = reference_sum if counter_name in ('meta', 'domains') else sum(counter.values())
+            counter.dumps(fp)
+            fp.write('\n\n')
+
+
+if __name__ == '__main__':
+    start = time()
+    log('Started execution.')
+    main()
+    log(f"Processing time: {time() - start:.3f} s")
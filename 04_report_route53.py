@@ -1,140 +1,144 @@
-import re
 import sys
 from time import time
 from pathlib import Path
-from collections import defaultdict, namedtuple
-from typing import Optional
-
-from lib.util import get_org_domain, get_sub_domain, log
+from collections import Counter, defaultdict
+from itertools import compress
+from datetime import date
+
+from lib.util import log
+from lib.route53 import Route53Table, load_route53_table, load_route53_shards, to_date, to_datetime, int_to_ip, \
+    NAME_FLAG_DMARC_SUB, NAME_FLAG_DMARC_NAME, MICROSECONDS_PER_DAY
+from lib.route53_rollup import Route53Rollup, load_route53_rollups, group_by
+from lib.sketches import HyperLogLog
 from statistics import median
-from datetime import datetime
-
-Route53Record = namedtuple('Route53Record', [
-    'date', 'version', 'distribution_id', 'request_name', 'request_type',
-    'response_code', 'protocol', 'edge_location', 'ip_address', 'ip_net'
-])
-
-
-def parse(line: str) -> Optional[Route53Record]:
-    parts = line.strip().split(' ')
-    if len(parts) != 11:
-        return None
-    return Route53Record(
-        date=datetime.strptime(parts[0], '%Y-%m-%dT%H:%M:%S.%fZ'),
-        version=parts[1],
-        distribution_id=parts[3],
-        request_name=parts[4],
-        request_type=parts[5],
-        response_code=parts[6],
-        protocol=parts[7],
-        edge_location=parts[8],
-        ip_address=parts[9],
-        ip_net=parts[10],
-    )
-
-
-def m1():
-    route53_file = Path('route53.txt')
-    zones = defaultdict(lambda: 0)
-    with open(route53_file, 'rt', encoding='utf-8') as rfp:
-        for line in rfp:
-            line = line.strip()
-            if line:
-                parts = line.split(' ')
-                if len(parts) == 11:
-                    zones[parts[3]] += 1
+
+
+def to_day(bucket: int) -> date:
+    return to_date(bucket // MICROSECONDS_PER_DAY)
+
+
+def dmarc_mask(table: Route53Table) -> bytes:
+    return table.mask(request_type='TXT', response_code='NOERROR', flags=NAME_FLAG_DMARC_NAME)
+
+
+def m1(table: Route53Table) -> None:
+    zones = Counter(table['distribution_id'])
 
     for zone, count in zones.items():
-        print(f"{zone}: {count}")
+        print(f"{table.decode('distribution_id', zone)}: {count}")
 
 
-def m2():
-    route53_file = Path('route53.txt')
-    dmarcs = defaultdict(lambda: 0)
-    for line in route53_file.read_text(encoding='utf-8').splitlines():
-        line = line.strip()
-        if line:
-            parts = line.split(' ')
-            if len(parts) == 11:
-                sub = get_sub_domain(parts[4])
-                if sub == '_dmarc':
-                    dmarcs[parts[3]] += 1
+def m2(table: Route53Table) -> None:
+    dmarcs = Counter(compress(table['distribution_id'], table.mask(flags=NAME_FLAG_DMARC_SUB)))
 
     for zone, count in dmarcs.items():
-        log(f"{zone}: {count}")
+        log(f"{table.decode('distribution_id', zone)}: {count}")
 
     log(f"{median(dmarcs.values())}")
 
 
-def m3(records: list[Route53Record]) -> None:
-    days = defaultdict(lambda: {'requests': 0, 'zones': set()})
-    p = re.compile('^_dmarc.[a-zA-Z0-9-]+\\.[a-z]+$')
-    for record in records:
-        if record.request_type != 'TXT':
-            continue
-        if p.match(record.request_name) is None:
-            continue
-        if record.response_code != 'NOERROR':
-            continue
-        days[record.date.date()]['requests'] += 1
-        days[record.date.date()]['zones'].add(record.distribution_id)
-
-    for day, data in days.items():
-        log(f"{day}: {data['requests']:,} requests, {len(data['zones']):,} zones, {data['requests'] / len(data['zones']):.1f} requests / zone")
+def m3(rollup: Route53Rollup) -> None:
+    cells = rollup.query('day', response_code='NOERROR', request_type='TXT', flags=NAME_FLAG_DMARC_NAME)
+    requests = group_by(cells, lambda key: key[0])
+    zones = Counter(day for day, _ in group_by(cells, lambda key: (key[0], key[1])))
 
-    sorted_data = dict(sorted(days.items(), key=lambda item: item[0]))
+    sorted_days = sorted(requests.keys())
+    for day in sorted_days:
+        log(f"{to_day(day)}: {requests[day]:,} requests, {zones[day]:,} zones, {requests[day] / zones[day]:.1f} requests / zone")
 
-    days_str = [f"'{day}T12:00:00Z'" for day in sorted_data.keys()]
+    days_str = [f"'{to_day(day)}T12:00:00Z'" for day in sorted_days]
     print(f"[{', '.join(days_str)}]")
 
-    values = [f"{data['requests'] / len(data['zones']):.0f}" for data in sorted_data.values()]
+    values = [f"{requests[day] / zones[day]:.0f}" for day in sorted_days]
     print(f"[{', '.join(values)}]")
 
 
-def m4(records: list[Route53Record]) -> None:
-    days = defaultdict(lambda: defaultdict(lambda: 0))
-    p = re.compile('^_dmarc.[a-zA-Z0-9-]+\\.[a-z]+$')
-    for record in records:
-        if record.request_type != 'TXT':
-            continue
-        if p.match(record.request_name) is None:
-            continue
-        if record.response_code != 'NOERROR':
-            continue
-        days[record.date.date()][record.distribution_id] += 1
+def m4(rollup: Route53Rollup) -> None:
+    cells = rollup.query('day', response_code='NOERROR', request_type='TXT', flags=NAME_FLAG_DMARC_NAME)
+    counts = group_by(cells, lambda key: (key[0], key[1]))
 
-    days = dict(sorted(days.items(), key=lambda item: item[0]))
+    days = defaultdict(dict)
+    for (day, zone), count in sorted(counts.items()):
+        days[day][zone] = count
     for day, data in days.items():
-        log(f"{day}: {', '.join([str(v) for v in data.values()])}")
-
-def m5(records: list[Route53Record]) -> None:
-    ips = defaultdict(lambda: 0)
-    p = re.compile('^_dmarc.[a-zA-Z0-9-]+\\.[a-z]+$')
-    for record in records:
-        if record.response_code != 'NOERROR':
-            continue
-        if record.request_type != 'TXT':
-            continue
-        if p.match(record.request_name) is None:
-            continue
-        ips[record.ip_address] += 1
+        log(f"{to_day(day)}: {', '.join([str(v) for v in data.values()])}")
+
+
+def m5(table: Route53Table) -> None:
+    ips = Counter(compress(zip(table['ip_hi'], table['ip_lo']), dmarc_mask(table)))
 
     ips = dict(sorted(ips.items(), key=lambda item: item[1]))
-    for ip, count in ips.items():
-        log(f"{ip}: {count}")
+    for (ip_hi, ip_lo), count in ips.items():
+        log(f"{int_to_ip((ip_hi << 64) | ip_lo)}: {count}")
+
+
+def m6(rollup: Route53Rollup) -> None:
+    """Queries and distinct source IPs per edge location. Route53 query logs carry no latency, so volume is what is reported."""
+    edges = defaultdict(Counter)
+    for (day, edge, request_type), count in rollup.edges.items():
+        edges[edge][request_type] += count
+    distinct_ips = {}
+    for (day, edge), hll in rollup.edge_ips.items():
+        if edge in distinct_ips:
+            distinct_ips[edge].merge(hll)
+        else:
+            distinct_ips[edge] = HyperLogLog(hll.precision, hll.registers)
+
+    for edge, counts in sorted(edges.items(), key=lambda item: item[1].total(), reverse=True):
+        types = ', '.join(f"{request_type}={count:,}" for request_type, count in counts.most_common())
+        log(f"{edge}: {counts.total():,} requests, ~{distinct_ips[edge].count():,} source IPs ({types})")
+
+
+def m7(rollup: Route53Rollup) -> None:
+    """Querying resolver fingerprints: request volume, transport protocols and EDNS client subnet usage per source IP."""
+    resolvers = defaultdict(Counter)
+    for (day, ip, protocol, subnet), count in rollup.resolvers.items():
+        resolvers[ip][protocol] += count
+        if subnet:
+            resolvers[ip]['ECS'] += count
+
+    fingerprints = Counter()
+    for ip, counts in resolvers.items():
+        protocols = '+'.join(sorted(protocol for protocol in counts if protocol != 'ECS'))
+        fingerprints[f"{protocols}{' ECS' if counts['ECS'] else ''}"] += 1
+    for fingerprint, count in fingerprints.most_common():
+        log(f"{fingerprint}: {count:,} resolvers")
+
+    top = sorted(resolvers.items(), key=lambda item: item[1].total() - item[1]['ECS'], reverse=True)[:20]
+    for ip, counts in top:
+        log(f"{ip}: {', '.join(f'{key}={value:,}' for key, value in counts.items())}")
+
+
+def m8(rollup: Route53Rollup) -> None:
+    """Approximate distinct source IPs per hour."""
+    for bucket, hll in sorted(rollup.distinct_ips['hour'].items()):
+        log(f"{to_datetime(bucket):%Y-%m-%d %H:%M}: ~{hll.count():,} source IPs")
+
+
+ROLLUP_METHODS = ['m3', 'm4', 'm6', 'm7', 'm8']
+
 
 def main():
     user_method = sys.argv[-1]
     log(f"Argument: {user_method}")
-    record_count = 0
-    records = []
-    for line in Path('route53.txt').read_text(encoding='utf-8').splitlines():
-        record = parse(line)
-        if record:
-            record_count += 1
-            records.append(record)
-    log(f"Total records: {record_count:,}")
-    globals()[user_method](records)
+    # Optional day range before the method name, e.g. '2025-03-01 2025-03-07 m3'
+    first_day = date.fromisoformat(sys.argv[1]) if len(sys.argv) > 2 else None
+    last_day = date.fromisoformat(sys.argv[2]) if len(sys.argv) > 3 else None
+    shard_dir = Path('route53')
+    if user_method in ROLLUP_METHODS and shard_dir.exists():
+        rollup = load_route53_rollups(shard_dir, first_day, last_day)
+        globals()[user_method](rollup)
+        return
+    if shard_dir.exists():
+        table = load_route53_shards(shard_dir, first_day, last_day)
+    else:
+        table = load_route53_table(Path('route53.txt'))
+    log(f"Total records: {len(table):,}")
+    if user_method in ROLLUP_METHODS:
+        # No daily shards to take the rollups from, aggregate the whole table in memory instead
+        globals()[user_method](Route53Rollup.build(table))
+        return
+    globals()[user_method](table)
 
 
 if __name__ == '__main__':
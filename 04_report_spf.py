@@ -1,68 +1,257 @@
+import os
+import re
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
-from json import loads
+from json import dumps, loads
+from pathlib import Path
+from tempfile import TemporaryDirectory
 from time import time
+from typing import Dict, List, Optional, Set, Tuple
 
+from lib.counters import DataCounter, merge_dicts, top_counts
+from lib.dmarc import POLICY_SPF_TOO_MANY_LOOKUPS
+from lib.domain_summary import SPF_MULTIPLE, SPF_NO_ALL
+from lib.file_partition import FilePartition, coalesce_partitions, to_partition_descriptions
+from lib.spf import (ERROR_LOOKUP_LIMIT, MAX_LOOKUPS, MAX_VOID_LOOKUPS, Expansion, SPFExpander, parse_spf, resolve_targets,
+                     spf_records, txt_answers)
+from lib.spill import SPILL_BUCKETS, SpillWriter, bucket_paths, read_bucket
 from lib.util import get_org_domain, log
-from lib.counters import DataCounter
 from datasets import datasets
 
+TOP_INCLUDE_TARGETS = 50
+WITHIN_LIMITS = 'within_limits'
+
+# Records are selected case-insensitively (RFC 7208, section 4.5). massdns writes compact JSON, the '"key": value'
+# spacing of the markers comes from the json.dumps() of 06_cache_clouddns.py, which rewrites every line
+_spf_regex = re.compile(rb'v=spf1', re.IGNORECASE)
+TXT_MARKER = b'"type": "TXT"'
+NOERROR_MARKER = b'"status": "NOERROR"'
+_name_regex = re.compile(rb'"name": "([^"]*)"')
+
+
+def do_spill(file_partitions: List[FilePartition], spill_dir: Path, prefix: str) -> Dict[str, int]:
+    """
+    Routes the NOERROR TXT answers of the org domains to the hash bucket of their domain, as
+    'domain, JSON list of SPF records' lines. Lines are filtered on the raw buffer, only lines
+    mentioning v=spf1 are parsed as JSON, duplicated answers are left to do_count().
+    """
+    counter = defaultdict(int)
+    search_spf = _spf_regex.search
+    with SpillWriter(spill_dir, prefix) as writer:
+        for file_partition in file_partitions:
+            for line in file_partition.read_bytes().split(b'\n'):
+                if TXT_MARKER not in line or NOERROR_MARKER not in line:
+                    continue
+                match = _name_regex.search(line)
+                name = match.group(1).decode().lower().removesuffix('.') if match is not None else ''
+                if not name or get_org_domain(name) != name:
+                    continue
+                counter['answers'] += 1
+                records = []
+                if search_spf(line) is not None:
+                    records = spf_records(txt_answers(loads(line)) or ())
+                writer.write(name, f"{name}\t{dumps(records)}")
+    return counter
+
+
+def domain_spf_records(bucket: int, spill_dir: Path) -> Dict[str, List[str]]:
+    """SPF records of every domain of one bucket, from the first of its answers."""
+    domains = {}
+    for line in read_bucket(bucket_paths(spill_dir, bucket)):
+        name, records = line.split('\t', 1)
+        if name not in domains:
+            domains[name] = loads(records)
+    return domains
+
+
+def do_count(bucket: int, spill_dir: Path) -> Dict[str, Dict[str, int]]:
+    """Counts the SPF records of the org domains of one bucket and the targets of their includes and redirects."""
+    counters = {
+        'meta': defaultdict(int), 'all': defaultdict(int), 'records': defaultdict(int), 'syntax': defaultdict(int),
+        'mechanisms': defaultdict(int), 'includes': defaultdict(int), 'targets': defaultdict(int),
+    }
+    meta = counters['meta']
+    for records in domain_spf_records(bucket, spill_dir).values():
+        meta['responses'] += 1
+        if not records:
+            continue
+        meta['spf'] += 1
+        counters['records'][f"{len(records)}" if len(records) < 3 else '3+'] += 1
+        if len(records) > 1:
+            counters['all'][SPF_MULTIPLE] += 1
+            continue
+        record = parse_spf(records[0])
+        counters['all'][record.all_mechanism or SPF_NO_ALL] += 1
+        counters['syntax']['valid' if record.is_valid else 'permerror'] += 1
+        for term in record.terms:
+            counters['mechanisms'][f"{term.name}=" if term.is_modifier else term.name] += 1
+        for target in record.includes:
+            counters['includes'][target] += 1
+        if record.is_valid:
+            for target in record.targets:
+                counters['targets'][target] += 1
+    return counters
+
+
+def do_fetch(file_partition: FilePartition, names: Set[str]) -> Dict[str, Tuple[str, ...]]:
+    """TXT strings of the names of one partition with a definitive answer, an answer with records wins over an empty one."""
+    found = {}
+    for line in file_partition.read_bytes().split(b'\n'):
+        if TXT_MARKER not in line:
+            continue
+        match = _name_regex.search(line)
+        if match is None or match.group(1).decode().lower().removesuffix('.') not in names:
+            continue
+        doc = loads(line)
+        txts = txt_answers(doc)
+        name = doc['name'].lower().removesuffix('.')
+        if txts is not None and not found.get(name):
+            found[name] = txts
+    return found
+
+
+def lookup_limit(expansion: Expansion) -> str:
+    """
+    Limit an expansion exceeds, else its error or WITHIN_LIMITS. With unknown targets the lookups
+    are a lower bound, which may exceed the limit anyway.
+    """
+    if expansion.lookups > MAX_LOOKUPS:
+        return ERROR_LOOKUP_LIMIT
+    return expansion.limit_error() or WITHIN_LIMITS
+
+
+def do_expand(bucket: int, spill_dir: Path, records: Dict[str, Optional[Tuple[str, ...]]]) -> Dict[str, Dict[str, int]]:
+    """
+    Counts the DNS lookups of the single, valid SPF records of the domains of one bucket. Include
+    and redirect targets are looked up in records, expansions are memoized per target within the task.
+    """
+    counters = {'meta': defaultdict(int), 'limits': defaultdict(int), 'lookups': defaultdict(int), 'void_lookups': defaultdict(int)}
+    meta = counters['meta']
+    expander = SPFExpander(records.get)
+    for spf in domain_spf_records(bucket, spill_dir).values():
+        if len(spf) != 1:
+            continue
+        record = parse_spf(spf[0])
+        if not record.is_valid:
+            continue
+        expansion = expander.expand(record)
+        meta['expanded'] += 1
+        limit = lookup_limit(expansion)
+        counters['limits'][limit] += 1
+        if limit == ERROR_LOOKUP_LIMIT:
+            meta['exceeding'] += 1
+        if not expansion.error:
+            counters['lookups'][expansion.lookups] += 1
+        counters['void_lookups'][expansion.void_lookups] += 1
+    return counters
+
 
 def main():
-    files = [datasets['de_combined2_org']]
-    line_count = 0
-    exit_early = False
-
-    domain_pass = set()
-
-    spf_all_mechanism = DataCounter(
-        'SPF all mechanism',
-        'Shows how many different SPF mechanisms were found in the responses. The sum percentage is relative to all successful domain queries.',
-        'Mechanism'
-    )
-
-    data_collectors = [
-        spf_all_mechanism
-    ]
-
-    for file in files:
-        with open(file, mode='rt', encoding='utf-8') as fp:
-            for line in fp:
-                line_count += 1
-                if exit_early and line_count > 10000:
-                    line_count = 0
-                    break
-
-                doc = loads(line.strip())
-                name = doc['name']
-                org_name = get_org_domain(name)
-                is_org_domain = org_name == get_org_domain(name)
-                is_ok = 'error' not in doc and 'status' in doc and doc['status'] == 'NOERROR'
-
-                if is_ok and doc['type'] == 'TXT' and is_org_domain:
-                    if 'data' in doc and 'answers' in doc['data']:
-                        domain_pass.add(org_name)
-                        for answer in doc['data']['answers']:
-                            answer_data: str = answer['data']
-                            if answer_data.startswith('v=spf1'):
-                                spf_fragments = answer['data'].split(' ')
-                                all_mechanism = spf_fragments[-1]
-                                if all_mechanism in ['-all', '~all', '?all', '+all']:
-                                    spf_all_mechanism[spf_fragments[-1]] += 1
-                                else:
-                                    spf_all_mechanism['other'] += 1
-
-    valid_domain_count = len(domain_pass)
+    file_path = datasets['de_combined2_org']
+    partitions = coalesce_partitions(to_partition_descriptions(file_path))
+    task_count = min(os.cpu_count() or 1, len(partitions)) or 1
+
+    meta = defaultdict(int)
+    includes = defaultdict(int)
+    targets = defaultdict(int)
+    reports = {
+        'all': DataCounter(
+            'SPF all mechanism',
+            'Shows the all mechanism of the SPF record at the org domain. no_all means a record without all mechanism, multiple means more than one SPF record (permerror). The sum percentage is relative to all domains with a successful TXT query.',
+            'Mechanism'
+        ),
+        'records': DataCounter(
+            'SPF records per domain',
+            'Shows how many v=spf1 records a domain publishes, more than one is a permerror (RFC 7208, section 4.5). The sum percentage is relative to all domains with a successful TXT query.',
+            'Records'
+        ),
+        'syntax': DataCounter(
+            'SPF record syntax',
+            'Shows whether the single SPF record of a domain parses, a syntax error makes it a permerror. The sum percentage is relative to the domains with an SPF record.',
+            'Syntax'
+        ),
+        'mechanisms': DataCounter(
+            'SPF mechanism types',
+            'Shows how often each mechanism (and modifier, with a trailing =) occurs in single SPF records. The relative percentage is relative to all terms, the sum percentage to the domains with an SPF record.',
+            'Term'
+        ),
+        'includes': DataCounter(
+            'SPF include targets',
+            f"Shows the {TOP_INCLUDE_TARGETS} most frequent include targets of single SPF records, all others are summed up as other. The sum percentage is relative to the domains with an SPF record.",
+            'Target'
+        ),
+        'limits': DataCounter(
+            'SPF lookup limit',
+            f"Shows whether single, valid SPF records stay within the limits of {MAX_LOOKUPS} DNS lookups and {MAX_VOID_LOOKUPS} void lookups (RFC 7208, section 4.6.4) once their includes and redirects are expanded. lookup_limit is reported whenever the known lookups exceed the limit, temperror means a target missing from the dataset, the other errors are permerrors in the chain (no_record, multiple, syntax, loop). The sum percentage is relative to the domains with an SPF record.",
+            'Outcome'
+        ),
+        'lookups': DataCounter(
+            'SPF DNS lookups',
+            f"Shows the DNS lookups of single, valid SPF records together with all records they include or redirect to (RFC 7208, section 4.6.4), more than {MAX_LOOKUPS} is a permerror. Targets are looked up in the TXT results of the dataset, records with a target missing there, or with an error in the chain, are left out. The sum percentage is relative to the domains with an SPF record.",
+            'Lookups'
+        ),
+        'void_lookups': DataCounter(
+            'SPF void lookups',
+            'Shows how many include and redirect targets of single, valid SPF records have no TXT records or do not exist. The sum percentage is relative to the domains with an SPF record.',
+            'Void lookups'
+        ),
+    }
+
+    # Answers are deduplicated per domain, duplicated uploads and retried requests are counted once
+    with TemporaryDirectory(dir=file_path.parent) as tmp_dir, ProcessPoolExecutor() as executor:
+        spill_dir = Path(tmp_dir)
+        futures_list = [
+            executor.submit(do_spill, partitions[task::task_count], spill_dir, f"task{task:03}")
+            for task in range(task_count)
+        ]
+        log(f"Spilling {len(partitions):,} partitions with {task_count} tasks...")
+        for future in as_completed(futures_list):
+            merge_dicts(meta, future.result())
+
+        futures_list = [executor.submit(do_count, bucket, spill_dir) for bucket in range(SPILL_BUCKETS)]
+        for future in as_completed(futures_list):
+            counters = future.result()
+            merge_dicts(meta, counters.pop('meta'))
+            merge_dicts(includes, counters.pop('includes'))
+            merge_dicts(targets, counters.pop('targets'))
+            for key, counter in counters.items():
+                merge_dicts(reports[key], counter)
+        top_counts(includes, reports['includes'], TOP_INCLUDE_TARGETS)
+
+        def fetch(names: List[str]) -> Dict[str, Optional[Tuple[str, ...]]]:
+            # One pass over the dataset per level of includes, targets missing from it stay unknown
+            found = {}
+            pending = set(names)
+            for future in as_completed([executor.submit(do_fetch, partition, pending) for partition in partitions]):
+                for name, txts in future.result().items():
+                    if not found.get(name):
+                        found[name] = txts
+            return {name: found.get(name) for name in names}
+
+        records = resolve_targets(targets, fetch)
+        log(f"Found {sum(txts is not None for txts in records.values()):,} of {len(records):,} include and redirect targets in the dataset.")
+        futures_list = [executor.submit(do_expand, bucket, spill_dir, records) for bucket in range(SPILL_BUCKETS)]
+        for future in as_completed(futures_list):
+            counters = future.result()
+            merge_dicts(meta, counters.pop('meta'))
+            for key, counter in counters.items():
+                merge_dicts(reports[key], counter)
 
+    log(f"{meta['spf']:,} of {meta['responses']:,} domains with a successful TXT query ({meta['answers']:,} answers) have an SPF record.")
     with open('spf_report.md', mode='wt', encoding='utf-8') as fp:
         fp.write('# SPF Report \n\n')
-        fp.write(f"\nApplicable domains: {valid_domain_count:,}")
+        fp.write(f"\nApplicable domains: {meta['responses']:,}")
+        fp.write(f"\nDomains with SPF record: {meta['spf']:,}")
+        fp.write(f"\nDomains exceeding the SPF lookup limit: {meta['exceeding']:,} of {meta['expanded']:,} single, valid SPF records {POLICY_SPF_TOO_MANY_LOOKUPS}")
         fp.write(f"\nReport time: {datetime.now():%Y-%m-%d %H:%M:%S%z}")
 
-        for data_collection in data_collectors:
+        for key, report in reports.items():
+            if not report:
+                continue
             fp.write('\n\n')
-            data_collection.reference_sum = valid_domain_count
-            data_str = data_collection.dump()
-            fp.write(data_str)
+            report.reference_sum = meta['responses'] if key in ('all', 'records') else meta['spf']
+            fp.write(report.dump())
 
 
 if __name__ == '__main__':
@@ -1,41 +1,142 @@
-from datetime import datetime
+import json
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
 from json import loads
+from statistics import median, quantiles
 from time import time
+from typing import List, TextIO
 
+from lib.collection_profile import NS, CollectionProfile, Timeline, merge_profiles
+from lib.counters import tree_merge
+from lib.file_partition import FilePartition, coalesce_partitions, to_partition_descriptions
 from lib.util import log
 from datasets import datasets
 
+MAX_TIMELINE_ROWS = 48  # Buckets are combined until the timeline fits
+SLOW_CHUNKS = 20
+
+
+def do_work(file_partition: FilePartition) -> CollectionProfile:
+    profile = CollectionProfile()
+    for line in file_partition.get_io():
+        if line.strip():
+            profile.observe(loads(line))
+    return profile
+
+
+def format_time(seconds: float) -> str:
+    return f"{datetime.fromtimestamp(seconds, timezone.utc):%Y-%m-%d %H:%M:%S}"
+
+
+def dump_timeline(fp: TextIO, timeline: Timeline) -> None:
+    factor = max(1, -(-len(timeline.counts) // MAX_TIMELINE_ROWS))
+    coarse = timeline.resample(factor)
+    fp.write('## Throughput over time\n\n')
+    fp.write(f"Results per second of all runners in buckets of {coarse.bucket_seconds:,} s (UTC).\n\n")
+    fp.write('-------\n\n')
+    fp.write('| Bucket start | Results | Results/s |\n')
+    fp.write('|---|---:|---:|\n')
+    for index, (count, rate) in enumerate(zip(coarse.counts, coarse.rates())):
+        fp.write(f"| {format_time(coarse.bucket_time(index))} | {count:,} | {rate:,.1f} |\n")
+
+
+def dump_runners(fp: TextIO, profile: CollectionProfile) -> None:
+    fp.write('## Runners\n\n')
+    fp.write(f"Rates are results per second of the {profile.bucket_seconds} s buckets a runner was active in. Gaps are runs of empty buckets between its first and last result, stalls are buckets below a tenth of its median rate.\n\n")
+    fp.write('-------\n\n')
+    fp.write('| Runner | Results | Chunks | Active | Median/s | Peak/s | Gaps | Longest gap | Stalls |\n')
+    fp.write('|---|---:|---:|---:|---:|---:|---:|---:|---:|\n')
+    chunks = {}
+    for chunk in profile.chunks:
+        runner = chunk.rsplit('/', 1)[0]
+        chunks[runner] = chunks.get(runner, 0) + 1
+    for runner, timeline in sorted(profile.runners.items(), key=lambda item: -item[1].total):
+        active = [rate for rate in timeline.rates() if rate]
+        gaps = timeline.gaps()
+        longest = max((seconds for _, seconds in gaps), default=0)
+        fp.write(
+            f"| {runner} | {timeline.total:,} | {chunks.get(runner, 0):,} | {timeline.active_seconds():,} s "
+            f"| {median(active):,.1f} | {max(active):,.1f} | {len(gaps):,} | {longest:,} s | {timeline.stalls():,} |\n"
+        )
+
+
+def percentiles(values: List[float]) -> List[float]:
+    """Median, 90th and 99th percentile."""
+    if len(values) < 2:
+        return values * 3 if values else [0.0] * 3
+    cuts = quantiles(values, n=100, method='inclusive')
+    return [cuts[49], cuts[89], cuts[98]]
+
+
+def dump_chunks(fp: TextIO, profile: CollectionProfile) -> None:
+    spans = profile.chunks
+    fp.write('## Chunks\n\n')
+    fp.write(f"Duration is the time between the first and the last result of a runner_tag/chunk_id. Lists the {SLOW_CHUNKS} chunks with the lowest rate.\n\n")
+    fp.write('-------\n\n')
+    fp.write('| Statistic | Median | 90th percentile | 99th percentile |\n')
+    fp.write('|---|---:|---:|---:|\n')
+    durations = percentiles(sorted(span.seconds for span in spans.values()))
+    rates = percentiles(sorted(span.rate for span in spans.values()))
+    fp.write(f"| Duration s | {' | '.join(f'{value:,.1f}' for value in durations)} |\n")
+    fp.write(f"| Results/s | {' | '.join(f'{value:,.1f}' for value in rates)} |\n\n")
+
+    fp.write('| Chunk | Results | Start | Duration s | Results/s |\n')
+    fp.write('|---|---:|---|---:|---:|\n')
+    for chunk, span in sorted(spans.items(), key=lambda item: (item[1].rate, item[0]))[:SLOW_CHUNKS]:
+        fp.write(f"| {chunk} | {span.lines:,} | {format_time(span.first / NS)} | {span.seconds:,.1f} | {span.rate:,.1f} |\n")
+
+
+def dump_resolvers(fp: TextIO, profile: CollectionProfile) -> None:
+    fp.write('## Resolvers\n\n')
+    fp.write('Response times are only known for results of 03_collect_dns.py, massdns does not record them.\n\n')
+    fp.write('-------\n\n')
+    fp.write('| Resolver | Results | Timeouts | SERVFAIL | Median ms | 90th ms | 99th ms |\n')
+    fp.write('|---|---:|---:|---:|---:|---:|---:|\n')
+    for resolver, health in sorted(profile.resolvers.items(), key=lambda item: -item[1].queries):
+        latencies = [health.latency.percentile(q) for q in (50, 90, 99)]
+        latency_columns = ' | '.join('-' if latency is None else f"{latency * 1000:,.1f}" for latency in latencies)
+        fp.write(f"| {resolver} | {health.queries:,} | {health.timeouts / health.queries:.2%} | {health.servfail / health.queries:.2%} | {latency_columns} |\n")
+
 
 def main():
     files = [datasets['de_combined2_org'], datasets['de_combined2_dmarc']]
-    line_count = 0
-    exit_early = False
-
-    for file in files:
-        min_rx_ts = None
-        max_rx_ts = None
-        with open(file, mode='rt', encoding='utf-8') as fp:
-            for line in fp:
-                line_count += 1
-                if exit_early and line_count > 100000:
-                    line_count = 0
-                    break
-
-                doc = loads(line.strip())
-                if 'rx_ts' in doc:
-                    rx_ts = doc['rx_ts']
-                    if min_rx_ts is None or rx_ts < min_rx_ts:
-                        min_rx_ts = rx_ts
-                    if max_rx_ts is None or rx_ts > max_rx_ts:
-                        max_rx_ts = rx_ts
-
-        start_time = datetime.fromtimestamp(min_rx_ts / 1000000000.0)
-        end_time = datetime.fromtimestamp(max_rx_ts / 1000000000.0)
-        diff = end_time - start_time
-        log(f"File: {file}")
-        log(f"Start time: {start_time:%Y-%m-%d %H:%M:%S%z}")
-        log(f"End time: {end_time:%Y-%m-%d %H:%M:%S%z}")
-        log(f"Time difference: {diff}")
+
+    with ProcessPoolExecutor() as executor:
+        futures_list = [
+            executor.submit(do_work, partition)
+            for file_path in files
+            for partition in coalesce_partitions(to_partition_descriptions(file_path))
+        ]
+        log(f"Submitted {len(futures_list)} tasks. Waiting for results...")
+        profile = tree_merge(futures_list, executor, merge_profiles) or CollectionProfile()
+
+    timeline = profile.timeline
+    if timeline.start is None:
+        log('No results with rx_ts found.')
+        return
+    first = min(span.first for span in profile.chunks.values())
+    last = max(span.last for span in profile.chunks.values())
+    seconds = max(1.0, (last - first) / NS)
+    log(f"{timeline.total:,} results from {format_time(first / NS)} to {format_time(last / NS)}, {timeline.total / seconds:,.1f} results/s.")
+
+    # Per-minute timelines, to compare or add up the runs of several collections
+    with open('timing_timelines.json', mode='wt', encoding='utf-8') as fp:
+        json.dump({'total': timeline.to_dict(), 'runners': {runner: runner_timeline.to_dict() for runner, runner_timeline in profile.runners.items()}}, fp)
+
+    with open('timing_report.md', mode='wt', encoding='utf-8') as fp:
+        fp.write('# Collection Timing \n\n')
+        fp.write(f"Line count: {profile.lines:,}\n")
+        fp.write(f"Start time: {format_time(first / NS)} UTC\n")
+        fp.write(f"End time: {format_time(last / NS)} UTC\n")
+        fp.write(f"Duration: {seconds:,.0f} s, {timeline.total / seconds:,.1f} results/s on average, {max(timeline.rates()):,.1f} results/s at peak\n\n")
+        dump_timeline(fp, timeline)
+        fp.write('\n\n')
+        dump_runners(fp, profile)
+        fp.write('\n\n')
+        dump_chunks(fp, profile)
+        if profile.resolvers:
+            fp.write('\n\n')
+            dump_resolvers(fp, profile)
 
 
 if __name__ == '__main__':
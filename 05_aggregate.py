@@ -1,25 +1,22 @@
 from time import time
-import json
 from pathlib import Path
 
-def main():
-    dataset = dict()
+from lib.domain_summary import read_summary_table
+from lib.util import log
+
 
-    for file in Path('datasets').glob('*.ndjson'):
-        with open(file, mode='rt', encoding='utf-8') as fp:
-            for line in fp:
-                doc = json.loads(line.strip())
-                if 'name' in doc:
-                    if doc['name'] not in dataset:
-                        dataset[doc['name']] = [doc]
-                    else:
-                        dataset[doc['name']].append(doc)
+def main():
+    # One row per org domain, joined from all datasets by 05_join_domains.py, read as a stream
+    summary_path = Path('datasets/de_combined2_domain_summary.tsv')
+    domains = 0
+    for _ in read_summary_table(summary_path):
+        domains += 1
 
-    print(f"Loaded {len(dataset)} domains")
+    print(f"Loaded {domains} domains")
 
 
 if __name__ == '__main__':
     start = time()
+    log('Started execution.')
     main()
     print(f"\nProcessing time: {time() - start:.3f} s")
-
@@ -1,45 +1,65 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from collections import Counter
+from functools import lru_cache
 from time import time
 from json import loads
-from collections import defaultdict
+from typing import Dict, Tuple
 
 from datasets import datasets
 from lib.dmarc import parse_dmarc
-from lib.uri import parse_uri, parse_domain
+from lib.file_partition import to_partition_descriptions, FilePartition
+from lib.uri import parse_receiver_domain
 from lib.util import log, get_org_domain
 
+RECORD_CACHE_SIZE = 65536  # Distinct DMARC record strings memoized per worker
+
+
+@lru_cache(maxsize=RECORD_CACHE_SIZE)
+def record_receivers(record: str) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
+    """Receiver org domains of the rua and ruf URIs of a DMARC record, parsed once per distinct record."""
+    dmarc = parse_dmarc(record)
+    receivers = ([], [])
+    if dmarc:
+        for values, result in ((dmarc.rua.value, receivers[0]), (dmarc.ruf.value, receivers[1])):
+            for value in values or []:
+                domain = parse_receiver_domain(value)
+                if domain:
+                    result.append(get_org_domain(domain))
+    return tuple(receivers[0]), tuple(receivers[1])
+
+
+def do_work(file_partition: FilePartition) -> Dict[str, Counter]:
+    counters = {'rua': Counter(), 'ruf': Counter()}
+    for line in file_partition.get_io():
+        doc = loads(line)
+        if 'data' in doc and 'type' in doc and doc['type'] == 'TXT' and 'answers' in doc['data']:
+            for answer in doc['data']['answers']:
+                if 'data' in answer and answer['data'].startswith('v=DMARC1'):
+                    rua, ruf = record_receivers(answer['data'])
+                    counters['rua'].update(rua)
+                    counters['ruf'].update(ruf)
+    return counters
+
 
 def main():
-    domains = defaultdict(lambda: 0)
-
-    with open(datasets['de_combined2_dmarc'], mode='rt', encoding='utf-8') as fp:
-        for line in fp:
-            doc = loads(line)
-            if 'data' in doc and 'type' in doc and doc['type'] == 'TXT' and 'answers' in doc['data']:
-                for answer in doc['data']['answers']:
-                    if 'data' in answer and answer['data'].startswith('v=DMARC1'):
-                        dmarc = parse_dmarc(answer['data'])
-                        if dmarc:
-                            if dmarc.rua.value:
-                                for value in dmarc.rua.value:
-                                    uri = parse_uri(value)
-                                    if not uri.error_type:
-                                        if uri.email:
-                                            domain = parse_domain(uri.email)
-                                            if domain:
-                                                domains[get_org_domain(domain)] += 1
-                            if dmarc.ruf.value:
-                                for value in dmarc.ruf.value:
-                                    uri = parse_uri(value)
-                                    if not uri.error_type:
-                                        if uri.email:
-                                            domain = parse_domain(uri.email)
-                                            if domain:
-                                                domains[get_org_domain(domain)] += 1
-
-    domains = dict(sorted(domains.items(), key=lambda item: item[1], reverse=True))
+    futures_list = []
+    counters = {'rua': Counter(), 'ruf': Counter()}
+
+    with ProcessPoolExecutor() as executor:
+        for file_partition in to_partition_descriptions(datasets['de_combined2_dmarc']):
+            futures_list.append(executor.submit(do_work, file_partition))
+
+        log(f"Submitted {len(futures_list)} tasks. Waiting for results...")
+        for future in as_completed(futures_list):
+            result = future.result()
+            for name, counter in counters.items():
+                counter.update(result[name])
+
+    domains = counters['rua'] + counters['ruf']
+    log(f"Found {len(domains):,} receiver domains.")
     with open('ru_domains.txt', mode='wt', encoding='utf-8') as fp:
-        for domain, count in domains.items():
-            fp.write(f"{domain}: {count}\n")
+        for domain, count in domains.most_common():
+            fp.write(f"{domain}: {count} (rua: {counters['rua'][domain]}, ruf: {counters['ruf'][domain]})\n")
 
 
 if __name__ == '__main__':
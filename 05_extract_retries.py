@@ -0,0 +1,144 @@
+import os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+from itertools import groupby
+from json import loads
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import time
+from typing import Dict, List, Tuple
+
+from lib.batches import BATCH_SIZE, write_batch_manifest, write_batches
+from lib.counters import DataCounter, merge_dicts
+from lib.external_sort import merge_runs
+from lib.file_partition import FilePartition, to_partition_descriptions
+from lib.retries import MAX_FAILURES, attempt_outcome, backoff_seconds, request_key, retry_failures, retry_prefix
+from lib.sketches import hash64
+from lib.spill import SPILL_BUCKETS, SpillWriter, bucket_paths, read_bucket
+from lib.util import log
+from datasets import datasets
+
+
+def do_spill(file_partitions: List[FilePartition], spill_dir: Path, prefix: str) -> Dict[str, int]:
+    """Routes the outcome of every attempt to the hash bucket of its request."""
+    counter = defaultdict(int)
+    with SpillWriter(spill_dir, prefix) as writer:
+        for file_partition in file_partitions:
+            for line in file_partition.get_io():
+                if not line.strip():
+                    continue
+                counter['lines'] += 1
+                doc = loads(line)
+                request = request_key(doc)
+                writer.write(request, f"{request}\t{attempt_outcome(doc)}")
+    return counter
+
+
+def do_group(bucket: int, spill_dir: Path, run_dir: Path) -> Tuple[Path, Dict[str, int]]:
+    """
+    Combines all attempts of the requests of one bucket. Retries are written as 'type, failures,
+    hash, name' lines, so merging the buckets yields the tiers in a shuffled but reproducible order.
+    """
+    outcomes = defaultdict(list)
+    for line in read_bucket(bucket_paths(spill_dir, bucket)):
+        request, outcome = line.split('\t')
+        outcomes[request].append(outcome)
+
+    counter = defaultdict(int)
+    lines = []
+    for request, request_outcomes in outcomes.items():
+        failures = retry_failures(request_outcomes)
+        if failures is None:
+            counter['answered'] += 1
+        elif failures > MAX_FAILURES:
+            counter['given up'] += 1
+        else:
+            counter['retry'] += 1
+            rr_type, name = request.split(' ', 1)
+            lines.append(f"{rr_type}\t{failures}\t{hash64(name):016x}\t{name}")
+
+    lines.sort()
+    run_path = run_dir / f"retries-{bucket:03}.run"
+    with open(run_path, mode='wt', encoding='utf-8') as fp:
+        for line in lines:
+            fp.write(f"{line}\n")
+    return run_path, counter
+
+
+def tier_key(line: str) -> Tuple[str, int]:
+    rr_type, failures, _ = line.split('\t', 2)
+    return rr_type, int(failures)
+
+
+def main():
+    files = [datasets['de_combined2_org'], datasets['de_combined2_dmarc']]
+    output_dir = Path('queue')
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    partitions = [partition for file_path in files for partition in to_partition_descriptions(file_path)]
+    task_count = min(os.cpu_count() or 1, len(partitions)) or 1
+    meta = defaultdict(int)
+    requests = DataCounter(
+        'Requests by outcome',
+        'Combines all attempts of a (type, name) request. Retry counts requests with only timeouts and SERVFAIL, given up those failing more than the retry limit.',
+        'Outcome'
+    )
+    tiers = DataCounter(
+        'Retries by tier',
+        'Requests to retry per record type and failed attempts, each tier is a batch prefix with its own backoff.',
+        'Tier'
+    )
+
+    created = datetime.now(timezone.utc)
+    sources = [file_path.as_posix() for file_path in files]
+    with TemporaryDirectory(dir=output_dir) as tmp_dir, ProcessPoolExecutor() as executor:
+        spill_dir = Path(tmp_dir)
+        futures_list = [
+            executor.submit(do_spill, partitions[task::task_count], spill_dir, f"task{task:03}")
+            for task in range(task_count)
+        ]
+        log(f"Spilling {len(partitions):,} partitions with {task_count} tasks...")
+        for future in as_completed(futures_list):
+            merge_dicts(meta, future.result())
+        log(f"Spilled {meta['lines']:,} attempts into {SPILL_BUCKETS} buckets.")
+
+        run_paths = []
+        futures_list = [executor.submit(do_group, bucket, spill_dir, spill_dir) for bucket in range(SPILL_BUCKETS)]
+        for future in as_completed(futures_list):
+            run_path, counter = future.result()
+            run_paths.append(run_path)
+            merge_dicts(requests, counter)
+
+        # One prefix per tier: massdns takes a single record type, and the backoff grows with the failures
+        for (rr_type, failures), lines in groupby(merge_runs(run_paths, dedupe=False), key=tier_key):
+            prefix = retry_prefix(rr_type, failures, created)
+            names = (line.rsplit('\t', 1)[1] for line in lines)
+            batches = write_batches(names, prefix, output_dir, BATCH_SIZE, executor=executor)
+            backoff = backoff_seconds(failures)
+            manifest_path = write_batch_manifest(
+                output_dir, prefix, batches,
+                sources=sources, rr_type=rr_type, failures=failures, backoff_seconds=backoff,
+                not_before=(created + timedelta(seconds=backoff)).isoformat(),
+            )
+            lines_written = sum(batch.lines for batch in batches)
+            tiers[f"{rr_type} after {failures} failures"] = lines_written
+            log(f"Wrote {len(batches)} chunks with {lines_written:,} {rr_type} retries, manifest: {manifest_path}")
+
+    requests.reference_sum = sum(requests.values())
+    tiers.reference_sum = requests['retry']
+    log(f"{requests['retry']:,} of {requests.reference_sum:,} requests need a retry.")
+    with open('retries_report.md', mode='wt', encoding='utf-8') as fp:
+        fp.write('# DNS Retries \n\n')
+        fp.write(f"Attempts: {meta['lines']:,}\n\n")
+        requests.dumps(fp)
+        if tiers:
+            fp.write('\n\n')
+            tiers.dumps(fp)
+
+
+if __name__ == '__main__':
+    start = time()
+    log('Started execution.')
+    main()
+    log(f"Processing time: {time() - start:.3f} s")
@@ -0,0 +1,107 @@
+import os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from json import loads
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import time
+from typing import Dict, List, Tuple
+
+from lib.counters import DataCounter, merge_dicts
+from lib.dmarc_domains import (DOMAIN_TABLE_HEADER, evaluate_domain, observation_line, parse_observation_line,
+                               dmarc_domain)
+from lib.external_sort import merge_runs
+from lib.file_partition import FilePartition, to_partition_descriptions
+from lib.spill import SPILL_BUCKETS, SpillWriter, bucket_paths, read_bucket
+from lib.util import log
+from datasets import datasets
+
+
+def do_spill(file_partitions: List[FilePartition], spill_dir: Path, prefix: str) -> Dict[str, int]:
+    """Routes the TXT results of all _dmarc names to their hash bucket."""
+    counter = defaultdict(int)
+    with SpillWriter(spill_dir, prefix) as writer:
+        for file_partition in file_partitions:
+            for line in file_partition.get_io():
+                if not line.strip():
+                    continue
+                counter['lines'] += 1
+                doc = loads(line)
+                if doc.get('type') != 'TXT' or not doc['name'].startswith('_dmarc.'):
+                    continue
+                writer.write(dmarc_domain(doc['name']), observation_line(doc))
+                counter['observations'] += 1
+    return counter
+
+
+def do_group(bucket: int, spill_dir: Path, run_dir: Path) -> Tuple[Path, Dict[str, int]]:
+    """Evaluates all names of one bucket, writing them sorted by domain."""
+    observations = defaultdict(list)
+    for line in read_bucket(bucket_paths(spill_dir, bucket)):
+        domain, observation = parse_observation_line(line)
+        observations[domain].append(observation)
+
+    counter = defaultdict(int)
+    run_path = run_dir / f"domains-{bucket:03}.run"
+    with open(run_path, mode='wt', encoding='utf-8') as fp:
+        for domain in sorted(observations):
+            result = evaluate_domain(domain, observations[domain])
+            counter[result.outcome] += 1
+            if result.rrsets > 1:
+                counter['inconsistent'] += 1
+            fp.write(f"{result.to_line()}\n")
+    return run_path, counter
+
+
+def main():
+    file_path = datasets['de_combined2_dmarc']
+    target_path = Path('datasets/de_combined2_dmarc_domains.tsv')
+    target_path.parent.mkdir(parents=True, exist_ok=True)
+
+    partitions = list(to_partition_descriptions(file_path))
+    task_count = min(os.cpu_count() or 1, len(partitions)) or 1
+    meta = defaultdict(int)
+    outcomes = DataCounter(
+        'DMARC evaluation outcome',
+        'Shows the outcome of the RFC 7489 evaluation of the TXT RRset at each _dmarc name, combining all attempts. Inconsistent counts names where attempts returned different non-empty RRsets.',
+        'Outcome'
+    )
+
+    with TemporaryDirectory(dir=target_path.parent) as tmp_dir, ProcessPoolExecutor() as executor:
+        spill_dir = Path(tmp_dir)
+        # Every task gets its own spill files, so the file count is task_count * SPILL_BUCKETS
+        futures_list = [
+            executor.submit(do_spill, partitions[task::task_count], spill_dir, f"task{task:03}")
+            for task in range(task_count)
+        ]
+        log(f"Spilling {len(partitions):,} partitions with {task_count} tasks...")
+        for future in as_completed(futures_list):
+            merge_dicts(meta, future.result())
+        log(f"Spilled {meta['observations']:,} observations of {meta['lines']:,} lines into {SPILL_BUCKETS} buckets.")
+
+        run_paths = []
+        futures_list = [executor.submit(do_group, bucket, spill_dir, spill_dir) for bucket in range(SPILL_BUCKETS)]
+        for future in as_completed(futures_list):
+            run_path, counter = future.result()
+            run_paths.append(run_path)
+            merge_dicts(outcomes, counter)
+
+        log(f"Merging {len(run_paths)} buckets into {target_path}...")
+        with open(target_path, mode='wt', encoding='utf-8') as fp:
+            fp.write(f"{DOMAIN_TABLE_HEADER}\n")
+            for line in merge_runs(run_paths, dedupe=False):
+                fp.write(f"{line}\n")
+
+    domain_count = sum(count for outcome, count in outcomes.items() if outcome != 'inconsistent')
+    outcomes.reference_sum = domain_count
+    log(f"Evaluated {domain_count:,} domains.")
+    with open('dmarc_domains_report.md', mode='wt', encoding='utf-8') as fp:
+        fp.write('# DMARC Domain Evaluation \n\n')
+        outcomes.dumps(fp)
+
+
+if __name__ == '__main__':
+    start = time()
+    log('Started execution.')
+    main()
+    log(f"Processing time: {time() - start:.3f} s")
@@ -0,0 +1,143 @@
+import os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from json import loads
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import time
+from typing import Dict, List, Tuple
+
+from lib.counters import DataCounter, merge_dicts
+from lib.dmarc_domains import OUTCOME_VALID
+from lib.domain_summary import (SPF_MULTIPLE, SPF_NONE, SUMMARY_TABLE_HEADER, DomainSummary, evaluate_summary,
+                                parse_summary_observation, read_summary_table, summary_observation)
+from lib.external_sort import merge_runs
+from lib.file_partition import FilePartition, to_partition_descriptions
+from lib.spill import SPILL_BUCKETS, SpillWriter, bucket_paths, read_bucket
+from lib.summary_table import SUMMARY_TABLE_EXTENSION, write_summary_table
+from lib.util import log
+from datasets import datasets
+
+
+def do_spill(file_partitions: List[FilePartition], spill_dir: Path, prefix: str) -> Dict[str, int]:
+    """Routes the MX, TXT and _dmarc TXT results of both datasets to the bucket of their org domain."""
+    counter = defaultdict(int)
+    with SpillWriter(spill_dir, prefix) as writer:
+        for file_partition in file_partitions:
+            for line in file_partition.get_io():
+                if not line.strip():
+                    continue
+                counter['lines'] += 1
+                observation = summary_observation(loads(line))
+                if observation is not None:
+                    writer.write(*observation)
+                    counter['observations'] += 1
+    return counter
+
+
+def mail_config(summary: DomainSummary) -> str:
+    """MX, SPF and DMARC presence of a domain, as the MX/SPF/DMARC permutations of 04_report.py."""
+    return ' '.join(f"{name} {'✓' if present else '✗'}" for name, present in (
+        ('MX', summary.has_mx),
+        ('SPF', summary.spf_all not in (SPF_NONE, SPF_MULTIPLE)),
+        ('DMARC', summary.dmarc == OUTCOME_VALID),
+    ))
+
+
+def do_join(bucket: int, spill_dir: Path, run_dir: Path) -> Tuple[Path, Dict[str, Dict[str, int]]]:
+    """Joins all observations of the domains of one bucket, writing their summaries sorted by domain."""
+    observations = defaultdict(list)
+    for line in read_bucket(bucket_paths(spill_dir, bucket)):
+        domain, observation = parse_summary_observation(line)
+        observations[domain].append(observation)
+
+    counters = {'config': defaultdict(int), 'spf_all': defaultdict(int), 'dmarc': defaultdict(int), 'dns_error': defaultdict(int)}
+    run_path = run_dir / f"summary-{bucket:03}.run"
+    with open(run_path, mode='wt', encoding='utf-8') as fp:
+        for domain in sorted(observations):
+            summary = evaluate_summary(domain, observations[domain])
+            counters['config'][mail_config(summary)] += 1
+            counters['spf_all'][summary.spf_all or 'none'] += 1
+            counters['dmarc'][summary.policy or summary.dmarc] += 1
+            counters['dns_error'][summary.dns_error or 'none'] += 1
+            fp.write(f"{summary.to_line()}\n")
+    return run_path, counters
+
+
+def main():
+    files = [datasets['de_combined2_org'], datasets['de_combined2_dmarc']]
+    target_path = Path('datasets/de_combined2_domain_summary.tsv')
+    target_path.parent.mkdir(parents=True, exist_ok=True)
+
+    partitions = [partition for file_path in files for partition in to_partition_descriptions(file_path)]
+    task_count = min(os.cpu_count() or 1, len(partitions)) or 1
+    meta = defaultdict(int)
+    reports = {
+        'config': DataCounter(
+            'Mail configuration per domain',
+            'Shows which combination of MX records, an SPF record and a valid DMARC record each org domain has. ✓ means present, ✗ means missing.',
+            'Configuration'
+        ),
+        'spf_all': DataCounter(
+            'SPF all mechanism per domain',
+            'Shows the all mechanism of the SPF record at the org domain. no_all means a record without all mechanism, multiple means more than one SPF record (permerror).',
+            'Mechanism'
+        ),
+        'dmarc': DataCounter(
+            'DMARC policy per domain',
+            'Shows the policy of valid DMARC records, otherwise the evaluation outcome of the _dmarc name.',
+            'Policy'
+        ),
+        'dns_error': DataCounter(
+            'DNS error class per domain',
+            'Shows the failure of the first request of a domain without definitive answer, NXDOMAIN if the org domain does not exist.',
+            'Error class'
+        ),
+    }
+
+    with TemporaryDirectory(dir=target_path.parent) as tmp_dir, ProcessPoolExecutor() as executor:
+        spill_dir = Path(tmp_dir)
+        futures_list = [
+            executor.submit(do_spill, partitions[task::task_count], spill_dir, f"task{task:03}")
+            for task in range(task_count)
+        ]
+        log(f"Spilling {len(partitions):,} partitions with {task_count} tasks...")
+        for future in as_completed(futures_list):
+            merge_dicts(meta, future.result())
+        log(f"Spilled {meta['observations']:,} observations of {meta['lines']:,} lines into {SPILL_BUCKETS} buckets.")
+
+        run_paths = []
+        futures_list = [executor.submit(do_join, bucket, spill_dir, spill_dir) for bucket in range(SPILL_BUCKETS)]
+        for future in as_completed(futures_list):
+            run_path, counters = future.result()
+            run_paths.append(run_path)
+            for key, counter in counters.items():
+                merge_dicts(reports[key], counter)
+
+        log(f"Merging {len(run_paths)} buckets into {target_path}...")
+        with open(target_path, mode='wt', encoding='utf-8') as fp:
+            fp.write(f"{SUMMARY_TABLE_HEADER}\n")
+            for line in merge_runs(run_paths, dedupe=False):
+                fp.write(f"{line}\n")
+
+    # Memory-mapped copy for ad hoc queries, the row number is the domain ID, see 04_report_domains.py
+    table_path = target_path.with_suffix(SUMMARY_TABLE_EXTENSION)
+    rows = write_summary_table(read_summary_table(target_path), table_path)
+    log(f"Wrote {rows:,} rows to {table_path}.")
+
+    domain_count = sum(reports['config'].values())
+    log(f"Joined {domain_count:,} domains.")
+    with open('domain_summary_report.md', mode='wt', encoding='utf-8') as fp:
+        fp.write('# Domain Summary \n\n')
+        fp.write(f"Domains: {domain_count:,}. Line count: {meta['lines']:,}")
+        for report in reports.values():
+            fp.write('\n\n')
+            report.reference_sum = domain_count
+            report.dumps(fp)
+
+
+if __name__ == '__main__':
+    start = time()
+    log('Started execution.')
+    main()
+    log(f"Processing time: {time() - start:.3f} s")
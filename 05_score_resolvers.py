@@ -0,0 +1,58 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from json import loads
+from pathlib import Path
+from time import time
+from typing import Dict
+
+from lib.dns_collector import read_resolvers, resolver_name
+from lib.file_partition import FilePartition, coalesce_partitions, to_partition_descriptions
+from lib.resolver_pool import ResolverHealth, ResolverPool
+from lib.util import log
+from datasets import datasets
+
+
+def do_work(file_partition: FilePartition) -> Dict[str, ResolverHealth]:
+    health: Dict[str, ResolverHealth] = {}
+    for line in file_partition.get_io():
+        if line.strip():
+            doc = loads(line)
+            if 'resolver' in doc:
+                resolver_health = health.get(doc['resolver'])
+                if resolver_health is None:
+                    resolver_health = health[doc['resolver']] = ResolverHealth()
+                resolver_health.observe(doc.get('status'), doc.get('error'), doc.get('rtt'))
+    return health
+
+
+def main():
+    files = [datasets['de_combined2_org'], datasets['de_combined2_dmarc']]
+    resolvers_path = Path('resolvers.txt')
+    weighted_path = Path('resolvers_weighted.txt')
+
+    # Resolvers without results still get a default weight
+    pool = ResolverPool([resolver_name(address) for address in read_resolvers(resolvers_path)] if resolvers_path.exists() else [])
+    with ProcessPoolExecutor() as executor:
+        futures_list = [
+            executor.submit(do_work, partition)
+            for file_path in files
+            for partition in coalesce_partitions(to_partition_descriptions(file_path))
+        ]
+        log(f"Submitted {len(futures_list)} tasks. Waiting for results...")
+        for future in as_completed(futures_list):
+            pool.merge(future.result())
+
+    now = time()
+    pool.update(now)
+    count = pool.write_weighted_list(weighted_path, now)
+    log(f"Wrote {count} of {len(pool.health)} resolvers to {weighted_path}.")
+    with open('resolver_report.md', mode='wt', encoding='utf-8') as fp:
+        fp.write('# Resolver Health \n\n')
+        fp.write('Latency is only known for results of 03_collect_dns.py, massdns does not record it.\n\n')
+        pool.dumps(fp, now)
+
+
+if __name__ == '__main__':
+    start = time()
+    log('Started execution.')
+    main()
+    log(f"Processing time: {time() - start:.3f} s")
@@ -1,21 +1,134 @@
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from collections import defaultdict
+from datetime import date
 from time import time
 from pathlib import Path
+from typing import Dict, List, Set, Tuple
+
 from lib.util import log
-import gzip
+from lib.route53 import (EPOCH_ORDINAL, SHARD_PARTS_KEY, SHARD_ROWS_KEY, Route53Table, load_manifest, merge_shard_parts,
+                         read_route53_log, recover_shards, save_manifest, shard_part_path, shard_path)
+from lib.route53_rollup import update_rollup
+
+FLUSH_ROWS = 20_000_000  # Rows buffered in memory before they are written to part files of the daily shards
+TASKS_PER_WORKER = 2  # Files parsed or waiting to be consumed per worker, results of all others are not held yet
+
+
+def do_work(source_file: Path) -> Tuple[Path, Dict[int, Route53Table]]:
+    table = Route53Table()
+    table.extend(read_route53_log(source_file))
+    table.reset_caches()
+    return source_file, table.split_days()
+
+
+def flush(target_dir: Path, buffered: Dict[int, List[Route53Table]], shard_parts: Dict[str, List[str]]) -> None:
+    """
+    Writes the buffered tables to a new part file per day, recording it to be committed. The shards
+    themselves are rewritten once at the end of the run, by merge_parts().
+    """
+    for day, tables in sorted(buffered.items()):
+        table = tables[0]
+        for other in tables[1:]:
+            table.merge(other)
+        parts = shard_parts.setdefault(shard_path(target_dir, day).stem, [])
+        part_path = shard_part_path(target_dir, day, len(parts))
+        table.save(part_path)
+        parts.append(part_path.name)
+    buffered.clear()
+
+
+def merge_parts(target_dir: Path, manifest: Dict[str, Dict], touched_days: Set[int]) -> None:
+    """
+    Merges the committed part files into their shards, one shard at a time. The new row count is
+    committed before the parts are deleted, a shard rewritten by an aborted merge is rolled back
+    by recover_shards() and its parts merged again.
+    """
+    shard_parts: Dict[str, List[str]] = manifest[SHARD_PARTS_KEY]
+    for stem in sorted(shard_parts):
+        day = date.fromisoformat(stem).toordinal() - EPOCH_ORDINAL
+        part_paths = [target_dir / name for name in shard_parts[stem]]
+        manifest[SHARD_ROWS_KEY][stem] = merge_shard_parts(target_dir, day, part_paths)
+        del shard_parts[stem]
+        save_manifest(target_dir, manifest)
+        for part_path in part_paths:
+            part_path.unlink()
+        touched_days.add(day)
+
 
 def main():
     source_dir = Path('E:\\route53')
-    target_file = Path('route53.txt')
-    file_counter = 0
+    target_dir = Path('route53')
+    target_dir.mkdir(parents=True, exist_ok=True)
+
+    manifest = load_manifest(target_dir)
+    # Rows of an aborted flush are not committed, the shards go back to the counts in the manifest
+    touched_days: Set[int] = set(recover_shards(target_dir, manifest))
+    if touched_days:
+        log(f"Rolled back {len(touched_days):,} shards of an aborted run.")
+    shard_parts: Dict[str, List[str]] = manifest[SHARD_PARTS_KEY]
+    source_files = []
+    for source_file in sorted(source_dir.glob('**/*.gz')):
+        key = source_file.relative_to(source_dir).as_posix()
+        if key not in manifest:
+            source_files.append(source_file)
+    log(f"{sum(not key.startswith('#') for key in manifest):,} files already ingested, {len(source_files):,} new files.")
+
+    buffered: Dict[int, List[Route53Table]] = defaultdict(list)
+    buffered_rows = 0
+    pending_keys: Dict[str, Dict] = {}
+    record_counter = 0
+
+    with ProcessPoolExecutor() as executor:
+        # A bounded window of tasks, so parsed tables are only held until they are consumed
+        max_pending = TASKS_PER_WORKER * (os.cpu_count() or 1)
+        remaining = iter(source_files)
+        pending = set()
+        log(f"Submitting {len(source_files)} tasks, {max_pending} at a time...")
+        while True:
+            for source_file in remaining:
+                pending.add(executor.submit(do_work, source_file))
+                if len(pending) >= max_pending:
+                    break
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                source_file, day_tables = future.result()
+                rows = 0
+                for day, table in day_tables.items():
+                    buffered[day].append(table)
+                    rows += len(table)
+                buffered_rows += rows
+                record_counter += rows
+                stat = source_file.stat()
+                pending_keys[source_file.relative_to(source_dir).as_posix()] = {
+                    'size': stat.st_size,
+                    'mtime': stat.st_mtime,
+                    'rows': rows,
+                }
+            del done, future, day_tables
+
+            # Keys and part files are committed together once the rows are on disk, part files of an
+            # aborted flush are deleted by recover_shards() and their source files ingested again
+            if buffered_rows >= FLUSH_ROWS:
+                flush(target_dir, buffered, shard_parts)
+                manifest.update(pending_keys)
+                save_manifest(target_dir, manifest)
+                pending_keys.clear()
+                buffered_rows = 0
+
+        flush(target_dir, buffered, shard_parts)
+        manifest.update(pending_keys)
+        save_manifest(target_dir, manifest)
+        merge_parts(target_dir, manifest, touched_days)
+
+        log(f"Building rollups for {len(touched_days):,} days...")
+        shard_paths = [path for path in (shard_path(target_dir, day) for day in sorted(touched_days)) if path.exists()]
+        list(executor.map(update_rollup, shard_paths))
 
-    with open(target_file, mode='wt', encoding='utf-8') as wfp:
-        for source_file in source_dir.glob('**/*.gz'):
-            file_counter += 1
-            with gzip.open(source_file, 'rt', encoding='utf-8') as rfp:
-                for line in rfp:
-                    wfp.write(line)
+    log(f"Read {record_counter:,} records from {len(source_files):,} files in {source_dir}.")
 
-    print(f"Read {file_counter} records from {source_dir}.")
 
 if __name__ == '__main__':
     start_time = time()
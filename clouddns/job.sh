@@ -3,8 +3,10 @@
 # --- Configuration ---
 JOB_SERVER_PATH=""
 API_KEY=""
-SLEEP_AFTER_SUCCESS=5
+SLEEP_AFTER_SUCCESS=0
+SLEEP_WHEN_BUSY=30
 RESOLVERS_FILE="/etc/clouddns/resolvers.txt"
+DEFAULT_RECORD_TYPE="NS"  # Unless the job server sends X-Record-Type (retry chunks)
 
 # --- Preparation (Tag) ---
 RANDOM_TAG=$(tr -dc A-Za-z0-9 < /dev/urandom | head -c 8)
@@ -19,11 +21,30 @@ while true; do
     echo "--- New Iteration ---"
 
     echo "Fetching new job from job_server"
-    if ! JOB_FILE_NAME=$(curl -J -O -X GET --fail -s "$JOB_SERVER_PATH/job" -H "Authorization: Bearer $API_KEY" -w "%{filename_effective}"); then
+    # %header{} needs curl 7.84 or later
+    if ! read -r HTTP_CODE JOB_FILE_NAME RECORD_TYPE < <(curl -J -O -X GET -s "$JOB_SERVER_PATH/job" -H "Authorization: Bearer $API_KEY" -H "X-Runner-Tag: $RANDOM_TAG" -w "%{http_code} %{filename_effective} %header{x-record-type}\n"); then
         echo "ERROR: Failed to fetch new job."
         exit 1
     fi
 
+    if [ "$HTTP_CODE" = "503" ]; then
+        echo "All jobs are leased, retrying in ${SLEEP_WHEN_BUSY}s..."
+        rm -f "$JOB_FILE_NAME"
+        sleep "$SLEEP_WHEN_BUSY"
+        continue
+    fi
+
+    if [ "$HTTP_CODE" = "404" ]; then
+        echo "No jobs left."
+        rm -f "$JOB_FILE_NAME"
+        exit 0
+    fi
+
+    if [ "$HTTP_CODE" != "200" ]; then
+        echo "ERROR: Failed to fetch new job (HTTP $HTTP_CODE)."
+        exit 1
+    fi
+
     if [ ! -f "$JOB_FILE_NAME" ]; then
         echo "ERROR: Job file not found."
         exit 1
@@ -34,7 +55,8 @@ while true; do
         exit 1
     fi
 
-    echo "Selected job file: $JOB_FILE_NAME"
+    RECORD_TYPE="${RECORD_TYPE:-$DEFAULT_RECORD_TYPE}"
+    echo "Selected job file: $JOB_FILE_NAME, record type $RECORD_TYPE"
     LOCAL_UNCOMPRESSED_FILE="${JOB_FILE_NAME%.bz2}"
     echo "Decompressing $JOB_FILE_NAME to $LOCAL_UNCOMPRESSED_FILE..."
     if ! bunzip2 "$JOB_FILE_NAME"; then
@@ -51,7 +73,7 @@ while true; do
     NAME_WITHOUT_EXT="${BASE_FILENAME%.*}"
     RESULT_FILE_BASE="${NAME_WITHOUT_EXT}.ndjson"
     echo "Running massdns with input: \"$LOCAL_UNCOMPRESSED_FILE\", output file: \"$RESULT_FILE_BASE\""
-    massdns --quiet --hashmap-size 2 --resolve-count 3 --retry never --interval 1000 --output Je --type NS --resolvers "$RESOLVERS_FILE" --outfile "$RESULT_FILE_BASE" "$LOCAL_UNCOMPRESSED_FILE"
+    massdns --quiet --hashmap-size 2 --resolve-count 3 --retry never --interval 1000 --output Je --type "$RECORD_TYPE" --resolvers "$RESOLVERS_FILE" --outfile "$RESULT_FILE_BASE" "$LOCAL_UNCOMPRESSED_FILE"
     WORKER_EXIT_CODE=$?
 
     if [ $WORKER_EXIT_CODE -ne 0 ]; then
@@ -81,7 +103,7 @@ while true; do
 
     DEST_URI="$JOB_SERVER_PATH/job/$JOB_FILE_NAME"
     echo "Attempting to delete original file $DEST_URI..."
-    if ! curl -X DELETE --fail-with-body -s "$DEST_URI" -H "Authorization: Bearer $API_KEY"; then
+    if ! curl -X DELETE --fail-with-body -s "$DEST_URI" -H "Authorization: Bearer $API_KEY" -H "X-Runner-Tag: $RANDOM_TAG"; then
         echo "WARN: Delete command for $DEST_URI failed (Code: $?). This might be okay if file was already deleted."
     fi
 
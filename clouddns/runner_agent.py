@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+Pipelined replacement for job.sh: while massdns runs, the next jobs are downloaded and
+decompressed, and finished results are compressed and uploaded in the background.
+
+Stand-alone on purpose (standard library only), as runner.sh copies single files to the runners.
+Configured through the same variables as job.sh, from the environment:
+
+    JOB_SERVER_PATH, API_KEY, RESOLVERS_FILE, PREFETCH_JOBS, MASSDNS
+
+If the job server serves a weighted resolver list (GET /resolvers), it replaces RESOLVERS_FILE
+and is refreshed every RESOLVERS_REFRESH seconds. The start of every massdns run is reported
+(PATCH /job/<file>), so the server does not count the prefetch wait as run time.
+
+Per-stage timings are printed after every job and written to runner_metrics.json.
+"""
+import bz2
+import json
+import random
+import shlex
+import string
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from os import cpu_count, getenv
+from pathlib import Path
+from queue import Queue
+from time import monotonic, sleep
+from typing import Dict, List, Optional, Tuple
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+JOB_SERVER_PATH = getenv('JOB_SERVER_PATH', '')
+API_KEY = getenv('API_KEY', '')
+RESOLVERS_FILE = getenv('RESOLVERS_FILE', '/etc/clouddns/resolvers.txt')
+PREFETCH_JOBS = int(getenv('PREFETCH_JOBS', '2'))  # Jobs downloaded ahead of massdns
+MASSDNS = getenv('MASSDNS', 'massdns --quiet --hashmap-size 2 --resolve-count 3 --retry never --interval 1000 --output Je --type NS')
+RETRY_AFTER = 30
+RESOLVERS_REFRESH = 300
+COMPRESS_BLOCK_SIZE = 900 * 1024  # bzip2 block size at level 9, every block becomes its own stream
+METRICS_FILE = Path('runner_metrics.json')
+
+STAGES = ('fetch', 'decompress', 'wait', 'massdns', 'compress', 'upload')
+
+
+def log(output: str) -> None:
+    print(f"[{datetime.now():%Y-%m-%d %H:%M:%S}] {output}", flush=True)
+
+
+class StageTimer:
+    """Seconds spent per stage, thread safe, as several stages run at the same time."""
+
+    def __init__(self):
+        self.seconds: Dict[str, float] = {stage: 0.0 for stage in STAGES}
+        self.counts: Dict[str, int] = {stage: 0 for stage in STAGES}
+        self.started = monotonic()
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.seconds[stage] += seconds
+            self.counts[stage] += 1
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            wall = monotonic() - self.started
+            return {
+                'wall': round(wall, 3),
+                'utilization': round(self.seconds['massdns'] / wall, 4) if wall > 0 else 0.0,
+                'stages': {stage: {'seconds': round(self.seconds[stage], 3), 'count': self.counts[stage]} for stage in STAGES},
+            }
+
+
+class Stage:
+    def __init__(self, timer: StageTimer, stage: str):
+        self.timer = timer
+        self.stage = stage
+
+    def __enter__(self) -> 'Stage':
+        self.start = monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.seconds = monotonic() - self.start
+        self.timer.add(self.stage, self.seconds)
+
+
+def compress_parallel(data: bytes, executor: ThreadPoolExecutor) -> bytes:
+    """
+    bzip2 compression on all cores: blocks are compressed independently and concatenated.
+    The result is a multi-stream file, which bunzip2 and Python's bz2 module read as one.
+    """
+    blocks = [data[start:start + COMPRESS_BLOCK_SIZE] for start in range(0, len(data), COMPRESS_BLOCK_SIZE)] or [b'']
+    return b''.join(executor.map(bz2.compress, blocks))
+
+
+def server_request(method: str, path: str, body: Optional[bytes] = None, headers: Optional[Dict[str, str]] = None):
+    request = Request(f"{JOB_SERVER_PATH}{path}", data=body, method=method)
+    request.add_header('Authorization', f"Bearer {API_KEY}")
+    for name, value in (headers or {}).items():
+        request.add_header(name, value)
+    return urlopen(request, timeout=300)
+
+
+def fetch_job(runner_tag: str) -> Tuple[Optional[str], Optional[bytes], Optional[str], int]:
+    """
+    Downloads the next job as (file name, data, record type, retry after). The record type is None
+    unless the server sends one for the chunk. A file name of None with retry after 0 means there
+    are no jobs left.
+    """
+    try:
+        with server_request('GET', '/job', headers={'X-Runner-Tag': runner_tag}) as response:
+            file_name = response.headers.get_filename()
+            return file_name, response.read(), response.headers.get('X-Record-Type'), 0
+    except HTTPError as e:
+        if e.code == 503:
+            return None, None, None, int(e.headers.get('Retry-After', RETRY_AFTER))
+        if e.code == 404:
+            return None, None, None, 0
+        raise
+
+
+def massdns_command(record_type: Optional[str], resolvers_path: Path, result_path: Path, input_path: Path) -> List[str]:
+    """The MASSDNS command line, with --type replaced if the job has its own record type."""
+    args = shlex.split(MASSDNS)
+    if record_type is not None:
+        if '--type' in args:
+            args[args.index('--type') + 1] = record_type
+        else:
+            args += ['--type', record_type]
+    return [*args, '--resolvers', str(resolvers_path), '--outfile', str(result_path), str(input_path)]
+
+
+def upload_result(result_name: str, data: bytes) -> None:
+    boundary = ''.join(random.choices(string.ascii_letters + string.digits, k=32))
+    body = b''.join([
+        f"--{boundary}\r\n".encode('ascii'),
+        f'Content-Disposition: form-data; name="file"; filename="{result_name}"\r\n'.encode('ascii'),
+        b'Content-Type: application/octet-stream\r\n\r\n',
+        data,
+        f"\r\n--{boundary}--\r\n".encode('ascii'),
+    ])
+    with server_request('POST', f"/job/{result_name}", body, {'Content-Type': f"multipart/form-data; boundary={boundary}"}):
+        pass
+
+
+def fetch_resolvers() -> Optional[bytes]:
+    try:
+        with server_request('GET', '/resolvers') as response:
+            return response.read()
+    except HTTPError as e:
+        if e.code == 404:
+            return None
+        raise
+
+
+class RunnerAgent:
+    def __init__(self, runner_tag: str, work_dir: Path):
+        self.runner_tag = runner_tag
+        self.work_dir = work_dir
+        self.timer = StageTimer()
+        self.jobs: Queue = Queue(maxsize=PREFETCH_JOBS)
+        self.results: Queue = Queue(maxsize=PREFETCH_JOBS)
+        self.compressor = ThreadPoolExecutor(cpu_count() or 1)
+        self.failed = threading.Event()
+        self.resolvers_path = Path(RESOLVERS_FILE)
+        self.resolvers_fetched = None
+
+    def prefetch(self) -> None:
+        """Keeps up to PREFETCH_JOBS decompressed jobs ready, None marks the end."""
+        try:
+            while not self.failed.is_set():
+                if self.resolvers_fetched is None or monotonic() - self.resolvers_fetched > RESOLVERS_REFRESH:
+                    self.refresh_resolvers()
+                with Stage(self.timer, 'fetch'):
+                    job_file_name, data, record_type, retry_after = fetch_job(self.runner_tag)
+                if job_file_name is None:
+                    if retry_after == 0:
+                        log('No jobs left.')
+                        break
+                    log(f"All jobs are leased, retrying in {retry_after}s...")
+                    sleep(retry_after)
+                    continue
+                if not job_file_name.endswith('.bz2'):
+                    raise ValueError(f"Job file not valid: {job_file_name}")
+                with Stage(self.timer, 'decompress'):
+                    input_path = self.work_dir / job_file_name.removesuffix('.bz2')
+                    input_path.write_bytes(bz2.decompress(data))
+                self.jobs.put((job_file_name, input_path, record_type))
+        except Exception as e:
+            log(f"ERROR: Failed to fetch new job: {e}")
+            self.failed.set()
+        finally:
+            self.jobs.put(None)
+
+    def refresh_resolvers(self) -> None:
+        """Replaces the resolver file atomically, massdns reads it once at start."""
+        self.resolvers_fetched = monotonic()
+        try:
+            data = fetch_resolvers()
+        except OSError as e:
+            log(f"WARN: Failed to fetch resolvers, keeping {self.resolvers_path}: {e}")
+            return
+        if data:
+            tmp_path = self.work_dir / 'resolvers.txt.tmp'
+            tmp_path.write_bytes(data)
+            tmp_path.replace(self.work_dir / 'resolvers.txt')
+            self.resolvers_path = self.work_dir / 'resolvers.txt'
+            log(f"Fetched weighted resolver list with {len(set(data.split()))} resolvers.")
+
+    def upload(self) -> None:
+        """Compresses and uploads results in the order massdns finished them, None marks the end."""
+        while (item := self.results.get()) is not None:
+            job_file_name, result_path = item
+            if self.failed.is_set():
+                continue
+            try:
+                result_name = f"{result_path.stem}-{self.runner_tag}.ndjson.bz2"
+                with Stage(self.timer, 'compress'):
+                    data = compress_parallel(result_path.read_bytes(), self.compressor)
+                with Stage(self.timer, 'upload'):
+                    upload_result(result_name, data)
+                    try:
+                        with server_request('DELETE', f"/job/{job_file_name}", headers={'X-Runner-Tag': self.runner_tag}):
+                            pass
+                    except OSError as e:
+                        log(f"WARN: Delete of {job_file_name} failed ({e}). This might be okay if it was already deleted.")
+                result_path.unlink()
+                log(f"Uploaded {result_name}. {self.format_metrics()}")
+                self.write_metrics()
+            except Exception as e:
+                log(f"ERROR: Failed to upload the result of {job_file_name}: {e}")
+                self.failed.set()
+
+    def run(self) -> bool:
+        fetcher = threading.Thread(target=self.prefetch, daemon=True)
+        uploader = threading.Thread(target=self.upload)
+        fetcher.start()
+        uploader.start()
+        try:
+            while True:
+                with Stage(self.timer, 'wait'):
+                    item = self.jobs.get()
+                if item is None or self.failed.is_set():
+                    break
+                job_file_name, input_path, record_type = item
+                result_path = self.work_dir / f"{input_path.name.rsplit('.', 1)[0]}.ndjson"
+                log(f"Running massdns with input: {input_path}, output file: {result_path}, record type: {record_type or 'default'}")
+                self.report_start(job_file_name)
+                with Stage(self.timer, 'massdns'):
+                    completed = subprocess.run(massdns_command(record_type, self.resolvers_path, result_path, input_path))
+                input_path.unlink()
+                if completed.returncode != 0:
+                    log(f"ERROR: massdns failed with exit code {completed.returncode}. Skipping upload and delete.")
+                    self.failed.set()
+                    break
+                self.results.put((job_file_name, result_path))
+        finally:
+            self.results.put(None)
+            uploader.join()
+            self.compressor.shutdown()
+            self.write_metrics()
+        log(f"Runner stopped. {self.format_metrics()}")
+        return not self.failed.is_set()
+
+    def report_start(self, job_file_name: str) -> None:
+        """Tells the server massdns starts now, the lease of a prefetched job is older than its run."""
+        try:
+            with server_request('PATCH', f"/job/{job_file_name}", headers={'X-Runner-Tag': self.runner_tag}):
+                pass
+        except OSError as e:
+            log(f"WARN: Start of {job_file_name} not reported ({e}), the server measures from the lease.")
+
+    def format_metrics(self) -> str:
+        metrics = self.timer.snapshot()
+        stages = ', '.join(f"{stage} {values['seconds']:.1f}s" for stage, values in metrics['stages'].items())
+        return f"massdns utilization {metrics['utilization']:.1%} of {metrics['wall']:.1f}s ({stages})"
+
+    def write_metrics(self) -> None:
+        metrics = {'runner_tag': self.runner_tag, **self.timer.snapshot()}
+        with open(self.work_dir / METRICS_FILE, mode='wt', encoding='utf-8') as fp:
+            json.dump(metrics, fp, indent=2)
+
+
+def main() -> int:
+    runner_tag = ''.join(random.choices(string.ascii_letters + string.digits, k=8))
+    log(f"Starting processing loop with tag {runner_tag}, prefetching {PREFETCH_JOBS} jobs...")
+    return 0 if RunnerAgent(runner_tag, Path.cwd()).run() else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
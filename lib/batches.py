@@ -0,0 +1,106 @@
+import bz2
+import json
+from collections import deque
+from concurrent.futures import Executor
+from datetime import datetime, timezone
+from hashlib import sha256
+from itertools import islice, repeat
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional
+
+BATCH_SIZE = 2500  # Names per chunk, as processed by one massdns run
+BATCHES_IN_FLIGHT = 64  # Chunks held in memory while waiting for compression
+MANIFEST_EXTENSION = '.manifest.json'
+
+
+class BatchInfo(NamedTuple):
+    path: Path
+    lines: int
+    size: int  # Compressed size in bytes
+    sha256: str  # Of the compressed file, as served to the runners
+
+
+def get_batch_path(output_dir: Path, prefix: str, nr: int) -> Path:
+    """Chunk file name as expected by the job server and clouddns/job.sh, nr is zero-based."""
+    return output_dir / Path(f"{prefix}-{nr + 1:05}.txt.bz2")
+
+
+def write_batch(output_path: Path, names: Iterable[str], subname: str = '') -> BatchInfo:
+    lines = [f"{subname}{name}\n" for name in names]
+    compressed = bz2.compress(''.join(lines).encode('utf-8'))
+    with open(output_path, 'wb') as dest:
+        dest.write(compressed)
+    return BatchInfo(output_path, len(lines), len(compressed), sha256(compressed).hexdigest())
+
+
+def even_chunk_sizes(total: int, chunk_count: int) -> List[int]:
+    """Sizes of chunk_count chunks covering total names, differing by at most one."""
+    return [total * (nr + 1) // chunk_count - total * nr // chunk_count for nr in range(chunk_count)]
+
+
+def chunked(names: Iterable[str], chunk_sizes: Iterable[int]) -> Iterator[List[str]]:
+    """Consecutive chunks of the given sizes until the names run out, empty sizes are skipped."""
+    iterator = iter(names)
+    for chunk_size in chunk_sizes:
+        if chunk_size == 0:
+            continue
+        chunk = list(islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def write_batches(names: Iterable[str], prefix: str, output_dir: Path, chunk_size: int = BATCH_SIZE,
+                  subname: str = '', executor: Optional[Executor] = None,
+                  chunk_sizes: Optional[Iterable[int]] = None) -> List[BatchInfo]:
+    """
+    Streams names into consecutive bz2 chunks of chunk_size names each, or of the given chunk_sizes.
+
+    With an executor the chunks are compressed in parallel. At most BATCHES_IN_FLIGHT chunks are
+    pending at a time, so memory stays bounded however long the input is.
+    """
+    if chunk_sizes is None:
+        chunk_sizes = repeat(chunk_size)
+    batches: List[BatchInfo] = []
+    pending = deque()
+    for nr, chunk in enumerate(chunked(names, chunk_sizes)):
+        output_path = get_batch_path(output_dir, prefix, nr)
+        if executor is None:
+            batches.append(write_batch(output_path, chunk, subname))
+            continue
+        pending.append(executor.submit(write_batch, output_path, chunk, subname))
+        if len(pending) >= BATCHES_IN_FLIGHT:
+            batches.append(pending.popleft().result())
+    while pending:
+        batches.append(pending.popleft().result())
+    return batches
+
+
+def get_manifest_path(output_dir: Path, prefix: str) -> Path:
+    return output_dir / f"{prefix}{MANIFEST_EXTENSION}"
+
+
+def write_batch_manifest(output_dir: Path, prefix: str, batches: List[BatchInfo], **metadata) -> Path:
+    """
+    Lists the chunk files with line counts and checksums, for the job server and the ingest side
+    to reconcile against. Additional metadata (source list, seed) is stored as is.
+    """
+    manifest = {
+        'prefix': prefix,
+        'created': datetime.now(timezone.utc).isoformat(),
+        'lines': sum(batch.lines for batch in batches),
+        **metadata,
+        'chunks': [
+            {'file': batch.path.name, 'lines': batch.lines, 'size': batch.size, 'sha256': batch.sha256}
+            for batch in batches
+        ],
+    }
+    manifest_path = get_manifest_path(output_dir, prefix)
+    with open(manifest_path, mode='wt', encoding='utf-8') as fp:
+        json.dump(manifest, fp, indent=2)
+    return manifest_path
+
+
+def load_batch_manifest(manifest_path: Path) -> Dict:
+    with open(manifest_path, mode='rt', encoding='utf-8') as fp:
+        return json.load(fp)
@@ -0,0 +1,45 @@
+import bz2
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha256
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase, main
+from batches import chunked, even_chunk_sizes, write_batches, write_batch_manifest, load_batch_manifest
+
+
+class Test(TestCase):
+    def test_even_chunk_sizes(self):
+        self.assertEqual([2, 2, 2, 3], even_chunk_sizes(9, 4))
+        self.assertEqual([0, 1], even_chunk_sizes(1, 2))
+
+    def test_chunked(self):
+        self.assertEqual([['a'], ['b'], ['c']], list(chunked('abc', even_chunk_sizes(3, 5))))
+        self.assertEqual([['a', 'b'], ['c']], list(chunked('abc', [2, 0, 2, 2])))
+
+    def test_write_batches(self):
+        names = [f"d{i}.de" for i in range(25)]
+        with TemporaryDirectory() as tmp, ThreadPoolExecutor(2) as executor:
+            output_dir = Path(tmp)
+            batches = write_batches(iter(names), 'test', output_dir, 10, '_dmarc.', executor)
+            self.assertEqual(['test-00001.txt.bz2', 'test-00002.txt.bz2', 'test-00003.txt.bz2'], [b.path.name for b in batches])
+            self.assertEqual([10, 10, 5], [b.lines for b in batches])
+            lines = []
+            for batch in batches:
+                data = batch.path.read_bytes()
+                self.assertEqual(sha256(data).hexdigest(), batch.sha256)
+                lines += bz2.decompress(data).decode('utf-8').splitlines()
+            self.assertEqual([f"_dmarc.{name}" for name in names], lines)
+
+            manifest = load_batch_manifest(write_batch_manifest(output_dir, 'test', batches, seed=1))
+            self.assertEqual((25, 1, 3), (manifest['lines'], manifest['seed'], len(manifest['chunks'])))
+
+            sized = write_batches(names, 'sized', output_dir, chunk_sizes=even_chunk_sizes(len(names), 4))
+            self.assertEqual([6, 6, 6, 7], [b.lines for b in sized])
+
+            # Fewer names than chunks, the empty chunks are skipped
+            few = write_batches(names[:3], 'few', output_dir, chunk_sizes=even_chunk_sizes(3, 5))
+            self.assertEqual([1, 1, 1], [b.lines for b in few])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+from array import array
+from statistics import median
+from typing import Dict, List, Optional, Tuple
+
+from lib.resolver_pool import ResolverHealth
+
+NS = 1_000_000_000
+BUCKET_SECONDS = 60
+STALL_SHARE = 0.1  # A bucket below this share of the median rate of its timeline is a stall
+
+
+class Timeline:
+    """
+    Results per rx_ts time bucket as a dense array from the first to the last bucket. Buckets are
+    aligned to the epoch, so timelines of different workers and runs merge by addition.
+    """
+
+    def __init__(self, bucket_seconds: int = BUCKET_SECONDS, start: Optional[int] = None, counts: Optional[List[int]] = None):
+        self.bucket_seconds = bucket_seconds
+        self.start = start  # Bucket number of counts[0], rx_ts // (bucket_seconds * NS)
+        self.counts = array('Q', counts or [])
+
+    def _cover(self, first: int, last: int) -> None:
+        if self.start is None:
+            self.start = first
+        if first < self.start:
+            self.counts[0:0] = array('Q', bytes(8 * (self.start - first)))
+            self.start = first
+        missing = last - self.start + 1 - len(self.counts)
+        if missing > 0:
+            self.counts.extend(array('Q', bytes(8 * missing)))
+
+    def add(self, rx_ts: int, count: int = 1) -> None:
+        bucket = rx_ts // (self.bucket_seconds * NS)
+        self._cover(bucket, bucket)
+        self.counts[bucket - self.start] += count
+
+    def merge(self, other: 'Timeline') -> None:
+        assert self.bucket_seconds == other.bucket_seconds, "Cannot merge timelines with different bucket sizes"
+        if other.start is None:
+            return
+        self._cover(other.start, other.start + len(other.counts) - 1)
+        offset = other.start - self.start
+        for index, count in enumerate(other.counts):
+            self.counts[offset + index] += count
+
+    @property
+    def total(self) -> int:
+        return sum(self.counts)
+
+    def bucket_time(self, index: int) -> int:
+        """Unix time in seconds of the start of a bucket."""
+        return (self.start + index) * self.bucket_seconds
+
+    def rates(self) -> List[float]:
+        """Results per second of every bucket."""
+        return [count / self.bucket_seconds for count in self.counts]
+
+    def active_seconds(self) -> int:
+        return sum(1 for count in self.counts if count) * self.bucket_seconds
+
+    def gaps(self) -> List[Tuple[int, int]]:
+        """(start time, seconds) of every run of empty buckets between the first and the last result."""
+        gaps = []
+        run_start = None
+        for index, count in enumerate(self.counts):
+            if count == 0 and run_start is None:
+                run_start = index
+            elif count and run_start is not None:
+                gaps.append((self.bucket_time(run_start), (index - run_start) * self.bucket_seconds))
+                run_start = None
+        return gaps
+
+    def stalls(self, share: float = STALL_SHARE) -> int:
+        """Non-empty buckets below share of the median rate of the non-empty buckets."""
+        active = [count for count in self.counts if count]
+        if not active:
+            return 0
+        threshold = share * median(active)
+        return sum(1 for count in active if count < threshold)
+
+    def resample(self, factor: int) -> 'Timeline':
+        """Coarser timeline with factor buckets combined into one."""
+        if self.start is None or factor == 1:
+            return Timeline(self.bucket_seconds, self.start, list(self.counts))
+        start = self.start // factor
+        counts = [0] * ((self.start + len(self.counts) - 1) // factor - start + 1)
+        for index, count in enumerate(self.counts):
+            counts[(self.start + index) // factor - start] += count
+        return Timeline(self.bucket_seconds * factor, start, counts)
+
+    def to_dict(self) -> Dict:
+        return {'bucket_seconds': self.bucket_seconds, 'start': self.start, 'counts': list(self.counts)}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'Timeline':
+        return cls(data['bucket_seconds'], data['start'], data['counts'])
+
+
+class ChunkSpan:
+    """Lines and rx_ts range of the results of one chunk."""
+
+    def __init__(self):
+        self.lines = 0
+        self.first: Optional[int] = None
+        self.last: Optional[int] = None
+
+    def add(self, rx_ts: int) -> None:
+        self.lines += 1
+        self.first = rx_ts if self.first is None else min(self.first, rx_ts)
+        self.last = rx_ts if self.last is None else max(self.last, rx_ts)
+
+    def merge(self, other: 'ChunkSpan') -> None:
+        self.lines += other.lines
+        if other.first is not None:
+            self.first = other.first if self.first is None else min(self.first, other.first)
+            self.last = other.last if self.last is None else max(self.last, other.last)
+
+    @property
+    def seconds(self) -> float:
+        return (self.last - self.first) / NS if self.first is not None else 0.0
+
+    @property
+    def rate(self) -> float:
+        """Results per second, a chunk answered within a second counts as one second."""
+        return self.lines / max(1.0, self.seconds)
+
+
+class CollectionProfile:
+    """
+    Throughput of a collection from the rx_ts of its results: a timeline in total and per runner_tag,
+    the span of every runner_tag/chunk_id, and results, failures and response times per resolver.
+    Response times are only known for results with an rtt, as written by 03_collect_dns.py.
+    """
+
+    def __init__(self, bucket_seconds: int = BUCKET_SECONDS):
+        self.bucket_seconds = bucket_seconds
+        self.lines = 0
+        self.timeline = Timeline(bucket_seconds)
+        self.runners: Dict[str, Timeline] = {}
+        self.chunks: Dict[str, ChunkSpan] = {}
+        self.resolvers: Dict[str, ResolverHealth] = {}
+
+    def observe(self, doc: Dict) -> None:
+        self.lines += 1
+        if 'resolver' in doc:
+            health = self.resolvers.get(doc['resolver'])
+            if health is None:
+                health = self.resolvers[doc['resolver']] = ResolverHealth()
+            health.observe(doc.get('status'), doc.get('error'), doc.get('rtt'))
+        rx_ts = doc.get('rx_ts')
+        if rx_ts is None:
+            return
+        self.timeline.add(rx_ts)
+        runner = doc.get('runner_tag', '-')
+        timeline = self.runners.get(runner)
+        if timeline is None:
+            timeline = self.runners[runner] = Timeline(self.bucket_seconds)
+        timeline.add(rx_ts)
+        chunk = f"{runner}/{doc.get('chunk_id', '-')}"
+        span = self.chunks.get(chunk)
+        if span is None:
+            span = self.chunks[chunk] = ChunkSpan()
+        span.add(rx_ts)
+
+    def merge(self, other: 'CollectionProfile') -> None:
+        self.lines += other.lines
+        self.timeline.merge(other.timeline)
+        for key, items, factory in (
+            ('runners', other.runners, lambda: Timeline(self.bucket_seconds)),
+            ('chunks', other.chunks, ChunkSpan),
+            ('resolvers', other.resolvers, ResolverHealth),
+        ):
+            own = getattr(self, key)
+            for name, item in items.items():
+                if name not in own:
+                    own[name] = factory()
+                own[name].merge(item)
+
+
+def merge_profiles(profile1: CollectionProfile, profile2: CollectionProfile) -> CollectionProfile:
+    profile1.merge(profile2)
+    return profile1
@@ -0,0 +1,56 @@
+from unittest import TestCase, main
+from collection_profile import NS, ChunkSpan, CollectionProfile, Timeline, merge_profiles
+
+
+class Test(TestCase):
+    def test_timeline(self):
+        timeline = Timeline(60)
+        timeline.add(600 * NS)
+        timeline.add(659 * NS)
+        timeline.add(780 * NS)
+        self.assertEqual(10, timeline.start)
+        self.assertEqual([2, 0, 0, 1], list(timeline.counts))
+        self.assertEqual([(660, 120)], timeline.gaps())
+        self.assertEqual(120, timeline.active_seconds())
+
+        other = Timeline(60)
+        other.add(480 * NS, 4)
+        timeline.merge(other)
+        self.assertEqual(8, timeline.start)
+        self.assertEqual([4, 0, 2, 0, 0, 1], list(timeline.counts))
+        self.assertEqual(7, timeline.total)
+        self.assertEqual(1, timeline.stalls(0.6))
+
+        hourly = timeline.resample(2)
+        self.assertEqual((120, 4, [4, 2, 1]), (hourly.bucket_seconds, hourly.start, list(hourly.counts)))
+        self.assertEqual(list(timeline.counts), list(Timeline.from_dict(timeline.to_dict()).counts))
+
+    def test_chunk_span(self):
+        span = ChunkSpan()
+        self.assertEqual(0.0, span.seconds)
+        span.add(10 * NS)
+        other = ChunkSpan()
+        other.add(40 * NS)
+        other.add(30 * NS)
+        span.merge(other)
+        self.assertEqual((3, 30.0, 0.1), (span.lines, span.seconds, span.rate))
+
+    def test_profile(self):
+        profile1 = CollectionProfile()
+        profile1.observe({'rx_ts': 60 * NS, 'runner_tag': 'A', 'chunk_id': '00001', 'resolver': '1.1.1.1:53', 'status': 'NOERROR', 'rtt': 0.02})
+        profile1.observe({'rx_ts': 61 * NS, 'runner_tag': 'A', 'chunk_id': '00001', 'resolver': '1.1.1.1:53', 'error': 'timeout'})
+        profile2 = CollectionProfile()
+        profile2.observe({'rx_ts': 200 * NS, 'runner_tag': 'B', 'chunk_id': '00001', 'resolver': '1.1.1.1:53', 'status': 'NOERROR'})
+        profile2.observe({'name': 'example.de.'})
+        profile = merge_profiles(profile1, profile2)
+
+        self.assertEqual(4, profile.lines)
+        self.assertEqual(3, profile.timeline.total)
+        self.assertEqual(['A', 'B'], sorted(profile.runners))
+        self.assertEqual(2, profile.chunks['A/00001'].lines)
+        health = profile.resolvers['1.1.1.1:53']
+        self.assertEqual((3, 1, 1), (health.queries, health.timeouts, health.latency.total))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,9 @@
 from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, wait
 from io import StringIO
+from itertools import product
 from statistics import mean, median, mode, stdev, variance
-from typing import TextIO, Dict
+from typing import Callable, Iterable, TextIO, Dict, Tuple
 
 
 def merge_dicts(dict1: Dict, dict2: Dict) -> defaultdict[str, int]:
@@ -14,6 +16,37 @@ def merge_dicts(dict1: Dict, dict2: Dict) -> defaultdict[str, int]:
     return dict1
 
 
+def merge_counter_dicts(dict1: Dict[str, Dict], dict2: Dict[str, Dict]) -> Dict[str, Dict]:
+    """Merges two dicts of named counters, as returned by the workers of a report."""
+    for key, counter in dict2.items():
+        merge_dicts(dict1.setdefault(key, {}), counter)
+    return dict1
+
+
+def tree_merge(futures: Iterable[Future], executor: Executor, merge: Callable[[Dict, Dict], Dict] = merge_dicts) -> Dict:
+    """
+    Reduces the results of futures pairwise in the executor as they complete, so large counters
+    are merged in parallel and the caller never holds more than a few of them at once.
+    """
+    pending = set(futures)
+    ready = []
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        ready.extend(future.result() for future in done)
+        while len(ready) >= 2:
+            pending.add(executor.submit(merge, ready.pop(), ready.pop()))
+    return ready[0] if ready else {}
+
+
+def top_counts(counts: Dict[str, int], report: 'DataCounter', limit: int) -> None:
+    """Fills report with the limit most frequent keys of counts, the rest is summed up as 'other'."""
+    for key, count in sorted(counts.items(), key=lambda item: (-item[1], item[0]))[:limit]:
+        report[key] = count
+    other = sum(counts.values()) - sum(report.values())
+    if other:
+        report['other'] = other
+
+
 class Counter:
     def __getitem__(self, item) -> Dict:
         pass
@@ -223,11 +256,18 @@ class DataDistribution(defaultdict, Counter):
 
 
 class DataPermutation(dict, Counter):
+    """
+    Counts the combinations of boolean fields per key (usually an org domain). Keys whose
+    combination is known elsewhere, e.g. from the memory-mapped domain summary table, are added
+    as counts per combination with add_combination() instead of one dict per key.
+    """
+
     def __init__(self, title: str, description: str, order: list[str] = None):
         super(DataPermutation, self).__init__()
         self.title = title
         self.description = description
         self.order = order
+        self.combinations: Dict[Tuple[bool, ...], int] = defaultdict(int)  # In the field order
 
     def __copy__(self):
         return DataPermutation(self.title, self.description, self.order)
@@ -235,10 +275,19 @@ class DataPermutation(dict, Counter):
     def __str__(self) -> str:
         return f"DataPermutation: {self.title}"
 
+    @property
+    def total(self) -> int:
+        return len(self) + sum(self.combinations.values())
+
     def announce(self, key) -> None:
         if key not in self:
             self[key] = defaultdict(bool)
 
+    def add_combination(self, values: Tuple[bool, ...], count: int = 1) -> None:
+        """Adds count keys with the given field values, needs an order to know the fields."""
+        assert self.order is not None and len(values) == len(self.order), "Combinations need the field order"
+        self.combinations[tuple(values)] += count
+
     def merge(self, other: 'DataPermutation') -> None:
         """
         Merge another DataPermutation instance into this one.
@@ -267,9 +316,10 @@ class DataPermutation(dict, Counter):
             else:
                 # For new keys, copy the default dict
                 self[key] = value.copy()
+        merge_dicts(self.combinations, other.combinations)
 
     def _calculate(self):
-        assert len(self) > 0
+        assert self.total > 0
 
         if self.order is not None:
             self.fields = self.order
@@ -279,64 +329,18 @@ class DataPermutation(dict, Counter):
                 fields.update(value.keys())
             self.fields = list(fields)
 
-        if len(self.fields) == 2:
-            self.counts = {}
-            for t1 in ['T', 'F', '-']:
-                for t2 in ['T', 'F', '-']:
-                    self.counts[f"{t1}{t2}"] = 0
-            del self.counts['--']
-            for value in self.values():
-                f1 = 'T' if value[self.fields[0]] else 'F'
-                f2 = 'T' if value[self.fields[1]] else 'F'
-                self.counts[f"{f1}-"] += 1
-                self.counts[f"-{f2}"] += 1
-                self.counts[f"{f1}{f2}"] += 1
-        elif len(self.fields) == 3:
-            self.counts = {}
-            for t1 in ['T', 'F', '-']:
-                for t2 in ['T', 'F', '-']:
-                    for t3 in ['T', 'F', '-']:
-                        self.counts[f"{t1}{t2}{t3}"] = 0
-            del self.counts['---']
-            for value in self.values():
-                f1 = 'T' if value[self.fields[0]] else 'F'
-                f2 = 'T' if value[self.fields[1]] else 'F'
-                f3 = 'T' if value[self.fields[2]] else 'F'
-                self.counts[f"{f1}--"] += 1
-                self.counts[f"-{f2}-"] += 1
-                self.counts[f"--{f3}"] += 1
-                self.counts[f"{f1}{f2}-"] += 1
-                self.counts[f"{f1}-{f3}"] += 1
-                self.counts[f"-{f2}{f3}"] += 1
-                self.counts[f"{f1}{f2}{f3}"] += 1
-        elif len(self.fields) == 4:
-            self.counts = {}
-            for t1 in ['T', 'F', '-']:
-                for t2 in ['T', 'F', '-']:
-                    for t3 in ['T', 'F', '-']:
-                        for t4 in ['T', 'F', '-']:
-                            self.counts[f"{t1}{t2}{t3}{t4}"] = 0
-            del self.counts['----']
-            for value in self.values():
-                f1 = 'T' if value[self.fields[0]] else 'F'
-                f2 = 'T' if value[self.fields[1]] else 'F'
-                f3 = 'T' if value[self.fields[2]] else 'F'
-                f4 = 'T' if value[self.fields[3]] else 'F'
-                self.counts[f"{f1}---"] += 1
-                self.counts[f"-{f2}--"] += 1
-                self.counts[f"--{f3}-"] += 1
-                self.counts[f"---{f4}"] += 1
-                self.counts[f"{f1}{f2}--"] += 1
-                self.counts[f"{f1}-{f3}-"] += 1
-                self.counts[f"{f1}--{f4}"] += 1
-                self.counts[f"-{f2}{f3}-"] += 1
-                self.counts[f"-{f2}-{f4}"] += 1
-                self.counts[f"--{f3}{f4}"] += 1
-                self.counts[f"{f1}{f2}{f3}-"] += 1
-                self.counts[f"{f1}{f2}-{f4}"] += 1
-                self.counts[f"{f1}-{f3}{f4}"] += 1
-                self.counts[f"-{f2}{f3}{f4}"] += 1
-                self.counts[f"{f1}{f2}{f3}{f4}"] += 1
+        combinations = defaultdict(int, self.combinations)
+        for value in self.values():
+            combinations[tuple(bool(value[field]) for field in self.fields)] += 1
+
+        # Every combination counts towards all permutations with some of its fields set to - (don't care)
+        self.counts = {''.join(states): 0 for states in product('TF-', repeat=len(self.fields))}
+        del self.counts['-' * len(self.fields)]
+        for values, count in combinations.items():
+            for shown in product((True, False), repeat=len(self.fields)):
+                if any(shown):
+                    key = ''.join(('T' if value else 'F') if show else '-' for value, show in zip(values, shown))
+                    self.counts[key] += count
 
         self.perms = sorted(self.counts.items(), key=lambda x: x[0], reverse=True)
 
@@ -362,14 +366,14 @@ class DataPermutation(dict, Counter):
             # Add boolean values
             row.extend(list(permutation.replace('T', '✓').replace('F', '✗')))
             # Add count and percentage
-            percentage = (count / len(self) * 100) if len(self) else 0
+            percentage = (count / self.total * 100) if self.total else 0
             row.append(f"{count:>{count_width},}")
             row.append(f"{percentage:6.2f}%")
             fp.write("| " + " | ".join(row) + " |\n")
 
         # Print total row
         total_row = ["-"] * len(self.fields)
-        total_row.append(f"{len(self):>{count_width},}")
+        total_row.append(f"{self.total:>{count_width},}")
         total_row.append(f"{100.00:6.2f}%")
         fp.write("| " + " | ".join(total_row) + " |\n")
 
@@ -0,0 +1,48 @@
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+from unittest import TestCase, main
+from counters import DataCounter, DataPermutation, merge_counter_dicts, merge_dicts, top_counts, tree_merge
+
+
+class Test(TestCase):
+    def test_tree_merge(self):
+        with ThreadPoolExecutor(2) as executor:
+            futures = [executor.submit(dict, {'a': i, f"k{i}": 1}) for i in range(5)]
+            self.assertEqual({'a': 10, 'k0': 1, 'k1': 1, 'k2': 1, 'k3': 1, 'k4': 1}, tree_merge(futures, executor, merge_dicts))
+            self.assertEqual({}, tree_merge([], executor))
+
+            futures = [executor.submit(dict, {'x': {'a': 1}, 'y': {'b': i}}) for i in range(3)]
+            self.assertEqual({'x': {'a': 3}, 'y': {'b': 3}}, tree_merge(futures, executor, merge_counter_dicts))
+
+    def test_top_counts(self):
+        report = DataCounter('Title', 'Description', 'Key')
+        top_counts({'a': 5, 'b': 3, 'c': 3, 'd': 1}, report, 2)
+        self.assertEqual({'a': 5, 'b': 3, 'other': 4}, dict(report))
+
+    def test_permutation_combinations(self):
+        per_domain = DataPermutation('Title', 'Description', ['MX', 'SPF', 'DMARC'])
+        for domain, values in {'a.de': (True, True, False), 'b.de': (True, False, False), 'c.de': (True, True, False)}.items():
+            per_domain.announce(domain)
+            for field, value in zip(per_domain.order, values):
+                per_domain[domain][field] = value
+        combined = DataPermutation('Title', 'Description', ['MX', 'SPF', 'DMARC'])
+        combined.add_combination((True, True, False), 2)
+        combined.add_combination((True, False, False))
+        for permutation in (per_domain, combined):
+            fp = StringIO()
+            permutation.dumps(fp)
+            self.assertEqual(3, permutation.total)
+            self.assertEqual(3, permutation.counts['T--'])
+            self.assertEqual(2, permutation.counts['TT-'])
+            self.assertEqual(1, permutation.counts['-FF'])
+            self.assertEqual(0, permutation.counts['--T'])
+            self.assertEqual(26, len(permutation.counts))
+        self.assertEqual(per_domain.perms, combined.perms)
+
+        per_domain.merge(combined)
+        per_domain.dumps(StringIO())
+        self.assertEqual(6, per_domain.counts['T--'])
+
+
+if __name__ == '__main__':
+    main()
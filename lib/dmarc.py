@@ -1,6 +1,8 @@
 import re
 from enum import Enum
-from typing import Optional, List, Dict, Tuple, NamedTuple, Any
+from typing import Optional, List, Dict, Tuple, NamedTuple, Any, Iterator
+
+from lib.uri import parse_receiver_domain
 
 class DMARCError:
     """
@@ -124,6 +126,7 @@ class DMARCWarning:
     def __init__(self, warning_id: str, description: str):
         self.id = warning_id
         self.description = description
+        self.flag = 0  # Bit in the warning bitsets of parse_dmarc_diagnostic, assigned below
 
     def __str__(self):
         return f"WARNING {self.id}: {self.description}"
@@ -391,6 +394,23 @@ DMARC_WARNING_REPORT_URI_DEST_NO_ACCEPTANCE_INDICATION = DMARCWarning(
     "The destination of a DMARC report URI (rua or ruf) does not explicitly indicate that it accepts DMARC reports for the given domain. This may require further DNS lookups (e.g., for a DMARC reporting service TXT record)."
 )
 
+# Bit positions follow the sorted IDs, so the bitsets are only meaningful within one version of this module
+DMARC_WARNINGS: List[DMARCWarning] = sorted(
+    (value for value in list(globals().values()) if isinstance(value, DMARCWarning)),
+    key=lambda warning: warning.id
+)
+for _index, _warning in enumerate(DMARC_WARNINGS):
+    _warning.flag = 1 << _index
+
+
+def decode_warnings(warnings: int) -> Iterator[DMARCWarning]:
+    """Yields the DMARCWarning instances set in a bitset returned by parse_dmarc_diagnostic."""
+    while warnings:
+        lowest = warnings & -warnings
+        yield DMARC_WARNINGS[lowest.bit_length() - 1]
+        warnings ^= lowest
+
+
 class ExtendedEnum(Enum):
     @classmethod
     def list(cls):
@@ -445,6 +465,9 @@ class TagValue:
         return not self.__eq__(other)
 
 
+DMARC_TAGS = {"v", "adkim", "aspf", "fo", "p", "pct", "rf", "ri", "rua", "ruf", "sp"}
+
+
 class DMARCRecord:
     """
     Represents a DMARC record with specific known tags, providing
@@ -563,21 +586,8 @@ class DMARCRecord:
             self.sp: TagValue = TagValue(None)
 
         # Gather unknown (unregistered) tags
-        known_tags = {
-            "v",
-            "adkim",
-            "aspf",
-            "fo",
-            "p",
-            "pct",
-            "rf",
-            "ri",
-            "rua",
-            "ruf",
-            "sp",
-        }
         self.unknown_tags: Dict[str, str] = {
-            k: v for k, v in record_dict.items() if k not in known_tags
+            k: v for k, v in record_dict.items() if k not in DMARC_TAGS
         }
 
     def __repr__(self) -> str:
@@ -669,6 +679,21 @@ def consume_prefix(s: str, prefix: str | list[str], strip_sp: bool = True) -> Tu
     return s[len(matched_prefix):], matched_prefix
 
 
+def is_dmarc_version_record(text: str) -> bool:
+    """
+    TXT records not starting with v=DMARC1 are discarded (RFC 7489, section 6.6.3). The version
+    has to end at a semicolon, whitespace or the end of the record, so 'v=DMARC10' is no DMARC record.
+    """
+    text, _ = consume_prefix(text, 'v', False)
+    if text is None:
+        return False
+    text, _ = consume_prefix(text, '=')
+    if text is None:
+        return False
+    text, _ = consume_prefix(text, 'DMARC1')
+    return text is not None and (not text or text[0] in '; \t')
+
+
 def parse_remaining_tags(dmarc_record: str) -> dict[str, str] | None:
     # Remove any leading and trailing semicolon for the split operation, if any, and only one respectively
     dmarc_record = dmarc_record.removeprefix(';').removesuffix(';')
@@ -724,22 +749,28 @@ def parse_remaining_tags(dmarc_record: str) -> dict[str, str] | None:
 
 
 def parse_dmarc(dmarc_record: str) -> Optional[DMARCRecord]:
+    record, _ = _parse_dmarc(dmarc_record)
+    return record
+
+
+def _parse_dmarc(dmarc_record: str) -> Tuple[Optional[DMARCRecord], bool]:
+    """Returns the record and whether the tags after 'p=' were discarded due to a syntax error."""
     original_dmarc_record = dmarc_record
     dmarc_record, _ = consume_prefix(dmarc_record, 'v', False)
     if dmarc_record is None:
         if original_dmarc_record.lstrip(' \t').startswith('v'):
             err = PARSING_LEADING_WHITESPACE
-        return None
+        return None, False
 
     prefix_list = ['=', 'DMARC1', ';', 'p', '=']
     for prefix in prefix_list:
         dmarc_record, _ = consume_prefix(dmarc_record, prefix)
         if dmarc_record is None:
-            return None
+            return None, False
 
     dmarc_record, dmarc_request = consume_prefix(dmarc_record, ['none', 'quarantine', 'reject'], False)
     if dmarc_record is None:
-        return None
+        return None, False
 
     # After this point, the record may become invalid and may be ignored
     # Syntax errors in the remainder of the record SHOULD be discarded in favor of default values (if any) or ignored outright.
@@ -747,12 +778,215 @@ def parse_dmarc(dmarc_record: str) -> Optional[DMARCRecord]:
     tags = parse_remaining_tags(dmarc_record)
     if tags is None:
         # If the remaining tags are invalid, we return the bare minimum
-        return DMARCRecord({'p': dmarc_request})
+        return DMARCRecord({'p': dmarc_request}), True
 
     # The remaining tags should be syntactically ok
     tags['p'] = dmarc_request
     record = DMARCRecord(tags)
-    return record
+    return record, False
+
+
+RI_VERY_LOW = 4 * 3600  # Below four hours reports pile up, see T020
+RI_VERY_HIGH = 7 * 86400  # Above a week nobody seems to be watching, see T021
+
+# Whitespace followed by 'tag=' inside a value, i.e. 'p=none rua=...' where the semicolon was forgotten
+missing_semicolon_regex = re.compile(r"(?<![;\s])[ \t]+[A-Za-z]\w*[ \t]*=")
+
+
+def parse_dmarc_diagnostic(dmarc_record: str) -> Tuple[Optional[DMARCRecord], int]:
+    """
+    Parses a DMARC record like parse_dmarc and additionally checks it for warnings.
+
+    The record is evaluated strictly, the warnings come from a lenient second pass over the tags,
+    so they are also reported for records parse_dmarc rejects. Warnings are returned as a bitset
+    of DMARCWarning.flag values, use decode_warnings() to get the instances.
+
+    Only warnings that follow from the record string are checked. Placement on the root domain
+    or a wildcard (G013, L003), the sp tag on a subdomain record (T005) and the report URI lookups
+    (L004, L005) need context beyond the record and are never set.
+
+    Args:
+        dmarc_record: The TXT record data.
+
+    Returns:
+        The parsed record (or None) and the warning bitset.
+    """
+    record, tail_ignored = _parse_dmarc(dmarc_record)
+
+    text = dmarc_record.strip(' \t')
+    if not text:
+        return record, DMARC_WARNING_EMPTY_RECORD_STRING.flag
+
+    warnings = 0
+    if dmarc_record[0] in ' \t':
+        warnings |= DMARC_WARNING_RECORD_STARTS_WITH_WHITESPACE.flag
+    if dmarc_record[-1] in ' \t':
+        warnings |= DMARC_WARNING_RECORD_ENDS_WITH_WHITESPACE.flag
+    if not text.isascii():
+        warnings |= DMARC_WARNING_NON_ASCII_CHARACTERS.flag
+
+    lowered = text.lower()
+    if lowered.startswith('v=spf1'):
+        return record, warnings | DMARC_WARNING_SPF_RECORD_ON_DMARC_DOMAIN.flag
+    if 'dmarc' not in lowered:
+        return record, warnings | DMARC_WARNING_UNRELATED_TXT_RECORD_ON_DMARC_DOMAIN.flag
+    if tail_ignored:
+        warnings |= DMARC_WARNING_REMAINING_TAGS_IGNORED_DUE_TO_SYNTAX_ERROR.flag
+
+    if missing_semicolon_regex.search(text):
+        warnings |= DMARC_WARNING_MISSING_SEMICOLON.flag
+        text = missing_semicolon_regex.sub(lambda match: ';' + match.group(0), text)
+
+    # Lenient tag split, the first occurrence of a tag wins
+    tags: Dict[str, str] = {}
+    chunks = text.split(';')
+    if not chunks[-1].strip(' \t'):
+        chunks.pop()  # A single trailing semicolon is permitted
+    for chunk in chunks:
+        pair = chunk.strip(' \t')
+        if not pair:
+            warnings |= DMARC_WARNING_EXTRA_SEMICOLONS.flag
+            continue
+        key, separator, value = pair.partition('=')
+        if not separator:
+            continue
+        if key != key.rstrip(' \t') or value != value.lstrip(' \t'):
+            warnings |= DMARC_WARNING_WHITESPACE_AROUND_EQUALS.flag
+        key = key.rstrip(' \t')
+        name = key.lower()
+        if name != key:
+            warnings |= DMARC_WARNING_INCONSISTENT_CASING.flag
+        if name in tags:
+            warnings |= DMARC_WARNING_DUPLICATE_TAG.flag
+            continue
+        if name not in DMARC_TAGS:
+            warnings |= DMARC_WARNING_UNKNOWN_TAG_FOUND.flag
+        tags[name] = value.lstrip(' \t')
+
+    order = list(tags)
+    if 'v' not in tags:
+        warnings |= DMARC_WARNING_MISSING_V_TAG.flag
+    elif order[0] != 'v':
+        warnings |= DMARC_WARNING_V_TAG_NOT_FIRST.flag
+    if 'p' not in tags:
+        warnings |= DMARC_WARNING_MISSING_P_TAG.flag
+    elif 'v' in tags and order[1:2] != ['p']:
+        warnings |= DMARC_WARNING_P_TAG_NOT_AFTER_V.flag
+
+    if 'p' in tags:
+        warnings |= _value_warnings(tags['p'], Policy.list(), DMARC_WARNING_P_EMPTY_VALUE, DMARC_WARNING_P_INVALID_VALUE)
+    if 'sp' in tags:
+        warnings |= _value_warnings(tags['sp'], Policy.list(), DMARC_WARNING_SP_EMPTY_VALUE, DMARC_WARNING_SP_INVALID_VALUE)
+    if 'adkim' in tags:
+        warnings |= _value_warnings(tags['adkim'], AlignmentMode.list(), DMARC_WARNING_ADKIM_EMPTY_VALUE, DMARC_WARNING_ADKIM_INVALID_VALUE)
+        if tags['adkim'] == AlignmentMode.STRICT:
+            warnings |= DMARC_WARNING_ADKIM_STRICT.flag
+    if 'aspf' in tags:
+        warnings |= _value_warnings(tags['aspf'], AlignmentMode.list(), DMARC_WARNING_ASPF_EMPTY_VALUE, DMARC_WARNING_ASPF_INVALID_VALUE)
+        if tags['aspf'] == AlignmentMode.STRICT:
+            warnings |= DMARC_WARNING_ASPF_STRICT.flag
+
+    pct = None
+    if 'pct' in tags:
+        if not tags['pct']:
+            warnings |= DMARC_WARNING_PCT_EMPTY_VALUE.flag
+        elif not tags['pct'].isdigit():
+            warnings |= DMARC_WARNING_PCT_NON_NUMERIC_VALUE.flag
+        else:
+            pct = int(tags['pct'])
+            if pct > 100:
+                warnings |= DMARC_WARNING_PCT_OUT_OF_RANGE_VALUE.flag
+
+    if 'rf' in tags:
+        formats = tags['rf'].split(':')
+        if not tags['rf']:
+            warnings |= DMARC_WARNING_RF_EMPTY_VALUE.flag
+        elif any(report_format not in ReportFormat.list() for report_format in formats):
+            warnings |= DMARC_WARNING_RF_INVALID_FORMAT.flag
+        if len(formats) > 1:
+            warnings |= DMARC_WARNING_RF_UNSUPPORTED_MULTIPLE_FORMATS.flag
+
+    if 'ri' in tags:
+        try:
+            ri = int(tags['ri'])
+            if ri <= 0:
+                warnings |= DMARC_WARNING_RI_ZERO_OR_NEGATIVE_VALUE.flag
+            elif ri < RI_VERY_LOW:
+                warnings |= DMARC_WARNING_RI_VERY_LOW_VALUE.flag
+            elif ri > RI_VERY_HIGH:
+                warnings |= DMARC_WARNING_RI_VERY_HIGH_VALUE.flag
+        except ValueError:
+            if tags['ri']:
+                warnings |= DMARC_WARNING_RI_NON_NUMERIC_VALUE.flag
+            else:
+                warnings |= DMARC_WARNING_RI_EMPTY_VALUE.flag
+
+    if 'rua' in tags:
+        warnings |= _report_uri_warnings(tags['rua'], _RUA_WARNINGS)
+    else:
+        warnings |= DMARC_WARNING_RUA_NO_TAG_FOUND.flag
+    if 'ruf' in tags:
+        warnings |= _report_uri_warnings(tags['ruf'], _RUF_WARNINGS)
+        if tags['ruf'] and 'rua' not in tags:
+            warnings |= DMARC_WARNING_RUF_ENABLED_WITHOUT_RUA.flag
+    else:
+        warnings |= DMARC_WARNING_RUF_NO_TAG_FOUND.flag
+
+    if 'fo' in tags:
+        options = tags['fo'].split(':')
+        if not tags['fo']:
+            warnings |= DMARC_WARNING_FO_EMPTY_VALUE.flag
+        elif any(option not in ('0', '1', 'd', 's') for option in options):
+            warnings |= DMARC_WARNING_FO_INVALID_OPTION_CHAR.flag
+        if len(set(options)) != len(options):
+            warnings |= DMARC_WARNING_FO_DUPLICATE_OPTION_CHAR.flag
+
+    if pct is not None and pct != 100 and tags.get('p') in (Policy.QUARANTINE, Policy.REJECT):
+        warnings |= DMARC_WARNING_PCT_NOT_100_WITH_ENFORCEMENT.flag
+
+    return record, warnings
+
+
+def _value_warnings(value: str, valid_values: List[str], empty: DMARCWarning, invalid: DMARCWarning) -> int:
+    if not value:
+        return empty.flag
+    if value not in valid_values:
+        return invalid.flag
+    return 0
+
+
+# (invalid format, unsupported scheme, missing mailto, no comma, more than two, empty)
+_RUA_WARNINGS = (
+    DMARC_WARNING_RUA_INVALID_URI_FORMAT, DMARC_WARNING_RUA_UNSUPPORTED_URI_SCHEME, DMARC_WARNING_RUA_MISSING_MAILTO_SCHEME,
+    DMARC_WARNING_RUA_MULTIPLE_URIS_NO_COMMA, DMARC_WARNING_RUA_MORE_THAN_TWO_URIS, DMARC_WARNING_RUA_EMPTY_VALUE,
+)
+_RUF_WARNINGS = (
+    DMARC_WARNING_RUF_INVALID_URI_FORMAT, DMARC_WARNING_RUF_UNSUPPORTED_URI_SCHEME, DMARC_WARNING_RUF_MISSING_MAILTO_SCHEME,
+    DMARC_WARNING_RUF_MULTIPLE_URIS_NO_COMMA, DMARC_WARNING_RUF_MORE_THAN_TWO_URIS, DMARC_WARNING_RUF_EMPTY_VALUE,
+)
+
+
+def _report_uri_warnings(value: str, uri_warnings: Tuple[DMARCWarning, ...]) -> int:
+    invalid, scheme, mailto, no_comma, too_many, empty = uri_warnings
+    if not value:
+        return empty.flag
+    warnings = 0
+    uris = [uri.strip(' \t') for uri in value.split(',')]
+    if len(uris) > 2:
+        warnings |= too_many.flag
+    for uri in uris:
+        if ' ' in uri or '\t' in uri or uri.lower().count('mailto:') > 1:
+            warnings |= no_comma.flag
+            continue
+        uri_scheme, separator, rest = uri.partition(':')
+        if not separator or '@' in uri_scheme:
+            warnings |= mailto.flag if '@' in uri else invalid.flag
+        elif uri_scheme.lower() != 'mailto':
+            warnings |= scheme.flag
+        elif parse_receiver_domain('mailto:' + rest) is None:
+            warnings |= invalid.flag
+    return warnings
+
 
 dmarc_regex = re.compile(r"(^[^a-z]*v[^a-z]*=)|(\bD[^a-z]*M[^a-z]*A[^a-z]*R[^a-z]*C\b)", re.IGNORECASE)
 
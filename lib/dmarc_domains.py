@@ -0,0 +1,111 @@
+from collections import Counter
+from json import dumps, loads
+from typing import List, NamedTuple, Tuple
+
+from lib.dmarc import is_dmarc_version_record, parse_dmarc_diagnostic
+
+DOMAIN_TABLE_HEADER = '#domain\toutcome\tp\tsp\tpct\trua\truf\twarnings\ttxt\tdmarc\tattempts\trrsets\trecord'
+
+# RFC 7489, section 6.6.3
+OUTCOME_VALID = 'valid'
+OUTCOME_INVALID = 'invalid'  # A single DMARC record, which does not parse
+OUTCOME_MULTIPLE = 'multiple'  # More than one DMARC record, no policy is applied
+OUTCOME_NO_RECORD = 'no_record'  # No TXT record starting with v=DMARC1
+OUTCOME_NXDOMAIN = 'nxdomain'
+OUTCOME_ERROR = 'error'  # No attempt got an answer
+
+# (status, TXT RRset) of a single attempt
+Observation = Tuple[str, Tuple[str, ...]]
+
+
+class DomainResult(NamedTuple):
+    """
+    Canonical DMARC evaluation of a single _dmarc name, one line of the domain table.
+
+    pct is -1 unless the record is valid. rrsets counts the distinct non-empty TXT RRsets
+    received, more than one means resolvers or retries disagreed.
+    """
+    domain: str
+    outcome: str
+    policy: str = ''
+    subdomain_policy: str = ''
+    pct: int = -1
+    rua: int = 0
+    ruf: int = 0
+    warnings: int = 0
+    txt: int = 0
+    dmarc: int = 0
+    attempts: int = 0
+    rrsets: int = 0
+    record: str = ''
+
+    def to_line(self) -> str:
+        return '\t'.join([
+            self.domain, self.outcome, self.policy, self.subdomain_policy, str(self.pct), str(self.rua), str(self.ruf),
+            f"{self.warnings:x}", str(self.txt), str(self.dmarc), str(self.attempts), str(self.rrsets), dumps(self.record)
+        ])
+
+    @classmethod
+    def from_line(cls, line: str) -> 'DomainResult':
+        domain, outcome, policy, subdomain_policy, pct, rua, ruf, warnings, txt, dmarc, attempts, rrsets, record = \
+            line.removesuffix('\n').split('\t')
+        return cls(domain, outcome, policy, subdomain_policy, int(pct), int(rua), int(ruf), int(warnings, 16),
+                   int(txt), int(dmarc), int(attempts), int(rrsets), loads(record))
+
+
+def dmarc_domain(name: str) -> str:
+    return name.lower().rstrip('.').removeprefix('_dmarc.')
+
+
+def observation_line(doc: dict) -> str:
+    """Compact spill line of a massdns TXT result, the TXT data of the answers sorted."""
+    answers = doc.get('data', {}).get('answers', [])
+    txts = sorted({answer['data'] for answer in answers if answer.get('type') == 'TXT' and 'data' in answer})
+    return dumps([dmarc_domain(doc['name']), doc.get('status', ''), txts])
+
+
+def parse_observation_line(line: str) -> Tuple[str, Observation]:
+    domain, status, txts = loads(line)
+    return domain, (status, tuple(txts))
+
+
+def evaluate_domain(domain: str, observations: List[Observation]) -> DomainResult:
+    """
+    Evaluates all attempts for a _dmarc name as a receiver would.
+
+    The most frequent non-empty TXT RRset wins, as an empty answer of a single resolver is more
+    likely a glitch than a record the other resolvers made up. Exactly one v=DMARC1 record is
+    required, otherwise no policy applies.
+    """
+    attempts = len(observations)
+    answered = Counter(txts for status, txts in observations if status == 'NOERROR' and txts)
+    if answered:
+        txts = min(answered.items(), key=lambda item: (-item[1], item[0]))[0]
+    elif any(status == 'NOERROR' for status, _ in observations):
+        return DomainResult(domain, OUTCOME_NO_RECORD, attempts=attempts)
+    elif any(status == 'NXDOMAIN' for status, _ in observations):
+        return DomainResult(domain, OUTCOME_NXDOMAIN, attempts=attempts)
+    else:
+        return DomainResult(domain, OUTCOME_ERROR, attempts=attempts)
+
+    records = [txt for txt in txts if is_dmarc_version_record(txt)]
+    counts = {'txt': len(txts), 'dmarc': len(records), 'attempts': attempts, 'rrsets': len(answered)}
+    if not records:
+        return DomainResult(domain, OUTCOME_NO_RECORD, **counts)
+    if len(records) > 1:
+        return DomainResult(domain, OUTCOME_MULTIPLE, **counts)
+
+    record, warnings = parse_dmarc_diagnostic(records[0])
+    if record is None:
+        return DomainResult(domain, OUTCOME_INVALID, warnings=warnings, record=records[0], **counts)
+    return DomainResult(
+        domain, OUTCOME_VALID,
+        policy=record.p.value.value,
+        subdomain_policy=record.sp.value.value if record.sp.explicit and record.sp.valid else '',
+        pct=record.pct.value if record.pct.valid else -1,
+        rua=len(record.rua.value or []),
+        ruf=len(record.ruf.value or []),
+        warnings=warnings,
+        record=records[0],
+        **counts
+    )
@@ -0,0 +1,33 @@
+from unittest import TestCase, main
+from dmarc_domains import (DomainResult, evaluate_domain, observation_line,
+                           parse_observation_line, OUTCOME_VALID, OUTCOME_INVALID, OUTCOME_MULTIPLE,
+                           OUTCOME_NO_RECORD, OUTCOME_NXDOMAIN, OUTCOME_ERROR)
+
+RECORD = 'v=DMARC1; p=reject; sp=none; rua=mailto:a@example.de,mailto:b@example.de'
+
+
+class Test(TestCase):
+    def test_observation_line(self):
+        doc = {'name': '_dmarc.Example.de.', 'type': 'TXT', 'status': 'NOERROR', 'data': {'answers': [
+            {'type': 'TXT', 'data': 'b'}, {'type': 'CNAME', 'data': 'x.de.'}, {'type': 'TXT', 'data': 'a'}]}}
+        self.assertEqual(('example.de', ('NOERROR', ('a', 'b'))), parse_observation_line(observation_line(doc)))
+
+    def test_evaluate_domain(self):
+        result = evaluate_domain('example.de', [('NOERROR', (RECORD, 'v=spf1 -all')), ('NOERROR', ()), ('SERVFAIL', ())])
+        self.assertEqual((OUTCOME_VALID, 'reject', 'none', 100, 2, 0), result[1:7])
+        self.assertEqual((2, 1, 3, 1), (result.txt, result.dmarc, result.attempts, result.rrsets))
+        self.assertEqual(result, DomainResult.from_line(result.to_line()))
+
+        majority = evaluate_domain('example.de', [('NOERROR', ('v=DMARC1; p=none',)), ('NOERROR', (RECORD,)), ('NOERROR', (RECORD,))])
+        self.assertEqual(('reject', 2), (majority.policy, majority.rrsets))
+
+        self.assertEqual(OUTCOME_MULTIPLE, evaluate_domain('a.de', [('NOERROR', (RECORD, 'v=DMARC1; p=none'))]).outcome)
+        self.assertEqual(OUTCOME_INVALID, evaluate_domain('a.de', [('NOERROR', ('v=DMARC1; p=block',))]).outcome)
+        self.assertEqual(OUTCOME_NO_RECORD, evaluate_domain('a.de', [('NOERROR', ('google-site-verification=x',))]).outcome)
+        self.assertEqual(OUTCOME_NO_RECORD, evaluate_domain('a.de', [('NOERROR', ()), ('NXDOMAIN', ())]).outcome)
+        self.assertEqual(OUTCOME_NXDOMAIN, evaluate_domain('a.de', [('NXDOMAIN', ()), ('SERVFAIL', ())]).outcome)
+        self.assertEqual(OUTCOME_ERROR, evaluate_domain('a.de', [('', ())]).outcome)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,10 @@
 from unittest import TestCase, main
-from dmarc import parse_dmarc, DMARCRecord
+from dmarc import parse_dmarc, parse_dmarc_diagnostic, decode_warnings, is_dmarc_version_record, DMARCRecord, DMARC_WARNINGS
+
+
+def warning_ids(dmarc_record: str) -> set:
+    _, warnings = parse_dmarc_diagnostic(dmarc_record)
+    return {warning.id for warning in decode_warnings(warnings)}
 
 
 def ov(tags: dict) -> DMARCRecord:
@@ -10,6 +15,16 @@ def ov(tags: dict) -> DMARCRecord:
 
 
 class Test(TestCase):
+    def test_is_dmarc_version_record(self):
+        self.assertTrue(is_dmarc_version_record('v=DMARC1'))
+        self.assertTrue(is_dmarc_version_record('v=DMARC1;'))
+        self.assertTrue(is_dmarc_version_record('v = DMARC1; p=none'))
+        self.assertTrue(is_dmarc_version_record('v=DMARC1 ;p=none'))
+        self.assertFalse(is_dmarc_version_record('v=DMARC10'))
+        self.assertFalse(is_dmarc_version_record('v=DMARC1p=none'))
+        self.assertFalse(is_dmarc_version_record('v=spf1 -all'))
+        self.assertFalse(is_dmarc_version_record(' v=DMARC1; p=none'))
+
     def test_minimal(self):
         self.assertEqual(ov({'p': 'none'}), parse_dmarc('v=DMARC1;p=none'))
         self.assertEqual(ov({'p': 'none'}), parse_dmarc('v =DMARC1;p=none'))
@@ -136,6 +151,29 @@ class Test(TestCase):
         self.assertEqual(None, parse_dmarc('k=v;=v'))
         self.assertEqual(None, parse_dmarc('k=v=v'))
 
+    def test_diagnostic_record(self):
+        for value in ['v=DMARC1; p=reject; rua=mailto:a@example.de', 'v=DMARC1; p=none; pct=x y', 'k=v', '']:
+            self.assertEqual(parse_dmarc(value), parse_dmarc_diagnostic(value)[0])
+        self.assertEqual(len(DMARC_WARNINGS), len({warning.flag for warning in DMARC_WARNINGS}))
+
+    def test_diagnostic_warnings(self):
+        self.assertEqual({'T030'}, warning_ids('v=DMARC1; p=reject; rua=mailto:a@example.de'))
+        self.assertEqual({'G007'}, warning_ids(' '))
+        self.assertEqual({'G012'}, warning_ids('v=spf1 -all'))
+        self.assertEqual({'G011'}, warning_ids('google-site-verification=abc'))
+        self.assertEqual({'G002', 'G004', 'T023', 'T030'}, warning_ids('p=none; v=DMARC1'))
+        self.assertEqual({'G003', 'G014', 'T030'}, warning_ids('v=DMARC1 rua=mailto:a@example.de'))
+        self.assertEqual({'G008', 'G009', 'G015', 'G016', 'G017', 'T023', 'T030'}, warning_ids(' V=DMARC1;; p = none; '))
+        self.assertEqual({'G005', 'G006', 'G010', 'T023', 'T030'}, warning_ids('v=DMARC1; p=none; x=1; p=reject; k=v=v; a'))
+        self.assertEqual({'T001', 'T004', 'T008', 'T011', 'T013', 'T023', 'T030'},
+                         warning_ids('v=DMARC1; p=block; sp=; adkim=s; aspf=s; pct=200'))
+        self.assertEqual({'T003', 'T015', 'T016', 'T020', 'T023', 'T030', 'T037', 'T038'},
+                         warning_ids('v=DMARC1; p=none; sp=all; rf=afrf:iodef; ri=3600; fo=1:1:x'))
+        self.assertEqual({'T012', 'T023', 'T030'}, warning_ids('v=DMARC1; p=quarantine; pct=abc'))
+        self.assertEqual({'L001', 'T023', 'T030'}, warning_ids('v=DMARC1; p=quarantine; pct=50'))
+        self.assertEqual({'L002', 'T023', 'T033'}, warning_ids('v=DMARC1; p=none; ruf=a@example.de'))
+        self.assertEqual({'T024', 'T025', 'T027', 'T028', 'T030'},
+                         warning_ids('v=DMARC1; p=none; rua=mailto:a@example.de mailto:b@example.de,https://x.de,mailto:nobody'))
 
 if __name__ == '__main__':
     main()
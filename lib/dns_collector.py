@@ -0,0 +1,344 @@
+import asyncio
+import bz2
+import json
+import socket
+from itertools import count
+from pathlib import Path
+from random import getrandbits
+from time import monotonic, time_ns
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from lib.dns_wire import LENGTH_PREFIX, RCODES, DNSFormatError, TYPES, decode_response, encode_query, type_name, with_query_id
+from lib.resolver_pool import ResolverPool
+
+RATE = 2000  # Queries per second per resolver
+BURST = 100
+RETRIES = 2  # Further attempts after the first, each on the next resolver
+CONCURRENCY = 2000  # Queries in flight over all resolvers
+INITIAL_TIMEOUT = 1.0
+MIN_TIMEOUT = 0.2
+MAX_TIMEOUT = 5.0
+TCP_TIMEOUT = 5.0
+RETRY_RCODES = frozenset((RCODES['SERVFAIL'], RCODES['REFUSED']))
+POOL_UPDATE_SECONDS = 30  # Resolver weights are recomputed, and old observations halved, this often
+ERROR_INVALID_NAME = 'invalid_name'  # The name cannot be encoded as a query, no resolver was asked
+
+
+class TokenBucket:
+    """Allows rate acquisitions per second on average, up to burst at once."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = monotonic()
+
+    async def acquire(self) -> None:
+        while True:
+            now = monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def parse_resolver_address(address: str) -> Tuple[str, int]:
+    """'ip', 'ip:port' or '[ipv6]:port' as (host, port), port 53 by default."""
+    if address.startswith('['):
+        host, _, rest = address[1:].partition(']')
+        return host, int(rest.lstrip(':') or 53)
+    if address.count(':') == 1:
+        host, port = address.split(':')
+        return host, int(port)
+    return address, 53
+
+
+def resolver_name(address: str) -> str:
+    """The resolver as written to the resolver field of the documents, e.g. '8.8.8.8:53'."""
+    host, port = parse_resolver_address(address)
+    return f"{host}:{port}"
+
+
+class Resolver:
+    """
+    One upstream resolver with its own rate limit and retransmission timeout.
+
+    The timeout follows the smoothed RTT as in RFC 6298 (srtt + 4 * rttvar), doubling after each
+    timeout until the next answer arrives.
+    """
+
+    def __init__(self, address: str, rate: float = RATE, burst: float = BURST, initial_timeout: float = INITIAL_TIMEOUT):
+        self.host, self.port = parse_resolver_address(address)
+        self.initial_timeout = initial_timeout
+        self.name = resolver_name(address)
+        self.bucket = TokenBucket(rate, burst)
+        self.srtt: Optional[float] = None
+        self.rttvar = 0.0
+        self.backoff = 1
+        self.sent = 0
+        self.answered = 0
+        self.timeouts = 0
+        self.pending: Dict[int, asyncio.Future] = {}
+        self.sock: Optional[socket.socket] = None
+
+    @property
+    def timeout(self) -> float:
+        base = self.initial_timeout if self.srtt is None else self.srtt + 4 * self.rttvar
+        return min(MAX_TIMEOUT, max(MIN_TIMEOUT, base) * self.backoff)
+
+    def observe_rtt(self, rtt: float) -> None:
+        if self.srtt is None:
+            self.srtt, self.rttvar = rtt, rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.backoff = 1
+
+    def observe_timeout(self) -> None:
+        self.timeouts += 1
+        self.backoff = min(self.backoff * 2, 8)
+
+    def query_id(self) -> int:
+        query_id = getrandbits(16)
+        while query_id in self.pending:
+            query_id = getrandbits(16)
+        return query_id
+
+    def open(self) -> None:
+        """
+        Connected UDP socket, so the kernel drops datagrams from other sources. Not an asyncio
+        transport: those read one datagram per loop iteration, and under load the answers then wait
+        in the socket buffer until their timeouts fire. _read_ready drains the buffer at once.
+        """
+        family = socket.AF_INET6 if ':' in self.host else socket.AF_INET
+        self.sock = socket.socket(family, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+        self.sock.connect((self.host, self.port))
+        asyncio.get_running_loop().add_reader(self.sock.fileno(), self._read_ready)
+
+    def _read_ready(self) -> None:
+        while True:
+            try:
+                data = self.sock.recv(65535)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                continue  # ICMP errors surface as timeouts of the affected queries
+            if len(data) >= 2:
+                future = self.pending.pop(LENGTH_PREFIX.unpack_from(data)[0], None)
+                if future is not None and not future.done():
+                    future.set_result(data)
+
+    def send(self, data: bytes) -> None:
+        try:
+            self.sock.send(data)
+        except (BlockingIOError, InterruptedError, ConnectionRefusedError):
+            pass  # Counts as lost, the timeout retries it
+
+    def close(self) -> None:
+        if self.sock is not None:
+            asyncio.get_running_loop().remove_reader(self.sock.fileno())
+            self.sock.close()
+            self.sock = None
+
+
+def _expire(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_exception(asyncio.TimeoutError())
+
+
+class DNSCollector:
+    """
+    Asynchronous stub resolver for bulk collection, producing the ndjson documents of massdns -o Je.
+
+    Every attempt waits for a token of its resolver. Timeouts, network errors, malformed answers
+    and SERVFAIL/REFUSED are retried up to retries times, each time on the next resolver, and
+    truncated UDP answers are repeated over TCP on the same resolver.
+
+    With a ResolverPool, resolvers are drawn by health instead of in turn, every outcome is fed
+    back to the pool, and quarantined resolvers only get queries if no other resolver is left.
+    """
+
+    def __init__(self, resolvers: List[str], rate: float = RATE, retries: int = RETRIES, concurrency: int = CONCURRENCY,
+                 initial_timeout: float = INITIAL_TIMEOUT, pool: Optional[ResolverPool] = None):
+        assert resolvers, 'At least one resolver is required'
+        self.resolvers = [Resolver(address, rate, initial_timeout=initial_timeout) for address in resolvers]
+        self.retries = retries
+        self.concurrency = concurrency
+        self.pool = pool
+        self._by_name = {resolver.name: resolver for resolver in self.resolvers}
+        self._rotation = count()
+        self._pool_updated = monotonic()
+
+    async def __aenter__(self) -> 'DNSCollector':
+        for resolver in self.resolvers:
+            resolver.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        for resolver in self.resolvers:
+            resolver.close()
+
+    async def _query_udp(self, resolver: Resolver, query: bytes) -> Tuple[bytes, float]:
+        loop = asyncio.get_running_loop()
+        query_id = resolver.query_id()
+        future = loop.create_future()
+        resolver.pending[query_id] = future
+        timeout = resolver.timeout
+        handle = loop.call_later(timeout, _expire, future)
+        started = monotonic()
+        resolver.sent += 1
+        try:
+            resolver.send(with_query_id(query, query_id))
+            data = await future
+        except asyncio.TimeoutError:
+            resolver.observe_timeout()
+            raise
+        finally:
+            handle.cancel()
+            resolver.pending.pop(query_id, None)
+        rtt = monotonic() - started
+        resolver.answered += 1
+        resolver.observe_rtt(rtt)
+        return data, rtt
+
+    async def _query_tcp(self, resolver: Resolver, query: bytes) -> bytes:
+        async def exchange() -> bytes:
+            reader, writer = await asyncio.open_connection(resolver.host, resolver.port)
+            try:
+                writer.write(LENGTH_PREFIX.pack(len(query)) + with_query_id(query, resolver.query_id()))
+                await writer.drain()
+                length, = LENGTH_PREFIX.unpack(await reader.readexactly(LENGTH_PREFIX.size))
+                return await reader.readexactly(length)
+            finally:
+                writer.close()
+        return await asyncio.wait_for(exchange(), TCP_TIMEOUT)
+
+    async def resolve(self, name: str, rr_type: int) -> Dict:
+        """Resolves one name and returns its result document."""
+        fqdn = name if name.endswith('.') else f"{name}."
+        try:
+            query = encode_query(0, fqdn, rr_type)
+        except DNSFormatError:
+            # Not the fault of any resolver, so none is asked or blamed
+            return {'name': fqdn, 'type': type_name(rr_type), 'class': 'IN', 'error': ERROR_INVALID_NAME, 'rx_ts': time_ns()}
+        start = next(self._rotation)
+        error = 'timeout'
+        resolver = self.resolvers[start % len(self.resolvers)]
+        document = None
+        tried: List[str] = []
+        for attempt in range(self.retries + 1):
+            resolver = self._pick(start, attempt, tried)
+            tried.append(resolver.name)
+            await resolver.bucket.acquire()
+            proto = 'UDP'
+            try:
+                data, rtt = await self._query_udp(resolver, query)
+                response = decode_response(data)
+                if response.truncated:
+                    proto = 'TCP'
+                    response = decode_response(await self._query_tcp(resolver, query))
+            except asyncio.TimeoutError:
+                error = 'timeout'
+                self._observe(resolver, error=error)
+                continue
+            except (OSError, asyncio.IncompleteReadError, DNSFormatError, IndexError) as e:
+                error = 'malformed' if isinstance(e, (DNSFormatError, IndexError)) else 'network'
+                self._observe(resolver, error=error)
+                continue
+            if response.name.lower() != fqdn.lower() or response.type != rr_type:
+                error = 'mismatch'
+                self._observe(resolver, error=error)
+                continue
+            self._observe(resolver, status=response.status, rtt=rtt)
+            document = self._document(fqdn, rr_type, response, resolver, proto, rtt)
+            if response.rcode not in RETRY_RCODES:
+                return document
+        if document is not None:
+            return document
+        return {
+            'name': fqdn, 'type': type_name(rr_type), 'class': 'IN', 'error': error,
+            'rx_ts': time_ns(), 'resolver': resolver.name,
+        }
+
+    def _pick(self, start: int, attempt: int, tried: List[str]) -> Resolver:
+        if self.pool is not None:
+            name = self.pool.choose(exclude=tried)
+            if name in self._by_name:
+                return self._by_name[name]
+        return self.resolvers[(start + attempt) % len(self.resolvers)]
+
+    def _observe(self, resolver: Resolver, status: Optional[str] = None, error: Optional[str] = None, rtt: Optional[float] = None) -> None:
+        if self.pool is None:
+            return
+        self.pool.observe(resolver.name, status, error, rtt)
+        now = monotonic()
+        if now - self._pool_updated >= POOL_UPDATE_SECONDS:
+            self._pool_updated = now
+            self.pool.update(now)
+            self.pool.decay()
+
+    @staticmethod
+    def _document(fqdn: str, rr_type: int, response, resolver: Resolver, proto: str, rtt: float) -> Dict:
+        data = {'answers': response.answers}
+        if response.authorities:
+            data['authorities'] = response.authorities
+        if response.additionals:
+            data['additionals'] = response.additionals
+        return {
+            'name': fqdn, 'type': type_name(rr_type), 'class': 'IN', 'status': response.status,
+            'rx_ts': time_ns(), 'data': data, 'flags': response.flag_names,
+            'resolver': resolver.name, 'proto': proto, 'rtt': round(rtt, 6),
+        }
+
+    async def collect(self, queries: Iterable[Tuple[str, int]], emit: Callable[[Dict], None]) -> int:
+        """Resolves all queries with up to concurrency in flight, emitting documents as they complete."""
+        iterator: Iterator[Tuple[str, int]] = iter(queries)
+        done = 0
+
+        async def worker() -> None:
+            nonlocal done
+            for name, rr_type in iterator:
+                emit(await self.resolve(name, rr_type))
+                done += 1
+
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+        return done
+
+    def resolver_stats(self) -> List[Dict]:
+        return [
+            {'resolver': resolver.name, 'sent': resolver.sent, 'answered': resolver.answered,
+             'timeouts': resolver.timeouts, 'srtt': resolver.srtt}
+            for resolver in self.resolvers
+        ]
+
+
+def read_resolvers(file_path: Path) -> List[str]:
+    """
+    Resolver list in the massdns format, one address per line, # starts a comment. Repeated lines
+    of a weighted list (see ResolverPool.write_weighted_list) are read once.
+    """
+    with open(file_path, mode='rt', encoding='utf-8') as fp:
+        addresses = (line.split('#', 1)[0].strip() for line in fp)
+        return list(dict.fromkeys(address for address in addresses if address))
+
+
+def collect_file(input_path: Path, output_path: Path, rr_type: str, resolvers: List[str], **options) -> Tuple[int, List[Dict]]:
+    """
+    Resolves every name of a (bz2) batch file and writes the documents as ndjson, compressed if
+    output_path ends with .bz2. Returns the number of documents and the per-resolver stats.
+    """
+    open_input = bz2.open if input_path.suffix == '.bz2' else open
+    open_output = bz2.open if output_path.suffix == '.bz2' else open
+    type_code = TYPES[rr_type]
+
+    async def run() -> Tuple[int, List[Dict]]:
+        with open_input(input_path, mode='rt', encoding='utf-8') as ifp, open_output(output_path, mode='wt', encoding='utf-8') as ofp:
+            queries = ((line.strip(), type_code) for line in ifp if line.strip())
+            async with DNSCollector(resolvers, **options) as collector:
+                written = await collector.collect(queries, lambda doc: ofp.write(json.dumps(doc) + '\n'))
+                return written, collector.resolver_stats()
+
+    return asyncio.run(run())
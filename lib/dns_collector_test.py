@@ -0,0 +1,118 @@
+import asyncio
+import bz2
+import json
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import IsolatedAsyncioTestCase, main
+from dns_collector import ERROR_INVALID_NAME, DNSCollector, TokenBucket, collect_file, parse_resolver_address
+from dns_stub import StubServer
+from dns_wire import TYPES
+from resolver_pool import ResolverPool
+
+LONG_SPF = 'v=spf1 ' + ' '.join(f"ip4:192.0.2.{i}" for i in range(60)) + ' -all'
+ZONE = {
+    'example.de.': {TYPES['TXT']: [LONG_SPF], TYPES['MX']: ['10 mx.example.de.']},
+    '_dmarc.example.de.': {TYPES['TXT']: ['v=DMARC1; p=reject']},
+}
+
+
+class Test(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.server = StubServer(ZONE, drop={'lost.de.'}, servfail={'broken.de.'})
+        self.address = await self.server.start()
+
+    async def asyncTearDown(self):
+        await self.server.close()
+
+    def test_parse_resolver_address(self):
+        self.assertEqual(('8.8.8.8', 53), parse_resolver_address('8.8.8.8'))
+        self.assertEqual(('127.0.0.1', 5353), parse_resolver_address('127.0.0.1:5353'))
+        self.assertEqual(('::1', 53), parse_resolver_address('[::1]'))
+        self.assertEqual(('2001:db8::1', 5353), parse_resolver_address('[2001:db8::1]:5353'))
+
+    async def test_resolve(self):
+        async with DNSCollector([self.address], initial_timeout=0.05) as collector:
+            doc = await collector.resolve('_dmarc.example.de', TYPES['TXT'])
+            self.assertEqual(('_dmarc.example.de.', 'TXT', 'NOERROR', 'UDP', self.address), (doc['name'], doc['type'], doc['status'], doc['proto'], doc['resolver']))
+            self.assertEqual(['v=DMARC1; p=reject'], [answer['data'] for answer in doc['data']['answers']])
+            self.assertIn('aa', doc['flags'])
+            self.assertIsInstance(doc['rx_ts'], int)
+
+            doc = await collector.resolve('example.de', TYPES['MX'])
+            self.assertEqual('10 mx.example.de.', doc['data']['answers'][0]['data'])
+            doc = await collector.resolve('nothing.example.de', TYPES['TXT'])
+            self.assertEqual(('NXDOMAIN', []), (doc['status'], doc['data']['answers']))
+            doc = await collector.resolve('_dmarc.example.de', TYPES['MX'])
+            self.assertEqual(('NOERROR', []), (doc['status'], doc['data']['answers']))
+
+    async def test_tcp_fallback(self):
+        async with DNSCollector([self.address], initial_timeout=0.05) as collector:
+            doc = await collector.resolve('example.de', TYPES['TXT'])
+        self.assertEqual(('TCP', [LONG_SPF]), (doc['proto'], [answer['data'] for answer in doc['data']['answers']]))
+        self.assertEqual((1, 1), (self.server.queries['UDP'], self.server.queries['TCP']))
+
+    async def test_retries(self):
+        self.server.lose_first = 1
+        async with DNSCollector([self.address, self.address], retries=2, initial_timeout=0.05) as collector:
+            doc = await collector.resolve('_dmarc.example.de', TYPES['TXT'])
+            self.assertEqual('NOERROR', doc['status'])
+            self.assertEqual(1, sum(resolver.timeouts for resolver in collector.resolvers))
+
+            doc = await collector.resolve('lost.de', TYPES['TXT'])
+            self.assertEqual(('timeout', 'lost.de.'), (doc['error'], doc['name']))
+            self.assertNotIn('status', doc)
+            doc = await collector.resolve('broken.de', TYPES['TXT'])
+            self.assertEqual('SERVFAIL', doc['status'])
+        self.assertEqual(3 + 3 + 2, self.server.queries['UDP'])
+
+    async def test_invalid_name(self):
+        pool = ResolverPool([self.address])
+        async with DNSCollector([self.address], initial_timeout=0.05, pool=pool) as collector:
+            docs = [await collector.resolve(name, TYPES['TXT']) for name in ('bücher.de', 'a' * 64 + '.de')]
+        self.assertEqual([ERROR_INVALID_NAME] * 2, [doc['error'] for doc in docs])
+        self.assertNotIn('resolver', docs[0])
+        self.assertEqual(0, self.server.queries['UDP'])
+        self.assertEqual(0, pool.health[self.address].queries)
+
+    async def test_pool(self):
+        dead = '127.0.0.1:9'  # Discard port, nothing answers
+        pool = ResolverPool([self.address, dead])
+        async with DNSCollector([dead, self.address], retries=1, initial_timeout=0.05, pool=pool) as collector:
+            for _ in range(10):
+                doc = await collector.resolve('_dmarc.example.de', TYPES['TXT'])
+                self.assertEqual('NOERROR', doc['status'])
+        self.assertEqual(10, pool.health[self.address].queries)
+        self.assertEqual(pool.health[dead].queries, pool.health[dead].timeouts)
+        self.assertIsNotNone(pool.health[self.address].latency.percentile(50))
+
+    async def test_token_bucket(self):
+        bucket = TokenBucket(1000, 5)
+        for _ in range(5):
+            await bucket.acquire()
+        self.assertLess(bucket.tokens, 1)
+        await bucket.acquire()
+
+    async def test_collect(self):
+        names = [f"d{i}.example.de" for i in range(500)] + ['_dmarc.example.de']
+        docs = []
+        async with DNSCollector([self.address], concurrency=50) as collector:
+            self.assertEqual(501, await collector.collect(((name, TYPES['TXT']) for name in names), docs.append))
+        self.assertEqual(sorted(f"{name}." for name in names), sorted(doc['name'] for doc in docs))
+        self.assertEqual(500, sum(doc['status'] == 'NXDOMAIN' for doc in docs))
+
+    async def test_collect_file(self):
+        with TemporaryDirectory() as tmp:
+            input_path = Path(tmp) / 'batch-00001.txt.bz2'
+            output_path = Path(tmp) / 'batch-00001.ndjson.bz2'
+            input_path.write_bytes(bz2.compress(b'_dmarc.example.de\nnothing.de\n'))
+
+            # collect_file() runs its own event loop
+            written, stats = await asyncio.get_running_loop().run_in_executor(None, collect_file, input_path, output_path, 'TXT', [self.address])
+            self.assertEqual(2, written)
+            self.assertEqual(2, stats[0]['answered'])
+            docs = [json.loads(line) for line in bz2.open(output_path, mode='rt')]
+            self.assertEqual({'NOERROR', 'NXDOMAIN'}, {doc['status'] for doc in docs})
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+import asyncio
+from collections import defaultdict
+from typing import Dict, List, Optional, Set, Tuple
+
+from lib.dns_wire import LENGTH_PREFIX, RCODES, DNSFormatError, decode_query, encode_response
+
+UDP_MAX_SIZE = 512  # Without EDNS, larger answers are truncated and have to be fetched over TCP
+
+Zone = Dict[str, Dict[int, List[str]]]  # Name with trailing dot -> type -> record data
+
+
+class StubServer:
+    """
+    Authoritative stand-in for tests and local benchmarks, answering from a dict over UDP and TCP
+    on the same port. Names not in the zone get NXDOMAIN.
+
+    Failures can be injected per name: lost queries (the first lose_first queries of every name
+    are dropped, names in drop never get an answer) and SERVFAIL for names in servfail.
+    """
+
+    def __init__(self, zone: Zone, udp_max_size: int = UDP_MAX_SIZE, lose_first: int = 0,
+                 drop: Optional[Set[str]] = None, servfail: Optional[Set[str]] = None):
+        self.zone = {name.lower(): records for name, records in zone.items()}
+        self.udp_max_size = udp_max_size
+        self.lose_first = lose_first
+        self.drop = {name.lower() for name in drop or ()}
+        self.servfail = {name.lower() for name in servfail or ()}
+        self.queries: Dict[str, int] = defaultdict(int)  # Per protocol
+        self._seen: Dict[str, int] = defaultdict(int)
+        self._udp_transport: Optional[asyncio.DatagramTransport] = None
+        self._tcp_server: Optional[asyncio.AbstractServer] = None
+
+    def answer(self, query: bytes, max_size: Optional[int]) -> Optional[bytes]:
+        try:
+            query_id, flags, name, rr_type = decode_query(query)
+        except (DNSFormatError, IndexError):
+            return None
+        key = name.lower()
+        self._seen[key] += 1
+        if key in self.drop or self._seen[key] <= self.lose_first:
+            return None
+        if key in self.servfail:
+            return encode_response(query_id, flags, name, rr_type, RCODES['SERVFAIL'], [])
+        if key not in self.zone:
+            return encode_response(query_id, flags, name, rr_type, RCODES['NXDOMAIN'], [])
+        answers = [(name, rr_type, 300, data) for data in self.zone[key].get(rr_type, [])]
+        return encode_response(query_id, flags, name, rr_type, RCODES['NOERROR'], answers, max_size)
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        """Starts listening, returns the address as 'ip:port'."""
+        loop = asyncio.get_running_loop()
+        server = self
+
+        class UDPProtocol(asyncio.DatagramProtocol):
+            def datagram_received(self, data: bytes, addr: Tuple) -> None:
+                server.queries['UDP'] += 1
+                response = server.answer(data, server.udp_max_size)
+                if response is not None:
+                    server._udp_transport.sendto(response, addr)
+
+        self._udp_transport, _ = await loop.create_datagram_endpoint(UDPProtocol, local_addr=(host, port))
+        host, port = self._udp_transport.get_extra_info('sockname')[:2]
+        self._tcp_server = await asyncio.start_server(self._handle_tcp, host, port)
+        return f"{host}:{port}"
+
+    async def _handle_tcp(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                length, = LENGTH_PREFIX.unpack(await reader.readexactly(LENGTH_PREFIX.size))
+                query = await reader.readexactly(length)
+                self.queries['TCP'] += 1
+                response = self.answer(query, None)
+                if response is None:
+                    break
+                writer.write(LENGTH_PREFIX.pack(len(response)) + response)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def close(self) -> None:
+        if self._udp_transport is not None:
+            self._udp_transport.close()
+        if self._tcp_server is not None:
+            self._tcp_server.close()
+            await self._tcp_server.wait_closed()
@@ -0,0 +1,273 @@
+from socket import AF_INET, AF_INET6, inet_ntop, inet_pton
+from struct import Struct
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+HEADER = Struct('!HHHHHH')
+RR_FIXED = Struct('!HHIH')
+QUESTION_FIXED = Struct('!HH')
+LENGTH_PREFIX = Struct('!H')
+SOA_FIXED = Struct('!IIIII')
+SRV_FIXED = Struct('!HHH')
+
+EDNS_PAYLOAD_SIZE = 1232  # DNS flag day 2020, avoids IP fragmentation
+
+TYPES = {
+    'A': 1, 'NS': 2, 'CNAME': 5, 'SOA': 6, 'PTR': 12, 'MX': 15, 'TXT': 16, 'AAAA': 28,
+    'SRV': 33, 'DNAME': 39, 'OPT': 41, 'DS': 43, 'DNSKEY': 48, 'CAA': 257,
+}
+TYPE_NAMES = {value: name for name, value in TYPES.items()}
+CLASS_NAMES = {1: 'IN', 3: 'CH', 4: 'HS', 255: 'ANY'}
+RCODE_NAMES = [
+    'NOERROR', 'FORMERR', 'SERVFAIL', 'NXDOMAIN', 'NOTIMP', 'REFUSED',
+    'YXDOMAIN', 'YXRRSET', 'NXRRSET', 'NOTAUTH', 'NOTZONE',
+]
+RCODES = {name: value for value, name in enumerate(RCODE_NAMES)}
+
+FLAG_QR = 0x8000
+FLAG_AA = 0x0400
+FLAG_TC = 0x0200
+FLAG_RD = 0x0100
+FLAG_RA = 0x0080
+FLAG_AD = 0x0020
+FLAG_CD = 0x0010
+# In the order massdns writes them
+FLAG_NAMES = (('aa', FLAG_AA), ('tc', FLAG_TC), ('rd', FLAG_RD), ('ra', FLAG_RA), ('ad', FLAG_AD), ('cd', FLAG_CD))
+
+_NAME_NEEDS_ESCAPE = frozenset(b'."\\ ();')
+_NAME_PLAIN_CHARS = bytes(char for char in range(33, 127) if char not in _NAME_NEEDS_ESCAPE)
+
+
+class DNSFormatError(ValueError):
+    pass
+
+
+class Response(NamedTuple):
+    id: int
+    flags: int
+    rcode: int
+    name: str
+    type: int
+    answers: List[Dict]
+    authorities: List[Dict]
+    additionals: List[Dict]
+
+    @property
+    def truncated(self) -> bool:
+        return bool(self.flags & FLAG_TC)
+
+    @property
+    def status(self) -> str:
+        return rcode_name(self.rcode)
+
+    @property
+    def flag_names(self) -> List[str]:
+        return [name for name, bit in FLAG_NAMES if self.flags & bit]
+
+
+def rcode_name(rcode: int) -> str:
+    return RCODE_NAMES[rcode] if rcode < len(RCODE_NAMES) else str(rcode)
+
+
+def type_name(rr_type: int) -> str:
+    return TYPE_NAMES.get(rr_type, f"TYPE{rr_type}")
+
+
+def encode_name(name: str) -> bytes:
+    """Uncompressed wire format of a domain name, with or without trailing dot."""
+    try:
+        labels = name.rstrip('.').encode('ascii').split(b'.') if name.rstrip('.') else []
+    except UnicodeEncodeError:
+        raise DNSFormatError(f"Non-ASCII name {name!r}, IDNs have to be given as A-labels") from None
+    parts = []
+    for label in labels:
+        if not 0 < len(label) < 64:
+            raise DNSFormatError(f"Invalid label in {name}")
+        parts.append(bytes((len(label),)) + label)
+    parts.append(b'\x00')
+    wire = b''.join(parts)
+    if len(wire) > 255:
+        raise DNSFormatError(f"Name too long: {name}")
+    return wire
+
+
+def encode_query(query_id: int, name: str, rr_type: int, recursion_desired: bool = True, edns: bool = True) -> bytes:
+    header = HEADER.pack(query_id, FLAG_RD if recursion_desired else 0, 1, 0, 0, 1 if edns else 0)
+    question = encode_name(name) + QUESTION_FIXED.pack(rr_type, 1)
+    if edns:
+        return header + question + b'\x00' + RR_FIXED.pack(TYPES['OPT'], EDNS_PAYLOAD_SIZE, 0, 0)
+    return header + question
+
+
+def with_query_id(query: bytes, query_id: int) -> bytes:
+    """A copy of an encoded query with another ID, so a query is encoded once for all its attempts."""
+    return query_id.to_bytes(2, 'big') + query[2:]
+
+
+def _escape_char(char: int) -> str:
+    if not 32 < char < 127:
+        return f"\\{char:03}"
+    return f"\\{chr(char)}" if char in _NAME_NEEDS_ESCAPE else chr(char)
+
+
+def _decode_name(data: bytes, offset: int) -> Tuple[str, int]:
+    """Name at offset as text with trailing dot, and the offset after it. Follows compression pointers."""
+    labels = []
+    end = None
+    jumps = 0
+    while True:
+        if offset >= len(data):
+            raise DNSFormatError('Name exceeds message')
+        length = data[offset]
+        if length & 0xC0 == 0xC0:
+            if offset + 1 >= len(data):
+                raise DNSFormatError('Truncated compression pointer')
+            if end is None:
+                end = offset + 2
+            jumps += 1
+            if jumps > 64:
+                raise DNSFormatError('Compression loop')
+            offset = ((length & 0x3F) << 8) | data[offset + 1]
+            continue
+        if length & 0xC0:
+            raise DNSFormatError('Unsupported label type')
+        offset += 1
+        if length == 0:
+            break
+        label = data[offset:offset + length]
+        if len(label) != length:
+            raise DNSFormatError('Label exceeds message')
+        if label.translate(None, _NAME_PLAIN_CHARS):  # Anything left needs escaping
+            labels.append(''.join(_escape_char(char) for char in label))
+        else:
+            labels.append(label.decode('ascii'))
+        offset += length
+    return '.'.join(labels) + '.', end if end is not None else offset
+
+
+def _character_strings(rdata: bytes) -> List[bytes]:
+    strings = []
+    offset = 0
+    while offset < len(rdata):
+        length = rdata[offset]
+        strings.append(rdata[offset + 1:offset + 1 + length])
+        offset += 1 + length
+    return strings
+
+
+def _decode_rdata(data: bytes, rr_type: int, offset: int, length: int) -> str:
+    """Presentation format of the record data, TXT strings are joined as the reports expect them."""
+    rdata = data[offset:offset + length]
+    if rr_type == 1 and length == 4:
+        return inet_ntop(AF_INET, rdata)
+    if rr_type == 28 and length == 16:
+        return inet_ntop(AF_INET6, rdata)
+    if rr_type in (2, 5, 12, 39):
+        return _decode_name(data, offset)[0]
+    if rr_type == 15 and length >= 3:
+        return f"{LENGTH_PREFIX.unpack_from(data, offset)[0]} {_decode_name(data, offset + 2)[0]}"
+    if rr_type == 16:
+        return b''.join(_character_strings(rdata)).decode('utf-8', errors='backslashreplace')
+    if rr_type == 6:
+        mname, position = _decode_name(data, offset)
+        rname, position = _decode_name(data, position)
+        if position + 20 <= offset + length:
+            serial, refresh, retry, expire, minimum = SOA_FIXED.unpack_from(data, position)
+            return f"{mname} {rname} {serial} {refresh} {retry} {expire} {minimum}"
+    if rr_type == 33 and length >= 7:
+        priority, weight, port = SRV_FIXED.unpack_from(data, offset)
+        return f"{priority} {weight} {port} {_decode_name(data, offset + 6)[0]}"
+    if rr_type == 257 and length >= 2:
+        tag_length = rdata[1]
+        tag = rdata[2:2 + tag_length].decode('ascii', errors='backslashreplace')
+        value = rdata[2 + tag_length:].decode('utf-8', errors='backslashreplace')
+        return f'{rdata[0]} {tag} "{value}"'
+    return f"\\# {length} {rdata.hex()}"  # RFC 3597
+
+
+def _decode_records(data: bytes, offset: int, count: int) -> Tuple[List[Dict], int]:
+    records = []
+    for _ in range(count):
+        name, offset = _decode_name(data, offset)
+        if offset + RR_FIXED.size > len(data):
+            raise DNSFormatError('Record exceeds message')
+        rr_type, rr_class, ttl, length = RR_FIXED.unpack_from(data, offset)
+        offset += RR_FIXED.size
+        if offset + length > len(data):
+            raise DNSFormatError('Record data exceeds message')
+        if rr_type != 41:  # The OPT pseudo record is not part of the output
+            records.append({
+                'ttl': ttl,
+                'type': type_name(rr_type),
+                'class': CLASS_NAMES.get(rr_class, f"CLASS{rr_class}"),
+                'name': name,
+                'data': _decode_rdata(data, rr_type, offset, length),
+            })
+        offset += length
+    return records, offset
+
+
+def decode_response(data: bytes) -> Response:
+    if len(data) < HEADER.size:
+        raise DNSFormatError('Message shorter than header')
+    query_id, flags, qd_count, an_count, ns_count, ar_count = HEADER.unpack_from(data)
+    offset = HEADER.size
+    name, rr_type = '', 0
+    for _ in range(qd_count):
+        name, offset = _decode_name(data, offset)
+        if offset + QUESTION_FIXED.size > len(data):
+            raise DNSFormatError('Question exceeds message')
+        rr_type, _ = QUESTION_FIXED.unpack_from(data, offset)
+        offset += QUESTION_FIXED.size
+    if flags & FLAG_TC:
+        # Sections of a truncated message may be cut anywhere, only the header counts
+        return Response(query_id, flags, flags & 0xF, name, rr_type, [], [], [])
+    answers, offset = _decode_records(data, offset, an_count)
+    authorities, offset = _decode_records(data, offset, ns_count)
+    additionals, offset = _decode_records(data, offset, ar_count)
+    return Response(query_id, flags, flags & 0xF, name, rr_type, answers, authorities, additionals)
+
+
+def decode_query(data: bytes) -> Tuple[int, int, str, int]:
+    """(id, flags, name, type) of a query, for the stand-in server."""
+    if len(data) < HEADER.size:
+        raise DNSFormatError('Message shorter than header')
+    query_id, flags, qd_count, _, _, _ = HEADER.unpack_from(data)
+    if qd_count != 1:
+        raise DNSFormatError('Expected exactly one question')
+    name, offset = _decode_name(data, HEADER.size)
+    rr_type, _ = QUESTION_FIXED.unpack_from(data, offset)
+    return query_id, flags, name, rr_type
+
+
+def encode_rdata(rr_type: int, value: str) -> bytes:
+    """Wire format of record data in presentation format, for the types the stand-in server serves."""
+    if rr_type == 1:
+        return inet_pton(AF_INET, value)
+    if rr_type == 28:
+        return inet_pton(AF_INET6, value)
+    if rr_type in (2, 5, 12, 39):
+        return encode_name(value)
+    if rr_type == 15:
+        preference, exchange = value.split(' ', 1)
+        return LENGTH_PREFIX.pack(int(preference)) + encode_name(exchange)
+    if rr_type == 16:
+        encoded = value.encode('utf-8')
+        chunks = [encoded[start:start + 255] for start in range(0, len(encoded), 255)] or [b'']
+        return b''.join(bytes((len(chunk),)) + chunk for chunk in chunks)
+    raise DNSFormatError(f"Unsupported type {type_name(rr_type)}")
+
+
+def encode_response(query_id: int, flags: int, name: str, rr_type: int, rcode: int,
+                    answers: List[Tuple[str, int, int, str]], max_size: Optional[int] = None) -> bytes:
+    """
+    Response with answers given as (name, type, ttl, data). If max_size is exceeded, the answers
+    are dropped and TC is set, as a server does over UDP.
+    """
+    question = encode_name(name) + QUESTION_FIXED.pack(rr_type, 1)
+    records = [encode_name(rr_name) + RR_FIXED.pack(rr_type_, 1, ttl, len(rdata)) + rdata
+               for rr_name, rr_type_, ttl, data in answers for rdata in [encode_rdata(rr_type_, data)]]
+    flags = FLAG_QR | FLAG_AA | (flags & FLAG_RD) | rcode
+    message = HEADER.pack(query_id, flags, 1, len(records), 0, 0) + question + b''.join(records)
+    if max_size is not None and len(message) > max_size:
+        return HEADER.pack(query_id, flags | FLAG_TC, 1, 0, 0, 0) + question
+    return message
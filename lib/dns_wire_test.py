@@ -0,0 +1,56 @@
+from unittest import TestCase, main
+from dns_wire import FLAG_RD, FLAG_TC, RCODES, TYPES, DNSFormatError, decode_query, decode_response, encode_name, encode_query, encode_response, \
+    with_query_id
+
+
+class Test(TestCase):
+    def test_encode_name(self):
+        self.assertEqual(b'\x07example\x02de\x00', encode_name('example.de.'))
+        self.assertEqual(b'\x00', encode_name('.'))
+        with self.assertRaises(DNSFormatError):
+            encode_name('a' * 64 + '.de')
+        with self.assertRaises(DNSFormatError):
+            encode_name('bücher.de')
+        with self.assertRaises(DNSFormatError):
+            encode_name('.'.join(['a' * 63] * 4))
+
+    def test_query(self):
+        query = encode_query(4711, '_dmarc.example.de', TYPES['TXT'])
+        self.assertEqual((4711, FLAG_RD, '_dmarc.example.de.', TYPES['TXT']), decode_query(query))
+        self.assertEqual((42, FLAG_RD, '_dmarc.example.de.', TYPES['TXT']), decode_query(with_query_id(query, 42)))
+
+    def test_response(self):
+        answers = [
+            ('example.de.', TYPES['MX'], 300, '10 mx.example.de.'),
+            ('example.de.', TYPES['TXT'], 60, 'v=spf1 ' + 'a' * 300),
+            ('example.de.', TYPES['A'], 60, '192.0.2.1'),
+            ('example.de.', TYPES['AAAA'], 60, '2001:db8::1'),
+        ]
+        response = decode_response(encode_response(1, FLAG_RD, 'example.de.', TYPES['MX'], RCODES['NOERROR'], answers))
+        self.assertEqual(('NOERROR', ['aa', 'rd'], False), (response.status, response.flag_names, response.truncated))
+        self.assertEqual(['10 mx.example.de.', 'v=spf1 ' + 'a' * 300, '192.0.2.1', '2001:db8::1'], [answer['data'] for answer in response.answers])
+        self.assertEqual({'ttl': 300, 'type': 'MX', 'class': 'IN', 'name': 'example.de.', 'data': '10 mx.example.de.'}, response.answers[0])
+
+        truncated = decode_response(encode_response(1, 0, 'example.de.', TYPES['TXT'], 0, answers, max_size=100))
+        self.assertTrue(truncated.flags & FLAG_TC)
+        self.assertEqual([], truncated.answers)
+        self.assertEqual('NXDOMAIN', decode_response(encode_response(1, 0, 'x.de.', 1, RCODES['NXDOMAIN'], [])).status)
+
+    def test_compression(self):
+        # Answer name and CNAME target point back into the question
+        header = bytes.fromhex('000181800001000100000000')
+        question = b'\x03www\x07example\x02de\x00' + bytes.fromhex('00050001')
+        answer = bytes.fromhex('c00c0005000100000e100006') + b'\x03cnm\xc0\x10'
+        message = header + question + answer
+        response = decode_response(message)
+        self.assertEqual('www.example.de.', response.answers[0]['name'])
+        self.assertEqual('cnm.example.de.', response.answers[0]['data'])
+        with self.assertRaises(DNSFormatError):
+            decode_response(message[:-3])
+        loop = bytes.fromhex('000181800001000000000000c00c00010001')
+        with self.assertRaises(DNSFormatError):
+            decode_response(loop)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+from collections import Counter, defaultdict
+from json import dumps, loads
+from pathlib import Path
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from lib.dmarc import parse_dmarc_diagnostic
+from lib.dmarc_domains import OUTCOME_VALID, evaluate_domain
+from lib.spf import parse_spf, spf_records
+from lib.util import get_org_domain
+
+SUMMARY_TABLE_HEADER = '#domain\tmx\tspf_all\tdmarc\tpolicy\tpct\tri\texplicit\tvalid\twarnings\tdns_error'
+
+# Requests joined per org domain
+KIND_MX = 'MX'
+KIND_SPF = 'SPF'  # TXT at the org domain
+KIND_DMARC = 'DMARC'  # TXT at _dmarc.<org domain>
+
+# spf_all, besides the all mechanism with its qualifier ('-all', '~all', '?all', '+all')
+SPF_NONE = ''  # No v=spf1 record
+SPF_NO_ALL = 'no_all'  # A record without all mechanism, e.g. ending in a redirect
+SPF_MULTIPLE = 'multiple'  # More than one v=spf1 record, a permerror (RFC 7208, section 4.5)
+
+DMARC_NOT_REQUESTED = 'not_requested'
+
+# DMARC tags in the order of the bits of the explicit and valid bitmasks
+DMARC_FLAG_TAGS = ('v', 'p', 'sp', 'adkim', 'aspf', 'fo', 'pct', 'rf', 'ri', 'rua', 'ruf')
+
+ERROR_TIMEOUT = 'TIMEOUT'  # Status of an attempt without answer
+DEFINITIVE_STATUSES = {'NOERROR', 'NXDOMAIN'}
+
+# (kind, status, sorted record data) of a single attempt
+Observation = Tuple[str, str, Tuple[str, ...]]
+
+
+class DomainSummary(NamedTuple):
+    """
+    Mail configuration of one org domain, joined from its MX, TXT and _dmarc TXT results.
+
+    pct and ri are -1 unless the DMARC record is valid. explicit and valid are bitmasks over
+    DMARC_FLAG_TAGS, warnings is the bitset of parse_dmarc_diagnostic. dns_error is empty if every
+    request got a definitive answer, 'NXDOMAIN' if the domain does not exist, otherwise the most
+    frequent failure of the first unanswered request.
+    """
+    domain: str
+    mx: int = 0  # Records in the MX RRset
+    spf_all: str = SPF_NONE
+    dmarc: str = DMARC_NOT_REQUESTED  # Outcome of evaluate_domain
+    policy: str = ''
+    pct: int = -1
+    ri: int = -1
+    explicit: int = 0
+    valid: int = 0
+    warnings: int = 0
+    dns_error: str = ''
+
+    @property
+    def has_mx(self) -> bool:
+        return self.mx > 0
+
+    def to_line(self) -> str:
+        return '\t'.join([
+            self.domain, str(self.mx), self.spf_all, self.dmarc, self.policy, str(self.pct), str(self.ri),
+            f"{self.explicit:x}", f"{self.valid:x}", f"{self.warnings:x}", self.dns_error
+        ])
+
+    @classmethod
+    def from_line(cls, line: str) -> 'DomainSummary':
+        domain, mx, spf_all, dmarc, policy, pct, ri, explicit, valid, warnings, dns_error = \
+            line.removesuffix('\n').split('\t')
+        return cls(domain, int(mx), spf_all, dmarc, policy, int(pct), int(ri), int(explicit, 16), int(valid, 16),
+                   int(warnings, 16), dns_error)
+
+
+def summary_observation(doc: Dict) -> Optional[Tuple[str, str]]:
+    """
+    Org domain and compact spill line of a massdns result, None for requests that do not take
+    part in the join (e.g. TXT of other subdomains).
+    """
+    name = doc['name'].lower().removesuffix('.')
+    org_domain = get_org_domain(name)
+    if doc['type'] == 'MX' and name == org_domain:
+        kind = KIND_MX
+    elif doc['type'] == 'TXT' and name == org_domain:
+        kind = KIND_SPF
+    elif doc['type'] == 'TXT' and name == f"_dmarc.{org_domain}":
+        kind = KIND_DMARC
+    else:
+        return None
+    answers = doc.get('data', {}).get('answers', [])
+    data = sorted({answer['data'] for answer in answers if answer.get('type') == doc['type'] and 'data' in answer})
+    status = ERROR_TIMEOUT if 'error' in doc else doc.get('status', '')
+    return org_domain, dumps([org_domain, kind, status, data])
+
+
+def parse_summary_observation(line: str) -> Tuple[str, Observation]:
+    domain, kind, status, data = loads(line)
+    return domain, (kind, status, tuple(data))
+
+
+def consensus_rrset(observations: List[Tuple[str, Tuple[str, ...]]]) -> Tuple[str, ...]:
+    """The most frequent non-empty RRset of the NOERROR attempts, as in evaluate_domain()."""
+    answered = Counter(data for status, data in observations if status == 'NOERROR' and data)
+    if not answered:
+        return ()
+    return min(answered.items(), key=lambda item: (-item[1], item[0]))[0]
+
+
+def spf_all_mechanism(txts: Tuple[str, ...]) -> str:
+    """The all mechanism of the single SPF record among the TXT records of a domain."""
+    records = spf_records(txts)
+    if not records:
+        return SPF_NONE
+    if len(records) > 1:
+        return SPF_MULTIPLE
+    return parse_spf(records[0]).all_mechanism or SPF_NO_ALL
+
+
+def failure_class(observations: List[Tuple[str, Tuple[str, ...]]]) -> str:
+    """'' if any attempt got a definitive answer, otherwise the most frequent failure."""
+    statuses = Counter(status for status, _ in observations)
+    if any(status in DEFINITIVE_STATUSES for status in statuses):
+        return ''
+    return min(statuses.items(), key=lambda item: (-item[1], item[0]))[0]
+
+
+def evaluate_summary(domain: str, observations: List[Observation]) -> DomainSummary:
+    by_kind: Dict[str, List[Tuple[str, Tuple[str, ...]]]] = defaultdict(list)
+    for kind, status, data in observations:
+        by_kind[kind].append((status, data))
+
+    fields = {
+        'mx': len(consensus_rrset(by_kind[KIND_MX])),
+        'spf_all': spf_all_mechanism(consensus_rrset(by_kind[KIND_SPF])),
+    }
+
+    if by_kind[KIND_DMARC]:
+        result = evaluate_domain(domain, by_kind[KIND_DMARC])
+        fields['dmarc'] = result.outcome
+        fields['warnings'] = result.warnings
+        if result.outcome == OUTCOME_VALID:
+            record, _ = parse_dmarc_diagnostic(result.record)
+            fields['policy'] = result.policy
+            fields['pct'] = result.pct
+            fields['ri'] = record.ri.value if record.ri.valid else -1
+            for bit, tag in enumerate(DMARC_FLAG_TAGS):
+                value = getattr(record, tag)
+                fields['explicit'] = fields.get('explicit', 0) | (value.explicit << bit)
+                fields['valid'] = fields.get('valid', 0) | (value.valid << bit)
+
+    org_statuses = {status for kind in (KIND_MX, KIND_SPF) for status, _ in by_kind[kind]}
+    if 'NXDOMAIN' in org_statuses and 'NOERROR' not in org_statuses:
+        fields['dns_error'] = 'NXDOMAIN'
+    else:
+        for kind in (KIND_MX, KIND_SPF, KIND_DMARC):
+            error = failure_class(by_kind[kind]) if by_kind[kind] else ''
+            if error:
+                fields['dns_error'] = error
+                break
+    return DomainSummary(domain, **fields)
+
+
+def dmarc_tag_bits(*tags: str) -> int:
+    """Bits of the tags in the explicit and valid bitmasks."""
+    return sum(1 << DMARC_FLAG_TAGS.index(tag) for tag in set(tags))
+
+
+def read_summary_table(file_path: Path) -> Iterator[DomainSummary]:
+    """Yields the rows of a summary table written by 05_join_domains.py, sorted by domain."""
+    with open(file_path, mode='rt', encoding='utf-8') as fp:
+        for line in fp:
+            if not line.startswith('#'):
+                yield DomainSummary.from_line(line)
@@ -0,0 +1,48 @@
+from unittest import TestCase, main
+from domain_summary import (DMARC_FLAG_TAGS, DMARC_NOT_REQUESTED, KIND_DMARC, KIND_MX, KIND_SPF, SPF_MULTIPLE,
+                            SPF_NO_ALL, SPF_NONE, DomainSummary, evaluate_summary, parse_summary_observation,
+                            spf_all_mechanism, summary_observation)
+
+RECORD = 'v=DMARC1; p=reject; pct=50; ri=3600; rua=mailto:a@example.de'
+
+
+class Test(TestCase):
+    def test_summary_observation(self):
+        doc = {'name': 'Example.de.', 'type': 'MX', 'status': 'NOERROR', 'data': {'answers': [
+            {'type': 'MX', 'data': '10 mx2.example.de.'}, {'type': 'MX', 'data': '5 mx1.example.de.'}]}}
+        domain, line = summary_observation(doc)
+        self.assertEqual('example.de', domain)
+        self.assertEqual(('example.de', (KIND_MX, 'NOERROR', ('10 mx2.example.de.', '5 mx1.example.de.'))),
+                         parse_summary_observation(line))
+        self.assertEqual((KIND_DMARC, 'TIMEOUT', ()), parse_summary_observation(
+            summary_observation({'name': '_dmarc.example.de.', 'type': 'TXT', 'error': 'timeout'})[1])[1])
+        self.assertIsNone(summary_observation({'name': 'www.example.de.', 'type': 'TXT', 'status': 'NOERROR'}))
+
+    def test_spf_all_mechanism(self):
+        self.assertEqual('-all', spf_all_mechanism(('v=spf1 mx -all', 'google-site-verification=x')))
+        self.assertEqual('~all', spf_all_mechanism(('v=spf1 include:_spf.example.de ~ALL',)))
+        self.assertEqual(SPF_NO_ALL, spf_all_mechanism(('v=spf1 redirect=_spf.example.de',)))
+        self.assertEqual(SPF_MULTIPLE, spf_all_mechanism(('v=spf1 -all', 'v=spf1 ~all')))
+        self.assertEqual(SPF_NONE, spf_all_mechanism(('v=spf10 -all',)))
+
+    def test_evaluate_summary(self):
+        summary = evaluate_summary('example.de', [
+            (KIND_MX, 'NOERROR', ('10 mx.example.de.',)),
+            (KIND_SPF, 'TIMEOUT', ()),
+            (KIND_SPF, 'NOERROR', ('v=spf1 mx -all',)),
+            (KIND_DMARC, 'NOERROR', (RECORD,)),
+        ])
+        self.assertEqual((1, '-all', 'valid', 'reject', 50, 3600, ''), summary[1:7] + (summary.dns_error,))
+        explicit = {tag for bit, tag in enumerate(DMARC_FLAG_TAGS) if summary.explicit >> bit & 1}
+        self.assertEqual({'v', 'p', 'pct', 'ri', 'rua'}, explicit)
+        self.assertEqual(2 ** len(DMARC_FLAG_TAGS) - 1, summary.valid)
+        self.assertEqual(summary, DomainSummary.from_line(summary.to_line()))
+
+        failed = evaluate_summary('a.de', [(KIND_MX, 'SERVFAIL', ()), (KIND_MX, 'TIMEOUT', ()), (KIND_MX, 'SERVFAIL', ())])
+        self.assertEqual((0, SPF_NONE, DMARC_NOT_REQUESTED, 'SERVFAIL'), (failed.mx, failed.spf_all, failed.dmarc, failed.dns_error))
+        missing = evaluate_summary('b.de', [(KIND_MX, 'NXDOMAIN', ()), (KIND_DMARC, 'NXDOMAIN', ())])
+        self.assertEqual(('nxdomain', 'NXDOMAIN'), (missing.dmarc, missing.dns_error))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+import heapq
+from contextlib import ExitStack
+from pathlib import Path
+from typing import Iterable, Iterator, List
+
+from lib.sketches import hash64
+
+RUN_SIZE = 2_000_000  # Lines held in memory per sorted run
+
+
+def _write_run(lines: List[str], run_path: Path) -> None:
+    lines.sort()
+    with open(run_path, mode='wt', encoding='utf-8') as fp:
+        for line in lines:
+            fp.write(f"{line}\n")
+
+
+def write_sorted_runs(lines: Iterable[str], run_dir: Path, prefix: str, run_size: int = RUN_SIZE,
+                      dedupe: bool = True) -> List[Path]:
+    """
+    Splits lines into sorted run files of at most run_size lines each.
+    Lines must not contain a newline. With dedupe, duplicates within a run are dropped early.
+
+    Returns:
+        The paths of the run files, in the order they were written.
+    """
+    run_paths: List[Path] = []
+    buffer = set() if dedupe else []
+    add = buffer.add if dedupe else buffer.append
+    for line in lines:
+        add(line)
+        if len(buffer) >= run_size:
+            run_path = run_dir / f"{prefix}-{len(run_paths):05}.run"
+            _write_run(list(buffer), run_path)
+            run_paths.append(run_path)
+            buffer.clear()
+    if buffer:
+        run_path = run_dir / f"{prefix}-{len(run_paths):05}.run"
+        _write_run(list(buffer), run_path)
+        run_paths.append(run_path)
+    return run_paths
+
+
+def merge_runs(run_paths: List[Path], dedupe: bool = True) -> Iterator[str]:
+    """k-way merge of sorted run files, yielding lines in sorted order (without newline)."""
+    with ExitStack() as stack:
+        iterators = []
+        for run_path in run_paths:
+            fp = stack.enter_context(open(run_path, mode='rt', encoding='utf-8'))
+            iterators.append(line.removesuffix('\n') for line in fp)
+        previous = None
+        for line in heapq.merge(*iterators):
+            if dedupe and line == previous:
+                continue
+            previous = line
+            yield line
+
+
+def write_shuffled_runs(lines: Iterable[str], run_dir: Path, seed: int, run_size: int = RUN_SIZE) -> List[Path]:
+    """
+    First half of a memory-bounded shuffle: runs sorted by a seeded hash of each line.
+
+    Sorting by the hash is a random permutation for a given seed, and duplicates still end up next
+    to each other, so merge_shuffled_runs() deduplicates for free.
+    """
+    keyed = (f"{hash64(f'{seed}:{line}'):016x}\t{line}" for line in lines)
+    return write_sorted_runs(keyed, run_dir, 'shuffle', run_size)
+
+
+def merge_shuffled_runs(run_paths: List[Path]) -> Iterator[str]:
+    for line in merge_runs(run_paths):
+        yield line.split('\t', 1)[1]
@@ -0,0 +1,36 @@
+import random
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase, main
+from external_sort import write_sorted_runs, merge_runs, write_shuffled_runs, merge_shuffled_runs
+
+
+class Test(TestCase):
+    def test_sort_dedupe(self):
+        values = [f"{random.randint(0, 500)}.de" for _ in range(2_000)]
+        with TemporaryDirectory() as tmp:
+            runs = write_sorted_runs(values[:1_000], Path(tmp), 'a', run_size=100)
+            runs += write_sorted_runs(values[1_000:], Path(tmp), 'b', run_size=100)
+            self.assertGreater(len(runs), 2)
+            self.assertEqual(sorted(set(values)), list(merge_runs(runs)))
+
+    def test_sort_keep_duplicates(self):
+        values = ['b', 'a', 'b', 'c', 'a']
+        with TemporaryDirectory() as tmp:
+            runs = write_sorted_runs(values, Path(tmp), 'a', run_size=2, dedupe=False)
+            self.assertEqual(sorted(values), list(merge_runs(runs, dedupe=False)))
+
+    def test_shuffle(self):
+        values = [f"{i % 300}.de" for i in range(1_000)]
+        with TemporaryDirectory() as tmp:
+            shuffled = list(merge_shuffled_runs(write_shuffled_runs(values, Path(tmp), 1, run_size=100)))
+            again = list(merge_shuffled_runs(write_shuffled_runs(reversed(values), Path(tmp), 1, run_size=70)))
+            other = list(merge_shuffled_runs(write_shuffled_runs(values, Path(tmp), 2)))
+        self.assertEqual(sorted(set(values)), sorted(shuffled))
+        self.assertEqual(shuffled, again)
+        self.assertNotEqual(shuffled, other)
+        self.assertNotEqual(sorted(shuffled), shuffled)
+
+
+if __name__ == '__main__':
+    main()
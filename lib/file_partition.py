@@ -1,5 +1,7 @@
+import mmap
 import struct
-from time import time
+from concurrent.futures import Executor
+from itertools import accumulate, chain, repeat
 from typing import List, Iterable, Optional, Tuple
 from pathlib import Path
 from lib.util import log
@@ -10,6 +12,8 @@ LENGTH_SIZE = struct.calcsize(LENGTH_FORMAT)
 LENGTH_MAX_VALUE = 2 ** (LENGTH_SIZE * 8) - 1
 PARTITION_LENGTH = 500  # Number of lines
 PARTITION_FILE_EXTENSION = '.partition'
+INDEX_RANGE_SIZE = 64 * 1024 * 1024  # Bytes per parallel indexing task
+READ_BLOCK_SIZE = 16 * 1024 * 1024
 
 
 class FilePartition:
@@ -17,47 +21,114 @@ class FilePartition:
         self.file_path = file_path
         self.descriptor = descriptor
 
-    def get_io(self) -> TextIOWrapper:
+    def read_bytes(self) -> bytes:
         chunk_start, chunk_length = self.descriptor
         with open(self.file_path, mode='rb') as fp:
             fp.seek(chunk_start)
-            chunk = fp.read(chunk_length)
-        b = BytesIO(chunk)
+            return fp.read(chunk_length)
+
+    def get_io(self) -> TextIOWrapper:
+        b = BytesIO(self.read_bytes())
         return TextIOWrapper(b, encoding='utf-8')
 
-def _generate_partition_file(file_path: Path) -> None:
-    assert file_path.exists(), f"Input file not found: {file_path}"
-    log(f"Generating partition file for {file_path}...")
-    partition_file = file_path.parent / (file_path.stem + PARTITION_FILE_EXTENSION)
-    chunk_lengths: List[int] = []
-    current_chunk_start_pos = 0
+def _count_newlines(file_path: Path, start: int, end: int) -> int:
+    count = 0
+    with open(file_path, mode='rb') as fp:
+        fp.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            block = fp.read(min(READ_BLOCK_SIZE, remaining))
+            if not block:
+                break
+            count += block.count(b'\n')
+            remaining -= len(block)
+    return count
+
 
-    with open(file_path, 'rb') as fp:
-        assert fp.seekable(), "Input file must be seekable."
+def _index_range(file_path: Path, start: int, end: int, first_line: int) -> Tuple[int, List[int]]:
+    """
+    Newlines in [start, end) and the offsets right after every one of them that completes a
+    partition, given that first_line lines precede start. Both come from one loop over the mapping.
+    """
+    ends: List[int] = []
+    count = 0
+    with open(file_path, mode='rb') as fp, mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        find = mm.find
+        pos = start
+        remaining = PARTITION_LENGTH - first_line % PARTITION_LENGTH
         while True:
-            for _ in range(PARTITION_LENGTH):
-                line = fp.readline()
-                if not line:
-                    break
-            current_pos = fp.tell()
-            chunk_size = current_pos - current_chunk_start_pos
-            assert chunk_size >= 0, "Unexpected end of file while reading partition."
-            assert chunk_size < LENGTH_MAX_VALUE, "Partition file is too large."
-            current_chunk_start_pos = current_pos
-            chunk_lengths.append(chunk_size)
-            if not line:
-                break
+            for _ in range(remaining):
+                pos = find(b'\n', pos, end)
+                if pos < 0:
+                    return count, ends
+                pos += 1
+                count += 1
+            ends.append(pos)
+            remaining = PARTITION_LENGTH
+
+
+def index_file(file_path: Path, executor: Optional[Executor] = None) -> Tuple[int, List[int]]:
+    """
+    Counts the lines of a file and computes its partition chunk lengths.
+
+    Without executor, or for files up to INDEX_RANGE_SIZE, lines are counted and partition
+    boundaries located in a single loop over the mapped file. Larger files are split into byte
+    ranges indexed in parallel with two passes: the newlines of all ranges are counted first,
+    which gives every range its first line number, then the partition boundaries are located.
+
+    Returns:
+        Tuple of the line count and the chunk lengths as stored in the partition file.
+    """
+    assert file_path.exists(), f"Input file not found: {file_path}"
+    size = file_path.stat().st_size
+    if size == 0:
+        return 0, []
+
+    ranges = [(start, min(start + INDEX_RANGE_SIZE, size)) for start in range(0, size, INDEX_RANGE_SIZE)]
+    if len(ranges) == 1 or executor is None:
+        newlines, partition_ends = _index_range(file_path, 0, size, 0)
+    else:
+        counts = list(executor.map(_count_newlines, repeat(file_path), *zip(*ranges)))
+        first_lines = list(accumulate(counts, initial=0))[:-1]
+        indexes = executor.map(_index_range, repeat(file_path), *zip(*ranges), first_lines)
+        newlines = sum(counts)
+        partition_ends = list(chain.from_iterable(ends for _, ends in indexes))
+
+    with open(file_path, mode='rb') as fp:
+        fp.seek(size - 1)
+        unterminated = fp.read(1) != b'\n'
+    line_count = newlines + (1 if unterminated else 0)
+
+    if not partition_ends or partition_ends[-1] != size:
+        partition_ends.append(size)
+    chunk_lengths = [end - start for start, end in zip([0] + partition_ends, partition_ends)]
+    return line_count, chunk_lengths
+
+
+def get_partition_file(file_path: Path) -> Path:
+    return file_path.parent / (file_path.stem + PARTITION_FILE_EXTENSION)
+
 
+def write_partition_file(file_path: Path, chunk_lengths: List[int]) -> None:
+    partition_file = get_partition_file(file_path)
     with open(partition_file, 'wb') as fp:
         fp.write(struct.pack(LENGTH_FORMAT, len(chunk_lengths)))
         for length in chunk_lengths:
+            assert length < LENGTH_MAX_VALUE, "Partition file is too large."
             fp.write(struct.pack(LENGTH_FORMAT, length))
+
+
+def _generate_partition_file(file_path: Path) -> None:
+    assert file_path.exists(), f"Input file not found: {file_path}"
+    log(f"Generating partition file for {file_path}...")
+    _, chunk_lengths = index_file(file_path)
+    write_partition_file(file_path, chunk_lengths)
     log(f"Partition file generated for {file_path}.")
 
 
 def to_partition_descriptions(file_path: Path) -> Iterable[FilePartition]:
     assert file_path.exists(), f"Input file not found: {file_path}"
-    partition_file = file_path.parent / (file_path.stem + PARTITION_FILE_EXTENSION)
+    partition_file = get_partition_file(file_path)
     if not partition_file.exists() or file_path.stat().st_mtime > partition_file.stat().st_mtime:
         _generate_partition_file(file_path)
 
@@ -79,3 +150,22 @@ def to_partition_descriptions(file_path: Path) -> Iterable[FilePartition]:
     for chunk_length in chunk_lengths:
         yield FilePartition(file_path, (current_pos, chunk_length))
         current_pos += chunk_length
+
+
+def coalesce_partitions(partitions: Iterable[FilePartition], target_size: int = READ_BLOCK_SIZE) -> List[FilePartition]:
+    """Joins adjacent partitions into ones of at least target_size bytes, for tasks working on whole buffers."""
+    result: List[FilePartition] = []
+    start, length = None, 0
+    file_path = None
+    for partition in partitions:
+        chunk_start, chunk_length = partition.descriptor
+        if start is None:
+            file_path, start, length = partition.file_path, chunk_start, 0
+        assert partition.file_path == file_path and chunk_start == start + length, "Partitions must be adjacent"
+        length += chunk_length
+        if length >= target_size:
+            result.append(FilePartition(file_path, (start, length)))
+            start = None
+    if start is not None and length:
+        result.append(FilePartition(file_path, (start, length)))
+    return result
@@ -0,0 +1,48 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase, main
+import file_partition
+from file_partition import (index_file, write_partition_file, to_partition_descriptions, coalesce_partitions,
+                            PARTITION_LENGTH)
+
+
+class Test(TestCase):
+    def test_index_file(self):
+        with TemporaryDirectory() as tmp:
+            path = Path(tmp) / 'domains.txt'
+            lines = [f"{'a' * (i % 7 + 1)}.de\n" for i in range(PARTITION_LENGTH * 3 + 17)]
+            path.write_text(''.join(lines), encoding='utf-8')
+            line_count, chunk_lengths = index_file(path)
+            self.assertEqual(len(lines), line_count)
+            self.assertEqual(4, len(chunk_lengths))
+            self.assertEqual(sum(len(line) for line in lines[:PARTITION_LENGTH]), chunk_lengths[0])
+            self.assertEqual(path.stat().st_size, sum(chunk_lengths))
+
+            # Small ranges force the two-phase parallel path
+            file_partition.INDEX_RANGE_SIZE = 1000
+            try:
+                with ThreadPoolExecutor() as executor:
+                    self.assertEqual((line_count, chunk_lengths), index_file(path, executor))
+            finally:
+                file_partition.INDEX_RANGE_SIZE = 64 * 1024 * 1024
+
+            write_partition_file(path, chunk_lengths)
+            read_lines = [line for partition in to_partition_descriptions(path) for line in partition.get_io()]
+            self.assertEqual(lines, read_lines)
+
+            coalesced = coalesce_partitions(to_partition_descriptions(path), chunk_lengths[0] * 2)
+            self.assertEqual(2, len(coalesced))
+            self.assertEqual(''.join(lines).encode('utf-8'), b''.join(partition.read_bytes() for partition in coalesced))
+
+    def test_index_file_unterminated(self):
+        with TemporaryDirectory() as tmp:
+            path = Path(tmp) / 'domains.txt'
+            path.write_text('a.de\nb.de', encoding='utf-8')
+            self.assertEqual((2, [9]), index_file(path))
+            path.write_text('', encoding='utf-8')
+            self.assertEqual((0, []), index_file(path))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+import re
+from itertools import product
+from string import ascii_lowercase, digits
+from typing import Iterator, List, Optional
+
+LETTERS = ascii_lowercase
+LDH_ALPHABET = '-' + digits + ascii_lowercase  # In ASCII order, so labels come out sorted
+MAX_LABEL_LENGTH = 63
+TAIL_LENGTH = 2  # Trailing characters expanded per block, a block holds about len(alphabet) ** TAIL_LENGTH labels
+
+# RFC 5891, section 4.2.3.1: hyphens in the third and fourth position are reserved (e.g. xn--)
+ldh_label_regex = re.compile(r"^(?!..--)[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?$")
+
+
+def is_ldh_label(label: str) -> bool:
+    return ldh_label_regex.match(label) is not None
+
+
+# Part of an A-label after xn--, within the label length limit and without trailing hyphen
+PUNYCODE_PATTERN = rb"[a-z0-9](?:[a-z0-9-]{0,57}[a-z0-9])?"
+# LDH label for validation, A-labels (xn--) are the one exception to the reserved hyphens
+DOMAIN_LABEL_PATTERN = rb"(?:xn--" + PUNYCODE_PATTERN + rb"|(?!..--)[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?)"
+
+
+def invalid_line_regex(tld: str) -> re.Pattern:
+    """
+    Matches every non-empty line of a lowercased buffer which is not a valid '<label>.<tld>' name.
+
+    Used with finditer over whole buffers: the regex engine skips valid lines without returning
+    to Python, so the cost per valid line stays in C.
+    """
+    valid = DOMAIN_LABEL_PATTERN + rb"\." + re.escape(tld.encode('ascii'))
+    return re.compile(rb"^(?!" + valid + rb"\r?$|\r?$).*$", re.MULTILINE)
+
+
+def a_label_line_regex(tld: str) -> re.Pattern:
+    """
+    Matches lines '<xn--label>.<tld>' of a buffer, group 1 is the punycode part of the label. Only
+    lines that invalid_line_regex() lets pass match, so no line is reported by both.
+    """
+    return re.compile(rb"^xn--(" + PUNYCODE_PATTERN + rb")\." + re.escape(tld.encode('ascii')) + rb"\r?$", re.MULTILINE)
+
+
+def is_punycode(encoded: str) -> bool:
+    """If the part after xn-- decodes to a label that is not plain ASCII (RFC 3492)."""
+    try:
+        return not encoded.encode('ascii').decode('punycode').isascii()
+    except UnicodeError:
+        return False
+
+
+def to_a_label_domain(name: str) -> Optional[str]:
+    """
+    Converts a domain with U-labels (e.g. müller.de) to A-labels, or None if not possible.
+
+    Uses the IDNA 2003 codec of the standard library, which differs from IDNA 2008 for a few
+    characters like ß, so the result is a close approximation for registry data.
+    """
+    try:
+        return name.encode('idna').decode('ascii')
+    except UnicodeError:
+        return None
+
+
+def invalid_domain_reason(name: str, tld: str) -> Optional[str]:
+    """Reason why a name is not a valid '<label>.<tld>' LDH name, or None if it is valid."""
+    label, dot, suffix = name.rpartition('.')
+    if not dot or suffix != tld:
+        return 'wrong tld'
+    if '.' in label:
+        return 'not a second-level name'
+    if not label:
+        return 'empty label'
+    if not label.isascii():
+        return 'non-ascii'
+    if len(label) > MAX_LABEL_LENGTH:
+        return 'label too long'
+    if label[0] == '-' or label[-1] == '-':
+        return 'leading or trailing hyphen'
+    if any(char not in LDH_ALPHABET for char in label):
+        return 'invalid characters'
+    if label.startswith('xn--'):
+        return None if is_punycode(label[4:]) else 'invalid punycode'
+    if label[2:4] == '--':
+        return 'reserved hyphens'
+    return None
+
+
+def label_shards(alphabet: str = LDH_ALPHABET) -> List[str]:
+    """First characters a label can start with, one shard each."""
+    return sorted(set(alphabet) - {'-'})
+
+
+def label_blocks(length: int, alphabet: str = LDH_ALPHABET, shard: str = '', suffix: str = '') -> Iterator[List[str]]:
+    """
+    Yields all LDH labels of the given length built from alphabet, in lexicographic order.
+
+    Labels neither start nor end with a hyphen and have no hyphens in the reserved third and fourth
+    position. Only labels starting with shard are generated, so the keyspace can be split across
+    processes. Each label has suffix appended (e.g. '.de\\n'), and blocks are lists of labels
+    sharing everything but the last TAIL_LENGTH characters, to keep the per-label overhead low.
+    """
+    assert 1 <= length <= MAX_LABEL_LENGTH, f"Label length must be between 1 and {MAX_LABEL_LENGTH}"
+    inner = ''.join(sorted(set(alphabet)))
+    edge = inner.replace('-', '')
+    if length == 1:
+        yield [f"{char}{suffix}" for char in edge if char.startswith(shard)]
+        return
+
+    tail_length = min(TAIL_LENGTH, length - 1)
+    head_length = length - tail_length
+    assert len(shard) <= head_length, f"Shard '{shard}' is longer than the head of {head_length} characters"
+    if shard and (shard[0] not in edge or any(char not in inner for char in shard)):
+        return
+
+    tails = [f"{''.join(middle)}{last}{suffix}" for middle in product(inner, repeat=tail_length - 1) for last in edge]
+    check_reserved = '-' in inner and length >= 4
+    for start in [shard] if shard else edge:
+        for rest in product(inner, repeat=head_length - len(start)):
+            head = f"{start}{''.join(rest)}"
+            if check_reserved and len(head) >= 4:
+                if head[2:4] == '--':
+                    continue
+                yield list(map(head.__add__, tails))
+            elif check_reserved:
+                yield [label for label in map(head.__add__, tails) if label[2:4] != '--']
+            else:
+                yield list(map(head.__add__, tails))
@@ -0,0 +1,62 @@
+from itertools import chain, product
+from unittest import TestCase, main
+from hostname import LDH_ALPHABET, LETTERS, a_label_line_regex, invalid_domain_reason, invalid_line_regex, is_ldh_label, \
+    is_punycode, label_blocks, label_shards, to_a_label_domain
+
+
+def labels(length: int, alphabet: str, shard: str = '') -> list:
+    return list(chain.from_iterable(label_blocks(length, alphabet, shard)))
+
+
+class Test(TestCase):
+    def test_is_ldh_label(self):
+        for label in ['a', 'a-b', '0', 'xn-a', 'a' * 63]:
+            self.assertTrue(is_ldh_label(label), label)
+        for label in ['', '-a', 'a-', 'ab--c', 'A', 'a_b', 'a' * 64]:
+            self.assertFalse(is_ldh_label(label), label)
+
+    def test_label_blocks(self):
+        for length in range(1, 6):
+            alphabet = LDH_ALPHABET if length < 4 else 'a1-'
+            expected = [label for label in map(''.join, product(sorted(alphabet), repeat=length)) if is_ldh_label(label)]
+            self.assertEqual(expected, labels(length, alphabet))
+            self.assertEqual(expected, list(chain.from_iterable(labels(length, alphabet, shard) for shard in label_shards(alphabet))))
+        self.assertEqual(26 ** 3, len(labels(3, LETTERS)))
+        self.assertEqual(['aa.de\n', 'ab.de\n', 'ac.de\n'], list(chain.from_iterable(label_blocks(2, 'abc', 'a', '.de\n'))))
+        self.assertEqual([], labels(3, LETTERS, '-'))
+
+    def test_invalid_line_regex(self):
+        buffer = b'a.de\n-a.de\r\n\nab--c.de\nxn--mller-kva.de\nsub.a.de\na.com\nm\xc3\xbcller.de\nabc.de\r\n' + b'a' * 64 + b'.de'
+        invalid = [match.group().rstrip(b'\r') for match in invalid_line_regex('de').finditer(buffer)]
+        self.assertEqual([b'-a.de', b'ab--c.de', b'sub.a.de', b'a.com', b'm\xc3\xbcller.de', b'a' * 64 + b'.de'], invalid)
+        self.assertEqual([b'mller-kva'], [match.group(1) for match in a_label_line_regex('de').finditer(buffer)])
+
+        # Lines invalid as LDH names are not A-label lines as well
+        buffer = b'xn--abc-.de\nxn--' + b'a' * 70 + b'.de\r\nxn--mller-kva.de\r\n'
+        invalid = [match.group().rstrip(b'\r') for match in invalid_line_regex('de').finditer(buffer)]
+        self.assertEqual([b'xn--abc-.de', b'xn--' + b'a' * 70 + b'.de'], invalid)
+        self.assertEqual([b'mller-kva'], [match.group(1) for match in a_label_line_regex('de').finditer(buffer)])
+
+    def test_invalid_domain_reason(self):
+        self.assertIsNone(invalid_domain_reason('a.de', 'de'))
+        self.assertIsNone(invalid_domain_reason('xn--mller-kva.de', 'de'))
+        self.assertEqual('wrong tld', invalid_domain_reason('a.com', 'de'))
+        self.assertEqual('not a second-level name', invalid_domain_reason('sub.a.de', 'de'))
+        self.assertEqual('empty label', invalid_domain_reason('.de', 'de'))
+        self.assertEqual('non-ascii', invalid_domain_reason('müller.de', 'de'))
+        self.assertEqual('label too long', invalid_domain_reason('a' * 64 + '.de', 'de'))
+        self.assertEqual('leading or trailing hyphen', invalid_domain_reason('a-.de', 'de'))
+        self.assertEqual('invalid characters', invalid_domain_reason('a_b.de', 'de'))
+        self.assertEqual('invalid punycode', invalid_domain_reason('xn--999999999.de', 'de'))
+        self.assertEqual('reserved hyphens', invalid_domain_reason('ab--c.de', 'de'))
+
+    def test_idn(self):
+        self.assertTrue(is_punycode('mller-kva'))
+        self.assertFalse(is_punycode('abc-'))
+        self.assertEqual('xn--mller-kva.de', to_a_label_domain('müller.de'))
+        self.assertEqual('xn--mller-kva.de', to_a_label_domain('MÜLLER.de'))
+        self.assertIsNone(to_a_label_domain('a' * 64 + 'ü.de'))
+
+
+if __name__ == '__main__':
+    main()
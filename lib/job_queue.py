@@ -0,0 +1,287 @@
+from collections import defaultdict, deque
+from datetime import datetime
+from heapq import heapify, heappop, heappush
+from pathlib import Path
+from statistics import median
+from threading import Lock
+from time import time
+from typing import Callable, Deque, Dict, List, NamedTuple, Optional, TextIO, Tuple
+
+from lib.batches import BATCH_SIZE, load_batch_manifest
+
+LEASE_TIMEOUT = 900  # Seconds until an unanswered chunk is handed out again
+STEAL_FACTOR = 2.0  # Idle runners re-run a leased chunk once it takes this much longer than expected
+TARGET_SECONDS = 300  # Chunk run time the advised chunk size aims for
+MIN_CHUNK_SIZE = 500
+MAX_CHUNK_SIZE = 50_000
+CHUNK_EXTENSION = '.txt.bz2'
+RESULT_EXTENSION = '.ndjson.bz2'
+DUPLICATES_DIR = 'duplicates'  # Below the result directory, results that are not the first of a known chunk
+
+
+def parse_result_name(result_name: str) -> Tuple[str, str]:
+    """
+    Splits a result file name as uploaded by clouddns/job.sh into chunk file and runner tag,
+    e.g. 'de_len_5_a-00001-Ab3dE9xZ.ndjson.bz2' -> ('de_len_5_a-00001.txt.bz2', 'Ab3dE9xZ').
+    """
+    assert result_name.endswith(RESULT_EXTENSION), f"Not a result file: {result_name}"
+    chunk_stem, _, runner_tag = result_name.removesuffix(RESULT_EXTENSION).rpartition('-')
+    assert chunk_stem and runner_tag, f"Result file without runner tag: {result_name}"
+    return f"{chunk_stem}{CHUNK_EXTENSION}", runner_tag
+
+
+def chunk_stem(chunk_file: str) -> str:
+    """
+    Chunk file name without extension, e.g. 'retry_txt_1_20250301120000-00001'. Unlike the chunk_id
+    field of the result documents, the chunk number alone, it is unique across shards, retry tiers
+    and rounds.
+    """
+    return chunk_file.removesuffix(CHUNK_EXTENSION)
+
+
+class Lease(NamedTuple):
+    chunk_file: str
+    runner_tag: str
+    started: float  # Lease time, moved to the start of massdns if the runner reports it
+    speculative: bool  # A second run of a chunk that is still leased to a slow runner
+
+
+class RunnerStats:
+    def __init__(self):
+        self.leases = 0
+        self.chunks = 0
+        self.names = 0
+        self.seconds = 0.0
+        self.expired = 0
+        self.last_seen = 0.0
+
+    @property
+    def names_per_second(self) -> Optional[float]:
+        return self.names / self.seconds if self.seconds > 0 else None
+
+
+class JobQueue:
+    """
+    Hands out the chunks of one or more batch manifests to runners and tracks them until a result
+    is uploaded.
+
+    Chunks are leased instead of removed: a lease not answered within lease_timeout puts the chunk
+    back at the front of the queue. Once the queue is empty, idle runners steal the longest running
+    lease if it is overdue by STEAL_FACTOR, the first result uploaded wins and later ones are kept as
+    duplicates. Chunks of a manifest with a not_before time (retry batches, see 05_extract_retries.py)
+    are held back until then. The state can be recreated from the manifests and the result directory, so nothing
+    besides the uploaded files has to be persisted. All methods are thread safe.
+    """
+
+    def __init__(self, lease_timeout: float = LEASE_TIMEOUT, target_seconds: float = TARGET_SECONDS,
+                 clock: Callable[[], float] = time):
+        self.lease_timeout = lease_timeout
+        self.target_seconds = target_seconds
+        self.clock = clock
+        self.chunk_lines: Dict[str, int] = {}
+        self.chunk_dirs: Dict[str, Path] = {}
+        self.chunk_types: Dict[str, str] = {}  # Record type of the chunks of manifests with an rr_type
+        self.pending: Deque[str] = deque()
+        self.delayed: List[Tuple[float, str]] = []  # Heap of (not before, chunk file)
+        self.leases: Dict[str, List[Lease]] = {}
+        self.results: Dict[str, List[str]] = defaultdict(list)  # Chunk file -> result files
+        self.unknown_results: List[str] = []
+        self.runners: Dict[str, RunnerStats] = defaultdict(RunnerStats)
+        self._lock = Lock()
+
+    def add_manifest(self, manifest_path: Path) -> int:
+        """Queues all chunks of a manifest written by write_batch_manifest(), returns the chunk count."""
+        manifest = load_batch_manifest(manifest_path)
+        not_before = datetime.fromisoformat(manifest['not_before']).timestamp() if 'not_before' in manifest else None
+        with self._lock:
+            for chunk in manifest['chunks']:
+                if chunk['file'] in self.chunk_lines:
+                    continue
+                self.chunk_lines[chunk['file']] = chunk['lines']
+                self.chunk_dirs[chunk['file']] = manifest_path.parent
+                if 'rr_type' in manifest:
+                    self.chunk_types[chunk['file']] = manifest['rr_type']
+                if not_before is not None and not_before > self.clock():
+                    heappush(self.delayed, (not_before, chunk['file']))
+                else:
+                    self.pending.append(chunk['file'])
+        return len(manifest['chunks'])
+
+    def add_results(self, result_dir: Path) -> int:
+        """Marks chunks with a result file from an earlier run as done, e.g. after a restart."""
+        result_names = sorted(path.name for path in result_dir.glob(f"*{RESULT_EXTENSION}"))
+        result_names += sorted(path.name for path in (result_dir / DUPLICATES_DIR).glob(f"*{RESULT_EXTENSION}"))
+        with self._lock:
+            for result_name in result_names:
+                self._record_result(result_name)
+            done = set(self.results)
+            self.pending = deque(chunk_file for chunk_file in self.pending if chunk_file not in done)
+            self.delayed = [item for item in self.delayed if item[1] not in done]
+            heapify(self.delayed)
+        return len(result_names)
+
+    def chunk_path(self, chunk_file: str) -> Path:
+        return self.chunk_dirs[chunk_file] / chunk_file
+
+    def record_type(self, chunk_file: str) -> Optional[str]:
+        """Record type to query the names of a chunk for, None for the default of the runner."""
+        return self.chunk_types.get(chunk_file)
+
+    def lease(self, runner_tag: str) -> Optional[Lease]:
+        """Next chunk for the runner, or None if there is nothing to do right now."""
+        with self._lock:
+            now = self.clock()
+            self._expire(now)
+            while self.delayed and self.delayed[0][0] <= now:
+                self.pending.append(heappop(self.delayed)[1])
+            self.runners[runner_tag].last_seen = now
+            speculative = False
+            if self.pending:
+                chunk_file = self.pending.popleft()
+            else:
+                chunk_file = self._steal(runner_tag, now)
+                if chunk_file is None:
+                    return None
+                speculative = True
+            lease = Lease(chunk_file, runner_tag, now, speculative)
+            self.leases.setdefault(chunk_file, []).append(lease)
+            self.runners[runner_tag].leases += 1
+            return lease
+
+    def start(self, chunk_file: str, runner_tag: str) -> bool:
+        """
+        A runner started working on a leased chunk (PATCH). Runners that prefetch jobs lease them
+        before they get to them, measuring from here keeps the queue wait out of their rate and
+        keeps their prefetched chunks from being stolen as overdue.
+        """
+        with self._lock:
+            now = self.clock()
+            leases = self.leases.get(chunk_file, [])
+            for index, lease in enumerate(leases):
+                if lease.runner_tag == runner_tag:
+                    leases[index] = lease._replace(started=now)
+                    self.runners[runner_tag].last_seen = now
+                    return True
+            return False
+
+    def complete(self, result_name: str) -> bool:
+        """Records an uploaded result, returns False if the chunk already had a result or is unknown."""
+        with self._lock:
+            return self._record_result(result_name)
+
+    def release(self, chunk_file: str, runner_tag: Optional[str] = None) -> None:
+        """
+        A runner is done with a chunk (DELETE after upload). Without a result the lease is dropped
+        and the chunk queued again.
+        """
+        with self._lock:
+            if chunk_file in self.results or chunk_file not in self.chunk_lines:
+                return
+            leases = self.leases.get(chunk_file, [])
+            remaining = [lease for lease in leases if runner_tag is not None and lease.runner_tag != runner_tag]
+            if remaining:
+                self.leases[chunk_file] = remaining
+                return
+            self.leases.pop(chunk_file, None)
+            if chunk_file not in self.pending:
+                self.pending.appendleft(chunk_file)
+
+    def advised_chunk_size(self, runner_tag: Optional[str] = None) -> int:
+        """
+        Chunk size a runner would finish in target_seconds, from the observed throughput of the
+        runner, or the fleet median while it has no completed chunk yet.
+        """
+        with self._lock:
+            rates = [stats.names_per_second for stats in self.runners.values() if stats.names_per_second]
+            rate = self.runners[runner_tag].names_per_second if runner_tag in self.runners else None
+        if rate is None:
+            rate = median(rates) if rates else None
+        if rate is None:
+            return BATCH_SIZE
+        return max(MIN_CHUNK_SIZE, min(MAX_CHUNK_SIZE, int(round(rate * self.target_seconds, -2))))
+
+    def is_done(self) -> bool:
+        with self._lock:
+            return not self.pending and not self.leases and not self.delayed
+
+    def reconcile(self) -> Dict:
+        """Chunks without a result, chunks with several results and results for unknown chunks."""
+        with self._lock:
+            return {
+                'chunks': len(self.chunk_lines),
+                'done': len(self.results),
+                'pending': len(self.pending),
+                'delayed': len(self.delayed),
+                'leased': len(self.leases),
+                'missing': sorted(chunk_stem(chunk_file) for chunk_file in self.chunk_lines if chunk_file not in self.results),
+                'duplicated': {chunk_stem(chunk_file): results for chunk_file, results in sorted(self.results.items()) if len(results) > 1},
+                'unknown': list(self.unknown_results),
+            }
+
+    def dumps(self, fp: TextIO) -> None:
+        """Writes the reconciliation and per-runner throughput as a Markdown report."""
+        state = self.reconcile()
+        fp.write('## Chunks\n\n')
+        fp.write('| State | Count |\n| --- | ---: |\n')
+        for key in ('chunks', 'done', 'pending', 'delayed', 'leased'):
+            fp.write(f"| {key.capitalize()} | {state[key]:,} |\n")
+        fp.write(f"| Missing | {len(state['missing']):,} |\n| Duplicated | {len(state['duplicated']):,} |\n| Unknown | {len(state['unknown']):,} |\n\n")
+        if state['missing']:
+            fp.write(f"Missing chunks: {', '.join(state['missing'])}\n\n")
+        for chunk, results in state['duplicated'].items():
+            fp.write(f"Duplicated chunk {chunk}: {', '.join(results)}\n\n")
+        for result_name in state['unknown']:
+            fp.write(f"Unknown result: {result_name}\n\n")
+
+        fp.write('## Runners\n\n')
+        fp.write('| Runner | Leases | Chunks | Names | Names/s | Expired | Advised chunk size |\n')
+        fp.write('| --- | ---: | ---: | ---: | ---: | ---: | ---: |\n')
+        with self._lock:
+            runners = sorted(self.runners.items(), key=lambda item: item[1].names, reverse=True)
+        for runner_tag, stats in runners:
+            rate = f"{stats.names_per_second:,.1f}" if stats.names_per_second else '-'
+            fp.write(f"| {runner_tag} | {stats.leases:,} | {stats.chunks:,} | {stats.names:,} | {rate} | {stats.expired:,} | {self.advised_chunk_size(runner_tag):,} |\n")
+        fp.write(f"\nAdvised chunk size for the next batches: {self.advised_chunk_size():,}\n")
+
+    def _record_result(self, result_name: str) -> bool:
+        chunk_file, runner_tag = parse_result_name(result_name)
+        if chunk_file not in self.chunk_lines:
+            self.unknown_results.append(result_name)
+            return False
+        first = chunk_file not in self.results
+        self.results[chunk_file].append(result_name)
+        stats = self.runners[runner_tag]
+        stats.chunks += 1
+        leases = self.leases.pop(chunk_file, [])
+        lease = next((lease for lease in leases if lease.runner_tag == runner_tag), None)
+        if lease is not None:
+            now = self.clock()
+            stats.names += self.chunk_lines[chunk_file]
+            stats.seconds += now - lease.started
+            stats.last_seen = now
+        return first
+
+    def _expire(self, now: float) -> None:
+        for chunk_file, leases in list(self.leases.items()):
+            active = [lease for lease in leases if now - lease.started < self.lease_timeout]
+            for lease in leases:
+                if lease not in active:
+                    self.runners[lease.runner_tag].expired += 1
+            if active:
+                self.leases[chunk_file] = active
+            else:
+                del self.leases[chunk_file]
+                self.pending.appendleft(chunk_file)
+
+    def _steal(self, runner_tag: str, now: float) -> Optional[str]:
+        """The overdue chunk leased the longest, if it runs on a single other runner."""
+        rates = [stats.names_per_second for stats in self.runners.values() if stats.names_per_second]
+        if not rates:
+            return None
+        rate = median(rates)
+        candidates = [
+            (leases[0].started, chunk_file) for chunk_file, leases in self.leases.items()
+            if len(leases) == 1 and leases[0].runner_tag != runner_tag
+            and now - leases[0].started > STEAL_FACTOR * self.chunk_lines[chunk_file] / rate
+        ]
+        return min(candidates)[1] if candidates else None
@@ -0,0 +1,126 @@
+from io import StringIO
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase, main
+from batches import write_batches, write_batch_manifest
+from job_queue import DUPLICATES_DIR, JobQueue, chunk_stem, parse_result_name
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class Test(TestCase):
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.dir = Path(self.tmp.name)
+        batches = write_batches((f"d{i}.de" for i in range(30)), 'de_len_5_a', self.dir, 10)
+        self.manifest_path = write_batch_manifest(self.dir, 'de_len_5_a', batches)
+        self.clock = Clock()
+        self.queue = JobQueue(lease_timeout=100, target_seconds=10, clock=self.clock)
+        self.assertEqual(3, self.queue.add_manifest(self.manifest_path))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_parse_result_name(self):
+        self.assertEqual(('de_len_5_a-00001.txt.bz2', 'Ab3dE9xZ'), parse_result_name('de_len_5_a-00001-Ab3dE9xZ.ndjson.bz2'))
+        self.assertEqual('de_len_5_a-00001', chunk_stem('de_len_5_a-00001.txt.bz2'))
+
+    def test_lease_and_complete(self):
+        lease = self.queue.lease('r1')
+        self.assertEqual('de_len_5_a-00001.txt.bz2', lease.chunk_file)
+        self.assertTrue(self.queue.chunk_path(lease.chunk_file).exists())
+        self.clock.now = 5
+        self.assertTrue(self.queue.complete('de_len_5_a-00001-r1.ndjson.bz2'))
+        self.assertEqual(2.0, self.queue.runners['r1'].names_per_second)
+        self.assertEqual(500, self.queue.advised_chunk_size('r1'))
+        self.queue.target_seconds = 1234
+        advised = self.queue.advised_chunk_size('r1')
+        self.assertEqual((int, 2500), (type(advised), advised))
+        self.queue.release(lease.chunk_file, 'r1')
+        self.assertEqual(['de_len_5_a-00002', 'de_len_5_a-00003'], self.queue.reconcile()['missing'])
+
+    def test_expired_lease_is_requeued(self):
+        self.queue.lease('r1')
+        self.clock.now = 100
+        self.assertEqual('de_len_5_a-00001.txt.bz2', self.queue.lease('r2').chunk_file)
+        self.assertEqual(1, self.queue.runners['r1'].expired)
+
+    def test_release_without_result_requeues(self):
+        lease = self.queue.lease('r1')
+        self.queue.release(lease.chunk_file, 'r1')
+        self.assertEqual(lease.chunk_file, self.queue.lease('r2').chunk_file)
+
+    def test_start_of_prefetched_lease(self):
+        self.queue.lease('r1')
+        self.queue.lease('r1')  # Prefetched while the first chunk runs
+        self.clock.now = 5
+        self.queue.complete('de_len_5_a-00001-r1.ndjson.bz2')
+        self.assertTrue(self.queue.start('de_len_5_a-00002.txt.bz2', 'r1'))
+        self.assertFalse(self.queue.start('de_len_5_a-00002.txt.bz2', 'r2'))
+        self.queue.lease('r2')
+        self.clock.now = 12
+        self.assertIsNone(self.queue.lease('r3'))  # 7 s into a 5 s chunk, not 12 s
+        self.queue.complete('de_len_5_a-00002-r1.ndjson.bz2')
+        self.assertAlmostEqual(20 / 12, self.queue.runners['r1'].names_per_second)  # 5 s and 7 s of massdns
+
+    def test_steal_and_duplicates(self):
+        self.queue.lease('r1')
+        self.clock.now = 1
+        self.queue.complete('de_len_5_a-00001-r1.ndjson.bz2')
+        self.queue.lease('r1')
+        self.queue.lease('r2')
+        self.assertIsNone(self.queue.lease('r3'))  # Nothing overdue yet
+        self.clock.now = 30
+        self.queue.complete('de_len_5_a-00003-r2.ndjson.bz2')
+        stolen = self.queue.lease('r3')
+        self.assertEqual(('de_len_5_a-00002.txt.bz2', True), (stolen.chunk_file, stolen.speculative))
+        self.assertIsNone(self.queue.lease('r2'))
+        self.assertTrue(self.queue.complete('de_len_5_a-00002-r3.ndjson.bz2'))
+        self.assertFalse(self.queue.complete('de_len_5_a-00002-r1.ndjson.bz2'))
+        self.assertFalse(self.queue.complete('other-00001-r1.ndjson.bz2'))
+        self.assertTrue(self.queue.is_done())
+
+        state = self.queue.reconcile()
+        self.assertEqual([], state['missing'])
+        self.assertEqual({'de_len_5_a-00002': ['de_len_5_a-00002-r3.ndjson.bz2', 'de_len_5_a-00002-r1.ndjson.bz2']}, state['duplicated'])
+        self.assertEqual(['other-00001-r1.ndjson.bz2'], state['unknown'])
+        fp = StringIO()
+        self.queue.dumps(fp)
+        self.assertIn('| r3 |', fp.getvalue())
+
+    def test_add_results(self):
+        (self.dir / 'de_len_5_a-00002-r1.ndjson.bz2').touch()
+        (self.dir / DUPLICATES_DIR).mkdir()
+        (self.dir / DUPLICATES_DIR / 'de_len_5_a-00002-a0.ndjson.bz2').touch()
+        self.assertEqual(2, self.queue.add_results(self.dir))
+        state = self.queue.reconcile()
+        self.assertEqual(['de_len_5_a-00001', 'de_len_5_a-00003'], state['missing'])
+        self.assertEqual({'de_len_5_a-00002': ['de_len_5_a-00002-r1.ndjson.bz2', 'de_len_5_a-00002-a0.ndjson.bz2']}, state['duplicated'])
+        self.assertEqual('de_len_5_a-00001.txt.bz2', self.queue.lease('r1').chunk_file)
+        self.assertEqual('de_len_5_a-00003.txt.bz2', self.queue.lease('r1').chunk_file)
+
+    def test_not_before(self):
+        batches = write_batches(['d0.de'], 'retry_txt_1', self.dir, 10)
+        write_batch_manifest(self.dir, 'retry_txt_1', batches, rr_type='TXT', not_before='1970-01-01T00:00:50+00:00')
+        self.assertEqual(1, self.queue.add_manifest(self.dir / 'retry_txt_1.manifest.json'))
+        self.assertEqual(('TXT', None), (self.queue.record_type('retry_txt_1-00001.txt.bz2'), self.queue.record_type('de_len_5_a-00001.txt.bz2')))
+        self.assertEqual(1, self.queue.reconcile()['delayed'])
+        for _ in range(3):
+            self.queue.lease('r1')
+        self.assertIsNone(self.queue.lease('r1'))
+        self.assertFalse(self.queue.is_done())
+        self.clock.now = 50
+        self.assertEqual('retry_txt_1-00001.txt.bz2', self.queue.lease('r2').chunk_file)
+        # Chunk 00001 of both manifests, told apart by their prefix
+        self.queue.complete('de_len_5_a-00001-r1.ndjson.bz2')
+        self.assertEqual(['de_len_5_a-00002', 'de_len_5_a-00003', 'retry_txt_1-00001'], self.queue.reconcile()['missing'])
+
+
+if __name__ == '__main__':
+    main()
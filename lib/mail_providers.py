@@ -0,0 +1,72 @@
+from typing import Iterable, List, Optional, Tuple
+
+from lib.util import get_org_domain
+
+NULL_MX = 'null MX'  # A single '0 .' record, the domain accepts no mail (RFC 7505)
+
+# Host suffix -> provider, for providers whose MX hosts span several org domains or are better known by name
+PROVIDER_SUFFIXES = [
+    ('mail.protection.outlook.com', 'Microsoft 365'),
+    ('outlook.com', 'Microsoft'),
+    ('hotmail.com', 'Microsoft'),
+    ('google.com', 'Google'),
+    ('googlemail.com', 'Google'),
+    ('ionos.de', 'IONOS'),
+    ('kundenserver.de', 'IONOS'),
+    ('schlund.de', 'IONOS'),
+    ('rzone.de', 'Strato'),
+    ('strato.de', 'Strato'),
+    ('hosteurope.de', 'Host Europe'),
+    ('kasserver.com', 'ALL-INKL.COM'),
+    ('your-server.de', 'Hetzner'),
+    ('netcup.net', 'netcup'),
+    ('udag.de', 'united-domains'),
+    ('secureserver.net', 'GoDaddy'),
+    ('ovh.net', 'OVHcloud'),
+    ('zoho.eu', 'Zoho'),
+    ('zoho.com', 'Zoho'),
+    ('mimecast.com', 'Mimecast'),
+    ('pphosted.com', 'Proofpoint'),
+    ('ppe-hosted.com', 'Proofpoint'),
+    ('messagelabs.com', 'Symantec'),
+    ('hornetsecurity.com', 'Hornetsecurity'),
+    ('icloud.com', 'Apple'),
+    ('yandex.net', 'Yandex'),
+]
+
+
+def parse_mx(data: str) -> Optional[Tuple[int, str]]:
+    """Preference and lower case host of an MX record as written by massdns, e.g. '10 mx.example.com.'"""
+    parts = data.split()
+    if len(parts) != 2 or not parts[0].isdigit():
+        return None
+    return int(parts[0]), parts[1].lower().removesuffix('.')
+
+
+def mx_provider(host: str) -> str:
+    """Provider of an MX host, the org domain of the host unless a known provider suffix matches."""
+    for suffix, provider in PROVIDER_SUFFIXES:
+        if host == suffix or host.endswith(f".{suffix}"):
+            return provider
+    return get_org_domain(host)
+
+
+def primary_provider(records: List[Tuple[int, str]]) -> str:
+    """
+    Provider of the hosts with the lowest preference, which receive the mail. Primary hosts
+    of different providers are joined with ' + '.
+    """
+    preference = min(preference for preference, _ in records)
+    providers = {mx_provider(host) for current, host in records if current == preference and host}
+    return ' + '.join(sorted(providers)) or NULL_MX
+
+
+def preference_pattern(preferences: Iterable[int]) -> str:
+    """
+    Number of hosts per distinct preference, lowest first, e.g. '2+1' for two primary hosts and
+    one backup. Names the redundancy of a setup independent of the preference values used.
+    """
+    counts = {}
+    for preference in sorted(preferences):
+        counts[preference] = counts.get(preference, 0) + 1
+    return '+'.join(str(count) for count in counts.values())
@@ -0,0 +1,29 @@
+from unittest import TestCase, main
+from mail_providers import NULL_MX, mx_provider, parse_mx, preference_pattern, primary_provider
+
+
+class Test(TestCase):
+    def test_parse_mx(self):
+        self.assertEqual((10, 'mx00.ionos.de'), parse_mx('10 MX00.ionos.de.'))
+        self.assertEqual((0, ''), parse_mx('0 .'))
+        self.assertIsNone(parse_mx('mx00.ionos.de.'))
+
+    def test_mx_provider(self):
+        self.assertEqual('Microsoft 365', mx_provider('example-de.mail.protection.outlook.com'))
+        self.assertEqual('Google', mx_provider('alt1.aspmx.l.google.com'))
+        self.assertEqual('Google', mx_provider('aspmx2.googlemail.com'))
+        self.assertEqual('example.de', mx_provider('mail.example.de'))
+
+    def test_primary_provider(self):
+        self.assertEqual('Google', primary_provider([(10, 'aspmx.l.google.com'), (20, 'alt1.aspmx.l.google.com'), (30, 'mx.example.de')]))
+        self.assertEqual('Google + IONOS', primary_provider([(10, 'mx00.ionos.de'), (10, 'aspmx.l.google.com')]))
+        self.assertEqual(NULL_MX, primary_provider([(0, '')]))
+
+    def test_preference_pattern(self):
+        self.assertEqual('1', preference_pattern([10]))
+        self.assertEqual('2+1', preference_pattern([20, 10, 10]))
+        self.assertEqual('1+1+1', preference_pattern([5, 0, 10]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+from lib.dmarc import DMARCRecord, parse_dmarc
+from lib.uri import parse_receiver_domain
+from lib.util import get_org_domain
+
+# RFC 7489, section 7.1: <policy domain>._report._dmarc.<receiver domain>
+REPORT_AUTH_INFIX = '._report._dmarc.'
+RECORD_CACHE_SIZE = 65536  # Distinct DMARC record strings memoized per process
+
+
+def normalize_domain(domain: str) -> str:
+    return domain.strip().removesuffix('.').lower()
+
+
+def policy_domain(request_name: str) -> str:
+    """Domain a DMARC record applies to, given the queried _dmarc name."""
+    return normalize_domain(request_name).removeprefix('_dmarc.')
+
+
+def report_receivers(record: DMARCRecord) -> List[Tuple[str, str]]:
+    """Distinct (tag, receiver domain) pairs of the valid rua and ruf URIs of a record, tag is 'rua' or 'ruf'."""
+    receivers = []
+    for tag, values in (('rua', record.rua.value), ('ruf', record.ruf.value)):
+        for value in values or []:
+            domain = parse_receiver_domain(value)
+            if domain:
+                receiver = (tag, normalize_domain(domain))
+                if receiver not in receivers:
+                    receivers.append(receiver)
+    return receivers
+
+
+def single_dmarc_record(answers: List[dict]) -> Optional[str]:
+    """The DMARC record of a deduplicated answer set, RFC 7489 discards all records if there is more than one."""
+    dmarc_answers = [answer['data'] for answer in answers if answer['type'] == 'TXT' and answer['data'].startswith('v')]
+    return dmarc_answers[0] if len(dmarc_answers) == 1 else None
+
+
+@lru_cache(maxsize=RECORD_CACHE_SIZE)
+def record_receiver_domains(record: str) -> Tuple[str, ...]:
+    """Sorted distinct receiver domains of a DMARC record string, empty if the record is invalid."""
+    dmarc = parse_dmarc(record)
+    if not dmarc:
+        return ()
+    return tuple(sorted({receiver for _, receiver in report_receivers(dmarc)}))
+
+
+def is_external(domain: str, receiver: str) -> bool:
+    """Reports to another organizational domain need the receiver to authorize them (RFC 7489, section 7.1)."""
+    return get_org_domain(domain) != get_org_domain(receiver)
+
+
+def report_auth_name(domain: str, receiver: str) -> str:
+    return f"{domain}{REPORT_AUTH_INFIX}{receiver}"
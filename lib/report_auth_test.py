@@ -0,0 +1,21 @@
+from unittest import TestCase, main
+from dmarc import parse_dmarc
+from report_auth import report_receivers, is_external, report_auth_name, policy_domain
+
+
+class Test(TestCase):
+    def test_report_receivers(self):
+        record = parse_dmarc('v=DMARC1; p=none; rua=mailto:a@Vendor.com.,mailto:b@vendor.com,invalid; ruf=mailto:c@example.de')
+        self.assertEqual([('rua', 'vendor.com'), ('ruf', 'example.de')], report_receivers(record))
+        self.assertEqual([], report_receivers(parse_dmarc('v=DMARC1; p=none')))
+
+    def test_names(self):
+        self.assertEqual('example.de', policy_domain('_dmarc.example.de.'))
+        self.assertTrue(is_external('example.de', 'rua.vendor.com'))
+        self.assertFalse(is_external('example.de', 'reports.example.de'))
+        name = report_auth_name('example.de', 'rua.vendor.com')
+        self.assertEqual('example.de._report._dmarc.rua.vendor.com', name)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,234 @@
+import os
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+from pathlib import Path
+from random import Random
+from typing import Collection, Dict, List, Optional, TextIO
+
+# Upper bounds of the latency buckets in seconds, about 19 % apart from 0.25 ms to 10 s
+LATENCY_BOUNDS = [0.00025 * 2 ** (step / 4) for step in range(62)]
+MIN_SAMPLES = 200  # Before a resolver can be judged
+MAX_TIMEOUT_RATE = 0.2
+MAX_FAILURE_RATE = 0.2  # SERVFAIL, REFUSED and errors other than timeouts
+QUARANTINE_SECONDS = 300  # Doubles with every repeated quarantine
+MAX_QUARANTINE_SECONDS = 6 * 3600
+PROBATION_WEIGHT = 0.1  # Share of the median weight while a resolver returns from quarantine
+DEFAULT_LATENCY = 0.05  # Assumed while no latency was measured, e.g. for massdns results
+MIN_SUCCESS = 0.05  # Keeps unjudged resolvers in rotation, so they collect enough samples
+WEIGHTED_LIST_LINES = 1000
+
+ERROR_TIMEOUT = 'timeout'  # Error of an attempt without answer, other errors are network, malformed or mismatch
+DEFAULT_PORT = ':53'
+
+STATE_HEALTHY = 'healthy'
+STATE_PROBATION = 'probation'
+STATE_QUARANTINED = 'quarantined'
+
+
+class LatencyHistogram:
+    """Fixed log-scale buckets, so percentiles cost no memory per sample and histograms merge by addition."""
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BOUNDS) + 1)
+        self.total = 0
+
+    def add(self, seconds: float) -> None:
+        self.counts[bisect_left(LATENCY_BOUNDS, seconds)] += 1
+        self.total += 1
+
+    def merge(self, other: 'LatencyHistogram') -> None:
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.total += other.total
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Upper bound of the bucket holding the q-th percentile (0 to 100), None without samples."""
+        if self.total == 0:
+            return None
+        bucket = bisect_right(list(accumulate(self.counts)), (self.total - 1) * q / 100)
+        return LATENCY_BOUNDS[min(bucket, len(LATENCY_BOUNDS) - 1)]
+
+
+def massdns_address(resolver: str) -> str:
+    """Resolver as a line of a massdns resolver list, plain addresses for the default port, e.g. [::1]:53 as ::1."""
+    if not resolver.endswith(DEFAULT_PORT):
+        return resolver
+    address = resolver.removesuffix(DEFAULT_PORT)
+    return address[1:-1] if address.startswith('[') else address
+
+
+class ResolverHealth:
+    def __init__(self):
+        self.queries = 0
+        self.timeouts = 0
+        self.servfail = 0
+        self.refused = 0
+        self.errors = 0  # Errors other than timeouts
+        self.latency = LatencyHistogram()
+
+    def observe(self, status: Optional[str] = None, error: Optional[str] = None, rtt: Optional[float] = None) -> None:
+        self.queries += 1
+        if error == ERROR_TIMEOUT:
+            self.timeouts += 1
+        elif error is not None:
+            self.errors += 1
+        elif status == 'SERVFAIL':
+            self.servfail += 1
+        elif status == 'REFUSED':
+            self.refused += 1
+        if rtt is not None:
+            self.latency.add(rtt)
+
+    def merge(self, other: 'ResolverHealth') -> None:
+        self.queries += other.queries
+        self.timeouts += other.timeouts
+        self.servfail += other.servfail
+        self.refused += other.refused
+        self.errors += other.errors
+        self.latency.merge(other.latency)
+
+    def decay(self) -> None:
+        """Halves all counts, so recent observations outweigh old ones in a long run."""
+        self.queries //= 2
+        self.timeouts //= 2
+        self.servfail //= 2
+        self.refused //= 2
+        self.errors //= 2
+        self.latency.counts = [count // 2 for count in self.latency.counts]
+        self.latency.total = sum(self.latency.counts)
+
+    @property
+    def timeout_rate(self) -> float:
+        return self.timeouts / self.queries if self.queries else 0.0
+
+    @property
+    def failure_rate(self) -> float:
+        return (self.servfail + self.refused + self.errors) / self.queries if self.queries else 0.0
+
+    def is_bad(self) -> bool:
+        return self.queries >= MIN_SAMPLES and (self.timeout_rate > MAX_TIMEOUT_RATE or self.failure_rate > MAX_FAILURE_RATE)
+
+    def score(self) -> float:
+        """Definitive answers per second of latency: squared success rate over p90 latency."""
+        success = max(MIN_SUCCESS, 1.0 - self.timeout_rate - self.failure_rate)
+        latency = self.latency.percentile(90) or DEFAULT_LATENCY
+        return success * success / latency
+
+
+class ResolverPool:
+    """
+    Health of a set of resolvers from their results, as weights for choosing among them.
+
+    Fed either by result documents (the resolver, status and error fields of massdns -o Je) or
+    directly by the collector, which also knows the round trip time. update() quarantines resolvers
+    with too many timeouts or too many SERVFAIL/REFUSED answers and other errors. After the quarantine they return on
+    probation with a small weight, and go back into quarantine for twice as long if they are
+    still bad.
+    """
+
+    def __init__(self, resolvers: Collection[str], rng: Optional[Random] = None):
+        self.health: Dict[str, ResolverHealth] = {resolver: ResolverHealth() for resolver in resolvers}
+        self.quarantined_until: Dict[str, float] = {}
+        self.probation: Dict[str, float] = {}
+        self.strikes: Dict[str, int] = {}
+        self.rng = rng or Random()
+        self._names: List[str] = []
+        self._cumulative: List[float] = []
+        self.update(0.0)
+
+    def observe(self, resolver: str, status: Optional[str] = None, error: Optional[str] = None, rtt: Optional[float] = None) -> None:
+        health = self.health.get(resolver)
+        if health is None:
+            health = self.health[resolver] = ResolverHealth()
+        health.observe(status, error, rtt)
+
+    def observe_document(self, doc: Dict) -> None:
+        if 'resolver' in doc:
+            self.observe(doc['resolver'], doc.get('status'), doc.get('error'))
+
+    def merge(self, health: Dict[str, ResolverHealth]) -> None:
+        for resolver, other in health.items():
+            self.health.setdefault(resolver, ResolverHealth()).merge(other)
+
+    def state(self, resolver: str, now: float) -> str:
+        if self.quarantined_until.get(resolver, 0.0) > now:
+            return STATE_QUARANTINED
+        return STATE_PROBATION if resolver in self.probation else STATE_HEALTHY
+
+    def update(self, now: float) -> None:
+        """Re-evaluates all resolvers and recomputes the weights."""
+        for resolver, health in self.health.items():
+            if self.quarantined_until.get(resolver, 0.0) > now:
+                continue
+            if resolver in self.quarantined_until:
+                # Back from quarantine, judged again on fresh observations only
+                del self.quarantined_until[resolver]
+                self.probation[resolver] = now
+                self.health[resolver] = ResolverHealth()
+                continue
+            if health.is_bad():
+                strikes = self.strikes.get(resolver, 0)
+                self.strikes[resolver] = strikes + 1
+                self.quarantined_until[resolver] = now + min(MAX_QUARANTINE_SECONDS, QUARANTINE_SECONDS * 2 ** strikes)
+                self.probation.pop(resolver, None)
+            elif resolver in self.probation and health.queries >= MIN_SAMPLES:
+                del self.probation[resolver]
+                self.strikes.pop(resolver, None)
+
+        weights = self.weights(now)
+        self._names = list(weights)
+        self._cumulative = list(accumulate(weights.values()))
+
+    def weights(self, now: float) -> Dict[str, float]:
+        """Relative weights of the usable resolvers, quarantined ones are left out."""
+        scores = {resolver: health.score() for resolver, health in self.health.items() if self.state(resolver, now) != STATE_QUARANTINED}
+        healthy = sorted(score for resolver, score in scores.items() if resolver not in self.probation)
+        median = healthy[len(healthy) // 2] if healthy else 1.0
+        return {
+            resolver: median * PROBATION_WEIGHT if resolver in self.probation else score
+            for resolver, score in sorted(scores.items())
+        }
+
+    def choose(self, exclude: Collection[str] = ()) -> Optional[str]:
+        """A resolver drawn by weight as of the last update(), None if all are quarantined or excluded."""
+        if not self._names:
+            return None
+        for _ in range(8):
+            resolver = self.rng.choices(self._names, cum_weights=self._cumulative)[0]
+            if resolver not in exclude:
+                return resolver
+        remaining = [resolver for resolver in self._names if resolver not in exclude]
+        return self.rng.choice(remaining) if remaining else None
+
+    def decay(self) -> None:
+        for health in self.health.values():
+            health.decay()
+
+    def write_weighted_list(self, file_path: Path, now: float, lines: int = WEIGHTED_LIST_LINES) -> int:
+        """
+        Resolver list for massdns, which picks lines uniformly: every resolver is repeated in
+        proportion to its weight, at least once. Replaced atomically, as runners may be reading it.
+        Returns the number of distinct resolvers written.
+        """
+        weights = self.weights(now)
+        total = sum(weights.values())
+        tmp_path = file_path.with_name(f"{file_path.name}.tmp")
+        with open(tmp_path, mode='wt', encoding='utf-8') as fp:
+            for resolver, weight in weights.items():
+                fp.write(f"{massdns_address(resolver)}\n" * max(1, round(lines * weight / total)))
+        os.replace(tmp_path, file_path)
+        return len(weights)
+
+    def dumps(self, fp: TextIO, now: float) -> None:
+        weights = self.weights(now)
+        total = sum(weights.values()) or 1.0
+        fp.write('| Resolver | State | Queries | Timeouts | SERVFAIL | REFUSED | Errors | p50 ms | p90 ms | p99 ms | Share |\n')
+        fp.write('| --- | --- | ---: | ---: | ---: | ---: | ---: | ---: | ---: | ---: | ---: |\n')
+        for resolver, health in sorted(self.health.items(), key=lambda item: weights.get(item[0], 0.0), reverse=True):
+            latencies = [health.latency.percentile(q) for q in (50, 90, 99)]
+            latency_text = ' | '.join(f"{latency * 1000:.1f}" if latency is not None else '-' for latency in latencies)
+            fp.write(
+                f"| {resolver} | {self.state(resolver, now)} | {health.queries:,} | {health.timeout_rate:.2%} "
+                f"| {health.servfail / (health.queries or 1):.2%} | {health.refused / (health.queries or 1):.2%} "
+                f"| {health.errors / (health.queries or 1):.2%} "
+                f"| {latency_text} | {weights.get(resolver, 0.0) / total:.2%} |\n"
+            )
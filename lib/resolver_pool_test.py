@@ -0,0 +1,80 @@
+from io import StringIO
+from pathlib import Path
+from random import Random
+from tempfile import TemporaryDirectory
+from unittest import TestCase, main
+from resolver_pool import MIN_SAMPLES, QUARANTINE_SECONDS, LatencyHistogram, ResolverPool
+
+
+def feed(pool: ResolverPool, resolver: str, count: int, status: str = 'NOERROR', error: str = None, rtt: float = None) -> None:
+    for _ in range(count):
+        pool.observe(resolver, status, error, rtt)
+
+
+class Test(TestCase):
+    def test_latency_histogram(self):
+        histogram = LatencyHistogram()
+        self.assertIsNone(histogram.percentile(50))
+        for ms in range(1, 101):
+            histogram.add(ms / 1000)
+        self.assertAlmostEqual(0.05, histogram.percentile(50), delta=0.01)
+        self.assertAlmostEqual(0.1, histogram.percentile(100), delta=0.02)
+        other = LatencyHistogram()
+        other.add(5.0)
+        histogram.merge(other)
+        self.assertEqual(101, histogram.total)
+        self.assertGreater(histogram.percentile(100), 4.0)
+
+    def test_weights_and_quarantine(self):
+        pool = ResolverPool(['1.1.1.1:53', '8.8.8.8:53', '9.9.9.9:53'], Random(1))
+        feed(pool, '1.1.1.1:53', MIN_SAMPLES, rtt=0.01)
+        feed(pool, '8.8.8.8:53', MIN_SAMPLES, rtt=0.04)
+        feed(pool, '9.9.9.9:53', MIN_SAMPLES // 2, error='timeout')
+        feed(pool, '9.9.9.9:53', MIN_SAMPLES // 2, status='SERVFAIL')
+        pool.update(0.0)
+        weights = pool.weights(0.0)
+        self.assertEqual(['1.1.1.1:53', '8.8.8.8:53'], sorted(weights))
+        self.assertGreater(weights['1.1.1.1:53'], 3 * weights['8.8.8.8:53'])
+        self.assertEqual('quarantined', pool.state('9.9.9.9:53', 0.0))
+        self.assertEqual({'1.1.1.1:53'}, {pool.choose(exclude=['8.8.8.8:53']) for _ in range(20)})
+        self.assertIsNone(pool.choose(exclude=['1.1.1.1:53', '8.8.8.8:53']))
+
+        # Back on probation with a small weight, quarantined twice as long if still bad
+        pool.update(QUARANTINE_SECONDS)
+        self.assertEqual('probation', pool.state('9.9.9.9:53', QUARANTINE_SECONDS))
+        self.assertLess(pool.weights(QUARANTINE_SECONDS)['9.9.9.9:53'], weights['8.8.8.8:53'])
+        feed(pool, '9.9.9.9:53', MIN_SAMPLES, error='timeout')
+        pool.update(QUARANTINE_SECONDS)
+        self.assertEqual(QUARANTINE_SECONDS * 3, pool.quarantined_until['9.9.9.9:53'])
+
+    def test_observe_document(self):
+        pool = ResolverPool([])
+        pool.observe_document({'resolver': '1.1.1.1:53', 'status': 'REFUSED'})
+        pool.observe_document({'resolver': '1.1.1.1:53', 'error': 'timeout'})
+        pool.observe_document({'resolver': '1.1.1.1:53', 'error': 'network'})
+        pool.observe_document({'resolver': '1.1.1.1:53', 'error': 'mismatch'})
+        pool.observe_document({'name': 'a.de.'})
+        health = pool.health['1.1.1.1:53']
+        self.assertEqual((4, 1, 1, 2), (health.queries, health.timeouts, health.refused, health.errors))
+        self.assertEqual(0.75, health.failure_rate)
+        health.decay()
+        self.assertEqual((2, 0, 0, 1), (health.queries, health.timeouts, health.refused, health.errors))
+
+    def test_write_weighted_list(self):
+        pool = ResolverPool(['1.1.1.1:53', '8.8.8.8:53', '[::1]:5353', '[2001:db8::1]:53'])
+        feed(pool, '1.1.1.1:53', MIN_SAMPLES, rtt=0.01)
+        feed(pool, '8.8.8.8:53', MIN_SAMPLES, rtt=0.03)
+        pool.update(0.0)
+        with TemporaryDirectory() as tmp:
+            path = Path(tmp) / 'resolvers.txt'
+            self.assertEqual(4, pool.write_weighted_list(path, 0.0, lines=100))
+            lines = path.read_text().splitlines()
+        self.assertEqual({'1.1.1.1', '8.8.8.8', '[::1]:5353', '2001:db8::1'}, set(lines))
+        self.assertGreater(lines.count('1.1.1.1'), 2 * lines.count('8.8.8.8'))
+        fp = StringIO()
+        pool.dumps(fp, 0.0)
+        self.assertIn('| 1.1.1.1:53 | healthy | 200 |', fp.getvalue())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+from datetime import datetime
+from typing import Dict, Iterable, Optional
+
+from lib.dns_collector import ERROR_INVALID_NAME
+
+DEFINITIVE_STATUSES = {'NOERROR', 'NXDOMAIN'}
+RETRY_STATUSES = {'SERVFAIL'}
+BACKOFF_SECONDS = 900  # Before the first retry, doubles with every failed attempt
+MAX_BACKOFF_SECONDS = 24 * 3600
+MAX_FAILURES = 6  # Requests failing more often are given up instead of retried
+
+# Outcome of a single attempt, as spilled by 05_extract_retries.py
+ATTEMPT_DEFINITIVE = 'D'
+ATTEMPT_TIMEOUT = 'T'
+ATTEMPT_SERVFAIL = 'S'
+ATTEMPT_OTHER = 'O'  # REFUSED, FORMERR etc., neither definitive nor worth a retry
+
+RETRY_OUTCOMES = {ATTEMPT_TIMEOUT, ATTEMPT_SERVFAIL}
+
+
+def attempt_outcome(doc: Dict) -> str:
+    """Outcome of one massdns -o Je result document."""
+    if 'error' in doc:
+        return ATTEMPT_OTHER if doc['error'] == ERROR_INVALID_NAME else ATTEMPT_TIMEOUT
+    status = doc.get('status')
+    if status in DEFINITIVE_STATUSES:
+        return ATTEMPT_DEFINITIVE
+    if status in RETRY_STATUSES:
+        return ATTEMPT_SERVFAIL
+    return ATTEMPT_OTHER
+
+
+def request_key(doc: Dict) -> str:
+    """'TYPE name' without the trailing dot, as the request is written to a batch."""
+    return f"{doc['type']} {doc['name'].removesuffix('.')}"
+
+
+def retry_failures(outcomes: Iterable[str]) -> Optional[int]:
+    """
+    Number of failed attempts of a request that never got a definitive answer, i.e. only timeouts
+    and SERVFAIL. None if the request does not need a retry: it was answered at least once, or an
+    attempt was rejected in a way a retry does not fix.
+    """
+    failures = 0
+    for outcome in outcomes:
+        if outcome not in RETRY_OUTCOMES:
+            return None
+        failures += 1
+    return failures or None
+
+
+def backoff_seconds(failures: int) -> int:
+    """Wait before the next attempt of a request that failed this often."""
+    return min(MAX_BACKOFF_SECONDS, BACKOFF_SECONDS * 2 ** (max(1, failures) - 1))
+
+
+def retry_prefix(rr_type: str, failures: int, created: datetime) -> str:
+    """
+    Batch prefix of one retry tier: massdns runs one record type per chunk, the backoff is per tier.
+    The extraction time keeps the chunks of every round apart, the job queue matches results to
+    chunks by file name.
+    """
+    return f"retry_{rr_type.lower()}_{failures}_{created:%Y%m%d%H%M%S}"
@@ -0,0 +1,30 @@
+from datetime import datetime, timezone
+from unittest import TestCase, main
+from retries import (ATTEMPT_DEFINITIVE, ATTEMPT_OTHER, ATTEMPT_SERVFAIL, ATTEMPT_TIMEOUT, MAX_BACKOFF_SECONDS,
+                     attempt_outcome, backoff_seconds, request_key, retry_failures, retry_prefix)
+
+
+class Test(TestCase):
+    def test_attempt_outcome(self):
+        self.assertEqual(ATTEMPT_TIMEOUT, attempt_outcome({'name': 'a.de.', 'type': 'TXT', 'error': 'timeout'}))
+        self.assertEqual(ATTEMPT_SERVFAIL, attempt_outcome({'name': 'a.de.', 'type': 'TXT', 'status': 'SERVFAIL'}))
+        self.assertEqual(ATTEMPT_DEFINITIVE, attempt_outcome({'name': 'a.de.', 'type': 'TXT', 'status': 'NXDOMAIN'}))
+        self.assertEqual(ATTEMPT_OTHER, attempt_outcome({'name': 'a.de.', 'type': 'TXT', 'status': 'REFUSED'}))
+        self.assertEqual(ATTEMPT_OTHER, attempt_outcome({'name': 'bücher.de.', 'type': 'TXT', 'error': 'invalid_name'}))
+        self.assertEqual('TXT _dmarc.a.de', request_key({'name': '_dmarc.a.de.', 'type': 'TXT'}))
+
+    def test_retry_failures(self):
+        self.assertEqual(3, retry_failures('TST'))
+        self.assertIsNone(retry_failures('TDT'))
+        self.assertIsNone(retry_failures('TO'))
+        self.assertIsNone(retry_failures(''))
+
+    def test_backoff(self):
+        self.assertEqual(900, backoff_seconds(1))
+        self.assertEqual(3600, backoff_seconds(3))
+        self.assertEqual(MAX_BACKOFF_SECONDS, backoff_seconds(20))
+        self.assertEqual('retry_txt_2_20250301120005', retry_prefix('TXT', 2, datetime(2025, 3, 1, 12, 0, 5, tzinfo=timezone.utc)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,401 @@
+import gzip
+import json
+import re
+import struct
+from array import array
+from datetime import date, datetime, timezone
+from functools import lru_cache
+from ipaddress import ip_address, IPv4Address, IPv6Address
+from itertools import compress, repeat
+from operator import floordiv
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from lib.util import get_sub_domain, log
+
+ROUTE53_FIELD_COUNT = 11
+ROUTE53_CACHE_EXTENSION = '.r53'
+ROUTE53_CACHE_MAGIC = b'R53C'
+ROUTE53_CACHE_VERSION = 1
+ROUTE53_MANIFEST_FILE = 'manifest.json'
+SHARD_ROWS_KEY = '#shards'  # Manifest entry with the committed row count of every shard, not a source file
+SHARD_PARTS_KEY = '#parts'  # Manifest entry with the committed part files of every shard, not merged yet
+SHARD_PART_EXTENSION = '.part'
+HEADER_LENGTH_FORMAT = 'I'
+HEADER_LENGTH_SIZE = struct.calcsize(HEADER_LENGTH_FORMAT)
+
+MICROSECONDS_PER_SECOND = 1_000_000
+MICROSECONDS_PER_DAY = 86_400 * MICROSECONDS_PER_SECOND
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+# Compiled once, previously every analysis compiled its own copy
+DMARC_NAME_REGEX = re.compile('^_dmarc.[a-zA-Z0-9-]+\\.[a-z]+$')
+
+# Bits of the name_flags column, request names themselves are not kept
+NAME_FLAG_DMARC_SUB = 1  # get_sub_domain(name) == '_dmarc'
+NAME_FLAG_DMARC_NAME = 2  # name matches DMARC_NAME_REGEX
+
+# Dictionary-encoded columns: code -> value is stored in the cache header
+DICTIONARY_COLUMNS = ['distribution_id', 'request_type', 'response_code', 'protocol', 'edge_location', 'ip_net']
+
+COLUMN_TYPES = {
+    'timestamp': 'q',  # Microseconds since epoch (UTC)
+    'distribution_id': 'I',
+    'request_type': 'I',
+    'response_code': 'I',
+    'protocol': 'I',
+    'edge_location': 'I',
+    'ip_hi': 'Q',  # Upper 64 bits of the IPv6 (or IPv4-mapped) address
+    'ip_lo': 'Q',  # Lower 64 bits
+    'ip_net': 'I',
+    'name_flags': 'B',
+}
+
+IPV4_MAPPED_PREFIX = 0xFFFF << 32
+
+
+@lru_cache(maxsize=4096)
+def _day_to_epoch_us(day: str) -> int:
+    return (date(int(day[0:4]), int(day[5:7]), int(day[8:10])).toordinal() - EPOCH_ORDINAL) * MICROSECONDS_PER_DAY
+
+
+def parse_timestamp(value: str) -> int:
+    """
+    Parses an ISO 8601 timestamp into microseconds since epoch (UTC).
+
+    The fixed layout written by Route53 ('2025-01-31T12:34:56.789Z') is sliced at
+    fixed offsets, everything else falls back to datetime.fromisoformat.
+    """
+    if len(value) >= 20 and value[-1] == 'Z' and value[10] == 'T' and value[19] in '.Z':
+        us = _day_to_epoch_us(value[0:10])
+        us += (int(value[11:13]) * 3600 + int(value[14:16]) * 60 + int(value[17:19])) * MICROSECONDS_PER_SECOND
+        fraction = value[20:-1]
+        if fraction:
+            us += int(fraction[:6].ljust(6, '0'))
+        return us
+    parsed = datetime.fromisoformat(value)
+    assert parsed.tzinfo is not None, f"Timestamp without offset: {value}"
+    return round(parsed.timestamp() * MICROSECONDS_PER_SECOND)
+
+
+def to_datetime(timestamp: int) -> datetime:
+    return datetime.fromtimestamp(timestamp / MICROSECONDS_PER_SECOND, timezone.utc)
+
+
+def to_date(day: int) -> date:
+    return date.fromordinal(day + EPOCH_ORDINAL)
+
+
+def ip_to_int(value: str) -> int:
+    """IPv4 addresses are stored IPv4-mapped (::ffff:a.b.c.d) so both families share one column pair."""
+    address = ip_address(value)
+    if address.version == 4:
+        return IPV4_MAPPED_PREFIX | int(address)
+    return int(address)
+
+
+def int_to_ip(value: int) -> str:
+    if value >> 32 == 0xFFFF:
+        return str(IPv4Address(value & 0xFFFFFFFF))
+    return str(IPv6Address(value))
+
+
+def name_flags(request_name: str) -> int:
+    flags = 0
+    if get_sub_domain(request_name) == '_dmarc':
+        flags |= NAME_FLAG_DMARC_SUB
+    if DMARC_NAME_REGEX.match(request_name) is not None:
+        flags |= NAME_FLAG_DMARC_NAME
+    return flags
+
+
+def read_route53_log(file_path: Path) -> Iterator[str]:
+    """Streams the lines of a (optionally gzip compressed) Route53 query log."""
+    if file_path.suffix == '.gz':
+        fp = gzip.open(file_path, mode='rt', encoding='utf-8')
+    else:
+        fp = open(file_path, mode='rt', encoding='utf-8')
+    with fp:
+        for line in fp:
+            yield line
+
+
+class Route53Table:
+    """
+    Columnar representation of Route53 query log records.
+
+    Strings with few distinct values are dictionary-encoded, IPs are kept as integers
+    and timestamps as int64 microseconds. Columns are plain arrays, so analyses can
+    run with C-level iterators (zip, map, itertools.compress, Counter) over them.
+    """
+
+    def __init__(self):
+        self.columns: Dict[str, array] = {name: array(typecode) for name, typecode in COLUMN_TYPES.items()}
+        self.dictionaries: Dict[str, List[str]] = {name: [] for name in DICTIONARY_COLUMNS}
+        self._codes: Dict[str, Dict[str, int]] = {name: {} for name in DICTIONARY_COLUMNS}
+        self._ip_cache: Dict[str, int] = {}
+
+    def reset_caches(self) -> None:
+        """Drops the parse caches, e.g. before a table is sent to another process."""
+        self._ip_cache.clear()
+
+    def __len__(self) -> int:
+        return len(self.columns['timestamp'])
+
+    def __getitem__(self, column: str) -> array:
+        return self.columns[column]
+
+    def encode(self, column: str, value: str) -> int:
+        codes = self._codes[column]
+        code = codes.get(value)
+        if code is None:
+            code = len(codes)
+            codes[value] = code
+            self.dictionaries[column].append(value)
+        return code
+
+    def code(self, column: str, value: str) -> Optional[int]:
+        return self._codes[column].get(value)
+
+    def decode(self, column: str, code: int) -> str:
+        return self.dictionaries[column][code]
+
+    def append_line(self, line: str) -> bool:
+        parts = line.strip().split(' ')
+        if len(parts) != ROUTE53_FIELD_COUNT:
+            return False
+        ip = self._ip_cache.get(parts[9])
+        if ip is None:
+            ip = ip_to_int(parts[9])
+            if len(self._ip_cache) < 1_000_000:
+                self._ip_cache[parts[9]] = ip
+        columns = self.columns
+        columns['timestamp'].append(parse_timestamp(parts[0]))
+        columns['distribution_id'].append(self.encode('distribution_id', parts[3]))
+        columns['request_type'].append(self.encode('request_type', parts[5]))
+        columns['response_code'].append(self.encode('response_code', parts[6]))
+        columns['protocol'].append(self.encode('protocol', parts[7]))
+        columns['edge_location'].append(self.encode('edge_location', parts[8]))
+        columns['ip_hi'].append(ip >> 64)
+        columns['ip_lo'].append(ip & 0xFFFFFFFFFFFFFFFF)
+        columns['ip_net'].append(self.encode('ip_net', parts[10]))
+        columns['name_flags'].append(name_flags(parts[4]))
+        return True
+
+    def extend(self, lines: Iterable[str]) -> int:
+        count = 0
+        for line in lines:
+            if self.append_line(line):
+                count += 1
+        return count
+
+    def merge(self, other: 'Route53Table') -> None:
+        """Appends all rows of other, re-mapping its dictionary codes onto this table."""
+        for name, typecode in COLUMN_TYPES.items():
+            if name in self._codes:
+                mapping = [self.encode(name, value) for value in other.dictionaries[name]]
+                self.columns[name].extend(array(typecode, map(mapping.__getitem__, other.columns[name])))
+            else:
+                self.columns[name].extend(other.columns[name])
+
+    def truncate(self, rows: int) -> None:
+        """Keeps the first rows only."""
+        for column in self.columns.values():
+            del column[rows:]
+
+    def ip(self, row: int) -> str:
+        return int_to_ip((self.columns['ip_hi'][row] << 64) | self.columns['ip_lo'][row])
+
+    def days(self) -> array:
+        """Day number (days since epoch, UTC) for every row."""
+        return array('i', map(floordiv, self.columns['timestamp'], repeat(MICROSECONDS_PER_DAY)))
+
+    def select(self, mask: bytes) -> 'Route53Table':
+        """New table with the rows selected by mask, sharing the dictionary codes of this table."""
+        table = Route53Table()
+        for name, typecode in COLUMN_TYPES.items():
+            table.columns[name] = array(typecode, compress(self.columns[name], mask))
+        for name in DICTIONARY_COLUMNS:
+            table.dictionaries[name] = list(self.dictionaries[name])
+            table._codes[name] = dict(self._codes[name])
+        return table
+
+    def split_days(self) -> Dict[int, 'Route53Table']:
+        """Splits the table into one table per day (days since epoch, UTC)."""
+        days = self.days()
+        distinct_days = set(days)
+        if len(distinct_days) == 1:
+            return {distinct_days.pop(): self}
+        return {day: self.select(bytes(map(day.__eq__, days))) for day in sorted(distinct_days)}
+
+    def mask(self, request_type: Optional[str] = None, response_code: Optional[str] = None, flags: int = 0) -> bytes:
+        """Row mask (one byte per row) for the common filter of the DMARC analyses."""
+        result = b'\x01' * len(self)
+        for column, value in (('request_type', request_type), ('response_code', response_code)):
+            if value is None:
+                continue
+            code = self.code(column, value)
+            if code is None:
+                return bytes(len(self))
+            result = _and_masks(result, bytes(map(code.__eq__, self.columns[column])))
+        if flags:
+            table = bytes(1 if i & flags == flags else 0 for i in range(256))
+            result = _and_masks(result, self.columns['name_flags'].tobytes().translate(table))
+        return result
+
+    def save(self, file_path: Path) -> None:
+        header = {
+            'version': ROUTE53_CACHE_VERSION,
+            'rows': len(self),
+            'columns': COLUMN_TYPES,
+            'dictionaries': self.dictionaries,
+        }
+        header_bytes = json.dumps(header).encode('utf-8')
+        tmp_path = file_path.with_name(file_path.name + '.tmp')
+        with open(tmp_path, mode='wb') as fp:
+            fp.write(ROUTE53_CACHE_MAGIC)
+            fp.write(struct.pack(HEADER_LENGTH_FORMAT, len(header_bytes)))
+            fp.write(header_bytes)
+            for name in COLUMN_TYPES:
+                self.columns[name].tofile(fp)
+        tmp_path.replace(file_path)
+
+    @classmethod
+    def load(cls, file_path: Path) -> 'Route53Table':
+        table = cls()
+        with open(file_path, mode='rb') as fp:
+            assert fp.read(len(ROUTE53_CACHE_MAGIC)) == ROUTE53_CACHE_MAGIC, f"Not a Route53 cache file: {file_path}"
+            header_length = struct.unpack(HEADER_LENGTH_FORMAT, fp.read(HEADER_LENGTH_SIZE))[0]
+            header = json.loads(fp.read(header_length).decode('utf-8'))
+            assert header['version'] == ROUTE53_CACHE_VERSION, f"Unsupported cache version: {header['version']}"
+            assert header['columns'] == COLUMN_TYPES, "Cache file has different columns"
+            rows = header['rows']
+            for name in COLUMN_TYPES:
+                table.columns[name].fromfile(fp, rows)
+        for name in DICTIONARY_COLUMNS:
+            for value in header['dictionaries'][name]:
+                table.encode(name, value)
+        return table
+
+
+def _and_masks(mask1: bytes, mask2: bytes) -> bytes:
+    assert len(mask1) == len(mask2)
+    return (int.from_bytes(mask1, 'little') & int.from_bytes(mask2, 'little')).to_bytes(len(mask1), 'little')
+
+
+def load_route53_table(log_path: Path) -> Route53Table:
+    """
+    Loads the columnar cache next to the log file, parsing the log only if the
+    cache is missing or older than the log.
+    """
+    assert log_path.exists(), f"Input file not found: {log_path}"
+    cache_path = log_path.parent / (log_path.stem + ROUTE53_CACHE_EXTENSION)
+    if cache_path.exists() and log_path.stat().st_mtime <= cache_path.stat().st_mtime:
+        return Route53Table.load(cache_path)
+
+    log(f"Generating Route53 cache file for {log_path}...")
+    table = Route53Table()
+    table.extend(read_route53_log(log_path))
+    table.save(cache_path)
+    log(f"Route53 cache file generated for {log_path}.")
+    return table
+
+
+def shard_path(shard_dir: Path, day: int) -> Path:
+    return shard_dir / f"{to_date(day)}{ROUTE53_CACHE_EXTENSION}"
+
+
+def append_to_shard(shard_dir: Path, day: int, table: Route53Table) -> int:
+    """Appends the rows of a table to a daily shard, returns the row count of the shard."""
+    path = shard_path(shard_dir, day)
+    if path.exists():
+        shard = Route53Table.load(path)
+        shard.merge(table)
+        table = shard
+    table.save(path)
+    return len(table)
+
+
+def shard_part_path(shard_dir: Path, day: int, part: int) -> Path:
+    return shard_dir / f"{to_date(day)}.{part:05}{ROUTE53_CACHE_EXTENSION}{SHARD_PART_EXTENSION}"
+
+
+def merge_shard_parts(shard_dir: Path, day: int, part_paths: List[Path]) -> int:
+    """
+    Appends the rows of the part files to a daily shard, rewriting it once. Returns the row count
+    of the shard. The part files are left for the caller to delete once the count is committed.
+    """
+    path = shard_path(shard_dir, day)
+    table = Route53Table.load(path) if path.exists() else Route53Table()
+    for part_path in part_paths:
+        table.merge(Route53Table.load(part_path))
+    table.save(path)
+    return len(table)
+
+
+def shard_rows(path: Path) -> int:
+    """Row count of a shard from its header, without loading the columns."""
+    with open(path, mode='rb') as fp:
+        assert fp.read(len(ROUTE53_CACHE_MAGIC)) == ROUTE53_CACHE_MAGIC, f"Not a Route53 cache file: {path}"
+        header_length = struct.unpack(HEADER_LENGTH_FORMAT, fp.read(HEADER_LENGTH_SIZE))[0]
+        return json.loads(fp.read(header_length).decode('utf-8'))['rows']
+
+
+def recover_shards(shard_dir: Path, manifest: Dict[str, Dict]) -> List[int]:
+    """
+    Rolls the shards back to the row counts committed with the manifest. A run that died while
+    flushing may have appended rows whose source files are not in the manifest yet, they are
+    cut off again and re-ingested, as are part files missing from the manifest. Manifests without
+    row counts commit the shards as they are. Returns the days of the changed shards.
+    """
+    committed_parts = {name for names in manifest.setdefault(SHARD_PARTS_KEY, {}).values() for name in names}
+    for path in shard_dir.glob(f"*{SHARD_PART_EXTENSION}"):
+        if path.name not in committed_parts:
+            path.unlink()
+    paths = sorted(shard_dir.glob(f"*{ROUTE53_CACHE_EXTENSION}"))
+    if SHARD_ROWS_KEY not in manifest:
+        manifest[SHARD_ROWS_KEY] = {path.stem: shard_rows(path) for path in paths}
+        return []
+    committed = manifest[SHARD_ROWS_KEY]
+    changed = []
+    for path in paths:
+        rows = committed.get(path.stem, 0)
+        if shard_rows(path) == rows:
+            continue
+        day = date.fromisoformat(path.stem).toordinal() - EPOCH_ORDINAL
+        if rows == 0:
+            path.unlink()
+        else:
+            table = Route53Table.load(path)
+            table.truncate(rows)
+            table.save(path)
+        changed.append(day)
+    return changed
+
+
+def load_route53_shards(shard_dir: Path, first_day: Optional[date] = None, last_day: Optional[date] = None) -> Route53Table:
+    """Loads and concatenates the daily shards written by 06_cache_route53.py, optionally restricted to a date range."""
+    assert shard_dir.exists(), f"Shard directory not found: {shard_dir}"
+    table = Route53Table()
+    for path in sorted(shard_dir.glob(f"*{ROUTE53_CACHE_EXTENSION}")):
+        day = date.fromisoformat(path.stem)
+        if (first_day and day < first_day) or (last_day and day > last_day):
+            continue
+        table.merge(Route53Table.load(path))
+    return table
+
+
+def load_manifest(shard_dir: Path) -> Dict[str, Dict]:
+    manifest_file = shard_dir / ROUTE53_MANIFEST_FILE
+    if manifest_file.exists():
+        with open(manifest_file, mode='rt', encoding='utf-8') as fp:
+            return json.load(fp)
+    return {}
+
+
+def save_manifest(shard_dir: Path, manifest: Dict[str, Dict]) -> None:
+    manifest_file = shard_dir / ROUTE53_MANIFEST_FILE
+    tmp_file = manifest_file.with_name(manifest_file.name + '.tmp')
+    with open(tmp_file, mode='wt', encoding='utf-8') as fp:
+        json.dump(manifest, fp, indent=2)
+    tmp_file.replace(manifest_file)
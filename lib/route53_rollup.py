@@ -0,0 +1,180 @@
+import json
+from base64 import b64decode, b64encode
+from collections import Counter, defaultdict
+from datetime import date
+from itertools import repeat
+from operator import floordiv
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from lib.route53 import Route53Table, int_to_ip, MICROSECONDS_PER_DAY, ROUTE53_CACHE_EXTENSION
+from lib.sketches import HyperLogLog
+from lib.util import log
+
+ROLLUP_VERSION = 2  # 2: IPv6 addresses are hashed over all 128 bits
+ROLLUP_EXTENSION = f'.rollup{ROLLUP_VERSION}.json'  # Rollups of an older version are rebuilt next to the old files
+HLL_PRECISION = 11
+
+RESOLUTIONS = {
+    'minute': 60 * 1_000_000,
+    'hour': 3600 * 1_000_000,
+    'day': MICROSECONDS_PER_DAY,
+}
+
+# (bucket, zone, response_code, request_type, name_flags)
+CubeKey = Tuple[int, str, str, str, int]
+
+
+class Route53Rollup:
+    """
+    Pre-aggregated Route53 query counts, built once per ingested day.
+
+    counts:         resolution -> (bucket, zone, response_code, request_type, name_flags) -> count
+    distinct_ips:   resolution -> bucket -> HyperLogLog of source IPs
+    edges:          (day, edge_location, request_type) -> count
+    edge_ips:       (day, edge_location) -> HyperLogLog of source IPs
+    resolvers:      (day, source IP, protocol, client subnet sent) -> count
+
+    Buckets are the bucket start in microseconds since epoch (UTC), days are days since epoch.
+    """
+
+    def __init__(self):
+        self.counts: Dict[str, Counter] = {resolution: Counter() for resolution in RESOLUTIONS}
+        self.distinct_ips: Dict[str, Dict[int, HyperLogLog]] = {resolution: {} for resolution in RESOLUTIONS}
+        self.edges: Counter = Counter()
+        self.edge_ips: Dict[Tuple[int, str], HyperLogLog] = {}
+        self.resolvers: Counter = Counter()
+
+    @classmethod
+    def build(cls, table: Route53Table) -> 'Route53Rollup':
+        rollup = cls()
+        decode = table.decode
+        ips = list(zip(table['ip_hi'], table['ip_lo']))
+
+        for resolution, size in RESOLUTIONS.items():
+            buckets = array_floor(table['timestamp'], size)
+            counts = Counter(zip(buckets, table['distribution_id'], table['response_code'], table['request_type'], table['name_flags']))
+            for (bucket, zone, rcode, rtype, flags), count in counts.items():
+                key = (bucket * size, decode('distribution_id', zone), decode('response_code', rcode), decode('request_type', rtype), flags)
+                rollup.counts[resolution][key] += count
+            hlls = rollup.distinct_ips[resolution]
+            for bucket, ip in set(zip(buckets, ips)):
+                hll = hlls.get(bucket * size)
+                if hll is None:
+                    hll = hlls[bucket * size] = HyperLogLog(HLL_PRECISION)
+                hll.add((ip[0] << 64) | ip[1])
+
+        days = array_floor(table['timestamp'], MICROSECONDS_PER_DAY)
+        for (day, edge, rtype), count in Counter(zip(days, table['edge_location'], table['request_type'])).items():
+            rollup.edges[(day, decode('edge_location', edge), decode('request_type', rtype))] += count
+        for day, edge, ip in set(zip(days, table['edge_location'], ips)):
+            key = (day, decode('edge_location', edge))
+            hll = rollup.edge_ips.get(key)
+            if hll is None:
+                hll = rollup.edge_ips[key] = HyperLogLog(HLL_PRECISION)
+            hll.add((ip[0] << 64) | ip[1])
+
+        no_subnet = table.code('ip_net', '-')
+        subnets = map((no_subnet if no_subnet is not None else -1).__ne__, table['ip_net'])
+        for (day, ip, protocol, subnet), count in Counter(zip(days, ips, table['protocol'], subnets)).items():
+            rollup.resolvers[(day, int_to_ip((ip[0] << 64) | ip[1]), decode('protocol', protocol), subnet)] += count
+        return rollup
+
+    def merge(self, other: 'Route53Rollup') -> None:
+        for resolution in RESOLUTIONS:
+            self.counts[resolution].update(other.counts[resolution])
+            _merge_hlls(self.distinct_ips[resolution], other.distinct_ips[resolution])
+        self.edges.update(other.edges)
+        _merge_hlls(self.edge_ips, other.edge_ips)
+        self.resolvers.update(other.resolvers)
+
+    def query(self, resolution: str, zone: Optional[str] = None, response_code: Optional[str] = None,
+              request_type: Optional[str] = None, flags: int = 0) -> Dict[CubeKey, int]:
+        """Cube cells of one resolution matching the given dimension values."""
+        return {
+            key: count for key, count in self.counts[resolution].items()
+            if (zone is None or key[1] == zone)
+            and (response_code is None or key[2] == response_code)
+            and (request_type is None or key[3] == request_type)
+            and key[4] & flags == flags
+        }
+
+    def save(self, file_path: Path) -> None:
+        data = {
+            'version': ROLLUP_VERSION,
+            'counts': {resolution: [[*key, count] for key, count in counts.items()] for resolution, counts in self.counts.items()},
+            'distinct_ips': {resolution: [[bucket, _encode_hll(hll)] for bucket, hll in hlls.items()] for resolution, hlls in self.distinct_ips.items()},
+            'edges': [[*key, count] for key, count in self.edges.items()],
+            'edge_ips': [[*key, _encode_hll(hll)] for key, hll in self.edge_ips.items()],
+            'resolvers': [[*key, count] for key, count in self.resolvers.items()],
+        }
+        tmp_path = file_path.with_name(file_path.name + '.tmp')
+        with open(tmp_path, mode='wt', encoding='utf-8') as fp:
+            json.dump(data, fp)
+        tmp_path.replace(file_path)
+
+    @classmethod
+    def load(cls, file_path: Path) -> 'Route53Rollup':
+        with open(file_path, mode='rt', encoding='utf-8') as fp:
+            data = json.load(fp)
+        assert data['version'] == ROLLUP_VERSION, f"Unsupported rollup version: {data['version']}"
+        rollup = cls()
+        for resolution in RESOLUTIONS:
+            rollup.counts[resolution] = Counter({tuple(row[:-1]): row[-1] for row in data['counts'][resolution]})
+            rollup.distinct_ips[resolution] = {bucket: _decode_hll(hll) for bucket, hll in data['distinct_ips'][resolution]}
+        rollup.edges = Counter({tuple(row[:-1]): row[-1] for row in data['edges']})
+        rollup.edge_ips = {(day, edge): _decode_hll(hll) for day, edge, hll in data['edge_ips']}
+        rollup.resolvers = Counter({tuple(row[:-1]): row[-1] for row in data['resolvers']})
+        return rollup
+
+
+def array_floor(values, size: int) -> list:
+    return list(map(floordiv, values, repeat(size)))
+
+
+def _merge_hlls(target: Dict, source: Dict) -> None:
+    for key, hll in source.items():
+        if key in target:
+            target[key].merge(hll)
+        else:
+            target[key] = HyperLogLog(hll.precision, hll.registers)
+
+
+def _encode_hll(hll: HyperLogLog) -> str:
+    return b64encode(hll.to_bytes()).decode('ascii')
+
+
+def _decode_hll(value: str) -> HyperLogLog:
+    return HyperLogLog.from_bytes(b64decode(value))
+
+
+def rollup_path(shard_path: Path) -> Path:
+    return shard_path.with_name(shard_path.name.removesuffix(ROUTE53_CACHE_EXTENSION) + ROLLUP_EXTENSION)
+
+
+def update_rollup(shard_path: Path) -> Path:
+    """Builds the rollup of a daily shard, unless it is already newer than the shard."""
+    path = rollup_path(shard_path)
+    if not path.exists() or shard_path.stat().st_mtime > path.stat().st_mtime:
+        log(f"Generating rollup file for {shard_path}...")
+        Route53Rollup.build(Route53Table.load(shard_path)).save(path)
+    return path
+
+
+def load_route53_rollups(shard_dir: Path, first_day: Optional[date] = None, last_day: Optional[date] = None) -> Route53Rollup:
+    """Merges the rollups of all daily shards in the range, building missing or outdated ones."""
+    assert shard_dir.exists(), f"Shard directory not found: {shard_dir}"
+    rollup = Route53Rollup()
+    for shard_path in sorted(shard_dir.glob(f"*{ROUTE53_CACHE_EXTENSION}")):
+        day = date.fromisoformat(shard_path.stem)
+        if (first_day and day < first_day) or (last_day and day > last_day):
+            continue
+        rollup.merge(Route53Rollup.load(update_rollup(shard_path)))
+    return rollup
+
+
+def group_by(cells: Dict[CubeKey, int], key_fn) -> Dict:
+    result = defaultdict(int)
+    for key, count in cells.items():
+        result[key_fn(key)] += count
+    return result
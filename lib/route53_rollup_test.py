@@ -0,0 +1,35 @@
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase, main
+from route53 import Route53Table, NAME_FLAG_DMARC_NAME, MICROSECONDS_PER_DAY
+from route53_rollup import Route53Rollup, group_by
+from route53_test import LINES
+
+
+class Test(TestCase):
+    def test_build_query(self):
+        table = Route53Table()
+        table.extend(LINES)
+        rollup = Route53Rollup.build(table)
+        self.assertEqual(3, rollup.counts['minute'].total())
+        cells = rollup.query('day', request_type='TXT', flags=NAME_FLAG_DMARC_NAME)
+        self.assertEqual({20148: 1}, group_by(cells, lambda key: key[0] // MICROSECONDS_PER_DAY))
+        self.assertEqual(2, rollup.distinct_ips['day'][20148 * MICROSECONDS_PER_DAY].count())
+        self.assertEqual(2, rollup.edges[(20148, 'FRA56-C1', 'TXT')] + rollup.edges[(20148, 'FRA56-C1', 'MX')])
+        self.assertEqual(1, rollup.resolvers[(20148, '2001:db8::1', 'UDP', True)])
+
+    def test_save_load_merge(self):
+        table = Route53Table()
+        table.extend(LINES)
+        rollup = Route53Rollup.build(table)
+        with TemporaryDirectory() as tmp:
+            path = Path(tmp) / '2025-03-01.rollup.json'
+            rollup.save(path)
+            loaded = Route53Rollup.load(path)
+        loaded.merge(rollup)
+        self.assertEqual(6, loaded.counts['hour'].total())
+        self.assertEqual(rollup.edge_ips[(20148, 'FRA56-C1')].registers, loaded.edge_ips[(20148, 'FRA56-C1')].registers)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+from datetime import datetime, timezone
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase, main
+from route53 import (SHARD_PARTS_KEY, SHARD_ROWS_KEY, Route53Table, append_to_shard, merge_shard_parts, parse_timestamp,
+                     ip_to_int, int_to_ip, recover_shards, shard_part_path, shard_path, shard_rows, to_date, NAME_FLAG_DMARC_SUB,
+                     NAME_FLAG_DMARC_NAME)
+
+LINES = [
+    '2025-03-01T10:00:00.123Z 1.0 2025-03-01T10:00:00Z Z1 _dmarc.example.de TXT NOERROR UDP FRA56-C1 192.0.2.1 -',
+    '2025-03-01T23:59:59.999Z 1.0 2025-03-01T23:59:59Z Z2 example.de MX NOERROR UDP FRA56-C1 2001:db8::1 192.0.2.0/24',
+    '2025-03-02T00:00:00.000Z 1.0 2025-03-02T00:00:00Z Z1 _dmarc.sub.example.de TXT NXDOMAIN TCP AMS1-C1 192.0.2.2 -',
+    'invalid line',
+]
+
+
+class Test(TestCase):
+    def test_parse_timestamp(self):
+        for value in ['2025-03-01T10:00:00.123Z', '2024-02-29T23:59:59.999999Z', '1999-12-31T00:00:00Z']:
+            expected = datetime.fromisoformat(value.replace('Z', '+00:00'))
+            self.assertEqual(round(expected.timestamp() * 1_000_000), parse_timestamp(value))
+        self.assertEqual(parse_timestamp('2025-03-01T10:00:00.123Z'), parse_timestamp('2025-03-01T11:00:00.123+01:00'))
+
+    def test_ip(self):
+        for value in ['192.0.2.1', '2001:db8::1', '::1']:
+            self.assertEqual(value, int_to_ip(ip_to_int(value)))
+
+    def test_table(self):
+        table = Route53Table()
+        self.assertEqual(3, table.extend(LINES))
+        self.assertEqual(3, len(table))
+        self.assertEqual(['Z1', 'Z2'], table.dictionaries['distribution_id'])
+        self.assertEqual([NAME_FLAG_DMARC_SUB | NAME_FLAG_DMARC_NAME, 0, 0], list(table['name_flags']))
+        self.assertEqual('2001:db8::1', table.ip(1))
+        self.assertEqual(['2025-03-01', '2025-03-01', '2025-03-02'], [str(to_date(day)) for day in table.days()])
+        self.assertEqual(b'\x01\x00\x00', table.mask(request_type='TXT', response_code='NOERROR'))
+        self.assertEqual(b'\x00\x00\x00', table.mask(request_type='AAAA'))
+        self.assertEqual(datetime(2025, 3, 1, 10, 0, 0, 123000, timezone.utc).timestamp() * 1_000_000,
+                         table['timestamp'][0])
+
+    def test_save_load_merge(self):
+        table = Route53Table()
+        table.extend(LINES[:2])
+        other = Route53Table()
+        other.extend(LINES[2:])
+        table.merge(other)
+        with TemporaryDirectory() as tmp:
+            path = Path(tmp) / 'route53.r53'
+            table.save(path)
+            loaded = Route53Table.load(path)
+        self.assertEqual(3, len(loaded))
+        self.assertEqual(table.columns, loaded.columns)
+        self.assertEqual(table.dictionaries, loaded.dictionaries)
+        self.assertEqual('AMS1-C1', loaded.decode('edge_location', loaded['edge_location'][2]))
+
+    def test_split_days(self):
+        table = Route53Table()
+        table.extend(LINES)
+        days = table.split_days()
+        self.assertEqual(['2025-03-01', '2025-03-02'], [str(to_date(day)) for day in days])
+        self.assertEqual([2, 1], [len(day_table) for day_table in days.values()])
+        last = list(days.values())[1]
+        self.assertEqual('Z1', last.decode('distribution_id', last['distribution_id'][0]))
+
+    def test_recover_shards(self):
+        table = Route53Table()
+        table.extend(LINES)
+        first, second = table.split_days().items()
+        with TemporaryDirectory() as tmp:
+            shard_dir = Path(tmp)
+            self.assertEqual(2, append_to_shard(shard_dir, *first))
+            manifest = {}
+            self.assertEqual([], recover_shards(shard_dir, manifest))
+            self.assertEqual({'2025-03-01': 2}, manifest[SHARD_ROWS_KEY])
+
+            # A flush that died before its manifest was saved
+            self.assertEqual(4, append_to_shard(shard_dir, *first))
+            append_to_shard(shard_dir, *second)
+            self.assertEqual(sorted([first[0], second[0]]), sorted(recover_shards(shard_dir, manifest)))
+            self.assertEqual(2, shard_rows(shard_path(shard_dir, first[0])))
+            self.assertEqual(2, len(Route53Table.load(shard_path(shard_dir, first[0]))))
+            self.assertFalse(shard_path(shard_dir, second[0]).exists())
+            self.assertEqual([], recover_shards(shard_dir, manifest))
+
+    def test_shard_parts(self):
+        table = Route53Table()
+        table.extend(LINES)
+        day, day_table = next(iter(table.split_days().items()))
+        with TemporaryDirectory() as tmp:
+            shard_dir = Path(tmp)
+            append_to_shard(shard_dir, day, day_table)
+            part_paths = [shard_part_path(shard_dir, day, part) for part in range(3)]
+            for part_path in part_paths:
+                day_table.save(part_path)
+            manifest = {SHARD_ROWS_KEY: {'2025-03-01': 2}, SHARD_PARTS_KEY: {'2025-03-01': [part_paths[0].name, part_paths[1].name]}}
+
+            # The third part was written by a flush that died before its manifest was saved
+            self.assertEqual([], recover_shards(shard_dir, manifest))
+            self.assertEqual([True, True, False], [part_path.exists() for part_path in part_paths])
+            self.assertEqual(6, merge_shard_parts(shard_dir, day, part_paths[:2]))
+            shard = Route53Table.load(shard_path(shard_dir, day))
+            self.assertEqual(6, len(shard))
+            self.assertEqual('Z2', shard.decode('distribution_id', shard['distribution_id'][5]))
+
+
+if __name__ == '__main__':
+    main()
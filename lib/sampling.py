@@ -0,0 +1,109 @@
+from itertools import islice
+from math import exp, floor, log as ln
+from random import Random
+from typing import Callable, Dict, Hashable, Iterable, List, TypeVar
+
+T = TypeVar('T')
+
+ALLOCATION_PROPORTIONAL = 'proportional'  # k items in total, split by stratum size
+ALLOCATION_EQUAL = 'equal'  # k items per stratum
+
+
+def _open_uniform(rng: Random) -> float:
+    """Uniform value in the open interval (0, 1), as log(0) is undefined."""
+    value = rng.random()
+    while value == 0.0:
+        value = rng.random()
+    return value
+
+
+def reservoir_sample(items: Iterable[T], k: int, rng: Random) -> List[T]:
+    """
+    Uniform sample of k items from a stream of unknown length (Algorithm L, Li 1994).
+
+    Instead of drawing a random number per item, the number of items to skip until the next
+    replacement is drawn, and skipped items are consumed by islice without touching them.
+    Returns all items if there are fewer than k.
+    """
+    iterator = iter(items)
+    reservoir = list(islice(iterator, k))
+    if len(reservoir) < k or k == 0:
+        return reservoir
+    end = object()
+    w = exp(ln(_open_uniform(rng)) / k)
+    while True:
+        skip = floor(ln(_open_uniform(rng)) / ln(1 - w))
+        item = next(islice(iterator, skip, None), end)
+        if item is end:
+            return reservoir
+        reservoir[rng.randrange(k)] = item
+        w *= exp(ln(_open_uniform(rng)) / k)
+
+
+class Reservoir:
+    """
+    Algorithm L for items that arrive one at a time, e.g. interleaved with other strata.
+
+    add() only compares a counter for skipped items, random numbers are drawn per replacement.
+    """
+
+    def __init__(self, k: int, rng: Random):
+        self.k = k
+        self.rng = rng
+        self.items: List = []
+        self.count = 0
+        self._w = 1.0
+        self._next = 0
+
+    def add(self, item) -> None:
+        self.count += 1
+        if self.count <= self.k:
+            self.items.append(item)
+            if self.count == self.k:
+                self._w = exp(ln(_open_uniform(self.rng)) / self.k)
+                self._skip()
+        elif self.count == self._next:
+            self.items[self.rng.randrange(self.k)] = item
+            self._w *= exp(ln(_open_uniform(self.rng)) / self.k)
+            self._skip()
+
+    def _skip(self) -> None:
+        self._next = self.count + floor(ln(_open_uniform(self.rng)) / ln(1 - self._w)) + 1
+
+
+def allocate_proportional(sizes: Dict[Hashable, int], k: int) -> Dict[Hashable, int]:
+    """Splits k by stratum size (largest remainder method), never exceeding a stratum's size."""
+    total = sum(sizes.values())
+    if total <= k:
+        return dict(sizes)
+    quotas = {stratum: k * size / total for stratum, size in sizes.items()}
+    allocation = {stratum: floor(quota) for stratum, quota in quotas.items()}
+    remaining = k - sum(allocation.values())
+    by_remainder = sorted(quotas, key=lambda stratum: (allocation[stratum] - quotas[stratum], str(stratum)))
+    for stratum in by_remainder[:remaining]:
+        allocation[stratum] += 1
+    return allocation
+
+
+def stratified_sample(items: Iterable[T], k: int, stratum_fn: Callable[[T], Hashable], rng: Random,
+                      allocation: str = ALLOCATION_PROPORTIONAL) -> Dict[Hashable, List[T]]:
+    """
+    Uniform sample within each stratum, in a single pass.
+
+    Every stratum keeps a reservoir of k items, as the stratum sizes are only known at the end.
+    With proportional allocation the reservoirs are then subsampled to k items in total, a uniform
+    subsample of a uniform sample is still uniform.
+    """
+    assert allocation in (ALLOCATION_PROPORTIONAL, ALLOCATION_EQUAL), f"Unknown allocation: {allocation}"
+    reservoirs: Dict[Hashable, Reservoir] = {}
+    for item in items:
+        stratum = stratum_fn(item)
+        reservoir = reservoirs.get(stratum)
+        if reservoir is None:
+            reservoir = reservoirs[stratum] = Reservoir(k, rng)
+        reservoir.add(item)
+
+    if allocation == ALLOCATION_EQUAL:
+        return {stratum: reservoir.items for stratum, reservoir in reservoirs.items()}
+    sizes = allocate_proportional({stratum: reservoir.count for stratum, reservoir in reservoirs.items()}, k)
+    return {stratum: rng.sample(reservoirs[stratum].items, size) for stratum, size in sorted(sizes.items(), key=lambda item: str(item[0]))}
@@ -0,0 +1,46 @@
+from collections import Counter
+from random import Random
+from unittest import TestCase, main
+from sampling import reservoir_sample, Reservoir, allocate_proportional, stratified_sample, ALLOCATION_EQUAL
+
+
+class Test(TestCase):
+    def test_reservoir_sample(self):
+        self.assertEqual([0, 1, 2], reservoir_sample(range(3), 5, Random(1)))
+        sample = reservoir_sample(range(100_000), 1_000, Random(1))
+        self.assertEqual(1_000, len(set(sample)))
+        self.assertEqual(sample, reservoir_sample(iter(range(100_000)), 1_000, Random(1)))
+        self.assertNotEqual(sample, reservoir_sample(range(100_000), 1_000, Random(2)))
+
+        # Every item should be picked with probability k / n
+        counts = Counter()
+        for seed in range(2_000):
+            counts.update(reservoir_sample(range(20), 5, Random(seed)))
+        self.assertTrue(all(400 < count < 600 for count in counts.values()), counts)
+
+    def test_reservoir(self):
+        counts = Counter()
+        for seed in range(2_000):
+            reservoir = Reservoir(5, Random(seed))
+            for item in range(20):
+                reservoir.add(item)
+            self.assertEqual(20, reservoir.count)
+            counts.update(reservoir.items)
+        self.assertTrue(all(400 < count < 600 for count in counts.values()), counts)
+
+    def test_allocate_proportional(self):
+        self.assertEqual({'a': 5, 'b': 3, 'c': 2}, allocate_proportional({'a': 500, 'b': 333, 'c': 167}, 10))
+        self.assertEqual({'a': 2, 'b': 1}, allocate_proportional({'a': 2, 'b': 1}, 10))
+
+    def test_stratified_sample(self):
+        items = [f"{'x' * (i % 3 + 1)}{i}" for i in range(3_000)]
+        sample = stratified_sample(items, 300, lambda item: item.count('x'), Random(1))
+        self.assertEqual([1, 2, 3], sorted(sample))
+        self.assertEqual([100, 100, 100], [len(values) for values in sample.values()])
+        self.assertTrue(all(item.count('x') == stratum for stratum, values in sample.items() for item in values))
+        equal = stratified_sample(items, 50, lambda item: item.count('x'), Random(1), ALLOCATION_EQUAL)
+        self.assertEqual([50, 50, 50], [len(values) for values in equal.values()])
+
+
+if __name__ == '__main__':
+    main()
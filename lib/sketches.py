@@ -0,0 +1,137 @@
+import struct
+from array import array
+from hashlib import blake2b
+from math import log as ln
+from operator import add
+from typing import Iterable, List
+
+MASK32 = (1 << 32) - 1
+MASK64 = (1 << 64) - 1
+
+
+def hash64(value: bytes | str | int) -> int:
+    """Stable 64-bit hash, unlike hash() it is identical across processes and runs."""
+    if type(value) is int and value > MASK64:
+        # Wider ints (IPv6 addresses) are hashed as bytes, truncating them would collide their prefixes
+        value = value.to_bytes((value.bit_length() + 7) // 8, 'big')
+    elif type(value) is int:
+        # splitmix64 finalizer, ints (IP addresses, IDs) are far too regular to be used directly
+        z = (value + 0x9E3779B97F4A7C15) & MASK64
+        z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+        z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & MASK64
+        return z ^ (z >> 31)
+    if type(value) is str:
+        value = value.encode('utf-8')
+    return int.from_bytes(blake2b(value, digest_size=8).digest(), 'little')
+
+
+class HyperLogLog:
+    """
+    Approximate distinct counter with mergeable fixed-size state.
+
+    The standard error is about 1.04 / sqrt(2 ** precision), so the default of 12
+    (4 KiB of registers) is accurate to roughly 1.6 %.
+    """
+
+    def __init__(self, precision: int = 12, registers: bytes | None = None):
+        assert 4 <= precision <= 18, "Precision must be between 4 and 18"
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = bytearray(registers) if registers is not None else bytearray(self.size)
+        assert len(self.registers) == self.size, "Register count does not match precision"
+
+    def __len__(self) -> int:
+        return self.count()
+
+    def add(self, value: bytes | str | int) -> None:
+        self.add_hash(hash64(value))
+
+    def add_hash(self, h: int) -> None:
+        remaining_bits = 64 - self.precision
+        index = h >> remaining_bits
+        rank = remaining_bits - (h & ((1 << remaining_bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def update(self, values: Iterable[bytes | str | int]) -> None:
+        for value in values:
+            self.add_hash(hash64(value))
+
+    def count(self) -> int:
+        size = self.size
+        alpha = 0.7213 / (1 + 1.079 / size)
+        estimate = alpha * size * size / sum(map(_INVERSE_POWERS.__getitem__, self.registers))
+        if estimate <= 2.5 * size:
+            zeros = self.registers.count(0)
+            if zeros:
+                estimate = size * ln(size / zeros)
+        return round(estimate)
+
+    def merge(self, other: 'HyperLogLog') -> None:
+        assert self.precision == other.precision, "Cannot merge HyperLogLog instances with different precisions"
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def to_bytes(self) -> bytes:
+        return bytes([self.precision]) + bytes(self.registers)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'HyperLogLog':
+        return cls(data[0], data[1:])
+
+
+_INVERSE_POWERS = [2.0 ** -rank for rank in range(65)]
+
+
+class CountMinSketch:
+    """
+    Approximate frequency counter with mergeable fixed-size state.
+
+    Estimates never undercount. They exceed the true count by more than e / width of the total
+    count with a probability of at most e ** -depth, so the width has to grow with the number of
+    distinct values for small counts to stay meaningful.
+    """
+    HEADER_FORMAT = '<IB'
+
+    def __init__(self, width: int = 1 << 20, depth: int = 4, counters: bytes | None = None):
+        assert width > 0 and width & (width - 1) == 0, "Width must be a power of two"
+        assert 1 <= depth <= 8, "Depth must be between 1 and 8"
+        self.width = width
+        self.depth = depth
+        self.counters = array('I', counters if counters is not None else bytes(4 * width * depth))
+        assert len(self.counters) == width * depth, "Counter count does not match width and depth"
+
+    def _indexes(self, h: int) -> List[int]:
+        # Double hashing, the rows use independent enough functions of a single 64-bit hash
+        h1, h2 = h & MASK32, (h >> 32) | 1
+        mask = self.width - 1
+        return [row * self.width + ((h1 + row * h2) & mask) for row in range(self.depth)]
+
+    def add(self, value: bytes | str | int, count: int = 1) -> None:
+        self.add_hash(hash64(value), count)
+
+    def add_hash(self, h: int, count: int = 1) -> None:
+        counters = self.counters
+        for index in self._indexes(h):
+            counters[index] += count
+
+    def estimate(self, value: bytes | str | int) -> int:
+        return self.estimate_hash(hash64(value))
+
+    def estimate_hash(self, h: int) -> int:
+        return min(map(self.counters.__getitem__, self._indexes(h)))
+
+    def total(self) -> int:
+        """Sum of all added counts."""
+        return sum(self.counters[:self.width])
+
+    def merge(self, other: 'CountMinSketch') -> None:
+        assert (self.width, self.depth) == (other.width, other.depth), "Cannot merge CountMinSketch instances of different sizes"
+        self.counters = array('I', map(add, self.counters, other.counters))
+
+    def to_bytes(self) -> bytes:
+        return struct.pack(self.HEADER_FORMAT, self.width, self.depth) + self.counters.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'CountMinSketch':
+        width, depth = struct.unpack_from(cls.HEADER_FORMAT, data)
+        return cls(width, depth, data[struct.calcsize(cls.HEADER_FORMAT):])
@@ -0,0 +1,66 @@
+from unittest import TestCase, main
+from sketches import CountMinSketch, HyperLogLog, hash64
+
+
+class Test(TestCase):
+    def test_hash64(self):
+        self.assertEqual(hash64('example.de'), hash64(b'example.de'))
+        self.assertNotEqual(hash64(1), hash64(2))
+        self.assertLess(hash64(2 ** 64 - 1), 2 ** 64)
+        self.assertNotEqual(hash64(1 << 64), hash64(2 << 64))
+        self.assertLess(hash64(2 ** 128 - 1), 2 ** 64)
+
+    def test_hyperloglog_ipv6(self):
+        # Addresses that only differ above bit 64, e.g. 2001:db8:i::1
+        hll = HyperLogLog()
+        hll.update((0x20010DB8 << 96) | (i << 80) | 1 for i in range(5_000))
+        self.assertAlmostEqual(5_000, hll.count(), delta=250)
+
+    def test_hyperloglog_count(self):
+        hll = HyperLogLog()
+        self.assertEqual(0, hll.count())
+        hll.update(range(100_000))
+        hll.update(range(50_000))
+        self.assertAlmostEqual(100_000, hll.count(), delta=5_000)
+
+        small = HyperLogLog()
+        small.update(['a', 'b', 'c', 'a'])
+        self.assertEqual(3, small.count())
+
+    def test_hyperloglog_merge(self):
+        hll1 = HyperLogLog(10)
+        hll1.update(range(0, 20_000))
+        hll2 = HyperLogLog(10)
+        hll2.update(range(10_000, 30_000))
+        union = HyperLogLog(10)
+        union.update(range(0, 30_000))
+        hll1.merge(hll2)
+        self.assertEqual(union.registers, hll1.registers)
+        self.assertEqual(hll1.registers, HyperLogLog.from_bytes(hll1.to_bytes()).registers)
+
+    def test_count_min_sketch(self):
+        sketch = CountMinSketch(1 << 12, 4)
+        for value in range(1_000):
+            sketch.add(value, 1 + value % 3)
+        self.assertEqual(1_999, sketch.total())
+        estimates = [sketch.estimate(value) - (1 + value % 3) for value in range(1_000)]
+        self.assertGreaterEqual(min(estimates), 0)
+        self.assertLess(sum(estimates), 100)
+        self.assertEqual(0, CountMinSketch(1 << 12, 4).estimate('missing'))
+
+    def test_count_min_sketch_merge(self):
+        sketch1 = CountMinSketch(1 << 8, 3)
+        sketch1.add('a.de')
+        sketch2 = CountMinSketch(1 << 8, 3)
+        sketch2.add('a.de', 2)
+        sketch2.add('b.de')
+        sketch1.merge(sketch2)
+        self.assertGreaterEqual(sketch1.estimate('a.de'), 3)
+        self.assertEqual(4, sketch1.total())
+        copy = CountMinSketch.from_bytes(sketch1.to_bytes())
+        self.assertEqual((256, 3), (copy.width, copy.depth))
+        self.assertEqual(sketch1.counters, copy.counters)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,266 @@
+import re
+from ipaddress import ip_network
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+# RFC 7208
+MECHANISMS = {'all', 'include', 'a', 'mx', 'ptr', 'ip4', 'ip6', 'exists'}
+LOOKUP_MECHANISMS = {'include', 'a', 'mx', 'ptr', 'exists'}  # Terms counting against the lookup limit
+TARGET_REQUIRED = {'include', 'exists'}
+MAX_LOOKUPS = 10  # Section 4.6.4
+MAX_VOID_LOOKUPS = 2
+MAX_DEPTH = 16  # Nesting of includes and redirects, a loop or a chain this deep is a permerror anyway
+
+# Outcome of an expansion, besides '' for a record that evaluates
+ERROR_SYNTAX = 'syntax'  # permerror, the record does not parse
+ERROR_NO_RECORD = 'no_record'  # permerror, an include or redirect target without SPF record
+ERROR_MULTIPLE = 'multiple'  # permerror, more than one SPF record at a name
+ERROR_LOOP = 'loop'  # permerror, an include or redirect chain refers back to itself
+ERROR_LOOKUP_LIMIT = 'lookup_limit'  # permerror, more than MAX_LOOKUPS lookups
+ERROR_VOID_LIMIT = 'void_limit'  # permerror, more than MAX_VOID_LOOKUPS void lookups
+ERROR_TEMPORARY = 'temperror'  # A target could not be resolved
+
+_modifier_regex = re.compile(r'^([a-z][a-z0-9_.-]*)=(.*)$', re.IGNORECASE)
+_mechanism_regex = re.compile(r'^([+\-~?]?)([a-z0-9]+)(?::([^/]*))?((?:/\d+)?(?://\d+)?)$', re.IGNORECASE)
+
+# TXT strings of a name, () if it has none (NXDOMAIN or no data), None if the lookup failed
+SPFResolver = Callable[[str], Optional[Tuple[str, ...]]]
+
+
+class SPFTerm(NamedTuple):
+    name: str  # Lower case mechanism or modifier name
+    qualifier: str = '+'  # Empty for modifiers
+    value: str = ''  # Domain spec, address or modifier value
+    cidr: str = ''  # Dual CIDR length as written, e.g. '/24' or '/24//64'
+
+    @property
+    def is_modifier(self) -> bool:
+        return not self.qualifier
+
+
+class SPFRecord(NamedTuple):
+    terms: Tuple[SPFTerm, ...]
+    errors: Tuple[str, ...] = ()
+
+    @property
+    def is_valid(self) -> bool:
+        return not self.errors
+
+    @property
+    def mechanisms(self) -> List[SPFTerm]:
+        return [term for term in self.terms if not term.is_modifier]
+
+    def modifier(self, name: str) -> Optional[str]:
+        for term in self.terms:
+            if term.is_modifier and term.name == name:
+                return term.value
+        return None
+
+    @property
+    def all_mechanism(self) -> Optional[str]:
+        """The all mechanism with its qualifier, e.g. '-all'. Mechanisms after it are never evaluated."""
+        for term in self.terms:
+            if term.name == 'all' and not term.is_modifier:
+                return f"{term.qualifier}all"
+        return None
+
+    @property
+    def includes(self) -> List[str]:
+        return [term.value.lower().removesuffix('.') for term in self.terms if term.name == 'include' and not term.is_modifier]
+
+    @property
+    def redirect(self) -> Optional[str]:
+        """The redirect target, unless an all mechanism makes it unreachable (section 6.1)."""
+        target = self.modifier('redirect')
+        if target is None or self.all_mechanism is not None:
+            return None
+        return target.lower().removesuffix('.')
+
+    @property
+    def lookups(self) -> int:
+        """DNS lookups of this record itself, without those of the included records."""
+        return sum(term.name in LOOKUP_MECHANISMS for term in self.mechanisms) + (self.redirect is not None)
+
+    @property
+    def targets(self) -> Tuple[str, ...]:
+        """Names whose records are evaluated as part of this one, in order."""
+        return tuple(self.includes) + ((self.redirect,) if self.redirect is not None else ())
+
+
+class Expansion(NamedTuple):
+    """DNS lookups of a record together with everything it includes or redirects to."""
+    lookups: int = 0
+    void_lookups: int = 0
+    depth: int = 0
+    error: str = ''
+
+    def limit_error(self) -> str:
+        """The error of the expansion, or the limit it exceeds (section 4.6.4)."""
+        if self.error:
+            return self.error
+        if self.lookups > MAX_LOOKUPS:
+            return ERROR_LOOKUP_LIMIT
+        if self.void_lookups > MAX_VOID_LOOKUPS:
+            return ERROR_VOID_LIMIT
+        return ''
+
+
+def is_spf_record(text: str) -> bool:
+    """Records are selected by their version section only (section 4.5)."""
+    lower = text[:7].lower()
+    return lower == 'v=spf1' or lower == 'v=spf1 '
+
+
+def spf_records(txts: Iterable[str]) -> List[str]:
+    return [txt for txt in txts if is_spf_record(txt)]
+
+
+def txt_answers(doc: Dict) -> Optional[Tuple[str, ...]]:
+    """TXT strings of a result document as an SPFResolver returns them, None unless the answer is definitive."""
+    if 'error' in doc or doc.get('type') != 'TXT':
+        return None
+    if doc.get('status') == 'NXDOMAIN':
+        return ()
+    if doc.get('status') != 'NOERROR':
+        return None
+    answers = doc.get('data', {}).get('answers', [])
+    return tuple(answer['data'] for answer in answers if answer.get('type') == 'TXT' and 'data' in answer)
+
+
+def _parse_term(text: str) -> Tuple[Optional[SPFTerm], Optional[str]]:
+    match = _modifier_regex.match(text)
+    if match is not None:
+        return SPFTerm(match.group(1).lower(), '', match.group(2)), None
+    match = _mechanism_regex.match(text)
+    if match is None:
+        return None, f"Invalid term: {text}"
+    qualifier, name, value, cidr = match.group(1) or '+', match.group(2).lower(), match.group(3), match.group(4)
+    if name not in MECHANISMS:
+        return None, f"Unknown mechanism: {name}"
+    term = SPFTerm(name, qualifier, value or '', cidr)
+    if name == 'all' and (value is not None or cidr):
+        return None, f"Invalid all mechanism: {text}"
+    if name in TARGET_REQUIRED and not value:
+        return None, f"Missing domain: {text}"
+    if name in ('include', 'exists', 'ptr') and cidr:
+        return None, f"Unexpected CIDR length: {text}"
+    if name in ('ip4', 'ip6'):
+        if not value or '//' in cidr:
+            return None, f"Invalid address: {text}"
+        try:
+            network = ip_network(f"{value}{cidr}", strict=False)
+        except ValueError:
+            return None, f"Invalid address: {text}"
+        if network.version != (4 if name == 'ip4' else 6):
+            return None, f"Wrong address family: {text}"
+    return term, None
+
+
+def parse_spf(text: str) -> SPFRecord:
+    """
+    Parses an SPF record into its terms. Syntax errors, which make the whole record a permerror,
+    are collected instead of raised, the terms that parse are kept for statistics.
+    """
+    assert is_spf_record(text), f"Not an SPF record: {text}"
+    parts = text.split(' ')
+    terms: List[SPFTerm] = []
+    errors: List[str] = []
+    seen_modifiers: Set[str] = set()
+    for part in parts[1:]:
+        if not part:
+            continue
+        term, error = _parse_term(part)
+        if error is not None:
+            errors.append(error)
+            continue
+        if term.is_modifier:
+            if term.name in ('redirect', 'exp'):
+                if term.name in seen_modifiers:
+                    errors.append(f"Duplicate modifier: {term.name}")
+                if not term.value:
+                    errors.append(f"Missing domain: {part}")
+            seen_modifiers.add(term.name)
+        terms.append(term)
+    return SPFRecord(tuple(terms), tuple(errors))
+
+
+class SPFExpander:
+    """
+    Expands include and redirect chains to count the DNS lookups of a record.
+
+    Targets are resolved with the injected resolver, e.g. a dict of TXT records collected from
+    the datasets. Expansions are memoized per target, so the includes of large providers are
+    expanded once per process however many domains refer to them. Targets containing macros
+    depend on the sender and are counted, but not expanded.
+    """
+
+    def __init__(self, resolver: SPFResolver):
+        self.resolver = resolver
+        self.cache: Dict[str, Expansion] = {}
+        self.records: Dict[str, SPFRecord] = {}  # Parsed records of the expanded targets
+
+    def expand_name(self, name: str, stack: Tuple[str, ...] = ()) -> Expansion:
+        if name in stack:
+            return Expansion(error=ERROR_LOOP)
+        if len(stack) >= MAX_DEPTH:
+            return Expansion(error=ERROR_LOOKUP_LIMIT)
+        expansion = self.cache.get(name)
+        if expansion is not None:
+            return expansion
+
+        txts = self.resolver(name)
+        if txts is None:
+            return Expansion(error=ERROR_TEMPORARY)
+        records = spf_records(txts)
+        if not records:
+            expansion = Expansion(void_lookups=0 if txts else 1, error=ERROR_NO_RECORD)
+        elif len(records) > 1:
+            expansion = Expansion(error=ERROR_MULTIPLE)
+        else:
+            record = self.records[name] = parse_spf(records[0])
+            if not record.is_valid:
+                expansion = Expansion(error=ERROR_SYNTAX)
+            else:
+                expansion = self.expand_targets(record.lookups, record.targets, stack + (name,))
+        self.cache[name] = expansion
+        return expansion
+
+    def expand_targets(self, lookups: int, targets: Tuple[str, ...], stack: Tuple[str, ...] = ()) -> Expansion:
+        """Expansion of a record given its own lookups and targets, see SPFRecord.lookups and targets."""
+        void_lookups = 0
+        depth = 0
+        error = ''
+        for target in targets:
+            if '%' in target:
+                continue
+            expansion = self.expand_name(target, stack)
+            lookups += expansion.lookups
+            void_lookups += expansion.void_lookups
+            depth = max(depth, expansion.depth + 1)
+            error = error or expansion.error
+        return Expansion(lookups, void_lookups, depth, error)
+
+    def expand(self, record: SPFRecord) -> Expansion:
+        if not record.is_valid:
+            return Expansion(record.lookups, error=ERROR_SYNTAX)
+        return self.expand_targets(record.lookups, record.targets)
+
+
+def resolve_targets(names: Iterable[str], fetch: Callable[[List[str]], Dict[str, Optional[Tuple[str, ...]]]],
+                    records: Optional[Dict[str, Optional[Tuple[str, ...]]]] = None) -> Dict[str, Optional[Tuple[str, ...]]]:
+    """
+    TXT records of names and of all names they include or redirect to, fetched level by level
+    in batches, for a dict backed SPFResolver. fetch gets the names still unknown and returns
+    their TXT strings as an SPFResolver would. Already known records can be passed in.
+    """
+    records = {} if records is None else records
+    pending = sorted({name for name in names if '%' not in name} - records.keys())
+    for _ in range(MAX_DEPTH):
+        if not pending:
+            break
+        records.update(fetch(pending))
+        targets: Set[str] = set()
+        for name in pending:
+            for text in spf_records(records.get(name) or ())[:1]:
+                targets.update(target for target in parse_spf(text).targets if '%' not in target)
+        pending = sorted(targets - records.keys())
+    return records
@@ -0,0 +1,95 @@
+from unittest import TestCase, main
+from spf import (ERROR_LOOKUP_LIMIT, ERROR_LOOP, ERROR_NO_RECORD, ERROR_SYNTAX, ERROR_TEMPORARY, ERROR_VOID_LIMIT,
+                 Expansion, SPFExpander, SPFTerm, is_spf_record, parse_spf, resolve_targets, txt_answers)
+
+PROVIDER = 'v=spf1 ip4:192.0.2.0/24 ip6:2001:db8::/32 include:_spf2.provider.example ~all'
+
+
+class Test(TestCase):
+    def test_is_spf_record(self):
+        self.assertTrue(is_spf_record('v=spf1 -all'))
+        self.assertTrue(is_spf_record('V=SPF1'))
+        self.assertFalse(is_spf_record('v=spf10 -all'))
+        self.assertFalse(is_spf_record(' v=spf1 -all'))
+
+    def test_txt_answers(self):
+        answers = [{'type': 'CNAME', 'data': 'b.example.'}, {'type': 'TXT', 'data': 'v=spf1 -all'}, {'type': 'TXT', 'data': 'x'}]
+        self.assertEqual(('v=spf1 -all', 'x'), txt_answers({'type': 'TXT', 'status': 'NOERROR', 'data': {'answers': answers}}))
+        self.assertEqual((), txt_answers({'type': 'TXT', 'status': 'NOERROR', 'data': {}}))
+        self.assertEqual((), txt_answers({'type': 'TXT', 'status': 'NXDOMAIN'}))
+        self.assertIsNone(txt_answers({'type': 'TXT', 'status': 'SERVFAIL'}))
+        self.assertIsNone(txt_answers({'type': 'TXT', 'error': 'timeout'}))
+        self.assertIsNone(txt_answers({'type': 'MX', 'status': 'NOERROR'}))
+
+    def test_parse_spf(self):
+        record = parse_spf('v=spf1 a mx/24 -ip4:198.51.100.1 include:_spf.provider.example  ?exists:%{i}.x.example redirect=other.example exp=exp.example')
+        self.assertTrue(record.is_valid)
+        self.assertEqual(SPFTerm('mx', '+', '', '/24'), record.terms[1])
+        self.assertEqual(SPFTerm('ip4', '-', '198.51.100.1'), record.terms[2])
+        self.assertEqual(('_spf.provider.example', 'other.example'), record.targets)
+        self.assertEqual(5, record.lookups)
+        self.assertIsNone(record.all_mechanism)
+
+        record = parse_spf('v=spf1 include:_spf.provider.example -ALL redirect=other.example')
+        self.assertEqual('-all', record.all_mechanism)
+        self.assertIsNone(record.redirect)
+        self.assertEqual(1, record.lookups)
+        self.assertEqual('+all', parse_spf('v=spf1 all').all_mechanism)
+
+    def test_parse_spf_errors(self):
+        for text in ['v=spf1 include', 'v=spf1 ip4:300.1.1.1', 'v=spf1 ip4:2001:db8::1', 'v=spf1 foo:bar',
+                     'v=spf1 -all:x', 'v=spf1 redirect=a.example redirect=b.example', 'v=spf1 a:x.example/33x']:
+            self.assertFalse(parse_spf(text).is_valid, text)
+        record = parse_spf('v=spf1 mx spf2.0/pra -all')
+        self.assertEqual(['mx', 'all'], [term.name for term in record.mechanisms])
+        self.assertEqual(1, len(record.errors))
+
+    def test_expander(self):
+        records = {
+            '_spf.provider.example': (PROVIDER,),
+            '_spf2.provider.example': ('v=spf1 a mx exists:x.example -all',),
+            'loop.example': ('v=spf1 include:loop2.example -all',),
+            'loop2.example': ('v=spf1 include:loop.example -all',),
+            'text.example': ('google-site-verification=x',),
+            'nxdomain.example': (),
+            'broken.example': ('v=spf1 foo',),
+        }
+        calls = []
+
+        def resolver(name):
+            calls.append(name)
+            return records.get(name)
+
+        expander = SPFExpander(resolver)
+        self.assertEqual(Expansion(6, 0, 2), expander.expand(parse_spf('v=spf1 mx include:_spf.provider.example -all')))
+        self.assertEqual(Expansion(4, 0, 1), expander.expand_name('_spf.provider.example'))
+        self.assertEqual(['_spf.provider.example', '_spf2.provider.example'], calls)
+
+        self.assertEqual(ERROR_LOOP, expander.expand(parse_spf('v=spf1 include:loop.example')).error)
+        self.assertEqual(ERROR_NO_RECORD, expander.expand(parse_spf('v=spf1 include:text.example')).error)
+        self.assertEqual(ERROR_SYNTAX, expander.expand(parse_spf('v=spf1 redirect=broken.example')).error)
+        self.assertEqual(ERROR_TEMPORARY, expander.expand(parse_spf('v=spf1 include:unknown.example')).error)
+        void = expander.expand(parse_spf('v=spf1 include:nxdomain.example include:nxdomain.example include:nxdomain.example'))
+        self.assertEqual((3, ERROR_NO_RECORD), (void.void_lookups, void.error))
+        self.assertEqual(ERROR_VOID_LIMIT, Expansion(3, 3).limit_error())
+
+        many = parse_spf('v=spf1 ' + ' '.join(['include:_spf.provider.example'] * 3) + ' -all')
+        self.assertEqual((15, ERROR_LOOKUP_LIMIT), (expander.expand(many).lookups, expander.expand(many).limit_error()))
+        self.assertEqual(2, calls.count('_spf.provider.example') + calls.count('_spf2.provider.example'))
+
+    def test_resolve_targets(self):
+        records = {'a.example': ('v=spf1 include:b.example redirect=c.example',), 'b.example': ('v=spf1 include:%{d}.x -all',),
+                   'c.example': ('v=spf1 include:a.example',)}
+        batches = []
+
+        def fetch(names):
+            batches.append(names)
+            return {name: records.get(name, ()) for name in names}
+
+        resolved = resolve_targets(['a.example'], fetch)
+        self.assertEqual([['a.example'], ['b.example', 'c.example']], batches)
+        self.assertEqual(records, resolved)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+from pathlib import Path
+from typing import Iterator, List, Optional, TextIO
+
+from lib.sketches import hash64
+
+SPILL_BUCKETS = 64  # Buckets per spill, each one has to fit into the memory of a single worker
+SPILL_EXTENSION = '.spill'
+
+
+def spill_bucket(key: str, bucket_count: int = SPILL_BUCKETS) -> int:
+    return hash64(key) % bucket_count
+
+
+class SpillWriter:
+    """
+    Hash partitions lines into bucket files, so all lines sharing a key end up in the same bucket.
+
+    Every writer needs its own prefix, the buckets of several writers are combined by bucket_paths().
+    Files are only created for buckets that receive lines.
+    """
+
+    def __init__(self, spill_dir: Path, prefix: str, bucket_count: int = SPILL_BUCKETS):
+        self.paths = [spill_dir / f"{prefix}-{bucket:03}{SPILL_EXTENSION}" for bucket in range(bucket_count)]
+        self._files: List[Optional[TextIO]] = [None] * bucket_count
+        self.line_count = 0
+
+    def write(self, key: str, line: str) -> None:
+        """Appends a line without newline to the bucket of the key."""
+        bucket = hash64(key) % len(self.paths)
+        fp = self._files[bucket]
+        if fp is None:
+            fp = self._files[bucket] = open(self.paths[bucket], mode='wt', encoding='utf-8')
+        fp.write(f"{line}\n")
+        self.line_count += 1
+
+    def close(self) -> None:
+        for bucket, fp in enumerate(self._files):
+            if fp is not None:
+                fp.close()
+                self._files[bucket] = None
+
+    def __enter__(self) -> 'SpillWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+
+def bucket_paths(spill_dir: Path, bucket: int) -> List[Path]:
+    """The files of one bucket written by all writers in the directory."""
+    return sorted(spill_dir.glob(f"*-{bucket:03}{SPILL_EXTENSION}"))
+
+
+def read_bucket(paths: List[Path]) -> Iterator[str]:
+    """Yields the lines (without newline) of the files of one bucket."""
+    for path in paths:
+        with open(path, mode='rt', encoding='utf-8') as fp:
+            for line in fp:
+                yield line.removesuffix('\n')
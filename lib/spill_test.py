@@ -0,0 +1,29 @@
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase, main
+from spill import SpillWriter, bucket_paths, read_bucket, spill_bucket
+
+
+class Test(TestCase):
+    def test_spill(self):
+        keys = [f"d{i}.de" for i in range(100)]
+        with TemporaryDirectory() as tmp:
+            spill_dir = Path(tmp)
+            for prefix in ['a', 'b']:
+                with SpillWriter(spill_dir, prefix, 8) as writer:
+                    for key in keys:
+                        writer.write(key, f"{key} {prefix}")
+                self.assertEqual(100, writer.line_count)
+            lines = []
+            for bucket in range(8):
+                paths = bucket_paths(spill_dir, bucket)
+                self.assertLessEqual(len(paths), 2)
+                for line in read_bucket(paths):
+                    self.assertEqual(bucket, spill_bucket(line.split()[0], 8))
+                    lines.append(line)
+        self.assertEqual(200, len(lines))
+        self.assertEqual(sorted(f"{key} {prefix}" for key in keys for prefix in 'ab'), sorted(lines))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,265 @@
+import json
+import mmap
+import shutil
+import struct
+from array import array
+from bisect import bisect_left
+from itertools import product
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from lib.domain_summary import DomainSummary
+
+SUMMARY_TABLE_EXTENSION = '.dst'
+SUMMARY_TABLE_MAGIC = b'DSUM'
+SUMMARY_TABLE_VERSION = 1
+HEADER_LENGTH_FORMAT = 'I'
+HEADER_LENGTH_SIZE = struct.calcsize(HEADER_LENGTH_FORMAT)
+ALIGNMENT = 8  # Every column starts at a multiple of the largest item size
+FLUSH_ROWS = 1 << 20  # Rows buffered per column while writing
+_NOT_TABLE = bytes([1, 0]) + bytes(254)
+
+# Dictionary-encoded columns: code -> value is stored in the header
+DICTIONARY_COLUMNS = ['spf_all', 'dmarc', 'policy', 'dns_error']
+
+COLUMN_TYPES = {
+    'mx': 'B',  # MX RRset size, capped at 255
+    'spf_all': 'B',
+    'dmarc': 'B',
+    'policy': 'B',
+    'pct': 'b',  # Signed, -1 unless the DMARC record is valid
+    'ri': 'i',
+    'explicit': 'H',  # Bitmask over DMARC_FLAG_TAGS
+    'valid': 'H',
+    'warnings': 'Q',  # Bitset of parse_dmarc_diagnostic
+    'dns_error': 'B',
+    'name_offsets': 'Q',  # rows + 1 offsets into the names blob
+}
+
+
+def _padding(size: int) -> int:
+    return -size % ALIGNMENT
+
+
+def write_summary_table(summaries: Iterable[DomainSummary], file_path: Path) -> int:
+    """
+    Writes domain summaries as a fixed-width columnar table, one row per summary in input order,
+    so the row number is the domain ID. Columns are buffered in temporary files, memory stays
+    bounded whatever the domain count. Returns the number of rows.
+    """
+    dictionaries: Dict[str, List[str]] = {name: [] for name in DICTIONARY_COLUMNS}
+    codes: Dict[str, Dict[str, int]] = {name: {} for name in DICTIONARY_COLUMNS}
+    rows = 0
+    with TemporaryDirectory(dir=file_path.parent) as tmp_dir:
+        column_paths = {name: Path(tmp_dir) / f"{name}.col" for name in COLUMN_TYPES}
+        names_path = Path(tmp_dir) / 'names.blob'
+        column_files = {name: open(path, mode='wb') for name, path in column_paths.items()}
+        buffers = {name: array(typecode) for name, typecode in COLUMN_TYPES.items()}
+        names = []
+        offset = 0
+        buffers['name_offsets'].append(0)
+        with open(names_path, mode='wb') as names_fp:
+            for summary in summaries:
+                for name in DICTIONARY_COLUMNS:
+                    value = getattr(summary, name)
+                    code = codes[name].get(value)
+                    if code is None:
+                        code = codes[name][value] = len(dictionaries[name])
+                        assert code < 256, f"Too many distinct values in column {name}"
+                        dictionaries[name].append(value)
+                    buffers[name].append(code)
+                buffers['mx'].append(min(summary.mx, 255))
+                buffers['pct'].append(summary.pct)
+                buffers['ri'].append(max(-1, min(summary.ri, 2 ** 31 - 1)))
+                buffers['explicit'].append(summary.explicit)
+                buffers['valid'].append(summary.valid)
+                buffers['warnings'].append(summary.warnings)
+                encoded = summary.domain.encode('utf-8')
+                names.append(encoded)
+                offset += len(encoded)
+                buffers['name_offsets'].append(offset)
+                rows += 1
+                if rows % FLUSH_ROWS == 0:
+                    for name, buffer in buffers.items():
+                        buffer.tofile(column_files[name])
+                        del buffer[:]
+                    names_fp.write(b''.join(names))
+                    names.clear()
+            for name, buffer in buffers.items():
+                buffer.tofile(column_files[name])
+                column_files[name].close()
+            names_fp.write(b''.join(names))
+
+        header = {
+            'version': SUMMARY_TABLE_VERSION,
+            'rows': rows,
+            'columns': COLUMN_TYPES,
+            'dictionaries': dictionaries,
+            'names_length': offset,
+        }
+        header_bytes = json.dumps(header).encode('utf-8')
+        tmp_path = file_path.with_name(file_path.name + '.tmp')
+        with open(tmp_path, mode='wb') as fp:
+            fp.write(SUMMARY_TABLE_MAGIC)
+            fp.write(struct.pack(HEADER_LENGTH_FORMAT, len(header_bytes)))
+            fp.write(header_bytes)
+            fp.write(bytes(_padding(fp.tell())))
+            for name in COLUMN_TYPES:
+                with open(column_paths[name], mode='rb') as column_fp:
+                    shutil.copyfileobj(column_fp, fp)
+                fp.write(bytes(_padding(fp.tell())))
+            with open(names_path, mode='rb') as names_fp:
+                shutil.copyfileobj(names_fp, fp)
+        tmp_path.replace(file_path)
+    return rows
+
+
+def mask_and(*masks: bytes) -> bytes:
+    result = int.from_bytes(masks[0], 'little')
+    for mask in masks[1:]:
+        assert len(mask) == len(masks[0])
+        result &= int.from_bytes(mask, 'little')
+    return result.to_bytes(len(masks[0]), 'little')
+
+
+def mask_or(*masks: bytes) -> bytes:
+    result = int.from_bytes(masks[0], 'little')
+    for mask in masks[1:]:
+        assert len(mask) == len(masks[0])
+        result |= int.from_bytes(mask, 'little')
+    return result.to_bytes(len(masks[0]), 'little')
+
+
+def mask_not(mask: bytes) -> bytes:
+    return mask.translate(_NOT_TABLE)
+
+
+def mask_rows(mask: bytes) -> Iterator[int]:
+    """Row numbers selected by a mask."""
+    row = mask.find(1)
+    while row >= 0:
+        yield row
+        row = mask.find(1, row + 1)
+
+
+def mask_combinations(*masks: bytes) -> Dict[Tuple[bool, ...], int]:
+    """Rows per combination of the masks being set or not, in the order of the masks."""
+    combinations = {}
+    for values in product((True, False), repeat=len(masks)):
+        combined = mask_and(*(mask if value else mask_not(mask) for mask, value in zip(masks, values)))
+        combinations[values] = combined.count(1)
+    return combinations
+
+
+class SummaryTable:
+    """
+    Memory-mapped domain summary table written by write_summary_table().
+
+    Nothing is read up front, columns are memoryviews on the mapping. Queries build row masks
+    (one byte 0 or 1 per row) that are combined with mask_and(), mask_or() and mask_not(). Masks
+    over single byte columns are a bytes.translate() of the column, bits of wider columns are tested
+    on a strided slice of the byte that holds them, so typical filters never run Python code per row.
+    """
+
+    def __init__(self, file_path: Path):
+        self._fp = open(file_path, mode='rb')
+        self._mm = mmap.mmap(self._fp.fileno(), 0, access=mmap.ACCESS_READ)
+        assert self._mm[:len(SUMMARY_TABLE_MAGIC)] == SUMMARY_TABLE_MAGIC, f"Not a summary table: {file_path}"
+        position = len(SUMMARY_TABLE_MAGIC)
+        header_length = struct.unpack_from(HEADER_LENGTH_FORMAT, self._mm, position)[0]
+        position += HEADER_LENGTH_SIZE
+        header = json.loads(self._mm[position:position + header_length].decode('utf-8'))
+        assert header['version'] == SUMMARY_TABLE_VERSION, f"Unsupported table version: {header['version']}"
+        assert header['columns'] == COLUMN_TYPES, "Table has different columns"
+        position += header_length
+        position += _padding(position)
+
+        self.rows: int = header['rows']
+        self.dictionaries: Dict[str, List[str]] = header['dictionaries']
+        self._codes = {name: {value: code for code, value in enumerate(values)} for name, values in self.dictionaries.items()}
+        self._view = view = memoryview(self._mm)
+        self._raw: Dict[str, memoryview] = {}
+        self.columns: Dict[str, memoryview] = {}
+        for name, typecode in COLUMN_TYPES.items():
+            length = (self.rows + (name == 'name_offsets')) * struct.calcsize(typecode)
+            self._raw[name] = view[position:position + length]
+            self.columns[name] = self._raw[name].cast(typecode)
+            position += length + _padding(length)
+        self._names = view[position:position + header['names_length']]
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def __getitem__(self, column: str) -> memoryview:
+        return self.columns[column]
+
+    def close(self) -> None:
+        for view in [*self.columns.values(), *self._raw.values(), self._names, self._view]:
+            view.release()
+        self._mm.close()
+        self._fp.close()
+
+    def __enter__(self) -> 'SummaryTable':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+    def code(self, column: str, value: str) -> Optional[int]:
+        return self._codes[column].get(value)
+
+    def domain(self, row: int) -> str:
+        offsets = self.columns['name_offsets']
+        return bytes(self._names[offsets[row]:offsets[row + 1]]).decode('utf-8')
+
+    def find(self, domain: str) -> Optional[int]:
+        """Row of a domain by binary search, tables written by 05_join_domains.py are sorted by domain."""
+        row = bisect_left(range(self.rows), domain, key=self.domain)
+        if row < self.rows and self.domain(row) == domain:
+            return row
+        return None
+
+    def summary(self, row: int) -> DomainSummary:
+        values = {name: self.columns[name][row] for name in COLUMN_TYPES if name != 'name_offsets'}
+        for name in DICTIONARY_COLUMNS:
+            values[name] = self.dictionaries[name][values[name]]
+        return DomainSummary(self.domain(row), **values)
+
+    def _byte_mask(self, column: str, selected: Iterable[int]) -> bytes:
+        """Rows of a single byte column whose byte value is in selected."""
+        assert struct.calcsize(COLUMN_TYPES[column]) == 1, f"Not a single byte column: {column}"
+        table = bytearray(256)
+        for value in selected:
+            table[value & 0xFF] = 1
+        return bytes(self._raw[column]).translate(table)
+
+    def isin(self, column: str, *values) -> bytes:
+        """Rows whose value is one of values, given as strings for dictionary-encoded columns."""
+        if column in self._codes:
+            values = [self._codes[column][value] for value in values if value in self._codes[column]]
+        return self._byte_mask(column, values)
+
+    def between(self, column: str, low: int, high: int) -> bytes:
+        """
+        Rows with low <= value <= high. Wider columns are compared row by row, still without a
+        Python frame per row, at about a tenth of the speed of a translate.
+        """
+        typecode = COLUMN_TYPES[column]
+        if struct.calcsize(typecode) == 1:
+            # Bounds are clamped to the range of the column type, so they do not wrap into the other sign
+            first, last = (-128, 127) if typecode == 'b' else (0, 255)
+            return self._byte_mask(column, range(max(low, first), min(high, last) + 1))
+        return bytes(map(range(low, high + 1).__contains__, self.columns[column]))
+
+    def has_bits(self, column: str, bits: int) -> bytes:
+        """Rows of a bitmask column with all of bits set."""
+        size = struct.calcsize(COLUMN_TYPES[column])
+        raw = self._raw[column]
+        mask = b'\x01' * self.rows
+        for index in range(size):
+            byte_bits = bits >> (8 * index) & 0xFF
+            if byte_bits:
+                table = bytes(1 if value & byte_bits == byte_bits else 0 for value in range(256))
+                mask = mask_and(mask, bytes(raw[index::size]).translate(table))
+        return mask
@@ -0,0 +1,56 @@
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase, main
+from domain_summary import DomainSummary, dmarc_tag_bits
+from summary_table import SummaryTable, mask_and, mask_combinations, mask_not, mask_or, mask_rows, write_summary_table
+
+SUMMARIES = [
+    DomainSummary('a.de', 2, '-all', 'valid', 'reject', 100, 86400, dmarc_tag_bits('v', 'p', 'rua'), 0x7ff, 0, ''),
+    DomainSummary('b.de', 0, '', 'nxdomain', dns_error='NXDOMAIN'),
+    DomainSummary('bücher.de', 1, '~all', 'valid', 'quarantine', 50, 3600, dmarc_tag_bits('v', 'p', 'pct', 'ri'), 0x7ff, 1 << 40, ''),
+    DomainSummary('c.de', 300, '?all', 'error', dns_error='TIMEOUT'),
+]
+
+
+class Test(TestCase):
+    def test_summary_table(self):
+        with TemporaryDirectory() as tmp:
+            table_path = Path(tmp) / 'summary.dst'
+            self.assertEqual(4, write_summary_table(SUMMARIES, table_path))
+            with SummaryTable(table_path) as table:
+                self.assertEqual(4, len(table))
+                self.assertEqual(SUMMARIES[:3], [table.summary(row) for row in range(3)])
+                self.assertEqual(255, table.summary(3).mx)
+                self.assertEqual('bücher.de', table.domain(2))
+                self.assertEqual(2, table.find('bücher.de'))
+                self.assertEqual(3, table.find('c.de'))
+                self.assertIsNone(table.find('bb.de'))
+                self.assertIsNone(table.find('d.de'))
+
+                has_mx = mask_not(table.isin('mx', 0))
+                self.assertEqual(b'\x01\x00\x01\x01', has_mx)
+                self.assertEqual([0, 2], list(mask_rows(mask_and(has_mx, table.isin('dmarc', 'valid')))))
+                self.assertEqual([0], list(mask_rows(mask_and(table.isin('policy', 'reject'), table.has_bits('explicit', dmarc_tag_bits('rua'))))))
+                self.assertEqual([2], list(mask_rows(table.between('pct', 0, 99))))
+                self.assertEqual([0, 2], list(mask_rows(table.between('pct', 50, 1000))))
+                self.assertEqual([1, 3], list(mask_rows(table.between('pct', -1, -1))))
+                self.assertEqual([3], list(mask_rows(table.between('mx', 200, 1000))))
+                self.assertEqual([2], list(mask_rows(table.between('ri', 0, 86399))))
+                self.assertEqual([2], list(mask_rows(table.has_bits('warnings', 1 << 40))))
+                self.assertEqual([1, 3], list(mask_rows(mask_or(table.isin('dns_error', 'NXDOMAIN'), table.isin('dns_error', 'TIMEOUT')))))
+                self.assertEqual(bytes(4), table.isin('policy', 'unknown'))
+
+                combinations = mask_combinations(has_mx, table.isin('dmarc', 'valid'))
+                self.assertEqual({(True, True): 2, (True, False): 1, (False, True): 0, (False, False): 1}, combinations)
+
+    def test_empty_table(self):
+        with TemporaryDirectory() as tmp:
+            table_path = Path(tmp) / 'summary.dst'
+            self.assertEqual(0, write_summary_table([], table_path))
+            with SummaryTable(table_path) as table:
+                self.assertEqual(b'', table.isin('mx', 0))
+                self.assertIsNone(table.find('a.de'))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,12 @@
 from dataclasses import dataclass
+from functools import lru_cache
 from typing import Optional
 from enum import Enum, auto
 
 # https://docs.python.org/3/library/contextvars.html
 
+RECEIVER_CACHE_SIZE = 65536  # Distinct reporting URIs memoized per process
+
 class UriParseErrorType(Enum):
     """Enumeration for specific parsing error types."""
     INVALID_SCHEME = auto()
@@ -98,4 +101,16 @@ def parse_domain(email: str) -> Optional[str]:
         else:
             return None
     else:
-        return None
\ No newline at end of file
+        return None
+
+@lru_cache(maxsize=RECEIVER_CACHE_SIZE)
+def parse_receiver_domain(uri: str) -> Optional[str]:
+    """
+    Domain of the mailbox a reporting URI points to, or None if the URI is invalid.
+
+    Memoized, as a few thousand report receivers make up almost all rua/ruf values.
+    """
+    parsed = parse_uri(uri)
+    if parsed.error_type or not parsed.email:
+        return None
+    return parse_domain(parsed.email)
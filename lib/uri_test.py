@@ -1,5 +1,5 @@
 from unittest import TestCase, main
-from uri import UriParseErrorType, parse_uri, parse_domain
+from uri import UriParseErrorType, parse_uri, parse_domain, parse_receiver_domain
 
 class Test(TestCase):
     def test_parse_uri(self):
@@ -91,5 +91,11 @@ class Test(TestCase):
         self.assertEqual('beispiel.de', parse_domain('a+b@beispiel.de'))
         self.assertEqual(None, parse_domain('abc.de'))
 
+    def test_parse_receiver_domain(self):
+        self.assertEqual('beispiel.de', parse_receiver_domain('mailto:a+b@beispiel.de!10m'))
+        self.assertEqual('beispiel.de', parse_receiver_domain('mailto:a+b@beispiel.de!10m'))
+        self.assertEqual(None, parse_receiver_domain('a+b@beispiel.de'))
+        self.assertEqual(None, parse_receiver_domain('mailto:abc'))
+
 if __name__ == '__main__':
     main()
@@ -1,3 +1,6 @@
+import bz2
+import gzip
+import lzma
 import string
 import random
 from datetime import datetime
@@ -5,6 +8,7 @@ from dotenv import load_dotenv
 from os import getenv, environ
 from sys import argv
 from pathlib import Path
+from typing import TextIO
 
 
 def env_ensure(name: str) -> str:
@@ -33,6 +37,17 @@ def get_sub_domain(domain: str) -> str:
     return '.'.join(domain.split('.')[0:-2])
 
 
+def open_text(file_path: Path) -> TextIO:
+    """Opens a text file for reading, decompressing .bz2, .gz and .xz files on the fly."""
+    if file_path.suffix == '.bz2':
+        return bz2.open(file_path, mode='rt', encoding='utf-8')
+    if file_path.suffix == '.gz':
+        return gzip.open(file_path, mode='rt', encoding='utf-8')
+    if file_path.suffix == '.xz':
+        return lzma.open(file_path, mode='rt', encoding='utf-8')
+    return open(file_path, mode='rt', encoding='utf-8')
+
+
 def random_tag(length: int) -> str:
     return "".join(random.choice(string.ascii_letters + string.digits) for _ in range(length))
 
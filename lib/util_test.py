@@ -1,5 +1,9 @@
+import bz2
+import gzip
+from pathlib import Path
+from tempfile import TemporaryDirectory
 from unittest import TestCase
-from util import get_org_domain, get_sub_domain
+from util import get_org_domain, get_sub_domain, open_text
 
 class Test(TestCase):
     def test_get_org_domain(self):
@@ -15,3 +19,10 @@ class Test(TestCase):
         self.assertEqual('_dmarc', get_sub_domain('_dmarc.example.com'))
         self.assertEqual('_dmarc.sub', get_sub_domain('_dmarc.sub.example.com'))
 
+    def test_open_text(self):
+        with TemporaryDirectory() as tmp:
+            for path, opener in [(Path(tmp) / 'a.txt', open), (Path(tmp) / 'a.txt.bz2', bz2.open), (Path(tmp) / 'a.txt.gz', gzip.open)]:
+                with opener(path, mode='wt', encoding='utf-8') as fp:
+                    fp.write('a.de\nb.de\n')
+                with open_text(path) as fp:
+                    self.assertEqual(['a.de\n', 'b.de\n'], list(fp))